@@ -0,0 +1,197 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# End-to-end benchmarks, run against the local device simulator.
+
+
+import os
+import shutil
+import tempfile
+import threading
+import collections
+
+from steelscript.cmdline import parsers
+from steelscript.cmdline.cli import CLICache
+from steelscript.cmdline.cli.ios_cli import IOS_CLI
+from steelscript.cmdline.cli.rvbd_cli import RVBD_CLI
+from steelscript.cmdline.cli.vyatta_cli import VyattaCLI
+from steelscript.cmdline.shell import Shell
+from steelscript.cmdline.simulator import DeviceSimulator
+
+import corpora
+from harness import benchmark, measure
+
+COMMAND = 'show version'
+LARGE_COMMAND = 'show logging'
+
+CLI_CLASSES = (
+    ('rvbd', RVBD_CLI),
+    ('ios', IOS_CLI),
+    ('vyatta', VyattaCLI),
+)
+
+# Stands in for the resources that CLICache is given.
+Resource = collections.namedtuple('Resource',
+                                  'uniqueid admin_ip username password')
+
+
+def _simulator(context, personality, **kwargs):
+    simulator = DeviceSimulator(personality, **kwargs)
+    simulator.start()
+    context.add_cleanup(simulator.stop)
+    return simulator
+
+
+@benchmark('session_setup', 'ms', higher_is_better=False)
+def session_setup(context):
+    """Connecting, logging in and disabling paging."""
+    results = {}
+    for personality, cli_class in CLI_CLASSES:
+        simulator = _simulator(context, personality)
+
+        def setup():
+            with cli_class(**simulator.connect_args):
+                pass
+        results[cli_class.__name__] = 1000 * measure(
+            setup, repeat=context.scale(10, 2))
+    return results
+
+
+@benchmark('commands', 'commands/s')
+def commands(context):
+    """Short commands run one after the other, per CLI class."""
+    results = {}
+    for personality, cli_class in CLI_CLASSES:
+        simulator = _simulator(context, personality)
+        with cli_class(**simulator.connect_args) as cli:
+            seconds = measure(
+                lambda: cli.exec_command(COMMAND, mode=None),
+                repeat=3, number=context.scale(100, 10))
+        results[cli_class.__name__] = 1 / seconds
+    return results
+
+
+@benchmark('expect_throughput', 'MB/s')
+def expect_throughput(context):
+    """Receiving and matching the output of a command with large output."""
+    size = context.scale(4, 1) * 1024 * 1024
+    simulator = _simulator(context, 'rvbd', output_size=size)
+    with RVBD_CLI(**simulator.connect_args) as cli:
+        seconds = measure(
+            lambda: cli.exec_command(LARGE_COMMAND, mode=None),
+            repeat=context.scale(3, 1))
+    return size / seconds / (1024 * 1024)
+
+
+@benchmark('shell_exec_latency', 'ms', higher_is_better=False)
+def shell_exec_latency(context):
+    """A command run by Shell.exec_command on an open connection."""
+    simulator = _simulator(context, 'rvbd')
+    shell = Shell(simulator.host, user=simulator.username,
+                  password=simulator.password, port=simulator.port)
+    shell.exec_command(COMMAND)
+    try:
+        return 1000 * measure(lambda: shell.exec_command(COMMAND),
+                              repeat=3, number=context.scale(50, 5))
+    finally:
+        shell.sshprocess.disconnect()
+
+
+@benchmark('clicache_scaling', 'commands/s')
+def clicache_scaling(context):
+    """
+    Commands run by threads sharing a CLICache, one CLI per thread, on
+    devices taking 5ms to answer.
+    """
+    simulator = _simulator(context, 'rvbd', latency=0.005)
+
+    def cli_class(hostname, username, password, **limits):
+        return RVBD_CLI(hostname=hostname, port=simulator.port,
+                        username=username, password=password, **limits)
+
+    number = context.scale(50, 5)
+    results = {}
+    for threads in context.scale((1, 4, 16), (1, 4)):
+        cache = CLICache()
+        resources = [Resource(index, simulator.host, simulator.username,
+                              simulator.password) for index in range(threads)]
+        for resource in resources:
+            cache.get_cli(resource, cli_class)
+
+        def run(resource):
+            cli = cache.get_cli(resource, cli_class)
+            for _ in range(number):
+                cli.exec_command(COMMAND, mode=None)
+
+        def run_all():
+            workers = [threading.Thread(target=run, args=(resource,))
+                       for resource in resources]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+        seconds = measure(run_all, repeat=context.scale(3, 1))
+        results['threads_%d' % threads] = threads * number / seconds
+        cache.drop_all()
+    return results
+
+
+@benchmark('sftp', 'MB/s')
+def sftp(context):
+    """Shell.get, Shell.put and Shell.get_many of 4 files over SFTP."""
+    size = context.scale(16, 1) * 1024 * 1024
+    root = tempfile.mkdtemp()
+    context.add_cleanup(lambda: shutil.rmtree(root))
+    remote = os.path.join(root, 'remote')
+    local = os.path.join(root, 'local')
+    os.mkdir(remote)
+    os.mkdir(local)
+    data = os.urandom(size)
+    names = ['file%d' % index for index in range(4)]
+    for name in names:
+        with open(os.path.join(remote, name), 'wb') as f:
+            f.write(data)
+
+    simulator = _simulator(context, 'rvbd', sftp_root=remote)
+    shell = Shell(simulator.host, user=simulator.username,
+                  password=simulator.password, port=simulator.port)
+    repeat = context.scale(3, 1)
+    try:
+        results = {}
+        seconds = measure(
+            lambda: shell.get(names[0], os.path.join(local, names[0])),
+            repeat=repeat)
+        results['get'] = size / seconds / (1024 * 1024)
+        seconds = measure(
+            lambda: shell.put(os.path.join(local, names[0]), 'put'),
+            repeat=repeat)
+        results['put'] = size / seconds / (1024 * 1024)
+        files = dict((name, os.path.join(local, name)) for name in names)
+        seconds = measure(lambda: shell.get_many(files), repeat=repeat)
+        results['get_many'] = len(names) * size / seconds / (1024 * 1024)
+        return results
+    finally:
+        shell.sshprocess.disconnect()
+
+
+@benchmark('parse_table', 'rows/s')
+def parse_table(context):
+    """cli_parse_table on a synthetic routing table."""
+    rows = context.scale(2000, 200)
+    table = corpora.route_table(rows)
+    seconds = measure(
+        lambda: parsers.cli_parse_table(table, corpora.TABLE_HEADERS))
+    return rows / seconds
+
+
+@benchmark('parse_basic', 'lines/s')
+def parse_basic(context):
+    """cli_parse_basic on synthetic key: value output."""
+    lines = context.scale(20000, 2000)
+    text = corpora.key_values(lines)
+    seconds = measure(lambda: parsers.cli_parse_basic(text))
+    return lines / seconds
@@ -0,0 +1,208 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Microbenchmarks of the channel and parser hot paths, on generated data,
+# so that changes to them can be measured without a connection.  Each
+# result is the time of one call in ns, with the peak bytes that call
+# allocated and the blocks it left allocated.
+
+
+from steelscript.cmdline import parsers
+from steelscript.cmdline import telnet
+from steelscript.cmdline.cli.rvbd_cli import RVBD_CLI
+from steelscript.cmdline.libvirtchannel import LibVirtChannel
+from steelscript.cmdline.sshchannel import SSHChannel
+
+import corpora
+from harness import Measurement, allocated, benchmark, measure_call
+
+# What RVBD_CLI looks for in command output.
+PROMPTS = [RVBD_CLI.CLI_ANY_PROMPT, RVBD_CLI.CLI_LESS_PROMPT,
+           RVBD_CLI.CLI_ERROR_PROMPT]
+
+
+def _sizes(context, largest=1000000):
+    """The corpus sizes, in lines, up to ``largest``."""
+    sizes = context.scale((1, 100, 10000, 100000, 1000000), (1, 100))
+    return [size for size in sizes if size <= largest]
+
+
+def _measure(function):
+    """Returns a :class:`Measurement` of one call of function."""
+    seconds = measure_call(function)
+    peak, blocks = allocated(function)
+    return Measurement(seconds * 1e9, peak_bytes=peak, blocks=blocks)
+
+
+def _channel():
+    # Unconnected: only the data processing methods are used.
+    return SSHChannel('127.0.0.1', 'admin', password='password')
+
+
+@benchmark('micro.fixup_carriage_returns', 'ns', higher_is_better=False)
+def fixup_carriage_returns(context):
+    """Channel.fixup_carriage_returns on whole command outputs."""
+    channel = _channel()
+    results = {}
+    for size in _sizes(context):
+        data = corpora.cli_output(size)
+        results['lines_%d' % size] = _measure(
+            lambda: channel.fixup_carriage_returns(data))
+    return results
+
+
+@benchmark('micro.find_match', 'ns', higher_is_better=False)
+def find_match(context):
+    """Channel._find_match on one line, for lines that do not match."""
+    channel = _channel()
+    results = {}
+    for length in (0, 80, 1000):
+        line = 'x' * length
+        results['chars_%d' % length] = _measure(
+            lambda: channel._find_match(line, PROMPTS))
+    return results
+
+
+def _expect(channel, chunks):
+    """What SSHChannel.expect does with the chunks it receives."""
+    received_data = ''
+    next_line_start = 0
+    for chunk in chunks:
+        received_data, new_lines = channel._process_data(
+            chunk, received_data, next_line_start)
+        output, match = channel._match_lines(
+            received_data, next_line_start, new_lines, PROMPTS)
+        if match:
+            return output, match
+        next_line_start = received_data.rfind('\n') + 1
+    raise AssertionError('The prompt was not matched')
+
+
+@benchmark('micro.expect', 'ns', higher_is_better=False)
+def expect(context):
+    """
+    SSHChannel._process_data and _match_lines on command output received
+    in chunks, up to and including the prompt.
+    """
+    channel = _channel()
+    results = {}
+    # Each chunk re-processes what was received before it, so large outputs
+    # in small chunks take too long to include.
+    for size in _sizes(context, largest=10000):
+        data = corpora.cli_output(size).encode()
+        for how in corpora.SPLITS:
+            chunks = corpora.split(data, how)
+            results['%s.lines_%d' % (how, size)] = _measure(
+                lambda: _expect(channel, chunks))
+    return results
+
+
+def _telnet_expect(chunks):
+    """What telnet.Telnet.expect does with the chunks it receives."""
+    connection = telnet.Telnet()
+    for chunk in chunks:
+        connection._received += connection.protocol.feed(chunk)
+        index, match, text = connection.match(PROMPTS)
+        if match:
+            return text, match
+    raise AssertionError('The prompt was not matched')
+
+
+@benchmark('micro.telnet_expect', 'ns', higher_is_better=False)
+def telnet_expect(context):
+    """
+    TelnetProtocol.feed and Telnet.match on command output received in
+    chunks, up to and including the prompt.
+    """
+    results = {}
+    for size in _sizes(context, largest=100000):
+        data = corpora.cli_output(size).encode()
+        for how in corpora.SPLITS:
+            chunks = corpora.split(data, how)
+            results['%s.lines_%d' % (how, size)] = _measure(
+                lambda: _telnet_expect(chunks))
+    return results
+
+
+class FakeStream(object):
+    """
+    A non-blocking libvirt stream that has received chunks of data.  The
+    event callback methods do nothing, as data is always ready.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = list(reversed(chunks))
+
+    def recv(self, nbytes):
+        if not self._chunks:
+            # What a non-blocking stream returns instead of waiting.
+            return -2
+        chunk = self._chunks.pop()
+        if len(chunk) > nbytes:
+            self._chunks.append(chunk[nbytes:])
+            chunk = chunk[:nbytes]
+        return chunk
+
+    def eventAddCallback(self, events, callback, opaque):
+        pass
+
+    def eventRemoveCallback(self):
+        pass
+
+
+def _libvirt_expect(chunks):
+    channel = LibVirtChannel('vm')
+    channel._stream = FakeStream(chunks)
+    return channel.expect(PROMPTS)
+
+
+@benchmark('micro.libvirt_expect', 'ns', higher_is_better=False)
+def libvirt_expect(context):
+    """
+    LibVirtChannel.expect on a console's output, read from a fake stream
+    in chunks, up to and including the prompt.
+    """
+    results = {}
+    for size in _sizes(context, largest=100000):
+        data = corpora.cli_output(size).encode()
+        for how in corpora.SPLITS:
+            chunks = corpora.split(data, how)
+            results['%s.lines_%d' % (how, size)] = _measure(
+                lambda: _libvirt_expect(chunks))
+    return results
+
+
+@benchmark('micro.cli_parse_table', 'ns', higher_is_better=False)
+def cli_parse_table(context):
+    """parsers.cli_parse_table on routing tables."""
+    results = {}
+    for size in _sizes(context, largest=100000):
+        table = corpora.route_table(size)
+        results['lines_%d' % size] = _measure(
+            lambda: parsers.cli_parse_table(table, corpora.TABLE_HEADERS))
+    return results
+
+
+@benchmark('micro.cli_parse_basic', 'ns', higher_is_better=False)
+def cli_parse_basic(context):
+    """parsers.cli_parse_basic on ``key: value`` output."""
+    results = {}
+    for size in _sizes(context, largest=100000):
+        text = corpora.key_values(size)
+        results['lines_%d' % size] = _measure(
+            lambda: parsers.cli_parse_basic(text))
+    return results
+
+
+@benchmark('micro.parse_saasinfo_data', 'ns', higher_is_better=False)
+def parse_saasinfo_data(context):
+    """parsers.parse_saasinfo_data on saasinfo output."""
+    results = {}
+    for size in _sizes(context):
+        text = corpora.saasinfo(size)
+        results['lines_%d' % size] = _measure(
+            lambda: parsers.parse_saasinfo_data(text))
+    return results
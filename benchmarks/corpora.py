@@ -0,0 +1,127 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Generated CLI output for benchmarks, deterministic for a given size.
+
+
+TABLE_HEADERS = ['Destination', 'Mask', 'Gateway', 'Interface']
+TABLE_WIDTH = 18
+
+
+def _address(number):
+    return '10.%d.%d.0' % ((number >> 8) & 0xff, number & 0xff)
+
+
+def route_table(rows):
+    """
+    Returns a routing table, as shown by ``show ip route`` on Riverbed
+    appliances, for :func:`steelscript.cmdline.parsers.cli_parse_table`
+    with :const:`TABLE_HEADERS`.
+
+    :param rows: number of routes.
+    """
+    lines = [''.join(header.ljust(TABLE_WIDTH)
+                     for header in TABLE_HEADERS).rstrip()]
+    for number in range(rows):
+        interface = 'aux' if number % 3 else 'primary'
+        gateway = '0.0.0.0' if number % 2 else '10.3.0.1'
+        lines.append(''.join(field.ljust(TABLE_WIDTH) for field in
+                             (_address(number), '255.255.255.0', gateway,
+                              interface)).rstrip())
+    return '\n'.join(lines)
+
+
+def key_values(lines):
+    """
+    Returns ``key: value`` output for
+    :func:`steelscript.cmdline.parsers.cli_parse_basic`, with a mix of
+    boolean, numeric and text values.
+
+    :param lines: number of lines.
+    """
+    values = ('yes', '15', 'Riverbed SteelHead', 'no', '', '2.5 %')
+    return '\n'.join('Setting number %d:%s%s' %
+                     (number, ' ' * (number % 5), values[number % 6])
+                     for number in range(lines))
+
+
+def saasinfo(entries):
+    """
+    Returns ``show service saasinfo`` output for
+    :func:`steelscript.cmdline.parsers.parse_saasinfo_data`.
+
+    :param entries: number of IP, hostname, MBX and regional IP lines,
+        spread over the sections.  There is one region per 50 entries, each
+        with at least one MBX line.
+    """
+    rule, dashes = '=' * 33, '-' * 33
+    regions = ['region%d.example' % number
+               for number in range(max(1, entries // 50))]
+    lines = [rule, 'SaaS Application', rule, 'BENCHAPP', '',
+             rule, 'SaaS IP', rule]
+    ips, hosts = entries * 4 // 10, entries * 3 // 10
+    mbxs = max(len(regions), entries // 10)
+    addresses = max(0, entries - ips - hosts - mbxs)
+    lines.extend('%s/24 [0-65535]' % _address(number)
+                 for number in range(ips))
+    lines.extend(['', rule, 'SaaS Hostname', rule])
+    lines.extend('*.host%d.example.com' % number for number in range(hosts))
+    lines.extend(['', rule, 'GeoDNS', rule, dashes, 'MBX Region', dashes])
+    lines.extend('mbx%d %s' % (number, regions[number % len(regions)])
+                 for number in range(mbxs))
+    lines.extend([dashes, 'Regional IPs', dashes])
+    for number, region in enumerate(regions):
+        lines.append(region)
+        lines.extend('132.245.%d.%d' % ((n >> 8) & 0xff, n & 0xff)
+                     for n in range(number, addresses, len(regions)))
+    return '\n'.join(lines)
+
+
+def cli_output(lines, prompt='sim > '):
+    """
+    Returns command output as a CLI sends it: mostly ``\\r\\n`` line ends,
+    with the ``\\r\\r\\n`` and lone ``\\r`` ends that pagers and terminal
+    redraws produce, followed by a prompt.
+
+    :param lines: number of lines before the prompt.
+    :param prompt: the prompt ending the output.
+    """
+    ends = ('\r\n', '\r\n', '\r\n', '\r\r\n', '\r\n', '\r')
+    return ''.join('%06d %s%s' % (number, 'x' * (number % 60),
+                                  ends[number % len(ends)])
+                   for number in range(lines)) + prompt
+
+
+SPLITS = ('whole', 'recv', 'small', 'lines', 'crlf')
+"""Names of the ways :func:`split` can split data into chunks."""
+
+
+def split(data, how):
+    """
+    Splits data into the chunks that a channel would receive.
+
+    :param data: bytes to split.
+    :param how: one of :const:`SPLITS`: ``'whole'`` for one chunk,
+        ``'recv'`` for the 4096 byte chunks of a busy connection,
+        ``'small'`` for 64 byte chunks, ``'lines'`` for a chunk per line,
+        and ``'crlf'`` for a chunk per line split between its ``\\r`` and
+        ``\\n``.
+    """
+    if how == 'whole':
+        return [data]
+    if how in ('recv', 'small'):
+        size = 4096 if how == 'recv' else 64
+        return [data[start:start + size]
+                for start in range(0, len(data), size)]
+    if how == 'lines':
+        return data.splitlines(True)
+    if how == 'crlf':
+        chunks = []
+        for chunk in data.split(b'\r\n'):
+            chunks.extend([chunk + b'\r', b'\n'])
+        chunks[-2:] = [chunks[-2][:-1]]
+        return chunks
+    raise ValueError('Unknown split %r' % how)
@@ -0,0 +1,267 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Registry, timing and baseline comparison for the benchmark suite.
+
+
+import gc
+import json
+import time
+import platform
+import statistics
+import tracemalloc
+
+RESULTS_VERSION = 1
+
+BENCHMARKS = []
+"""Registered :class:`Benchmark` objects, in registration order."""
+
+
+class Benchmark(object):
+    """
+    A registered benchmark.
+
+    :param name: unique name, used to compare against baselines.
+    :param unit: unit of the measured value, such as ``'commands/s'``.
+    :param higher_is_better: whether a larger value is an improvement.
+    :param function: callable taking a :class:`Context` and returning the
+        measured value, or a dict of extra names (appended to ``name``
+        with a ``.``) to values.  Values may be :class:`Measurement`
+        objects, to report more than the compared value.
+    """
+
+    def __init__(self, name, unit, higher_is_better, function):
+        self.name = name
+        self.unit = unit
+        self.higher_is_better = higher_is_better
+        self.function = function
+
+    def run(self, context):
+        """
+        Runs the benchmark.
+
+        :return: a list of :class:`Result`.
+        """
+        value = self.function(context)
+        if not isinstance(value, dict):
+            value = {None: value}
+        results = []
+        for key, measured in value.items():
+            name = self.name if key is None else '%s.%s' % (self.name, key)
+            extra = None
+            if isinstance(measured, Measurement):
+                measured, extra = measured.value, measured.extra
+            results.append(Result(name, measured, self.unit,
+                                  self.higher_is_better, extra))
+        return results
+
+
+def benchmark(name, unit, higher_is_better=True):
+    """
+    Decorator registering a function as a benchmark::
+
+        @benchmark('session_setup', 'ms', higher_is_better=False)
+        def session_setup(context):
+            ...
+            return milliseconds
+    """
+    def register(function):
+        BENCHMARKS.append(Benchmark(name, unit, higher_is_better, function))
+        return function
+    return register
+
+
+class Measurement(object):
+    """
+    A value returned by a benchmark, with extra figures that are reported
+    along with it but not compared to baselines.
+
+    :param value: the measured value.
+    :param extra: the extra figures, by name.
+    """
+
+    def __init__(self, value, **extra):
+        self.value = value
+        self.extra = extra
+
+
+class Result(object):
+    """A measured value of a benchmark."""
+
+    def __init__(self, name, value, unit, higher_is_better, extra=None):
+        self.name = name
+        self.value = value
+        self.unit = unit
+        self.higher_is_better = higher_is_better
+        self.extra = extra or {}
+
+    def to_dict(self):
+        data = {'value': self.value, 'unit': self.unit,
+                'higher_is_better': self.higher_is_better}
+        data.update(self.extra)
+        return data
+
+
+class Context(object):
+    """
+    What benchmarks share: options, and resources such as simulators that
+    are cleaned up once all benchmarks have run.
+
+    :param quick: if True, benchmarks do less work, for smoke tests.
+    """
+
+    def __init__(self, quick=False):
+        self.quick = quick
+        self._cleanups = []
+
+    def scale(self, full, quick):
+        """Returns ``quick`` in quick runs and ``full`` otherwise."""
+        return quick if self.quick else full
+
+    def add_cleanup(self, function):
+        """Runs a function once all benchmarks have run."""
+        self._cleanups.append(function)
+
+    def close(self):
+        while self._cleanups:
+            self._cleanups.pop()()
+
+
+def measure(function, repeat=5, number=1):
+    """
+    Times a function, with garbage collection disabled.
+
+    :param function: callable taking no arguments.
+    :param repeat: number of timings taken.
+    :param number: calls made per timing.
+    :return: median seconds per call.
+    """
+    timings = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for _ in range(number):
+                function()
+            timings.append((time.perf_counter() - started) / number)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return statistics.median(timings)
+
+
+def measure_call(function, repeat=3, min_time=0.02):
+    """
+    Times a function, calling it enough times per timing to be measured
+    accurately.
+
+    :param function: callable taking no arguments.
+    :param repeat: number of timings taken.
+    :param min_time: seconds that each timing should last at least.
+    :return: median seconds per call.
+    """
+    number = 1
+    while True:
+        seconds = measure(function, repeat=1, number=number)
+        if seconds * number >= min_time / 10 or number >= 1 << 20:
+            break
+        number *= 10
+    number = max(1, int(min_time / max(seconds, 1e-9)))
+    return measure(function, repeat=repeat, number=number)
+
+
+def allocated(function):
+    """
+    Measures the memory a function allocates.
+
+    :param function: callable taking no arguments, called once.
+    :return: ``(peak, blocks)``, the peak bytes allocated during the call
+        and the number of memory blocks still allocated after it, as
+        traced by :mod:`tracemalloc`.
+    """
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    try:
+        gc.collect()
+        before = tracemalloc.take_snapshot()
+        start_size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        result = function()
+        peak = tracemalloc.get_traced_memory()[1] - start_size
+        after = tracemalloc.take_snapshot()
+        del result
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in
+                 after.compare_to(before, 'filename'))
+    return peak, blocks
+
+
+def results_document(results):
+    """Returns results as a dict ready to be written as JSON."""
+    return {
+        'version': RESULTS_VERSION,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': dict((result.name, result.to_dict())
+                        for result in results),
+    }
+
+
+def write_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results_document(results), f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def read_results(path):
+    """
+    Reads results written by :func:`write_results`.
+
+    :return: dict of benchmark names to their result dicts.
+    :raises ValueError: if the file is not a results file of this version.
+    """
+    with open(path) as f:
+        document = json.load(f)
+    if document.get('version') != RESULTS_VERSION:
+        raise ValueError('%s is not a version %d results file' %
+                         (path, RESULTS_VERSION))
+    return document['results']
+
+
+def compare(results, baseline, threshold, thresholds=None):
+    """
+    Compares results to a baseline.
+
+    :param results: list of :class:`Result`.
+    :param baseline: dict as returned by :func:`read_results`.  Results
+        missing from it are not compared.
+    :param threshold: the fraction that a result may be worse than its
+        baseline by, such as 0.1 for 10%.
+    :param thresholds: dict of benchmark names to thresholds overriding
+        ``threshold``.
+    :return: a list of ``(result, baseline value, change)`` tuples for the
+        results worse than allowed, where change is the relative change,
+        negative when worse.
+    """
+    thresholds = thresholds or {}
+    regressions = []
+    for result in results:
+        if result.name not in baseline:
+            continue
+        old = baseline[result.name]['value']
+        if not old:
+            continue
+        change = (result.value - old) / old
+        if not result.higher_is_better:
+            change = -change
+        if change < -thresholds.get(result.name, threshold):
+            regressions.append((result, old, change))
+    return regressions
@@ -0,0 +1,436 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Load generator: drives many concurrent sessions through the library
+# against simulated devices, reporting how memory, threads, latency and
+# throughput change as concurrency grows.  See benchmarks/README.rst.
+
+
+import re
+import abc
+import sys
+import json
+import time
+import argparse
+import resource
+import threading
+import subprocess
+import collections
+from concurrent import futures
+
+from steelscript.cmdline import cli as cli_module
+from steelscript.cmdline.cli.pool import CLIPool
+from steelscript.cmdline.cli.rvbd_cli import RVBD_CLI
+from steelscript.cmdline.histogram import Histogram
+from steelscript.cmdline.shell import Shell
+
+COMMAND = 'show version'
+
+# From 0.1ms to about 2 minutes, each bucket 10% wider than the last, as
+# commands on the simulator take around a millisecond.
+LATENCY_BOUNDS = tuple(round(0.0001 * 1.1 ** n, 7) for n in range(150))
+
+# Stands in for the resources that CLICache is given.
+Resource = collections.namedtuple('Resource',
+                                  'uniqueid admin_ip username password')
+
+Device = collections.namedtuple('Device', 'host port username password')
+
+
+class Simulators(object):
+    """
+    Device simulators, each in its own process so that their memory and
+    threads are not counted as the library's.
+
+    :param count: number of simulated devices.
+    :param latency: seconds each simulated device takes to answer a line.
+    """
+
+    def __init__(self, count, latency=0):
+        self.devices = []
+        self._processes = []
+        try:
+            for _ in range(count):
+                self._start(latency)
+        except Exception:
+            self.stop()
+            raise
+
+    def _start(self, latency):
+        process = subprocess.Popen(
+            [sys.executable, '-u', '-m', 'steelscript.cmdline.simulator',
+             '--port', '0', '--latency', str(latency)],
+            stdout=subprocess.PIPE, universal_newlines=True)
+        self._processes.append(process)
+        line = process.stdout.readline()
+        match = re.search(r' on (\S+):(\d+)$', line)
+        if not match:
+            raise RuntimeError('Simulator did not start: %r' % line)
+        self.devices.append(Device(match.group(1), int(match.group(2)),
+                                   'admin', 'password'))
+
+    def stop(self):
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.wait()
+            process.stdout.close()
+        self._processes = []
+
+
+class Workload(object, metaclass=abc.ABCMeta):
+    """
+    Sessions driven by the load generator.  Session ``index`` belongs to
+    device ``index % len(devices)``.
+
+    :param devices: list of :class:`Device` to open sessions to.
+    """
+
+    name = None
+
+    def __init__(self, devices):
+        self.devices = devices
+        # Indexes of the sessions opened, and the next index to open.
+        self.opened = []
+        self.next_index = 0
+
+    def device(self, index):
+        return self.devices[index % len(self.devices)]
+
+    @abc.abstractmethod
+    def open(self, index):
+        """Opens session ``index``."""
+        pass
+
+    def opened_all(self):
+        """Called once a batch of sessions is open."""
+
+    @abc.abstractmethod
+    def run(self, index):
+        """Runs one command on session ``index``."""
+        pass
+
+    @abc.abstractmethod
+    def close(self):
+        """Closes all sessions."""
+        pass
+
+
+class CLICacheWorkload(Workload):
+    """An RVBD_CLI per session, shared through a :class:`CLICache`."""
+
+    name = 'clicache'
+
+    def __init__(self, devices):
+        super(CLICacheWorkload, self).__init__(devices)
+        self._cache = cli_module.CLICache()
+        self._resources = {}
+
+    def _cli_class(self, hostname, username, password, **limits):
+        # CLICache connects to port 22; the simulators listen elsewhere.
+        hostname, port = hostname.rsplit(':', 1)
+        return RVBD_CLI(hostname=hostname, port=int(port), username=username,
+                        password=password, **limits)
+
+    def open(self, index):
+        device = self.device(index)
+        resource = Resource(index, '%s:%s' % (device.host, device.port),
+                            device.username, device.password)
+        self._resources[index] = resource
+        self._cache.get_cli(resource, self._cli_class)
+
+    def run(self, index):
+        self._cache.get_cli(self._resources[index], self._cli_class) \
+            .exec_command(COMMAND, mode=None)
+
+    def close(self):
+        self._cache.drop_all()
+
+
+class ShellWorkload(Workload):
+    """A :class:`Shell` per session, running a command per exec request."""
+
+    name = 'shell'
+
+    def __init__(self, devices):
+        super(ShellWorkload, self).__init__(devices)
+        self._shells = {}
+
+    def open(self, index):
+        device = self.device(index)
+        shell = Shell(device.host, user=device.username,
+                      password=device.password, port=device.port)
+        shell.sshprocess.connect()
+        self._shells[index] = shell
+
+    def run(self, index):
+        self._shells[index].exec_command(COMMAND)
+
+    def close(self):
+        for shell in self._shells.values():
+            shell.sshprocess.disconnect()
+        self._shells.clear()
+
+
+class PoolWorkload(Workload):
+    """
+    A :class:`CLIPool` per device.  Each worker takes a session from its
+    device's pool for every command, so there are as many sessions as
+    workers using a pool at once.
+    """
+
+    name = 'pool'
+
+    def __init__(self, devices):
+        super(PoolWorkload, self).__init__(devices)
+        self._pools = [
+            CLIPool(lambda device=device: RVBD_CLI(
+                hostname=device.host, port=device.port,
+                username=device.username, password=device.password),
+                min_idle=0)
+            for device in devices]
+        self._opened = []
+        self._lock = threading.Lock()
+
+    def open(self, index):
+        # Sessions are started by taking them, and stay in the pool once
+        # released, when all are open.
+        cli = self._pools[index % len(self._pools)].acquire()
+        with self._lock:
+            self._opened.append((index, cli))
+
+    def opened_all(self):
+        with self._lock:
+            opened, self._opened = self._opened, []
+        for index, cli in opened:
+            self._pools[index % len(self._pools)].release(cli)
+
+    def run(self, index):
+        with self._pools[index % len(self._pools)].session() as cli:
+            cli.exec_command(COMMAND, mode=None)
+
+    def close(self):
+        for pool in self._pools:
+            pool.close()
+
+
+WORKLOADS = dict((workload.name, workload) for workload in
+                 (CLICacheWorkload, ShellWorkload, PoolWorkload))
+
+
+def memory():
+    """Returns the resident memory of this process, in bytes."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    # Only the peak is available elsewhere.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def raise_file_limit():
+    """Allows as many open files as permitted, for sockets."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def _quantiles(histogram):
+    return dict(('p%d' % (q * 100), 1000 * (histogram.quantile(q) or 0))
+                for q in (0.5, 0.99))
+
+
+def open_sessions(workload, count, connectors):
+    """
+    Tries to open sessions until the workload has tried ``count``.
+
+    :return: ``(histogram, errors)``: the seconds each session took to
+        open, and the number that failed to.
+    """
+    histogram = Histogram(LATENCY_BOUNDS)
+    lock = threading.Lock()
+    errors = []
+
+    def open_one(index):
+        started = time.monotonic()
+        try:
+            workload.open(index)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+            return
+        histogram.record(time.monotonic() - started)
+        with lock:
+            workload.opened.append(index)
+
+    with futures.ThreadPoolExecutor(max_workers=connectors) as executor:
+        executor.map(open_one, range(workload.next_index, count))
+    workload.next_index = max(workload.next_index, count)
+    workload.opened.sort()
+    workload.opened_all()
+    return histogram, len(errors)
+
+
+def drive(workload, duration):
+    """
+    Runs commands on the open sessions, a thread each, for ``duration``
+    seconds.
+
+    :return: ``(histogram, commands, errors, threads)``: the seconds each
+        command took, the numbers of commands run and of errors, and the
+        threads running while driving.
+    """
+    histogram = Histogram(LATENCY_BOUNDS)
+    counts = {'errors': 0, 'threads': 0}
+    lock = threading.Lock()
+    start = threading.Barrier(len(workload.opened) + 1)
+    stop = threading.Event()
+
+    def work(index):
+        errors = 0
+        start.wait()
+        while not stop.is_set():
+            started = time.monotonic()
+            try:
+                workload.run(index)
+            except Exception:
+                errors += 1
+                continue
+            histogram.record(time.monotonic() - started)
+        with lock:
+            counts['errors'] += errors
+
+    threads = [threading.Thread(target=work, args=(index,))
+               for index in workload.opened]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    start.wait()
+    time.sleep(duration / 2.0)
+    counts['threads'] = threading.active_count()
+    time.sleep(duration / 2.0)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return histogram, histogram.count, counts['errors'], counts['threads']
+
+
+def run_level(workload, concurrency, options, baseline_memory):
+    """Grows the workload to ``concurrency`` sessions and drives them."""
+    opening, open_errors = open_sessions(workload, concurrency,
+                                         options.connectors)
+    sessions = len(workload.opened)
+    sessions_memory = memory() - baseline_memory
+    idle_threads = threading.active_count()
+    latency, commands, errors, threads = drive(workload, options.duration)
+    level = {
+        'concurrency': concurrency,
+        'sessions': sessions,
+        'open_errors': open_errors,
+        'idle_threads': idle_threads,
+        'threads': threads,
+        'memory': sessions_memory,
+        'memory_per_session': sessions_memory / float(max(1, sessions)),
+        'throughput': commands / options.duration,
+        'commands': commands,
+        'errors': errors,
+        'open_ms': _quantiles(opening),
+        'latency_ms': _quantiles(latency),
+    }
+    return level
+
+
+HEADER = ('%8s %8s %8s %10s %10s %10s %10s %10s %10s %7s' %
+          ('sessions', 'idle thr', 'threads', 'MB', 'KB/sess', 'open p50',
+           'p50 ms', 'p99 ms', 'cmds/s', 'errors'))
+
+
+def format_level(level):
+    return ('%8d %8d %8d %10.1f %10.1f %10.2f %10.2f %10.2f %10.1f %7d' %
+            (level['sessions'], level['idle_threads'], level['threads'],
+             level['memory'] / 1e6, level['memory_per_session'] / 1e3,
+             level['open_ms']['p50'], level['latency_ms']['p50'],
+             level['latency_ms']['p99'], level['throughput'],
+             level['open_errors'] + level['errors']))
+
+
+def parse_levels(value):
+    try:
+        levels = sorted(set(int(level) for level in value.split(',')))
+    except ValueError:
+        levels = None
+    if not levels or levels[0] < 1:
+        raise argparse.ArgumentTypeError(
+            'Expected positive numbers separated by commas, got %r' % value)
+    return levels
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Drive many concurrent sessions against simulated '
+                    'devices, reporting how resources, latency and '
+                    'throughput grow with concurrency.')
+    parser.add_argument('--workload', choices=sorted(WORKLOADS),
+                        default='clicache',
+                        help='how sessions are opened and driven '
+                             '(default: clicache)')
+    parser.add_argument('--concurrency', type=parse_levels,
+                        default=[1, 10, 100, 500],
+                        help='concurrent sessions at each level, separated '
+                             'by commas (default: 1,10,100,500)')
+    parser.add_argument('--devices', type=int, default=10,
+                        help='simulated devices to spread sessions over '
+                             '(default: 10)')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='seconds the simulated devices take to answer '
+                             'a line (default: 0.005)')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds to drive each level for (default: 10)')
+    parser.add_argument('--connectors', type=int, default=32,
+                        help='sessions opened at once (default: 32)')
+    parser.add_argument('--output', '-o', default=None,
+                        help='file to write the results to, as JSON')
+    options = parser.parse_args(argv)
+
+    raise_file_limit()
+    simulators = Simulators(options.devices, options.latency)
+    workload = WORKLOADS[options.workload](simulators.devices)
+    levels = []
+    try:
+        baseline_memory = memory()
+        print('%s workload, %d devices, %.1fms latency, %.0fs per level' %
+              (options.workload, options.devices, 1000 * options.latency,
+               options.duration))
+        print(HEADER)
+        for concurrency in options.concurrency:
+            level = run_level(workload, concurrency, options,
+                              baseline_memory)
+            levels.append(level)
+            print(format_level(level))
+            sys.stdout.flush()
+    finally:
+        workload.close()
+        simulators.stop()
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({'workload': options.workload,
+                       'devices': options.devices,
+                       'latency': options.latency,
+                       'duration': options.duration,
+                       'python': sys.version.split()[0],
+                       'levels': levels}, f, indent=2, sort_keys=True)
+            f.write('\n')
+    return 1 if any(level['open_errors'] or level['errors']
+                    for level in levels) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Runs the benchmark suite, optionally failing on regressions from a
+# baseline.  See benchmarks/README.rst.
+
+
+import re
+import sys
+import argparse
+
+import harness
+
+# Importing the benchmark modules registers their benchmarks.
+MODULES = ('bench_e2e', 'bench_micro')
+
+
+def parse_thresholds(values):
+    thresholds = {}
+    for value in values:
+        name, _, threshold = value.rpartition('=')
+        if not name:
+            raise argparse.ArgumentTypeError(
+                'Expected NAME=FRACTION, got %r' % value)
+        thresholds[name] = float(threshold)
+    return thresholds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run the steelscript.cmdline benchmarks.')
+    parser.add_argument('-k', dest='pattern', default=None,
+                        help='only run benchmarks whose name matches this '
+                             'regular expression')
+    parser.add_argument('--quick', action='store_true',
+                        help='do less work, to check that the benchmarks '
+                             'run')
+    parser.add_argument('--list', action='store_true',
+                        help='list the benchmarks and exit')
+    parser.add_argument('--output', '-o', default=None,
+                        help='file to write the results to, as JSON')
+    parser.add_argument('--baseline', '-b', default=None,
+                        help='results file to compare against')
+    parser.add_argument('--threshold', '-t', type=float, default=0.2,
+                        help='fraction that results may be worse than the '
+                             'baseline by (default: 0.2)')
+    parser.add_argument('--threshold-for', action='append', default=[],
+                        metavar='NAME=FRACTION',
+                        help='threshold for one result, may be repeated')
+    options = parser.parse_args(argv)
+
+    for module in MODULES:
+        __import__(module)
+    benchmarks = [b for b in harness.BENCHMARKS
+                  if options.pattern is None or
+                  re.search(options.pattern, b.name)]
+
+    if options.list:
+        for b in benchmarks:
+            print('%-30s %s' % (b.name, b.unit))
+        return 0
+
+    baseline = None
+    if options.baseline:
+        baseline = harness.read_results(options.baseline)
+
+    context = harness.Context(quick=options.quick)
+    results = []
+    try:
+        for b in benchmarks:
+            for result in b.run(context):
+                results.append(result)
+                line = '%-40s %14.3f %s' % (result.name, result.value,
+                                            result.unit)
+                for key in sorted(result.extra):
+                    line += ' %s=%s' % (key, result.extra[key])
+                if baseline and result.name in baseline:
+                    old = baseline[result.name]['value']
+                    line += '  (baseline %.3f)' % old
+                print(line)
+                sys.stdout.flush()
+    finally:
+        context.close()
+
+    if options.output:
+        harness.write_results(results, options.output)
+
+    if baseline is None:
+        return 0
+    regressions = harness.compare(
+        results, baseline, options.threshold,
+        parse_thresholds(options.threshold_for))
+    for result, old, change in regressions:
+        print('REGRESSION %s: %.3f %s, baseline %.3f (%.1f%% worse)' %
+              (result.name, result.value, result.unit, old, -100 * change))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,12 +9,31 @@ import abc
 import re
 import logging
 
+from steelscript.cmdline import instrumentation
+from steelscript.cmdline.debuglog import Preview
+from steelscript.cmdline.footprint import Footprint
+from steelscript.cmdline.hooks import HookRegistry
+
+log = logging.getLogger(__name__)
+
 
 class Channel(object, metaclass=abc.ABCMeta):
     """
     Abstract class to define common interface for a two communication channel.
     """
 
+    instrumentation = None
+    """
+    :class:`steelscript.cmdline.instrumentation.Instrumentation` recording
+    the output received by :meth:`expect`, or None.
+    """
+
+    hooks = HookRegistry()
+    """
+    :class:`steelscript.cmdline.hooks.HookRegistry` of the channel.  Hooks
+    added to ``Channel.hooks`` run for every channel.
+    """
+
     @abc.abstractmethod
     def receive_all(self):
         """
@@ -67,7 +86,81 @@ class Channel(object, metaclass=abc.ABCMeta):
         """
         return
 
+    def keepalive(self, timeout=10):
+        """
+        Checks that the other end is still there, without disturbing the
+        session.
+
+        Channels that can detect a silently dropped connection override
+        this; the default assumes the channel is alive.
+
+        :param timeout: maximum time, in seconds, to wait for an answer.
+        :return: True if the channel is alive, False if it was found dead,
+            in which case it has been closed.
+        """
+        return True
+
+    def footprint(self):
+        """
+        Returns the memory that the channel holds on to, such as received
+        data that has not been read yet.
+
+        Channels that hold data override this; the default holds nothing.
+
+        :return: a :class:`steelscript.cmdline.footprint.Footprint`
+        """
+        return Footprint()
+
+    def add_hook(self, event, callback):
+        """
+        Runs a callback whenever an event happens on this channel only.
+
+        For example, to count the bytes received::
+
+            channel.add_hook(hooks.RECEIVE,
+                             lambda channel, event, data: meter(len(data)))
+
+        :param event: one of :const:`steelscript.cmdline.hooks.EVENTS`
+        :param callback: called as ``callback(channel, event, **data)``,
+            see :class:`steelscript.cmdline.hooks.HookRegistry`.
+        """
+        if 'hooks' not in self.__dict__:
+            self.hooks = HookRegistry(parent=type(self).hooks)
+        self.hooks.add(event, callback)
+
+    def remove_hook(self, event, callback):
+        """
+        Stops running a callback added with :meth:`add_hook`.
+
+        :raises ValueError: if the callback was not added to this channel
+            for the event.
+        """
+        if 'hooks' not in self.__dict__:
+            raise ValueError("No hooks were added to this channel")
+        self.hooks.remove(event, callback)
+
     # ###### Helper methods ###################
+    def _fire(self, event, **data):
+        """
+        Runs the hooks for an event, if there are any.
+
+        :param event: one of :const:`steelscript.cmdline.hooks.EVENTS`
+        :param data: the event's data
+        """
+        registry = self.hooks
+        if registry:
+            registry.fire(event, self, **data)
+
+    def _receive_stats(self):
+        """
+        Returns the object to count the output received by one expect call
+        with.  See :class:`steelscript.cmdline.instrumentation.ReceiveStats`.
+        """
+        if self.instrumentation is None:
+            return instrumentation.NO_RECEIVE_STATS
+        return self.instrumentation.receive_stats(
+            channel=type(self).__name__)
+
     def safe_line_feeds(self, in_string):
         """
         :param in_string: string to replace linefeeds
@@ -128,7 +221,9 @@ class Channel(object, metaclass=abc.ABCMeta):
 
         :return: (match_res, safe_match_text) where match_res
             is the given input guaranteed to be in list form,
-            and safe_match_text is a version suitable for logging.
+            and safe_match_text is a list of
+            :class:`steelscript.cmdline.debuglog.Preview` objects suitable
+            for logging.
         """
         if match_res is None:
             raise TypeError('Parameter match_res is required!')
@@ -142,13 +237,11 @@ class Channel(object, metaclass=abc.ABCMeta):
 
         self._verify_connected()
 
-        # Create a newline-free copy of the list of regexes for outputting
-        # to the log. Otherwise the newlines make the output unreadable.
-        safe_match_text = []
-        for match in match_res:
-            safe_match_text.append(self.safe_line_feeds(match))
+        # Newline-free versions of the regexes for outputting to the log,
+        # only formatted if they are actually logged.
+        safe_match_text = [Preview(match) for match in match_res]
 
-        logging.debug('Waiting for %s' % str(safe_match_text))
+        log.debug('Waiting for %s', safe_match_text)
 
         return match_res, safe_match_text
 
@@ -163,10 +256,69 @@ class Channel(object, metaclass=abc.ABCMeta):
             no match was found.
         """
 
+        # Checked once, as this runs for every line received.
+        debug = log.isEnabledFor(logging.DEBUG)
         for pattern in match_res:
-            logging.debug('Search "%s" in "%s"' % (pattern, data))
+            if debug:
+                log.debug('Search "%s" in "%s"', pattern, Preview(data))
             match = re.search(pattern, data)
             if match:
                 return match
 
         return None
+
+    def _process_data(self, new_data, received_data, next_line_start):
+        """
+        Process the new data and return updated received_data and new lines.
+
+        :param bytes new_data: The newly read data in bytes
+        :param str received_data: All data received before new_data, str
+        :param next_line_start: Where to start splitting off the new lines.
+
+        :return: A tuple of the updated received_data followed by the list
+            of new lines.
+        """
+        received_data += new_data.decode()
+
+        # The CLI does some odd things, sending multiple \r's or just a
+        # \r, sometimes \r\r\n. To make this look like typical input, all
+        # the \r characters with \n near them are stripped. To make
+        # prompt matching easier, any \r character that does not have
+        # a \n near is replaced with a \n.
+        received_data = received_data[:next_line_start] + \
+            self.fixup_carriage_returns(received_data[next_line_start:])
+
+        # Take the data from next_line_start to end and split it into
+        # lines so we can look for a match on each one
+        new_lines = received_data[next_line_start:].splitlines()
+        return received_data, new_lines
+
+    def _match_lines(self, received_data, next_line_start,
+                     new_lines, match_res):
+        """
+        Examine new lines for matches against our regular expressions.
+
+        :param received_data: All data received so far, including latest.
+        :param new_lines: Latest data split into individual lines.
+        :param next_line_start: The point in received_data where new lines
+            begin.
+        :param match_res: The regular expressions for matching as documented
+            for `expect()`
+
+        :return: ``(output, match_object)`` as described for `expect() except
+            that ``(None, None)`` is returned to indicate no match.
+        """
+        # Loop through all new lines and check them for matches.
+        for line_num in range(len(new_lines)):
+            match = self._find_match(new_lines[line_num], match_res)
+            if match:
+                log.debug('Matched "%s" in \n%s', Preview(match.re.pattern),
+                          Preview(new_lines[line_num]))
+
+                # Output is all data up to the next_line_start, plus
+                # all lines up to the one we matched.
+                output = received_data[:next_line_start] + \
+                    '\n'.join(new_lines[:line_num]) + \
+                    new_lines[line_num][:match.start()]
+                return output, match
+        return None, None
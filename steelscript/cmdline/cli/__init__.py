@@ -4,11 +4,23 @@
 # accompanying the software ("License").  This software is distributed "AS IS"
 # as set forth in the License.
 
+import time
+import inspect
 import logging
+import functools
+import contextlib
+import collections
 
 from steelscript.cmdline import sshchannel
 from steelscript.cmdline import exceptions
+from steelscript.cmdline import retry
+from steelscript.cmdline import ratelimit
+from steelscript.cmdline import timeouts
+from steelscript.cmdline import instrumentation
+from steelscript.cmdline.deadline import Deadline
+from steelscript.cmdline.footprint import Footprint
 from steelscript.common.connection import test_tcp_conn
+from steelscript.common.exceptions import RvbdConnectException
 
 # Control-u clears any entered text.  Neat.
 DELETE_LINE = '\x15'
@@ -44,6 +56,26 @@ class CLIMode(object):
     """Used within the code to indicate unknown or don`t-care situations"""
 
 
+def deadline_scoped(method):
+    """
+    Decorator bounding everything a CLI method does by one deadline.
+
+    The deadline is built from the method's ``timeout`` and ``deadline``
+    arguments and applies to every prompt wait made while the method runs,
+    including mode probes, mode changes and reconnects.
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        arguments = signature.bind(self, *args, **kwargs)
+        arguments.apply_defaults()
+        with self._deadline_scope(arguments.arguments.get('timeout'),
+                                  arguments.arguments.get('deadline')):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class CLI(object):
     """
     Base class CLI implementation for Network Devices
@@ -78,6 +110,29 @@ class CLI(object):
         communication.  Defaults to
         ``steelscript.cmdline.sshchannel.SSHChannel``
     :type channel_class: class
+    :param retry_policy: :class:`steelscript.cmdline.retry.RetryPolicy`
+        used when restarting a broken channel.  Defaults to three attempts
+        with jittered exponential backoff.
+    :type retry_policy: RetryPolicy
+    :param rate_limiter: :class:`steelscript.cmdline.ratelimit.TokenBucket`
+        limiting the logins and commands sent per second, typically shared
+        by all sessions to the host, see
+        :func:`steelscript.cmdline.ratelimit.get_limiter`.  None for no
+        limit.
+    :type rate_limiter: TokenBucket
+    :param governor:
+        :class:`steelscript.cmdline.ratelimit.ConcurrencyGovernor` that
+        must grant a slot for this session before it starts.  The slot is
+        held until the session is closed.
+    :type governor: ConcurrencyGovernor
+    :param timeout_model: :class:`steelscript.cmdline.timeouts.TimeoutModel`
+        choosing the timeout of commands run without one, and learning
+        from every command run.
+    :type timeout_model: TimeoutModel
+    :param instrumentation:
+        :class:`steelscript.cmdline.instrumentation.Instrumentation`
+        recording where the time of each command goes.
+    :type instrumentation: Instrumentation
     :param channel_args: additional ``transport_type``-dependent
         arguments, passed blindly to the transport ``start`` method.
     """
@@ -101,7 +156,9 @@ class CLI(object):
                  terminal='console', prompt=None, port=None,
                  machine_name=None,
                  machine_manager_uri=DEFAULT_MACHINE_MANAGER_URI,
-                 channel_class=sshchannel.SSHChannel, **channel_args):
+                 channel_class=sshchannel.SSHChannel, retry_policy=None,
+                 rate_limiter=None, governor=None, timeout_model=None,
+                 instrumentation=None, **channel_args):
 
         self._channel_class = channel_class
         self._channel_args = dict()
@@ -127,6 +184,24 @@ class CLI(object):
         if self._prompt is None:
             self._prompt = self.CLI_ANY_PROMPT
 
+        if retry_policy is None:
+            retry_policy = retry.RetryPolicy(max_attempts=3, base_delay=1,
+                                             max_delay=10)
+        self._retry_policy = retry_policy
+
+        # Deadline bounding the operation in progress, if any.
+        self._deadline = None
+
+        self._rate_limiter = rate_limiter
+        self._governor = governor
+        self._holds_slot = False
+
+        self._timeout_model = timeout_model
+
+        self._instrumentation = instrumentation
+        # When output was last received, for timing its processing.
+        self._received_at = None
+
         self.channel = None
 
     def __del__(self):
@@ -143,6 +218,31 @@ class CLI(object):
         if self.channel:
             self.channel.close()
         self.channel = None
+        self._release_slot()
+
+    def _release_slot(self):
+        if self._holds_slot:
+            self._governor.release(self._host())
+            self._holds_slot = False
+
+    def _host(self):
+        # The device, for per-host limits.  Older callers pass the
+        # deprecated 'host' argument, and console sessions have only a
+        # machine name.
+        return (self._channel_args.get('hostname') or
+                self._channel_args.get('host') or
+                self._channel_args.get('machine_name'))
+
+    def _wait_time(self):
+        # Seconds left to wait for a limit, or None if unbounded.
+        if self._deadline is None:
+            return None
+        return self._deadline.remaining()
+
+    def _take_token(self):
+        # Waits until the rate limiter, if any, allows another command.
+        if self._rate_limiter is not None:
+            self._rate_limiter.acquire(timeout=self._wait_time())
 
     def start(self, start_prompt=None):
         """
@@ -152,20 +252,145 @@ class CLI(object):
         :type start_prompt: regex pattern
         """
 
+        if self._governor is not None and not self._holds_slot:
+            self._governor.acquire(self._host(), timeout=self._wait_time())
+            self._holds_slot = True
+        try:
+            self._start_channel(start_prompt)
+        except Exception:
+            self._release_slot()
+            raise
+
+    def _start_channel(self, start_prompt):
         self.channel = self._channel_class(**self._channel_args)
+        if self._instrumentation is not None:
+            self.channel.instrumentation = self._instrumentation
 
         # Wait for a prompt, try and figure out where we are.  It's a new
         # channel so we should only be at bash or the main CLI prompt.
         if start_prompt is None:
             start_prompt = self.CLI_START_PROMPT
 
-        host = self._channel_args['hostname']
-        port = self._channel_args.get('port', self.channel.conn_port)
         # will raise an exception if it fails.
-        if test_tcp_conn(host, port):
-            self._log.info("test_tcp_conn to {0}:{1} passed"
-                           "".format(host, port))
-            self.channel.start(start_prompt)
+        if self._test_connection():
+            self._take_token()
+            if self._deadline is None or self._deadline.expires is None:
+                self.channel.start(start_prompt)
+            else:
+                self.channel.start(start_prompt,
+                                   timeout=self._deadline.limit())
+
+    def _test_connection(self):
+        """
+        Checks that the host accepts TCP connections on the channel's port.
+
+        Channels that do not connect over TCP, and so have no
+        ``conn_port``, are not checked.
+
+        Failures count against the circuit breaker of the host and port,
+        and are raised as ``ConnectionError`` so that the retry policy
+        retries them.  Successes are not recorded: the port accepting TCP
+        connections does not show that the session behind it can be set
+        up, which the channel records when it connects.
+
+        :return: True
+        :raises ConnectionError: if the host cannot be reached.
+        """
+        host = self._host()
+        port = self._channel_args.get('port',
+                                      getattr(self.channel, 'conn_port', None))
+        if port is None:
+            return True
+        try:
+            test_tcp_conn(host, port)
+        except RvbdConnectException as e:
+            retry.get_breaker(host, port).record_failure()
+            raise exceptions.ConnectionError(
+                cause=e, context='Failed to connect to %s:%s' % (host, port))
+        self._log.debug("test_tcp_conn to %s:%s passed", host, port)
+        return True
+
+    def _restart(self):
+        """
+        Tears down the channel and starts a new one.
+
+        Attempts are spaced out according to the retry policy, so that
+        many CLIs losing their connections at once do not all reconnect
+        at the same moment.  A host whose circuit breaker is open fails
+        immediately with ``CircuitOpen``.
+        """
+        def attempt():
+            self._cleanup_helper()
+            self.start()
+
+        policy = self._retry_policy
+        if self._deadline is not None:
+            policy = policy.limited_to(self._deadline.remaining())
+        policy.call(attempt)
+
+    def reconnect(self):
+        """
+        Drops the current session, if any, and starts a new one.
+
+        Suitable as the ``reconnect`` callback of
+        :class:`steelscript.cmdline.health.HealthMonitor`.
+        """
+        self._restart()
+
+    def keepalive(self, timeout=10):
+        """
+        Checks that the session is still alive without running a command.
+
+        :param timeout: maximum time, in seconds, to wait for an answer.
+        :return: True if the session is alive, False if there is none or
+            it was found dead.
+        """
+        if self.channel is None:
+            return False
+        return self.channel.keepalive(timeout)
+
+    def footprint(self):
+        """
+        Returns the memory that the session holds on to.
+
+        :return: a :class:`steelscript.cmdline.footprint.Footprint`, empty
+            if there is no session.
+        """
+        if self.channel is None:
+            return Footprint()
+        return self.channel.footprint()
+
+    def _phase(self, name):
+        """
+        Returns a context manager timing its block as a phase of the
+        command in progress, if the CLI is instrumented.
+
+        :param name: phase name, such as ``mode`` or ``send``.
+        """
+        if self._instrumentation is None:
+            return contextlib.nullcontext()
+        return self._instrumentation.timer('cmdline_phase_seconds',
+                                           session=type(self).__name__,
+                                           phase=name)
+
+    @contextlib.contextmanager
+    def _deadline_scope(self, timeout=None, deadline=None):
+        """
+        Bounds every wait made within the block by one overall deadline.
+
+        Scopes nest: an inner scope can only shorten the deadline of the
+        scope around it.
+
+        :param timeout: seconds allowed for the block.  None or 0 for no
+            limit of its own.
+        :param deadline: a :class:`Deadline` to honor as well, or None.
+        """
+        outer = self._deadline
+        self._deadline = Deadline.earliest(outer, deadline, Deadline(timeout))
+        try:
+            yield self._deadline
+        finally:
+            self._deadline = outer
 
     def _send_and_wait(self, text_to_send, match_res, timeout=60):
         """
@@ -175,23 +400,35 @@ class CLI(object):
             responsible for your own command terminator!
         :param match_res: Pattern(s) to look for to be considered successful.
         :param timeout: Maximum time, in seconds, to wait for a regular
-            expression match. 0 to wait forever.
+            expression match. 0 to wait forever.  Shortened if need be to
+            end by the deadline of the operation in progress.
 
         :return: ``(output, match_object)`` where output is the output of the
             command (without the matched text), and match_object is a Python
             :class:`re.MatchObject` containing data on what was matched.
+
+        :raises CmdlineTimeout: if the deadline has already passed.
         """
         # TODO: There was a call to 'self.channel.receive_all()' here, which
         # appears to be used to 'flush' the buffer first.  For interactive
         # prompts on libvirtchannel, this was causing an endless blocking call.
         # We still probably want to figure out an alternative.
 
+        self._take_token()
+
+        # Never wait past the deadline of the operation in progress.
+        if self._deadline is not None:
+            timeout = self._deadline.limit(timeout)
+
         # will raise an exception if it fails.
-        if test_tcp_conn(self._channel_args['hostname'],
-                         self._channel_args.get('port',
-                                                self.channel.conn_port)):
-            self.channel.send(text_to_send)
-            return self.channel.expect(match_res, timeout)
+        if self._test_connection():
+            with self._phase('send'):
+                self.channel.send(text_to_send)
+            with self._phase('wait'):
+                result = self.channel.expect(match_res, timeout)
+            if self._instrumentation is not None:
+                self._received_at = time.monotonic()
+            return result
 
     def _send_line_and_wait(self, text_to_send, match_res, timeout=60):
         """
@@ -209,8 +446,11 @@ class CLI(object):
         text_to_send = text_to_send + ENTER_LINE
         return self._send_and_wait(text_to_send, match_res, timeout)
 
-    def exec_command(self, command, timeout=60, output_expected=None,
-                     prompt=None):
+    @instrumentation.instrumented
+    @timeouts.learned_timeout
+    @deadline_scoped
+    def exec_command(self, command, timeout=timeouts.DEFAULT,
+                     output_expected=None, prompt=None, deadline=None):
         """
         Executes the given command.
 
@@ -219,7 +459,8 @@ class CLI(object):
 
         :param command:  command to execute, newline appended automatically
         :param timeout:  maximum time, in seconds, to wait for the command to
-            finish. 0 to wait forever.
+            finish. 0 to wait forever.  Defaults to the timeout learned by
+            the CLI's ``timeout_model`` if it has one, and to 60 otherwise.
         :param output_expected: If not None, indicates whether output is
             expected (True) or no output is expected (False).
             If the opposite occurs, raise UnexpectedOutput. Default is None.
@@ -227,6 +468,11 @@ class CLI(object):
         :param prompt: Prompt regex for matching unusual prompts.  This should
             almost never needed.  This parameter is for unusual
             situations like an install config wizard.
+        :param deadline: an overall
+            :class:`steelscript.cmdline.deadline.Deadline` for this call,
+            for example one shared by several commands.  Together with
+            ``timeout``, it bounds every wait made along the way, including
+            mode changes and reconnects.
 
         :return: output of the command, minus the command itself.
 
@@ -244,9 +490,10 @@ class CLI(object):
 
         if prompt is None:
             prompt = self._prompt
-        (output, match) = self._send_line_and_wait(command,
-                                                   prompt,
-                                                   timeout=timeout)
+        with timeouts.recording(self, command, timeout):
+            (output, match) = self._send_line_and_wait(command,
+                                                       prompt,
+                                                       timeout=timeout)
 
         # CLI adds on escape chars and such sometimes, so to remove the
         # command we just send from the output, split the output into lines,
@@ -271,6 +518,23 @@ class CLICache(object):
     Riverbed appliance CLI, can result in performance degradation
     or even out-of-memory conditions.  This cache allows for sharing
     a single CLI and easily cleaning up all CLIs on all systems.
+
+    :param commands_per_second: if given, CLIs from this cache share the
+        per-host rate limit of
+        :func:`steelscript.cmdline.ratelimit.get_limiter`, with this rate.
+    :param burst: burst size of that rate limit.
+    :param governor:
+        :class:`steelscript.cmdline.ratelimit.ConcurrencyGovernor` capping
+        the sessions opened by this cache, and possibly others.
+    :param memory_budget: bytes that the CLIs of this cache may hold
+        together, as reported by :meth:`footprint`.  When a new CLI is
+        cached, or :meth:`trim` is called, least recently used CLIs are
+        dropped until the total is within budget.  None for no budget.
+    :param session_budget: bytes that one CLI may hold.  CLIs holding more
+        are dropped by :meth:`trim`.  None for no budget.
+
+    Dropping a CLI removes it from the cache, as :meth:`drop_cli` does; its
+    session closes once no one else holds a reference to it.
     """
 
     @staticmethod
@@ -284,11 +548,27 @@ class CLICache(object):
         """
         target.cli_cache = CLICache()
 
-    def __init__(self):
-        self._cli_cache = {}
+    def __init__(self, commands_per_second=None, burst=None, governor=None,
+                 memory_budget=None, session_budget=None):
+        # Least recently used first.
+        self._cli_cache = collections.OrderedDict()
+        self._commands_per_second = commands_per_second
+        self._burst = burst
+        self._governor = governor
+        self.memory_budget = memory_budget
+        self.session_budget = session_budget
+
+        self.evictions = 0
+        """Number of CLIs dropped to stay within budget."""
 
     def get_cli(self, resource, cli_class=CLI):
-        """Get CLI from cache, or cache a new one. """
+        """
+        Get CLI from cache, or cache a new one.
+
+        New CLIs are made by calling ``cli_class`` with the ``hostname``,
+        ``username`` and ``password`` of the resource, and the limits of
+        this cache.
+        """
         if resource.uniqueid not in self._cli_cache:
             # TODO: IP discovery may need to happen here.
             #       For now, assume hostname or admin_ip is known.
@@ -298,11 +578,22 @@ class CLICache(object):
                 logging.debug("Failed to get admin ip: %s" % e)
                 logging.debug("Use hostname instead.")
                 host = resource.hostname
-            cli = cli_class(host=host,
-                            user=resource.username,
-                            password=resource.password)
+            limits = {}
+            if self._commands_per_second is not None:
+                limits['rate_limiter'] = ratelimit.get_limiter(
+                    host, self._commands_per_second, self._burst)
+            if self._governor is not None:
+                limits['governor'] = self._governor
+            cli = cli_class(hostname=host,
+                            username=resource.username,
+                            password=resource.password,
+                            **limits)
             cli.start()
             self._cli_cache[resource.uniqueid] = cli
+            if self.memory_budget is not None:
+                self._trim(keep=resource.uniqueid)
+        else:
+            self._cli_cache.move_to_end(resource.uniqueid)
         return self._cli_cache[resource.uniqueid]
 
     def drop_cli(self, resource):
@@ -321,3 +612,62 @@ class CLICache(object):
     def drop_all(self):
         """Clean up CLI cache, disconnecting all sessions"""
         self._cli_cache.clear()
+
+    def footprints(self):
+        """
+        Returns the memory held by each cached CLI.
+
+        :return: dict of resource unique ids to
+            :class:`steelscript.cmdline.footprint.Footprint`
+        """
+        return collections.OrderedDict(
+            (uniqueid, cli.footprint())
+            for uniqueid, cli in list(self._cli_cache.items()))
+
+    def footprint(self):
+        """
+        Returns the memory held by all cached CLIs together.
+
+        :return: a :class:`steelscript.cmdline.footprint.Footprint`
+        """
+        return sum(self.footprints().values(), Footprint())
+
+    def trim(self):
+        """
+        Drops CLIs until the cache is within its budgets.
+
+        Collectors that keep CLIs cached for long should call this now and
+        then, as CLIs hold more memory when data arrives that is not read.
+
+        :return: list of the unique ids of the resources whose CLIs were
+            dropped.
+        """
+        return self._trim()
+
+    def _trim(self, keep=None):
+        if self.memory_budget is None and self.session_budget is None:
+            return []
+        footprints = self.footprints()
+        dropped = []
+        if self.session_budget is not None:
+            for uniqueid, footprint in footprints.items():
+                if (uniqueid != keep and
+                        footprint.total > self.session_budget):
+                    dropped.append(uniqueid)
+        if self.memory_budget is not None:
+            total = sum(footprint.total for uniqueid, footprint
+                        in footprints.items() if uniqueid not in dropped)
+            for uniqueid, footprint in footprints.items():
+                if total <= self.memory_budget:
+                    break
+                if uniqueid == keep or uniqueid in dropped:
+                    continue
+                dropped.append(uniqueid)
+                total -= footprint.total
+        for uniqueid in dropped:
+            logging.info("Dropping CLI for %s to stay within memory budget, "
+                         "holding %d bytes", uniqueid,
+                         footprints[uniqueid].total)
+            self._cli_cache.pop(uniqueid, None)
+        self.evictions += len(dropped)
+        return dropped
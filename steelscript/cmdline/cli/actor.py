@@ -0,0 +1,197 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Serialized, prioritized access to a single CLI session.
+
+import sys
+import time
+import queue
+import logging
+import itertools
+import threading
+from concurrent import futures
+
+# Suggested priorities; lower values run first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 50
+PRIORITY_BACKGROUND = 100
+
+# Queued after everything else to stop the worker thread.
+_STOP = sys.maxsize
+
+
+class CLIActor(object):
+    """
+    Runs commands on one CLI session from a single thread.
+
+    A :class:`steelscript.cmdline.cli.CLI` must not be used from several
+    threads at once, and opening a session per thread can degrade the
+    device (see :class:`steelscript.cmdline.cli.CLICache`).  An actor owns
+    one session and runs the commands submitted to it one at a time, in
+    order of priority, then of submission.  Each submission returns a
+    :class:`concurrent.futures.Future` for its result::
+
+        actor = CLIActor(cli)
+        version = actor.submit('show version',
+                               priority=PRIORITY_INTERACTIVE)
+        stats = actor.submit('show stats', priority=PRIORITY_BACKGROUND)
+        print(version.result(timeout=60))
+
+    If the CLI has not been started, it is started by the actor thread
+    before the first command.
+
+    :param cli: the CLI session to own.  It must not be used directly
+        while the actor is running.
+    :param name: name of the worker thread, for logs.
+    """
+
+    def __init__(self, cli, name=None):
+        self.cli = cli
+
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._close_cli = False
+
+        # Metrics
+        self._submitted = 0
+        self._started = 0
+        self._completed = 0
+        self._failed = 0
+        self._cancelled = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+        self._log = logging.getLogger(__name__)
+        self._thread = threading.Thread(target=self._run,
+                                        name=name or 'CLIActor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def submit(self, command, priority=PRIORITY_NORMAL, **kwargs):
+        """
+        Queues a command for :meth:`CLI.exec_command`.
+
+        :param command: the command to run.
+        :param priority: lower values run first.  Commands of equal
+            priority run in the order submitted.
+        :param kwargs: passed to ``exec_command``, such as ``timeout``
+            or ``mode``.
+
+        :return: a Future resolving to the command's output, or to the
+            exception it raised.
+        :raises RuntimeError: if the actor is closed.
+        """
+        return self.call(lambda cli: cli.exec_command(command, **kwargs),
+                         priority=priority)
+
+    def call(self, func, priority=PRIORITY_NORMAL):
+        """
+        Queues an arbitrary operation on the session.
+
+        :param func: callable taking the CLI as its only argument, for
+            example ``lambda cli: cli.enter_mode(CLIMode.CONFIG)``.
+        :param priority: as for :meth:`submit`.
+
+        :return: a Future resolving to the return value of ``func``.
+        :raises RuntimeError: if the actor is closed.
+        """
+        future = futures.Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Cannot submit to a closed actor')
+            self._submitted += 1
+            self._queue.put((priority, next(self._sequence),
+                             (func, future, time.time())))
+        return future
+
+    def close(self, wait=True, close_cli=True):
+        """
+        Stops accepting commands.
+
+        Commands already queued still run.
+
+        :param wait: if True, wait for the queued commands to finish.
+        :param close_cli: if True, close the CLI session once done.
+        """
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._close_cli = close_cli
+                self._queue.put((_STOP, next(self._sequence), None))
+        if wait:
+            self._thread.join()
+
+    @property
+    def queue_depth(self):
+        """Number of commands waiting to run."""
+        with self._lock:
+            return self._submitted - self._started
+
+    def stats(self):
+        """
+        Returns counters describing the actor's work so far.
+
+        :return: a dict with the number of commands ``submitted``,
+            ``completed``, ``failed`` and ``cancelled``, the current
+            ``queue_depth``, and the ``mean_wait`` and ``max_wait`` in
+            seconds that commands spent queued before starting.
+        """
+        with self._lock:
+            started = self._started
+            return {
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'cancelled': self._cancelled,
+                'queue_depth': self._submitted - started,
+                'mean_wait': self._total_wait / started if started else 0.0,
+                'max_wait': self._max_wait,
+            }
+
+    def _run(self):
+        while True:
+            priority, _, job = self._queue.get()
+            if priority == _STOP:
+                break
+            func, future, queued_at = job
+
+            wait = time.time() - queued_at
+            with self._lock:
+                self._started += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+
+            if not future.set_running_or_notify_cancel():
+                with self._lock:
+                    self._cancelled += 1
+                continue
+
+            try:
+                if self.cli.channel is None:
+                    self.cli.start()
+                result = func(self.cli)
+            except Exception as e:
+                with self._lock:
+                    self._failed += 1
+                future.set_exception(e)
+            else:
+                with self._lock:
+                    self._completed += 1
+                future.set_result(result)
+
+        if self._close_cli:
+            try:
+                self.cli._cleanup_helper()
+            except Exception:
+                self._log.exception('Error closing CLI')
@@ -7,7 +7,7 @@
 
 import re
 
-from steelscript.cmdline import cli, exceptions
+from steelscript.cmdline import cli, exceptions, instrumentation, timeouts
 
 
 class IOS_CLI(cli.CLI):
@@ -215,9 +215,13 @@ class IOS_CLI(cli.CLI):
             interface,
             self.CLI_SUBIF_PROMPT)
 
-    def exec_command(self, command, timeout=60, mode=cli.CLIMode.CONFIG,
-                     output_expected=None, error_expected=False,
-                     interface=None, prompt=None):
+    @instrumentation.instrumented
+    @timeouts.learned_timeout
+    @cli.deadline_scoped
+    def exec_command(self, command, timeout=timeouts.DEFAULT,
+                     mode=cli.CLIMode.CONFIG, output_expected=None,
+                     error_expected=False, interface=None, prompt=None,
+                     deadline=None):
         """Executes the given command.
 
         This method handles detecting simple boolean conditions such as
@@ -225,7 +229,8 @@ class IOS_CLI(cli.CLI):
 
         :param command:  command to execute, newline appended automatically
         :param timeout:  maximum time, in seconds, to wait for the command to
-            finish. 0 to wait forever.
+            finish. 0 to wait forever.  Defaults to the timeout learned by
+            the CLI's ``timeout_model`` if it has one, and to 60 otherwise.
         :param mode:  mode to enter before running the command.  To skip this
             step and execute directly in the cli's current mode, explicitly
             set this parameter to None.  The default is "configure"
@@ -245,6 +250,11 @@ class IOS_CLI(cli.CLI):
             almost never be used as the ``mode`` parameter automatically
             handles all typical cases.  This parameter is for unusual
             situations like the install config wizard.
+        :param deadline: an overall
+            :class:`steelscript.cmdline.deadline.Deadline` for this call,
+            for example one shared by several commands.  Together with
+            ``timeout``, it bounds every wait made along the way, including
+            mode changes and reconnects.
 
         :raises CmdlineTimeout: on timeout
         :raises CLIError: if the output matches the cli's error format, and
@@ -261,15 +271,17 @@ class IOS_CLI(cli.CLI):
                             "value or None")
 
         if mode is not None:
-            self.enter_mode(mode, interface)
+            with self._phase('mode'):
+                self.enter_mode(mode, interface)
 
         self._log.debug('Executing cmd "%s"' % command)
 
         if prompt is None:
             prompt = self.CLI_ANY_PROMPT
-        (output, match_res) = self._send_line_and_wait(command,
-                                                       prompt,
-                                                       timeout=timeout)
+        with timeouts.recording(self, command, timeout):
+            (output, match_res) = self._send_line_and_wait(command,
+                                                           prompt,
+                                                           timeout=timeout)
 
         output = '\n'.join(output.splitlines()[1:])
 
@@ -280,7 +292,8 @@ class IOS_CLI(cli.CLI):
             else:
                 try:
                     mode = self.current_cli_mode()
-                except exceptions.UnknownCLIMode:
+                except (exceptions.UnknownCLIMode,
+                        exceptions.CmdlineTimeout):
                     mode = '<unrecognized>'
                 raise exceptions.CLIError(command, output=output, mode=mode)
 
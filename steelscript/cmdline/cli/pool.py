@@ -0,0 +1,309 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Pool of started CLI sessions to a single device.
+
+import time
+import logging
+import threading
+import contextlib
+
+from steelscript.cmdline import exceptions
+
+
+class CLIPool(object):
+    """
+    Keeps fully started CLI sessions to one device ready for use.
+
+    Starting a CLI session takes several round trips: connecting, logging
+    in, launching the CLI, entering a known mode and disabling paging.
+    The pool does this ahead of time in a background thread, keeping at
+    least ``min_idle`` started sessions waiting, so that a caller only
+    pays for the commands it runs::
+
+        pool = CLIPool(functools.partial(RVBD_CLI, hostname='sh1',
+                                         username='admin', password='pw'),
+                       min_idle=2, mode=CLIMode.ENABLE)
+        with pool.session() as cli:
+            cli.exec_command('show version')
+
+    Sessions are handed out in ``mode``.  Returned sessions are put back
+    into ``mode``, and sessions lost to errors are replaced, in the
+    background.
+
+    :param factory: callable returning a new CLI that has not been started,
+        for example the CLI class with its arguments bound.
+    :param min_idle: number of started sessions to keep waiting.
+    :param max_size: upper bound on sessions, idle and in use together.
+        None for no bound.
+    :param mode: :class:`steelscript.cmdline.cli.CLIMode` that sessions are
+        handed out in, or None to leave sessions in whatever mode they
+        start or are returned in.
+    :param retry_delay: seconds to wait before trying again after a session
+        failed to start.
+    :param health_monitor: optional
+        :class:`steelscript.cmdline.health.HealthMonitor` to check idle
+        sessions with.  Sessions in use are never checked.
+    """
+
+    def __init__(self, factory, min_idle=1, max_size=None, mode=None,
+                 retry_delay=5, health_monitor=None):
+        if max_size is not None and max_size < min_idle:
+            raise ValueError("max_size should be at least min_idle")
+
+        self._factory = factory
+        self.min_idle = min_idle
+        self.max_size = max_size
+        self.mode = mode
+        self.retry_delay = retry_delay
+        self._health_monitor = health_monitor
+
+        self._cond = threading.Condition()
+        # Started sessions ready to be handed out, most recently used last.
+        self._idle = []
+        # Sessions handed back, waiting to be put back into mode.
+        self._returned = []
+        # Each session's lock, held while it is in use or being prepared.
+        self._locks = {}
+        # Sessions in existence or being started.
+        self._size = 0
+        self._next_start = 0
+        self._closed = False
+
+        self._log = logging.getLogger(__name__)
+        self._thread = threading.Thread(target=self._run, name='CLIPool')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    @property
+    def idle(self):
+        """Number of sessions ready to be handed out."""
+        with self._cond:
+            return len(self._idle)
+
+    @property
+    def size(self):
+        """Number of sessions, idle, in use, or being started."""
+        with self._cond:
+            return self._size
+
+    def acquire(self, timeout=None):
+        """
+        Takes a session out of the pool.
+
+        If no session is ready and the pool is below ``max_size``, one is
+        started in the calling thread.  Otherwise this waits for a session
+        to be returned.
+
+        :param timeout: maximum time, in seconds, to wait for a session.
+            None to wait forever.
+        :return: a started CLI, in ``mode``.
+        :raises CmdlineTimeout: if no session became available in time.
+        :raises ConnectionError: if the pool is closed, or starting a new
+            session failed.
+        """
+        expires = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise exceptions.ConnectionError(
+                        context='Session pool is closed')
+                if self._idle:
+                    cli = self._idle.pop()
+                    break
+                if self.max_size is None or self._size < self.max_size:
+                    self._size += 1
+                    cli = None
+                    break
+                remaining = None if expires is None else expires - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise exceptions.CmdlineTimeout(timeout=timeout)
+                self._cond.wait(remaining)
+            # Taking a session may leave the pool short.
+            self._cond.notify_all()
+
+        if cli is None:
+            cli = self._start_session()
+            if cli is None:
+                raise exceptions.ConnectionError(
+                    context='Could not start a new session')
+        self._locks[id(cli)].acquire()
+        if self._health_monitor is not None:
+            self._health_monitor.unwatch(cli)
+        return cli
+
+    def release(self, cli, discard=False):
+        """
+        Gives a session back to the pool.
+
+        :param cli: a session obtained from :meth:`acquire`
+        :param discard: if True, the session is closed rather than reused,
+            for example after it ran into an error.
+        """
+        lock = self._locks[id(cli)]
+        with self._cond:
+            discard = discard or self._closed
+            if discard:
+                self._forget(cli)
+            else:
+                self._returned.append(cli)
+                lock.release()
+            self._cond.notify_all()
+        if discard:
+            self._cleanup(cli)
+            lock.release()
+
+    @contextlib.contextmanager
+    def session(self, timeout=None):
+        """
+        Context manager acquiring a session and releasing it afterwards.
+
+        The session is discarded if the block raises a
+        :class:`ConnectionError` or :class:`CmdlineTimeout`, as it may
+        be left in an unknown state.
+
+        :param timeout: see :meth:`acquire`
+        """
+        cli = self.acquire(timeout)
+        try:
+            yield cli
+        except (exceptions.ConnectionError, exceptions.CmdlineTimeout):
+            self.release(cli, discard=True)
+            raise
+        except BaseException:
+            self.release(cli)
+            raise
+        self.release(cli)
+
+    def close(self):
+        """
+        Stops replenishing and closes idle sessions.
+
+        Sessions in use are closed when they are released.
+        """
+        with self._cond:
+            self._closed = True
+            sessions = self._idle + self._returned
+            self._idle = []
+            self._returned = []
+            locks = [self._forget(cli) for cli in sessions]
+            self._cond.notify_all()
+        for cli, lock in zip(sessions, locks):
+            # Waits for a health check in progress to finish.
+            with lock:
+                self._cleanup(cli)
+        self._thread.join()
+
+    def _forget(self, cli):
+        # Called with self._cond held.  Returns the session's lock; the
+        # caller closes the session with _cleanup once it has released
+        # self._cond, as closing goes over the network.
+        self._size -= 1
+        lock = self._locks.pop(id(cli))
+        if self._health_monitor is not None:
+            self._health_monitor.unwatch(cli)
+        return lock
+
+    def _cleanup(self, cli):
+        # Called with the session's lock held, and self._cond released.
+        try:
+            cli._cleanup_helper()
+        except Exception:
+            self._log.exception("Error closing session %r" % (cli,))
+
+    def _start_session(self):
+        # Called with a slot already counted in self._size.  Returns the
+        # new session, or None if it could not be started.
+        cli = self._factory()
+        try:
+            cli.start()
+            self._enter_mode(cli)
+        except Exception as e:
+            self._log.warning("Could not start session: %s" % e)
+            try:
+                cli._cleanup_helper()
+            except Exception:
+                pass
+            with self._cond:
+                self._size -= 1
+                self._next_start = time.time() + self.retry_delay
+                self._cond.notify_all()
+            return None
+
+        with self._cond:
+            self._locks[id(cli)] = threading.Lock()
+        return cli
+
+    def _enter_mode(self, cli):
+        if self.mode is not None:
+            cli.enter_mode(self.mode)
+
+    def _add_idle(self, cli):
+        with self._cond:
+            if self._closed:
+                lock = self._forget(cli)
+            else:
+                # Watched before it is published, so that acquire()
+                # always finds it watched and can unwatch it.
+                if self._health_monitor is not None:
+                    self._health_monitor.watch(
+                        cli, reconnect=self._reconnector(cli),
+                        lock=self._locks[id(cli)])
+                self._idle.append(cli)
+                self._cond.notify_all()
+                return
+        with lock:
+            self._cleanup(cli)
+
+    def _reconnector(self, cli):
+        def reconnect():
+            cli.reconnect()
+            self._enter_mode(cli)
+        return reconnect
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    if self._returned:
+                        cli = self._returned.pop(0)
+                        break
+                    wait = self._next_start - time.time()
+                    if (len(self._idle) < self.min_idle and
+                            (self.max_size is None or
+                             self._size < self.max_size) and wait <= 0):
+                        self._size += 1
+                        cli = None
+                        break
+                    self._cond.wait(wait if wait > 0 else None)
+
+            if cli is None:
+                cli = self._start_session()
+                if cli is not None:
+                    self._add_idle(cli)
+                continue
+
+            # Put a returned session back into mode before reusing it.
+            lock = self._locks[id(cli)]
+            with lock:
+                try:
+                    self._enter_mode(cli)
+                except Exception as e:
+                    self._log.info("Discarding returned session: %s" % e)
+                    with self._cond:
+                        self._forget(cli)
+                        self._cond.notify_all()
+                    self._cleanup(cli)
+                    continue
+            self._add_idle(cli)
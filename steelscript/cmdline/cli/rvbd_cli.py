@@ -9,6 +9,8 @@ import socket
 
 from steelscript.cmdline import exceptions
 from steelscript.cmdline import cli
+from steelscript.cmdline import timeouts
+from steelscript.cmdline import instrumentation
 
 # Control-u clears any entered text.  Neat.
 DELETE_LINE = b'\x15'
@@ -172,8 +174,7 @@ class RVBD_CLI(cli.CLI):
                                 ' {error}'.format(error=e))
                 self._log.debug('RVBD_CLI.enter_mode() - Attempting to '
                                 'reinitialize connection')
-                self._cleanup_helper()
-                self.start()
+                self._restart()
                 # assuming all is well now. Recursively calling enter_mode()
                 self.enter_mode(mode=mode, reinit=False)
             else:
@@ -298,8 +299,12 @@ class RVBD_CLI(cli.CLI):
         elif mode == cli.CLIMode.CONFIG:
             self._log.info('Already at Config, doing nothing')
 
-    def exec_command(self, command, timeout=60, mode=cli.CLIMode.UNDEF,
-                     output_expected=None, error_expected=False, prompt=None):
+    @instrumentation.instrumented
+    @timeouts.learned_timeout
+    @cli.deadline_scoped
+    def exec_command(self, command, timeout=timeouts.DEFAULT,
+                     mode=cli.CLIMode.UNDEF, output_expected=None,
+                     error_expected=False, prompt=None, deadline=None):
         """Executes the given command.
 
         This method handles detecting simple boolean conditions such as
@@ -307,7 +312,8 @@ class RVBD_CLI(cli.CLI):
 
         :param command:  command to execute, newline appended automatically
         :param timeout:  maximum time, in seconds, to wait for the command to
-            finish. 0 to wait forever.
+            finish. 0 to wait forever.  Defaults to the timeout learned by
+            the CLI's ``timeout_model`` if it has one, and to 60 otherwise.
         :param mode:  mode to enter before running the command. The default
             is :func:`default_mode`.  To skip this step and execute directly
             in the cli's current mode, explicitly set this parameter to None.
@@ -324,6 +330,11 @@ class RVBD_CLI(cli.CLI):
             almost never be used as the ``mode`` parameter automatically
             handles all typical cases.  This parameter is for unusual
             situations like the install config wizard.
+        :param deadline: an overall
+            :class:`steelscript.cmdline.deadline.Deadline` for this call,
+            for example one shared by several commands.  Together with
+            ``timeout``, it bounds every wait made along the way, including
+            mode changes and reconnects.
 
         :return: output of the command, minus the command itself.
 
@@ -345,7 +356,8 @@ class RVBD_CLI(cli.CLI):
         if mode is cli.CLIMode.UNDEF:
             mode = self.default_mode
         if mode is not None:
-            self.enter_mode(mode)
+            with self._phase('mode'):
+                self.enter_mode(mode)
 
         self._log.debug('Executing cmd "%s"' % command)
 
@@ -353,17 +365,16 @@ class RVBD_CLI(cli.CLI):
             prompt = self._prompt
 
         try:
-            (output, match_res) = self._send_line_and_wait(command,
-                                                           prompt,
-                                                           timeout=timeout)
+            with timeouts.recording(self, command, timeout):
+                (output, match_res) = self._send_line_and_wait(
+                    command, prompt, timeout=timeout)
         except exceptions.ConnectionError as e:
             self._log.info("Connection channel in unexpected state. Flushing "
                            "and restarting. Error was {error}".format(error=e))
-            self._cleanup_helper()
-            self.start()
-            (output, match_res) = self._send_line_and_wait(command,
-                                                           prompt,
-                                                           timeout=timeout)
+            self._restart()
+            with timeouts.recording(self, command, timeout):
+                (output, match_res) = self._send_line_and_wait(
+                    command, prompt, timeout=timeout)
 
         # CLI adds on escape chars and such sometimes and the result is that
         # some part of the command that was entered shows up as an extra
@@ -377,7 +388,8 @@ class RVBD_CLI(cli.CLI):
             else:
                 try:
                     mode = self.current_cli_mode()
-                except exceptions.UnknownCLIMode:
+                except (exceptions.UnknownCLIMode,
+                        exceptions.CmdlineTimeout):
                     mode = '<unrecognized>'
                 raise exceptions.CLIError(command, output=output, mode=mode)
 
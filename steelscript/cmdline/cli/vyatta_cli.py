@@ -10,6 +10,8 @@ import re
 
 from steelscript.cmdline import exceptions
 from steelscript.cmdline import cli
+from steelscript.cmdline import timeouts
+from steelscript.cmdline import instrumentation
 
 
 class VyattaCLI(cli.CLI):
@@ -177,8 +179,12 @@ class VyattaCLI(cli.CLI):
         else:
             raise exceptions.UnknownCLIMode(mode=mode)
 
-    def exec_command(self, command, timeout=60, mode=cli.CLIMode.CONFIG,
-                     force=False, output_expected=None, prompt=None):
+    @instrumentation.instrumented
+    @timeouts.learned_timeout
+    @cli.deadline_scoped
+    def exec_command(self, command, timeout=timeouts.DEFAULT,
+                     mode=cli.CLIMode.CONFIG, force=False,
+                     output_expected=None, prompt=None, deadline=None):
         """
         Executes the given command.
 
@@ -187,7 +193,8 @@ class VyattaCLI(cli.CLI):
 
         :param command:  command to execute, newline appended automatically
         :param timeout:  maximum time, in seconds, to wait for the command to
-            finish. 0 to wait forever.
+            finish. 0 to wait forever.  Defaults to the timeout learned by
+            the CLI's ``timeout_model`` if it has one, and to 60 otherwise.
         :param mode:  mode to enter before running the command.  To skip this
             step and execute directly in the cli's current mode, explicitly
             set this parameter to None.  The default is "configure"
@@ -202,6 +209,11 @@ class VyattaCLI(cli.CLI):
             almost never be used as the ``mode`` parameter automatically
             handles all typical cases.  This parameter is for unusual
             situations like the install config wizard.
+        :param deadline: an overall
+            :class:`steelscript.cmdline.deadline.Deadline` for this call,
+            for example one shared by several commands.  Together with
+            ``timeout``, it bounds every wait made along the way, including
+            mode changes and reconnects.
 
         :return: output of the command, minus the command itself.
 
@@ -215,15 +227,17 @@ class VyattaCLI(cli.CLI):
             raise TypeError("exec_command: output_expected requires a boolean "
                             "value or None")
         if mode is not None:
-            self.enter_mode(mode, force)
+            with self._phase('mode'):
+                self.enter_mode(mode, force)
 
         self._log.debug('Executing cmd "%s"' % command)
 
         if prompt is None:
             prompt = self.CLI_ANY_PROMPT
-        (output, match_res) = self._send_line_and_wait(command,
-                                                       prompt,
-                                                       timeout=timeout)
+        with timeouts.recording(self, command, timeout):
+            (output, match_res) = self._send_line_and_wait(command,
+                                                           prompt,
+                                                           timeout=timeout)
         output = output.splitlines()[1:]
 
         # Vyatta does not have a standard error prompt
@@ -0,0 +1,98 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Time budgets shared by the steps of a single operation.
+
+
+import time
+
+from steelscript.cmdline import exceptions
+
+
+class Deadline(object):
+    """
+    A point in time by which an operation must complete.
+
+    A single command may involve several waits (probing the mode, changing
+    mode, reconnecting, and finally the command itself).  Passing one
+    Deadline through all of them makes the caller's timeout the upper
+    bound on the whole operation, rather than on each wait separately.
+
+    Wherever a channel accepts a ``timeout`` it also accepts a Deadline.
+
+    :param timeout: seconds from now.  None or 0 means no deadline,
+        following the convention that a timeout of 0 waits forever.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        if timeout:
+            self.expires = time.time() + timeout
+        else:
+            self.expires = None
+
+    def __repr__(self):
+        return '<Deadline timeout=%s remaining=%s>' % (self.timeout,
+                                                       self.remaining())
+
+    @classmethod
+    def coerce(cls, timeout):
+        """
+        Returns ``timeout`` as a Deadline.
+
+        :param timeout: a Deadline, which is returned as is, or a timeout
+            in seconds, which starts a new Deadline.
+        """
+        if isinstance(timeout, Deadline):
+            return timeout
+        return cls(timeout)
+
+    @staticmethod
+    def earliest(*deadlines):
+        """
+        Returns whichever of the given deadlines expires first.
+
+        None entries and unlimited deadlines are ignored.  If nothing is
+        left, an unlimited Deadline is returned.
+        """
+        limited = [d for d in deadlines
+                   if d is not None and d.expires is not None]
+        if not limited:
+            return Deadline(None)
+        return min(limited, key=lambda d: d.expires)
+
+    def remaining(self):
+        """
+        Seconds left before the deadline.
+
+        :return: a float no smaller than 0, or None if there is no deadline.
+        """
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.time())
+
+    def expired(self):
+        """True if the deadline has passed."""
+        return self.expires is not None and time.time() >= self.expires
+
+    def limit(self, timeout=None):
+        """
+        Clamps a per-step timeout so that the step ends by the deadline.
+
+        :param timeout: the timeout the step would use on its own, in
+            seconds.  None or 0 for no limit of its own.
+
+        :return: the timeout to use, following the same convention.
+        :raises CmdlineTimeout: if the deadline has already passed.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise exceptions.CmdlineTimeout(timeout=self.timeout)
+        if not timeout:
+            return remaining
+        return min(timeout, remaining)
@@ -0,0 +1,143 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Cheap debug logging of channel traffic, and full traffic transcripts.
+
+
+import logging
+import threading
+
+from steelscript.cmdline import hooks
+from steelscript.cmdline.footprint import Footprint, sizeof
+
+PREVIEW_SIZE = 200
+"""
+Characters of text shown by a :class:`Preview`, or None for all.  May be
+changed at any time.
+"""
+
+TRANSCRIPT_LOGGER = 'steelscript.cmdline.transcript'
+"""Name of the logger that transcripts are written to."""
+
+_transcript = logging.getLogger(TRANSCRIPT_LOGGER)
+# Transcripts only go where they are sent, never to the application's log.
+_transcript.propagate = False
+
+_transcript_lock = threading.Lock()
+_transcript_handlers = []
+
+
+class Preview(object):
+    """
+    Text shown in debug messages as a short, single line.
+
+    The text is only escaped and truncated to :const:`PREVIEW_SIZE` if the
+    message is actually logged, so pass a preview as an argument rather
+    than formatting it into the message::
+
+        log.debug('Sending "%s"', Preview(text))
+
+    :param text: str or bytes
+    """
+
+    __slots__ = ('_text',)
+
+    def __init__(self, text):
+        self._text = text
+
+    def __str__(self):
+        text = self._text
+        if isinstance(text, bytes):
+            text = text.decode('utf8', 'replace')
+        suffix = ''
+        size = PREVIEW_SIZE
+        if size is not None and len(text) > size:
+            suffix = '...(%d more)' % (len(text) - size)
+            text = text[:size]
+        return text.replace('\n', '\\n').replace('\r', '\\r') + suffix
+
+    def __repr__(self):
+        return repr(str(self))
+
+
+def _channel_name(channel):
+    host = (getattr(channel, '_host', None) or
+            getattr(channel, '_machine_name', None))
+    name = type(channel).__name__
+    return '%s(%s)' % (name, host) if host else name
+
+
+def _write_transcript(channel, event, text=None, data=None):
+    direction = '>>' if event == hooks.SEND else '<<'
+    payload = text if event == hooks.SEND else data
+    _transcript.debug('%s %s %r', _channel_name(channel), direction, payload)
+
+
+def enable_transcript(handler):
+    """
+    Writes everything sent and received by every channel to a handler.
+
+    Unlike the debug log, which only shows previews, the transcript holds
+    full payloads.  It goes to the ``steelscript.cmdline.transcript``
+    logger, which does not propagate to the root logger.  Channels do no
+    transcript work until this is called.
+
+    :param handler: a :class:`logging.Handler`, or a path to write the
+        transcript to.
+    :return: the handler, for :func:`disable_transcript`.
+    """
+    # Imported here as the channel module logs through this one.
+    from steelscript.cmdline.channel import Channel
+
+    if not isinstance(handler, logging.Handler):
+        handler = logging.FileHandler(handler)
+    with _transcript_lock:
+        if not _transcript_handlers:
+            _transcript.setLevel(logging.DEBUG)
+            Channel.hooks.add(hooks.SEND, _write_transcript)
+            Channel.hooks.add(hooks.RECEIVE, _write_transcript)
+        _transcript.addHandler(handler)
+        _transcript_handlers.append(handler)
+    return handler
+
+
+def disable_transcript(handler=None):
+    """
+    Stops writing a transcript to a handler.
+
+    :param handler: a handler returned by :func:`enable_transcript`, or
+        None for all of them.  Removed handlers are closed.
+    """
+    from steelscript.cmdline.channel import Channel
+
+    with _transcript_lock:
+        handlers = (list(_transcript_handlers) if handler is None
+                    else [handler])
+        for h in handlers:
+            _transcript_handlers.remove(h)
+            _transcript.removeHandler(h)
+            h.close()
+        if handlers and not _transcript_handlers:
+            Channel.hooks.remove(hooks.SEND, _write_transcript)
+            Channel.hooks.remove(hooks.RECEIVE, _write_transcript)
+            _transcript.setLevel(logging.NOTSET)
+
+
+def transcript_footprint():
+    """
+    Returns the memory held by transcript handlers that keep records, such
+    as :class:`logging.handlers.MemoryHandler`.  The transcript is shared by
+    all sessions, so this is not part of any session's footprint.
+
+    :return: a :class:`steelscript.cmdline.footprint.Footprint`
+    """
+    with _transcript_lock:
+        handlers = list(_transcript_handlers)
+    held = 0
+    for handler in handlers:
+        for record in list(getattr(handler, 'buffer', ())):
+            held += sizeof(record.msg) + sizeof(record.args)
+    return Footprint({'transcript': held})
@@ -176,6 +176,29 @@ class CLINotRunning(ConnectionError):
                                             _subclass_msg=msg)
 
 
+class CircuitOpen(ConnectionError):
+    """
+    Exception for when calls to a host are refused by a circuit breaker.
+
+    The host failed repeatedly in the recent past, so no connection was
+    attempted.
+
+    :param host: The host whose circuit is open.
+    :param retry_in: Seconds until a trial connection will be allowed.
+
+    :ivar host: The host whose circuit is open.
+    :ivar retry_in: Seconds until a trial connection will be allowed.
+    """
+
+    def __init__(self, host, retry_in=None):
+        self.host = host
+        self.retry_in = retry_in
+        msg = "Circuit open for host '%s'" % host
+        if retry_in is not None:
+            msg = "%s, retry in %.1f seconds." % (msg, retry_in)
+        super(CircuitOpen, self).__init__(_subclass_msg=msg)
+
+
 class CmdlineError(CmdlineException):
     """
     Base for command responses that specifically indicate an error.
@@ -287,6 +310,29 @@ class UnexpectedOutput(CmdlineException):
                                                _subclass_msg=msg)
 
 
+class ReplayMismatch(CmdlineException):
+    """
+    Indicates a replayed session was sent something other than what was
+    recorded.
+
+    :param sent: The text that was sent.
+    :param expected: The text sent at this point of the recording, or
+                     None if the recording had nothing more to send.
+
+    :ivar sent: The text that was sent.
+    :ivar expected: The text sent at this point of the recording.
+    """
+
+    def __init__(self, sent, expected=None):
+        self.sent = sent
+        self.expected = expected
+        if expected is None:
+            msg = "Sent %r past the end of the recording." % sent
+        else:
+            msg = "Sent %r where the recording sent %r." % (sent, expected)
+        super(ReplayMismatch, self).__init__(command=sent, _subclass_msg=msg)
+
+
 class UnknownCLIMode(CmdlineException):
     """
     Exception for any CLI that sees or is asked for an unknown mode.
@@ -0,0 +1,84 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Accounting of the memory held by sessions.
+
+
+import sys
+
+
+class Footprint(object):
+    """
+    Memory held by a session, or by several, broken down by what holds it.
+
+    Footprints count the data that sessions hold on to, which grows with
+    use, such as received data waiting to be read.  The fixed cost of the
+    objects making up a session is not included.
+
+    :param held: dict of names, such as ``'receive_buffer'``, to the bytes
+        held now.
+    :param reserved: dict of names to bytes that may come to be held
+        without the session doing anything, such as the data that an SSH
+        server may still send before flow control stops it.  Not part of
+        :attr:`total`.
+    """
+
+    def __init__(self, held=None, reserved=None):
+        self.held = dict(held or {})
+        self.reserved = dict(reserved or {})
+
+    @property
+    def total(self):
+        """Bytes held now."""
+        return sum(self.held.values())
+
+    @property
+    def reserved_total(self):
+        """Bytes that may come to be held."""
+        return sum(self.reserved.values())
+
+    def __add__(self, other):
+        result = Footprint(self.held, self.reserved)
+        for name, size in other.held.items():
+            result.held[name] = result.held.get(name, 0) + size
+        for name, size in other.reserved.items():
+            result.reserved[name] = result.reserved.get(name, 0) + size
+        return result
+
+    def __repr__(self):
+        return '<Footprint total=%d reserved=%d %r>' % (
+            self.total, self.reserved_total, self.held)
+
+    def to_dict(self):
+        """Returns the footprint as a dict of JSON-compatible values."""
+        return {'total': self.total, 'held': dict(self.held),
+                'reserved_total': self.reserved_total,
+                'reserved': dict(self.reserved)}
+
+
+def sizeof(obj):
+    """
+    Returns the bytes used by an object and the containers, strings and
+    bytes it holds, each counted once.
+
+    :param obj: a str, bytes, or a list, tuple, set or dict of them, nested
+        to any depth.  Other objects are only counted for their own size.
+    """
+    seen = set()
+    pending = [obj]
+    size = 0
+    while pending:
+        item = pending.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            pending.extend(item.keys())
+            pending.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            pending.extend(item)
+    return size
@@ -0,0 +1,169 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Background health checking of long-lived sessions.
+
+
+import logging
+import threading
+
+
+class _Watch(object):
+    # Bookkeeping for one watched session.
+
+    def __init__(self, session, reconnect, lock):
+        self.session = session
+        self.reconnect = reconnect
+        self.lock = lock
+        self.healthy = True
+
+
+class HealthMonitor(object):
+    """
+    Background thread that checks idle sessions are still alive.
+
+    Connections left idle may be dropped silently by the network, for
+    example by a firewall idle timeout.  Without checks this is only
+    discovered when the next command hangs until its timeout.  The
+    monitor periodically calls the ``keepalive(timeout)`` method of each
+    watched session (SSH keepalive requests for :class:`SSHProcess` and
+    :class:`SSHChannel`, telnet NOPs for :class:`TelnetChannel`, either
+    for a :class:`CLI`), marks those that fail as unhealthy, and reconnects
+    them in the background.
+
+    Sessions are not thread-safe, so a session watched with a ``lock`` is
+    only checked or reconnected while the lock is free, that is, while the
+    session is idle.  Callers using the session from other threads should
+    hold the same lock while doing so.
+
+    Can be used as a context manager, which starts and stops the thread::
+
+        with HealthMonitor(interval=30) as monitor:
+            monitor.watch(cli, lock=cli_lock)
+            ...
+
+    :param interval: seconds between checks of all sessions
+    :param timeout: seconds to wait for a session to answer a keepalive
+    """
+
+    def __init__(self, interval=30, timeout=10):
+        self.interval = interval
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._watches = {}
+        self._stopping = threading.Event()
+        self._thread = None
+        self._log = logging.getLogger(__name__)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def watch(self, session, reconnect=None, lock=None):
+        """
+        Starts checking a session.
+
+        :param session: any object with a ``keepalive(timeout)`` method
+            returning False once the session is dead.
+        :param reconnect: callable re-establishing the session after it was
+            found dead.  Defaults to the session's ``reconnect`` method, if
+            it has one, such as :meth:`CLI.reconnect`.  If None, dead
+            sessions are only marked unhealthy.
+        :param lock: lock held by whoever is using the session.  If given,
+            the session is skipped whenever the lock is taken.
+        """
+        if reconnect is None:
+            reconnect = getattr(session, 'reconnect', None)
+        with self._lock:
+            self._watches[id(session)] = _Watch(session, reconnect, lock)
+
+    def unwatch(self, session):
+        """Stops checking a session.  Unknown sessions are ignored."""
+        with self._lock:
+            self._watches.pop(id(session), None)
+
+    def is_healthy(self, session):
+        """
+        Returns whether a session passed its last check, or was reconnected
+        since.
+
+        :raises KeyError: if the session is not watched
+        """
+        with self._lock:
+            return self._watches[id(session)].healthy
+
+    def check(self):
+        """
+        Checks all watched sessions now, in the calling thread.
+
+        :return: the sessions still unhealthy after the check.
+        """
+        with self._lock:
+            watches = list(self._watches.values())
+
+        unhealthy = []
+        for watch in watches:
+            if watch.lock is None:
+                self._check(watch)
+            elif watch.lock.acquire(False):
+                try:
+                    self._check(watch)
+                finally:
+                    watch.lock.release()
+            if not watch.healthy:
+                unhealthy.append(watch.session)
+        return unhealthy
+
+    def _check(self, watch):
+        try:
+            alive = watch.session.keepalive(self.timeout)
+        except Exception:
+            self._log.exception("Keepalive of %r failed" % (watch.session,))
+            alive = False
+
+        if alive:
+            watch.healthy = True
+            return
+
+        if watch.healthy:
+            self._log.warning("Session %r is dead" % (watch.session,))
+        watch.healthy = False
+        if watch.reconnect is None:
+            return
+        try:
+            watch.reconnect()
+        except Exception as e:
+            # Tried again at the next check.
+            self._log.warning("Reconnecting %r failed: %s" %
+                              (watch.session, e))
+        else:
+            self._log.info("Reconnected %r" % (watch.session,))
+            watch.healthy = True
+
+    def start(self):
+        """Starts the background thread, if not already running."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='HealthMonitor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread and waits for it to finish."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.check()
@@ -0,0 +1,124 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Compact histograms of durations.
+
+
+import math
+import bisect
+import threading
+
+
+def _default_bounds():
+    # From 1ms to about 2 hours, each bucket 25% wider than the last.
+    bounds = []
+    bound = 0.001
+    while bound < 7200:
+        bounds.append(round(bound, 6))
+        bound *= 1.25
+    return tuple(bounds)
+
+
+class Histogram(object):
+    """
+    Counts of observed values, in buckets of exponentially growing width.
+
+    Quantiles are estimated to within one bucket, that is within 25% with
+    the default bounds, using a fixed amount of memory however many values
+    are recorded.  Histograms are thread-safe and can be saved as plain
+    dicts with :meth:`to_dict`.
+
+    :param bounds: increasing upper bounds of the buckets.  Values above
+        the last bound are counted in an extra overflow bucket.
+    """
+
+    DEFAULT_BOUNDS = _default_bounds()
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = None
+        self._lock = threading.Lock()
+
+    def record(self, value):
+        """Adds one value."""
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        """
+        Estimates the value below which a fraction ``q`` of values fall.
+
+        :param q: a fraction between 0 and 1, such as 0.99
+        :return: the upper bound of the bucket holding that quantile, or
+            the largest value seen if it is smaller.  None if no values
+            were recorded.
+        """
+        with self._lock:
+            if not self.count:
+                return None
+            rank = max(1, int(math.ceil(q * self.count)))
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    break
+            if index < len(self.bounds):
+                return min(self.bounds[index], self.max)
+            return self.max
+
+    @property
+    def mean(self):
+        """The mean of recorded values, or None if there are none."""
+        with self._lock:
+            return self.sum / self.count if self.count else None
+
+    def merge(self, other):
+        """Adds the values recorded by another histogram with equal bounds."""
+        if other.bounds != self.bounds:
+            raise ValueError("Cannot merge histograms with different bounds")
+        with other._lock:
+            counts, count = list(other.counts), other.count
+            total, maximum = other.sum, other.max
+        with self._lock:
+            self.counts = [a + b for a, b in zip(self.counts, counts)]
+            self.count += count
+            self.sum += total
+            if maximum is not None and (self.max is None or
+                                        maximum > self.max):
+                self.max = maximum
+
+    def to_dict(self):
+        """
+        Returns the histogram as a dict of JSON-compatible values.
+
+        Only non-empty buckets are included, keyed by index.
+        """
+        with self._lock:
+            result = {'count': self.count, 'sum': self.sum, 'max': self.max,
+                      'buckets': {str(i): c for i, c in enumerate(self.counts)
+                                  if c}}
+        if self.bounds != self.DEFAULT_BOUNDS:
+            result['bounds'] = list(self.bounds)
+        return result
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuilds a histogram saved with :meth:`to_dict`."""
+        histogram = cls(data.get('bounds', cls.DEFAULT_BOUNDS))
+        for index, count in data['buckets'].items():
+            histogram.counts[int(index)] = count
+        histogram.count = data['count']
+        histogram.sum = data['sum']
+        histogram.max = data['max']
+        return histogram
@@ -0,0 +1,119 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Callbacks fired by channels as they send, receive and match text.
+
+
+import logging
+import threading
+
+CONNECT = 'connect'
+"""The channel connected.  No data."""
+
+SEND = 'send'
+"""Text is about to be sent.  Data: ``text``."""
+
+RECEIVE = 'receive'
+"""A chunk of output was read.  Data: ``data``, the bytes read.
+
+Every channel passes bytes.  The telnet client decodes what it reads, so
+telnet channels pass that text encoded as UTF-8.  Not fired when a read
+finds the connection closed.
+"""
+
+MATCH = 'match'
+"""An expect call matched.  Data: ``output`` and ``match``."""
+
+TIMEOUT = 'timeout'
+"""An expect call timed out.  Data: ``timeout`` and ``failed_match``."""
+
+CLOSE = 'close'
+"""The channel is closing.  No data."""
+
+EVENTS = (CONNECT, SEND, RECEIVE, MATCH, TIMEOUT, CLOSE)
+
+
+class HookRegistry(object):
+    """
+    Callbacks to run on channel events.
+
+    Each callback is called as ``callback(channel, event, **data)``, with
+    the data listed for each event in :const:`EVENTS`, from the thread
+    using the channel.  Callbacks should return quickly; exceptions they
+    raise are logged and otherwise ignored, so that a broken profiler
+    cannot break a session.
+
+    :class:`steelscript.cmdline.channel.Channel` has a registry whose hooks
+    apply to every channel.  A channel gets its own registry, chained to
+    that one, when a hook is added to it with
+    :meth:`steelscript.cmdline.channel.Channel.add_hook`.
+
+    :param parent: registry whose hooks also fire, after this one's.
+    """
+
+    def __init__(self, parent=None):
+        self._parent = parent
+        self._lock = threading.Lock()
+        # Tuples, replaced rather than modified, so that firing needs no
+        # lock.
+        self._callbacks = {}
+
+    def __bool__(self):
+        return bool(self._callbacks) or bool(self._parent)
+
+    def add(self, event, callback):
+        """
+        Registers a callback for an event.
+
+        :param event: one of :const:`EVENTS`
+        :param callback: the callable to run
+        """
+        if event not in EVENTS:
+            raise ValueError("Unknown channel event '%s'" % event)
+        with self._lock:
+            self._callbacks[event] = (self._callbacks.get(event, ()) +
+                                      (callback,))
+
+    def remove(self, event, callback):
+        """
+        Unregisters a callback added with :meth:`add`.
+
+        :raises ValueError: if the callback is not registered for the
+            event.
+        """
+        with self._lock:
+            callbacks = list(self._callbacks.get(event, ()))
+            callbacks.remove(callback)
+            if callbacks:
+                self._callbacks[event] = tuple(callbacks)
+            else:
+                del self._callbacks[event]
+
+    def clear(self):
+        """Unregisters all callbacks of this registry."""
+        with self._lock:
+            self._callbacks = {}
+
+    def callbacks(self, event):
+        """Returns the callbacks that run for an event, in order."""
+        callbacks = self._callbacks.get(event, ())
+        if self._parent is not None:
+            callbacks += self._parent.callbacks(event)
+        return callbacks
+
+    def fire(self, event, channel, **data):
+        """
+        Runs the callbacks registered for an event.
+
+        :param event: one of :const:`EVENTS`
+        :param channel: the channel the event happened on
+        :param data: the event's data
+        """
+        for callback in self.callbacks(event):
+            try:
+                callback(channel, event, **data)
+            except Exception:
+                logging.exception("Error in %s hook %r" % (event, callback))
@@ -0,0 +1,302 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Timing of command execution phases, with Prometheus export.
+
+
+import os
+import time
+import tempfile
+import functools
+import threading
+import contextlib
+
+from steelscript.cmdline.histogram import Histogram
+
+# Bucket bounds for counts and sizes: powers of two up to 1G.
+SIZE_BOUNDS = tuple(2 ** i for i in range(31))
+
+# Metrics recorded by this package, with their bounds and help text.
+METRICS = {
+    'cmdline_command_seconds': (
+        Histogram.DEFAULT_BOUNDS,
+        'Time taken by exec_command, start to finish.'),
+    'cmdline_phase_seconds': (
+        Histogram.DEFAULT_BOUNDS,
+        'Time taken by each phase of exec_command: mode, send, wait and '
+        'parse.'),
+    'cmdline_first_byte_seconds': (
+        Histogram.DEFAULT_BOUNDS,
+        'Time from starting to wait for output to its first byte.'),
+    'cmdline_receive_seconds': (
+        Histogram.DEFAULT_BOUNDS,
+        'Time from starting to wait for output to receiving all of it.'),
+    'cmdline_received_bytes': (
+        SIZE_BOUNDS,
+        'Bytes received while waiting for output.'),
+    'cmdline_received_chunks': (
+        SIZE_BOUNDS,
+        'Reads needed to receive the output.'),
+}
+
+# Quantiles included in snapshots.
+SNAPSHOT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Instrumentation(object):
+    """
+    Collects histograms of where the time of commands goes.
+
+    Pass an instance as ``instrumentation`` to
+    :class:`steelscript.cmdline.cli.CLI` or
+    :class:`steelscript.cmdline.shell.Shell`.  Every ``exec_command`` then
+    records its overall duration, the duration of each of its phases
+    (entering the mode, sending, waiting for the prompt and processing the
+    output), and how long the first byte of output took, how many bytes
+    arrived and in how many reads.  See :const:`METRICS`.
+
+    Each histogram is labeled with the class of the session or channel
+    that recorded it.  One instance can be shared by any number of
+    sessions and threads.  Sessions without instrumentation do no timing
+    at all.
+
+    Collected data is available as plain dicts from :meth:`snapshot`, or in
+    the Prometheus text exposition format from :meth:`to_prometheus` and
+    :meth:`export`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, name, value, **labels):
+        """
+        Records one value of a metric.
+
+        :param name: metric name, preferably one of :const:`METRICS`.
+            Other metrics are bucketed as durations.
+        :param value: the value, in seconds for durations.
+        :param labels: label names and values identifying the series.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                bounds = METRICS.get(name, (Histogram.DEFAULT_BOUNDS,))[0]
+                histogram = self._histograms[key] = Histogram(bounds)
+        histogram.record(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """
+        Context manager recording the duration of its block.
+
+        The duration is recorded even if the block raises.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def receive_stats(self, **labels):
+        """
+        Returns a :class:`ReceiveStats` recording to this instance.
+
+        :param labels: as for :meth:`observe`.
+        """
+        return ReceiveStats(self, labels)
+
+    def histogram(self, name, **labels):
+        """
+        Returns the histogram of one series, or None if nothing was recorded
+        to it.
+        """
+        with self._lock:
+            return self._histograms.get((name, tuple(sorted(labels.items()))))
+
+    def reset(self):
+        """Forgets everything recorded so far."""
+        with self._lock:
+            self._histograms.clear()
+
+    def _series(self):
+        with self._lock:
+            return sorted(self._histograms.items())
+
+    def snapshot(self):
+        """
+        Summarizes everything recorded so far.
+
+        :return: a list of dicts, one per series, each with the metric
+            ``name``, its ``labels`` as a dict, and the ``count``, ``sum``,
+            ``mean`` and ``max`` of its values, and ``quantiles`` mapping
+            each of :const:`SNAPSHOT_QUANTILES` to its estimate.
+        """
+        result = []
+        for (name, labels), histogram in self._series():
+            result.append({
+                'name': name,
+                'labels': dict(labels),
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'mean': histogram.mean,
+                'max': histogram.max,
+                'quantiles': {q: histogram.quantile(q)
+                              for q in SNAPSHOT_QUANTILES},
+            })
+        return result
+
+    def to_prometheus(self):
+        """
+        Returns everything recorded so far in the Prometheus text format.
+
+        Each metric is a histogram with a cumulative ``_bucket`` series per
+        bound, plus ``_sum`` and ``_count``.
+        """
+        lines = []
+        previous = None
+        for (name, labels), histogram in self._series():
+            if name != previous:
+                help_text = METRICS.get(name, (None, name))[1]
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s histogram' % name)
+                previous = name
+            with histogram._lock:
+                counts = list(histogram.counts)
+                total, count = histogram.sum, histogram.count
+            cumulative = 0
+            for bound, bucket in zip(histogram.bounds, counts):
+                cumulative += bucket
+                lines.append('%s_bucket%s %d' % (
+                    name, _format_labels(labels, ('le', repr(bound))),
+                    cumulative))
+            lines.append('%s_bucket%s %d' % (
+                name, _format_labels(labels, ('le', '+Inf')), count))
+            lines.append('%s_sum%s %r' % (name, _format_labels(labels),
+                                          total))
+            lines.append('%s_count%s %d' % (name, _format_labels(labels),
+                                            count))
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def export(self, path=None, callback=None):
+        """
+        Exports everything recorded so far in the Prometheus text format.
+
+        Writing to a file suits the node exporter's textfile collector,
+        which reads ``*.prom`` files from a directory.
+
+        :param path: file to write.  It is replaced atomically, so a
+            collector never reads it half written.
+        :param callback: callable given the text, for example to push it
+            to a gateway.
+        """
+        if path is None and callback is None:
+            raise ValueError("Either path or callback is required")
+        text = self.to_prometheus()
+        if path is not None:
+            directory = os.path.dirname(os.path.abspath(path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(text)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        if callback is not None:
+            callback(text)
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels)
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs)
+
+
+class ReceiveStats(object):
+    """
+    Tracks the output received by one wait for output.
+
+    Call :meth:`received` for every read and :meth:`finished` once the
+    wait succeeded.
+
+    :param instrumentation: the :class:`Instrumentation` to record to.
+    :param labels: dict of labels for the recorded values.
+    """
+
+    def __init__(self, instrumentation, labels):
+        self._instrumentation = instrumentation
+        self._labels = labels
+        self.started = time.monotonic()
+        self.first_byte = None
+        self.bytes = 0
+        self.chunks = 0
+
+    def received(self, nbytes):
+        """Counts one read of ``nbytes`` bytes."""
+        if self.first_byte is None and nbytes:
+            self.first_byte = time.monotonic()
+        self.bytes += nbytes
+        self.chunks += 1
+
+    def finished(self):
+        """Records the wait."""
+        observe = self._instrumentation.observe
+        labels = self._labels
+        if self.first_byte is not None:
+            observe('cmdline_first_byte_seconds',
+                    self.first_byte - self.started, **labels)
+        observe('cmdline_receive_seconds', time.monotonic() - self.started,
+                **labels)
+        observe('cmdline_received_bytes', self.bytes, **labels)
+        observe('cmdline_received_chunks', self.chunks, **labels)
+
+
+class _NoReceiveStats(object):
+    # Stands in for ReceiveStats when there is no instrumentation.
+
+    def received(self, nbytes):
+        pass
+
+    def finished(self):
+        pass
+
+
+NO_RECEIVE_STATS = _NoReceiveStats()
+
+
+def instrumented(method):
+    """
+    Decorator recording the duration of an ``exec_command`` method.
+
+    Does nothing unless the method's object has an ``_instrumentation``.
+    The time from the object's last receipt of output, which it notes in
+    ``_received_at``, to the method returning is recorded as its ``parse``
+    phase.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        instrumentation = getattr(self, '_instrumentation', None)
+        if instrumentation is None:
+            return method(self, *args, **kwargs)
+        session = type(self).__name__
+        self._received_at = None
+        with instrumentation.timer('cmdline_command_seconds',
+                                   session=session):
+            result = method(self, *args, **kwargs)
+        if self._received_at is not None:
+            instrumentation.observe('cmdline_phase_seconds',
+                                    time.monotonic() - self._received_at,
+                                    session=session, phase='parse')
+        return result
+    return wrapper
@@ -0,0 +1,87 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Loading of SSH private keys, shared across connections.
+
+
+import os
+import hashlib
+import logging
+import threading
+
+import paramiko
+
+# Key types tried, in order, when loading a private key file.
+KEY_CLASSES = (paramiko.Ed25519Key, paramiko.ECDSAKey, paramiko.RSAKey)
+
+# (realpath, passphrase digest) -> ((mtime_ns, size), key)
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load_private_key(path, passphrase=None):
+    """
+    Returns the private key stored in a file, parsing it only once.
+
+    Parsed keys are cached for the whole process and shared by every
+    connection using the same file and passphrase, so that a wrong
+    passphrase fails even once the key is cached.  The file is parsed
+    again if it has been modified since.
+
+    :param path: path to an RSA, ECDSA or Ed25519 private key file, in
+        either PEM or OpenSSH format
+    :param passphrase: passphrase of an encrypted key file
+
+    :return: a paramiko PKey.
+    :raises paramiko.PasswordRequiredException: if the key is encrypted
+        and no passphrase was given
+    :raises paramiko.SSHException: if the file holds no supported key,
+        or the passphrase is wrong
+    :raises IOError: if the file cannot be read
+    """
+    path = os.path.realpath(os.path.expanduser(path))
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cache_key = (path, _digest(passphrase))
+
+    with _cache_lock:
+        cached = _cache.get(cache_key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        key = _parse_private_key(path, passphrase)
+        _cache[cache_key] = (version, key)
+        return key
+
+
+def _digest(passphrase):
+    # Only a digest is kept, so the cache holds no passphrases.
+    if passphrase is None:
+        return None
+    if isinstance(passphrase, str):
+        passphrase = passphrase.encode('utf8')
+    return hashlib.sha256(passphrase).digest()
+
+
+def _parse_private_key(path, passphrase):
+    logging.debug("Loading private key %s" % path)
+    error = None
+    for key_class in KEY_CLASSES:
+        try:
+            return key_class.from_private_key_file(path, password=passphrase)
+        except paramiko.PasswordRequiredException:
+            raise
+        except paramiko.SSHException as e:
+            # Wrong key type, or a bad passphrase; try the next type.
+            error = e
+    raise paramiko.SSHException("Could not load private key %s: %s" %
+                                (path, error))
+
+
+def clear_key_cache():
+    """Forgets all cached private keys."""
+    with _cache_lock:
+        _cache.clear()
@@ -5,8 +5,11 @@
 # as set forth in the License.
 
 
+import re
+import codecs
 import logging
-import signal
+import weakref
+import threading
 
 try:
     import libvirt
@@ -14,7 +17,10 @@ try:
 except:
     HAS_LIBVIRT = False
 
-from steelscript.cmdline import exceptions, channel
+from steelscript.cmdline import exceptions, channel, deadline, hooks
+from steelscript.cmdline.debuglog import Preview
+
+log = logging.getLogger(__name__)
 
 # Control-u clears any entered text.  Neat.
 DELETE_LINE = '\x15'
@@ -34,6 +40,146 @@ ROOT_PROMPT = '%s# ' % NAME_PREFIX
 
 DEFAULT_EXPECT_TIMEOUT = 300
 
+# Largest block read from a console stream at once.
+RECV_SIZE = 65536
+
+# What a non-blocking stream returns when it has nothing to read.
+_WOULD_BLOCK = -2
+
+_event_loop_lock = threading.Lock()
+_event_loop = None
+
+
+def start_event_loop():
+    """
+    Starts a thread running libvirt's default event loop, if not already
+    started.
+
+    Libvirt reports stream events, such as a console having output to read,
+    through an event loop, which has to be registered before connections
+    are opened.  Applications that run their own libvirt event loop should
+    register it before starting channels; this one is then not started.
+    """
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is not None:
+            return
+        if libvirt.virEventRegisterDefaultImpl() < 0:
+            raise exceptions.ConnectionError(
+                context='Failed to register the libvirt event loop')
+        _event_loop = threading.Thread(target=_run_event_loop,
+                                       name='libvirt-events')
+        _event_loop.daemon = True
+        _event_loop.start()
+
+
+def _run_event_loop():
+    while True:
+        libvirt.virEventRunDefaultImpl()
+
+
+class ConsoleManager(object):
+    """
+    Shares libvirt connections among the consoles of many domains.
+
+    One connection is opened per hypervisor URI, when the first console on
+    it starts, and closed once the last is closed.  The streams of all the
+    consoles are served by the one event loop of :func:`start_event_loop`.
+
+    Channels from :meth:`channel` are :class:`LibVirtChannel` objects, for
+    use like any other channel.  CLI classes create their own channels;
+    pass them ``manager=`` to have those share connections too.  Channels
+    not given a manager use the one of :func:`default_console_manager`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # The connection in use for each URI, and the number of consoles
+        # using each connection.
+        self._connections = {}
+        self._users = {}
+        self._channels = weakref.WeakSet()
+
+    def channel(self, machine_name, machine_manager_uri='qemu:///system',
+                **kwargs):
+        """
+        Returns a channel to the console of a domain, not started yet.
+
+        Takes the parameters of :class:`LibVirtChannel`.
+        """
+        channel = LibVirtChannel(machine_name, machine_manager_uri,
+                                 manager=self, **kwargs)
+        self._channels.add(channel)
+        return channel
+
+    def acquire(self, uri):
+        """
+        Returns the connection to a hypervisor, opening it if needed.
+
+        Each call must be matched by a call to :meth:`release`.
+
+        :param uri: the hypervisor URI
+        :raises libvirt.libvirtError: if the connection could not be
+            opened.
+        """
+        start_event_loop()
+        with self._lock:
+            conn = self._connections.get(uri)
+            if conn is None:
+                log.debug('Connecting to %s', uri)
+                conn = libvirt.open(uri)
+                conn.registerCloseCallback(self._on_connection_closed, uri)
+                self._connections[uri] = conn
+            self._users[conn] = self._users.get(conn, 0) + 1
+            return conn
+
+    def release(self, uri, conn):
+        """
+        Stops using a connection from :meth:`acquire`, closing it if
+        nothing else uses it.
+        """
+        with self._lock:
+            self._users[conn] -= 1
+            if self._users[conn]:
+                return
+            del self._users[conn]
+            if self._connections.get(uri) is conn:
+                del self._connections[uri]
+        log.debug('Closing the connection to %s', uri)
+        try:
+            conn.unregisterCloseCallback()
+            conn.close()
+        except libvirt.libvirtError as e:
+            log.debug('Failed to close the connection to %s: %s', uri, e)
+
+    def _on_connection_closed(self, conn, reason, uri):
+        # Runs in the event loop thread.  Consoles still using the
+        # connection see their streams fail; new ones get a new connection.
+        log.warning('Connection to %s closed, reason %s', uri, reason)
+        with self._lock:
+            self._connections.pop(uri, None)
+
+    def close(self):
+        """Closes the channels from :meth:`channel`, and their connections."""
+        for channel in list(self._channels):
+            channel.close()
+
+
+_default_manager_lock = threading.Lock()
+_default_manager = None
+
+
+def default_console_manager():
+    """
+    Returns the :class:`ConsoleManager` of channels not given one,
+    creating it on first use.
+    """
+    global _default_manager
+    with _default_manager_lock:
+        if _default_manager is None:
+            _default_manager = ConsoleManager()
+        return _default_manager
+
 
 class LibVirtChannel(channel.Channel):
     """
@@ -44,10 +190,12 @@ class LibVirtChannel(channel.Channel):
         may be found.  Defaults to a local qemu hypervisor.
     :param user: username for authentication
     :param password: password for authentication
+    :param manager: :class:`ConsoleManager` to get the hypervisor
+        connection from.  Defaults to :func:`default_console_manager`.
     """
 
     def __init__(self, machine_name, machine_manager_uri='qemu:///system',
-                 username='root', password='', **kwargs):
+                 username='root', password='', manager=None, **kwargs):
         """
         Manages connection and authentication via libvirt.
         """
@@ -57,6 +205,15 @@ class LibVirtChannel(channel.Channel):
         self._conn = None
         self._stream = None
         self._console_logged_in = False
+        self._manager = manager
+
+        # Text read past the last match, and the decoder of what is read,
+        # which may end part way through a character.
+        self._unread = ''
+        self._decoder = codecs.getincrementaldecoder('utf8')('ignore')
+        # Stream events not handled yet, set by the event loop thread.
+        self._stream_events = 0
+        self._stream_ready = threading.Condition()
 
         self._username = username
         self._password = password
@@ -67,11 +224,13 @@ class LibVirtChannel(channel.Channel):
 
         :param match_res: Pattern(s) of prompts to look for.
             May be a single regex string, or a list of them.
-        :param timeout: maximum time, in seconds, to wait for a regular
-            expression match. 0 to wait forever.
+        :param timeout: maximum time, in seconds, for the whole login, or
+            a :class:`steelscript.cmdline.deadline.Deadline`.  0 to wait
+            forever.
 
         :return: Python :class:`re.MatchObject` containing data on
             what was matched.
+        :raises CmdlineTimeout: if the login exceeds the timeout.
         """
 
         if not HAS_LIBVIRT:
@@ -82,29 +241,77 @@ class LibVirtChannel(channel.Channel):
         elif not (isinstance(match_res, list) or isinstance(match_res, tuple)):
             match_res = [match_res, ]
 
+        if self._manager is None:
+            self._manager = default_console_manager()
+
         try:
             # Get connection and libvirt domain
-            self._conn = libvirt.open(self._uri)
+            self._conn = self._manager.acquire(self._uri)
             self._domain = self._conn.lookupByName(self._machine_name)
         except libvirt.libvirtError:
+            self._disconnect()
             raise exceptions.ConnectionError(
                 context="Failed to find domain '%s' on host" %
                         self._machine_name)
 
-        # Make sure domain is running
-        self._verify_domain_running()
-
-        # open console
-        self._stream = self._conn.newStream(0)
-        console_flags = libvirt.VIR_DOMAIN_CONSOLE_FORCE
-        self._domain.openConsole(None, self._stream, console_flags)
+        try:
+            # Make sure domain is running
+            self._verify_domain_running()
+
+            # open console
+            self._stream = self._conn.newStream(libvirt.VIR_STREAM_NONBLOCK)
+            console_flags = libvirt.VIR_DOMAIN_CONSOLE_FORCE
+            self._domain.openConsole(None, self._stream, console_flags)
+            self._stream.eventAddCallback(
+                libvirt.VIR_STREAM_EVENT_READABLE |
+                libvirt.VIR_STREAM_EVENT_ERROR |
+                libvirt.VIR_STREAM_EVENT_HANGUP,
+                self._on_stream_event, None)
+        except Exception:
+            self._disconnect()
+            raise
+        self._fire(hooks.CONNECT)
+
+        return self._handle_init_login(match_res,
+                                       deadline.Deadline.coerce(timeout))
+
+    def footprint(self):
+        """
+        Returns the memory held by console output read past the last match,
+        including the bytes of a character only partly received.
 
-        return self._handle_init_login(match_res, timeout)
+        :return: a :class:`steelscript.cmdline.footprint.Footprint`
+        """
+        footprint = super(LibVirtChannel, self).footprint()
+        partial, _ = self._decoder.getstate()
+        footprint.held['receive_buffer'] = (
+            len(self._unread.encode('utf8')) + len(partial))
+        return footprint
 
     def close(self):
-        # For compatibility with other channels.
-        # TODO: Should we actually close this somehow?
-        pass
+        """
+        Closes the console, and the hypervisor connection unless other
+        consoles use it.  The domain is left running.
+        """
+        self._disconnect()
+        self._fire(hooks.CLOSE)
+
+    def _disconnect(self):
+        stream, self._stream = self._stream, None
+        if stream is not None:
+            try:
+                stream.eventRemoveCallback()
+                stream.abort()
+            except libvirt.libvirtError as e:
+                log.debug('Failed to close the console of %s: %s',
+                          self._machine_name, e)
+        conn, self._conn = self._conn, None
+        if conn is not None and self._manager is not None:
+            self._manager.release(self._uri, conn)
+        self._domain = None
+        self._console_logged_in = False
+        self._unread = ''
+        self._decoder.reset()
 
     def _verify_domain_running(self):
         """
@@ -137,7 +344,7 @@ class LibVirtChannel(channel.Channel):
         prompt_list = [LOGIN_PROMPT, PASSWORD_PROMPT]
         prompt_list.extend(logged_in_res)
 
-        logging.debug("Send an empty line to refresh the prompt.")
+        log.debug("Send an empty line to refresh the prompt.")
         # Clear the input buffer
         self.send('%s%s' % (DELETE_LINE, ENTER_LINE))
         (output, match) = self.expect(prompt_list, timeout=timeout)
@@ -145,8 +352,7 @@ class LibVirtChannel(channel.Channel):
         # If we did not get a username or password prompt, we are logged in
         if match.re.pattern not in [LOGIN_PROMPT, PASSWORD_PROMPT]:
             self._console_logged_in = True
-        logging.debug("Console prompt = %s" %
-                      match.string[match.start():match.end()])
+        log.debug("Console prompt = %s", match.group(0))
         return match
 
     def _handle_init_login(self, logged_in_res, timeout):
@@ -155,13 +361,17 @@ class LibVirtChannel(channel.Channel):
 
         :param logged_in_res: Regex list of logged in prompts.
         :type logged_in_res: list (single pattern not allowed)
-        :param timeout: Time to wait for each prompt match.
+        :param timeout: maximum time, in seconds, for the whole login, or
+            a :class:`steelscript.cmdline.deadline.Deadline`.  0 to wait
+            forever.
 
         :return: Match object for last prompt received.
+        :raises CmdlineTimeout: if the login exceeds the timeout.
         """
+        login_deadline = deadline.Deadline.coerce(timeout)
         try:
             match = self._check_console_mode(logged_in_res,
-                                             timeout=DEFAULT_EXPECT_TIMEOUT)
+                                             timeout=login_deadline)
             if self._console_logged_in:
                 return match
 
@@ -169,27 +379,71 @@ class LibVirtChannel(channel.Channel):
             if match.re.pattern == PASSWORD_PROMPT:
                 # Do not know who was being logged in, so reset the
                 # session to start over.
-                logging.debug("Incomplete login session found.")
+                log.debug("Incomplete login session found.")
                 self.send(DISCONNECT_SESSION)
-                self.expect([LOGIN_PROMPT])
+                self.expect([LOGIN_PROMPT], login_deadline)
 
         except exceptions.CmdlineTimeout:
             # Make one last attempt to get a login prompt
             # Could be stuck in a program that does not have a prompt
             # we recognize.
-            logging.debug("Time out logging in, retrying.")
+            log.debug("Time out logging in, retrying.")
             self.send(DISCONNECT_SESSION)
-            self.expect([LOGIN_PROMPT])
+            self.expect([LOGIN_PROMPT], login_deadline)
 
         # Now do the login.
         self.send('%s%s' % (self._username, ENTER_LINE))
-        (output, match) = self.expect([PASSWORD_PROMPT, ROOT_PROMPT])
+        (output, match) = self.expect([PASSWORD_PROMPT, ROOT_PROMPT],
+                                      login_deadline)
         if match.re.pattern == PASSWORD_PROMPT:
             self.send('%s%s' % (self._password, ENTER_LINE))
-            (output, match) = self.expect(logged_in_res)
+            (output, match) = self.expect(logged_in_res, login_deadline)
         self._console_logged_in = True
         return match
 
+    def _on_stream_event(self, stream, events, opaque):
+        # Runs in the event loop thread; the stream is only read by the
+        # thread using the channel.
+        with self._stream_ready:
+            self._stream_events |= events
+            self._stream_ready.notify_all()
+
+    def _read(self, wait=True, read_deadline=None):
+        """
+        Reads a block of data from the console stream.
+
+        :param wait: if True, wait until there is data to read.
+        :param read_deadline: a :class:`steelscript.cmdline.deadline.Deadline`
+            to stop waiting at.  None to wait as long as it takes.
+        :return: the bytes read, or None if there were none and either
+            not waiting or the deadline expired.
+        :raises ConnectionError: if the console was closed, or reading it
+            failed.
+        """
+        while True:
+            try:
+                data = self._stream.recv(RECV_SIZE)
+            except libvirt.libvirtError as e:
+                raise exceptions.ConnectionError(
+                    cause=e, context='Failed to read the console of %s' %
+                    self._machine_name)
+            if data != _WOULD_BLOCK:
+                break
+            if not wait:
+                return None
+            with self._stream_ready:
+                while not self._stream_events:
+                    if read_deadline is not None and read_deadline.expired():
+                        return None
+                    self._stream_ready.wait(
+                        None if read_deadline is None
+                        else read_deadline.remaining())
+                self._stream_events = 0
+        if not data:
+            raise exceptions.ConnectionError(
+                context='Console of %s was closed' % self._machine_name)
+        return data
+
     def receive_all(self):
         """
         Returns all text currently in the receive buffer, effectively flushing
@@ -197,14 +451,14 @@ class LibVirtChannel(channel.Channel):
 
         :return: the text that was present in the receive queue, if any.
         """
-        # Enclosed variables are immutable, but their contents are not.
-        received = ['']
-
-        def handler(s, buf, opaque):
-            received[0] += buf.decode('utf8', 'ignore')
-
-        self._stream.recvAll(handler, None)
-        return received[0]
+        received = [self._unread]
+        self._unread = ''
+        while True:
+            data = self._read(wait=False)
+            if data is None:
+                break
+            received.append(self._decoder.decode(data))
+        return ''.join(received)
 
     def send(self, text_to_send):
         """
@@ -212,12 +466,19 @@ class LibVirtChannel(channel.Channel):
 
         :param str text_to_send: Text to send, including command terminator(s)
                              when applicable.
+        :raises ConnectionError: if writing to the console failed.
         """
         # There is also a sendAll that works like recvAll, but while
         # Python libvirt's recv still needs a length specified, its send
         # just takes the length of the supplied data automatically.
+        self._fire(hooks.SEND, text=text_to_send)
         encoded = text_to_send.encode('utf8')
-        self._stream.send(encoded)
+        try:
+            self._stream.send(encoded)
+        except libvirt.libvirtError as e:
+            raise exceptions.ConnectionError(
+                cause=e, context='Failed to write to the console of %s' %
+                self._machine_name)
 
     def expect(self, match_res, timeout=DEFAULT_EXPECT_TIMEOUT):
         """
@@ -226,11 +487,14 @@ class LibVirtChannel(channel.Channel):
         Internally, this method works with bytes, but input and output
         are unicode as usual.
 
+        The timeout is kept without signals, so channels may be used from
+        any thread, several at once.
+
         :param match_res: a list of regular expressions to match against
             the output.
         :param timeout: Time to wait for matching data in the stream,
-            in seconds.  Note that the default timeout is longer than
-            on most channels.
+            in seconds, or a :class:`steelscript.cmdline.deadline.Deadline`.
+            Note that the default timeout is longer than on most channels.
 
         :return: ``(output, match_object)`` where output is the output of
             the command (without the matched text), and match_object is a
@@ -245,34 +509,55 @@ class LibVirtChannel(channel.Channel):
         :raises CmdlineTimeout: if no match found before timeout.
         """
 
-        # Timeout handler
-        def expectsig(signum, frame):
-            raise exceptions.CmdlineTimeout(timeout)
-
+        expect_deadline = deadline.Deadline.coerce(timeout)
         match_res, safe_match_text = self._expect_init(match_res)
 
-        # We want to manage lines as unicode so that match object results
-        # will be stored as unicode.  Otherwise, we lead bytestrings
-        # out to the caller.  The type of the matched string is determined
-        # by the input string- the regex pattern can be either bytes
-        # or unicode.
-        data = ""
-        signal.signal(signal.SIGALRM, expectsig)
-        signal.alarm(timeout)
+        # Text is searched from the start of the line being received, with
+        # the character before it, so that patterns anchored on a line
+        # break see it, and each search only covers new data.  Text before
+        # that is kept in lines, to be joined once matched.  Matching text
+        # keeps match objects and output as unicode.
+        patterns = [re.compile(pattern) for pattern in match_res]
+        lines = []
+        tail = self._unread
+        self._unread = ''
+        position = 0
+        stats = self._receive_stats()
         while True:
-            recv = self._stream.recv(1)
-            data = data + recv.decode('utf8', 'ignore')
-            match = self._find_match(data, match_res)
+            for pattern in patterns:
+                match = pattern.search(tail, position)
+                if match is not None:
+                    break
             if match is not None:
-                logline = data
-                logging.debug('> ' + logline.strip('\r\n'))
-                logging.debug("successfully matched %s", match.re.pattern)
-                signal.alarm(0)
-                return (data[0:match.start()], match)
-
-            if recv == b'\n':
-                # Consoles will send either an 8 bit codec UTF-8
-                # Not 7 bit ASCII.  Use UTF-8 as that includes ISO-8859-1
-                # which should work for anything we have.
-                logline = data.strip('\r\n')
-                logging.debug('> ' + logline)
+                output = ''.join(lines) + tail[:match.start()]
+                self._unread = tail[match.end():]
+                log.debug('> %s', Preview(output))
+                log.debug("successfully matched %s", match.re.pattern)
+                stats.finished()
+                self._fire(hooks.MATCH, output=output, match=match)
+                return (output, match)
+
+            line_break = max(tail.rfind('\n'), tail.rfind('\r'))
+            if line_break > 1:
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug('> %s', Preview(tail[position:line_break]))
+                lines.append(tail[:line_break - 1])
+                tail = tail[line_break - 1:]
+                position = 1
+
+            # Checked before reading too, as a console that keeps printing
+            # always has something to read.
+            recv = None
+            if not expect_deadline.expired():
+                recv = self._read(read_deadline=expect_deadline)
+            if recv is None:
+                self._fire(hooks.TIMEOUT, timeout=expect_deadline.timeout,
+                           failed_match=match_res)
+                raise exceptions.CmdlineTimeout(expect_deadline.timeout,
+                                                failed_match=match_res)
+            stats.received(len(recv))
+            self._fire(hooks.RECEIVE, data=recv)
+            # Consoles will send either an 8 bit codec UTF-8
+            # Not 7 bit ASCII.  Use UTF-8 as that includes ISO-8859-1
+            # which should work for anything we have.
+            tail += self._decoder.decode(recv)
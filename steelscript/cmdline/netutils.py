@@ -0,0 +1,222 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# TCP connection setup with explicit timeouts.
+
+
+import time
+import errno
+import socket
+import logging
+import selectors
+import threading
+
+# Seconds to wait for one address before also trying the next one, as
+# recommended by RFC 8305 ("Happy Eyeballs").
+CONNECTION_ATTEMPT_DELAY = 0.25
+
+_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN)
+
+
+def resolve(host, port, timeout=None):
+    """
+    Looks up the addresses of a host, giving up after ``timeout``.
+
+    The system resolver cannot be interrupted, so on timeout the lookup is
+    abandoned to a daemon thread rather than cancelled.
+
+    :param host: hostname or address
+    :param port: port number
+    :param timeout: seconds to wait.  None or 0 to wait as long as the
+        system resolver does.
+
+    :return: a list of ``socket.getaddrinfo`` tuples for stream sockets.
+    :raises socket.timeout: if the lookup did not complete in time
+    :raises socket.gaierror: if the lookup failed
+    """
+    if not timeout:
+        return socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+
+    result = {}
+
+    def lookup():
+        try:
+            result['addrs'] = socket.getaddrinfo(host, port, 0,
+                                                 socket.SOCK_STREAM)
+        except socket.error as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=lookup, name='resolve-%s' % host)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise socket.timeout("Lookup of '%s' timed out after %s seconds" %
+                             (host, timeout))
+    if 'error' in result:
+        raise result['error']
+    return result['addrs']
+
+
+def interleave(addrinfos):
+    """
+    Orders addresses so that consecutive ones alternate address families.
+
+    The first family returned by the resolver, usually the preferred one,
+    stays first.
+
+    :param addrinfos: ``socket.getaddrinfo`` tuples
+    :return: the same tuples, reordered.
+    """
+    by_family = {}
+    for addrinfo in addrinfos:
+        by_family.setdefault(addrinfo[0], []).append(addrinfo)
+    queues = list(by_family.values())
+
+    ordered = []
+    while queues:
+        for queue in queues:
+            ordered.append(queue.pop(0))
+        queues = [queue for queue in queues if queue]
+    return ordered
+
+
+def connect(host, port, timeout=None, dns_timeout=None,
+            attempt_delay=CONNECTION_ATTEMPT_DELAY):
+    """
+    Opens a TCP connection, racing the addresses of the host.
+
+    Addresses are tried in :func:`interleave` order.  Each is given
+    ``attempt_delay`` seconds to connect before the next is started
+    alongside it; the first to connect wins and the others are closed.
+    A host that has both an unreachable IPv6 address and a working IPv4
+    address therefore connects in a fraction of a second instead of after
+    the operating system's TCP timeout.
+
+    :param host: hostname or address
+    :param port: port number
+    :param timeout: seconds allowed for connecting to all addresses,
+        excluding the lookup.  None or 0 for no limit.
+    :param dns_timeout: seconds allowed for looking up ``host``
+    :param attempt_delay: seconds to wait on an address before also trying
+        the next one
+
+    :return: a connected, blocking socket, with Nagle's algorithm
+        disabled.
+    :raises socket.timeout: if the lookup or the connection timed out
+    :raises socket.error: the last error seen if no address could connect
+    """
+    addrinfos = interleave(resolve(host, port, dns_timeout))
+    if not addrinfos:
+        raise socket.gaierror("No addresses found for '%s'" % host)
+
+    expires = time.monotonic() + timeout if timeout else None
+    selector = selectors.DefaultSelector()
+    pending = []
+    last_error = None
+    next_attempt = time.monotonic()
+    try:
+        while True:
+            now = time.monotonic()
+            # Start the next attempt if it is due, or at once if nothing
+            # else is in flight.
+            if addrinfos and (now >= next_attempt or not pending):
+                family, type_, proto, _, sockaddr = addrinfos.pop(0)
+                try:
+                    sock = socket.socket(family, type_, proto)
+                except socket.error as e:
+                    last_error = e
+                    continue
+                sock.setblocking(False)
+                err = sock.connect_ex(sockaddr)
+                if err == 0:
+                    return _connected(sock)
+                if err not in _IN_PROGRESS:
+                    last_error = socket.error(err, '%s connecting to %s' %
+                                              (errno.errorcode.get(err, err),
+                                               sockaddr))
+                    sock.close()
+                    continue
+                pending.append(sock)
+                selector.register(sock, selectors.EVENT_WRITE, sockaddr)
+                next_attempt = now + attempt_delay
+
+            if not pending:
+                raise last_error
+
+            if expires is not None and now >= expires:
+                raise socket.timeout("Connection to '%s' port %s timed out "
+                                     "after %s seconds" %
+                                     (host, port, timeout))
+
+            wake_at = [next_attempt] if addrinfos else []
+            if expires is not None:
+                wake_at.append(expires)
+            wait = max(0, min(wake_at) - now) if wake_at else None
+
+            for key, _ in selector.select(wait):
+                sock = key.fileobj
+                selector.unregister(sock)
+                pending.remove(sock)
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err == 0:
+                    return _connected(sock)
+                logging.debug("Connecting to %s failed: %s" %
+                              (key.data, errno.errorcode.get(err, err)))
+                last_error = socket.error(err, '%s connecting to %s' %
+                                          (errno.errorcode.get(err, err),
+                                           key.data))
+                sock.close()
+    finally:
+        for sock in pending:
+            sock.close()
+        selector.close()
+
+
+# Waits on one descriptor with a single poll() call, rather than creating
+# an epoll or kqueue descriptor each time.  Unlike select(), poll() takes
+# descriptors of any number, as processes with thousands of sessions have.
+_WaitSelector = getattr(selectors, 'PollSelector', selectors.SelectSelector)
+
+
+def wait_readable(fileobj, timeout=None):
+    """
+    Waits until there is data to read.
+
+    :param fileobj: a socket, or any object with a ``fileno()`` method
+        such as a paramiko Channel.
+    :param timeout: maximum seconds to wait.  None to wait forever.
+
+    :return: True if there is data to read, or False if the timeout
+        expired first.
+    """
+    with _WaitSelector() as selector:
+        selector.register(fileobj, selectors.EVENT_READ)
+        return bool(selector.select(timeout))
+
+
+def wait_writable(fileobj, timeout=None):
+    """
+    Waits until data can be written without blocking.
+
+    :param fileobj: a socket, or any object with a ``fileno()`` method.
+    :param timeout: maximum seconds to wait.  None to wait forever.
+
+    :return: True if data can be written, or False if the timeout expired
+        first.
+    """
+    with _WaitSelector() as selector:
+        selector.register(fileobj, selectors.EVENT_WRITE)
+        return bool(selector.select(timeout))
+
+
+def _connected(sock):
+    sock.setblocking(True)
+    # SSH sends many small packets, such as requests that are answered
+    # before the next is sent.  Held back by Nagle's algorithm until the
+    # peer's delayed acknowledgement, each would cost up to 40ms.
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
@@ -0,0 +1,204 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Limits on the rate of commands and the number of concurrent sessions.
+
+
+import time
+import threading
+import contextlib
+
+from steelscript.cmdline import exceptions
+
+
+class TokenBucket(object):
+    """
+    Limits how often something happens, while allowing short bursts.
+
+    The bucket holds up to ``burst`` tokens and refills at ``rate`` tokens
+    per second.  Each command takes a token, waiting for one if the bucket
+    is empty, so that over any period no more than
+    ``burst + rate * period`` commands are sent.
+
+    :param rate: tokens added per second
+    :param burst: capacity of the bucket.  Defaults to ``rate``, allowing
+        one second's worth of commands at once.
+    """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError("rate should be positive")
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        # Called with self._lock held.
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """
+        Takes tokens if they are available right now.
+
+        :return: True if the tokens were taken, False otherwise.
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, timeout=None):
+        """
+        Takes tokens, waiting for them as needed.
+
+        :param tokens: number of tokens to take
+        :param timeout: maximum time, in seconds, to wait.  None to wait as
+            long as needed.
+
+        :return: the time, in seconds, spent waiting.
+        :raises CmdlineTimeout: if the tokens would not be available in
+            time.  No tokens are taken in that case.
+        """
+        if tokens > self.burst:
+            raise ValueError("Cannot take more than %s tokens at once" %
+                             self.burst)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            if timeout is not None and waited + delay > timeout:
+                raise exceptions.CmdlineTimeout(timeout=timeout)
+            time.sleep(delay)
+            waited += delay
+
+
+class ConcurrencyGovernor(object):
+    """
+    Caps the number of sessions open at once, per host and overall.
+
+    Share one governor among all the CLIs and Shells of a program to keep
+    a fleet-wide run from opening more sessions than the devices, or the
+    program itself, can handle::
+
+        governor = ConcurrencyGovernor(max_total=200, max_per_host=2)
+        with governor.slot('sh1'):
+            ...
+
+    :param max_total: sessions allowed across all hosts.  None for no
+        limit.
+    :param max_per_host: sessions allowed to a single host.  None for no
+        limit.
+    """
+
+    def __init__(self, max_total=None, max_per_host=None):
+        self.max_total = max_total
+        self.max_per_host = max_per_host
+
+        self._cond = threading.Condition()
+        self._total = 0
+        self._per_host = {}
+
+    def _available(self, host):
+        # Called with self._cond held.
+        if self.max_total is not None and self._total >= self.max_total:
+            return False
+        if (self.max_per_host is not None and
+                self._per_host.get(host, 0) >= self.max_per_host):
+            return False
+        return True
+
+    def acquire(self, host, timeout=None):
+        """
+        Takes a session slot for a host, waiting for one if needed.
+
+        :param host: the host the session is to
+        :param timeout: maximum time, in seconds, to wait.  None to wait
+            as long as needed.
+
+        :raises CmdlineTimeout: if no slot became free in time.
+        """
+        expires = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._available(host):
+                remaining = (None if expires is None
+                             else expires - time.monotonic())
+                if remaining is not None and remaining <= 0:
+                    raise exceptions.CmdlineTimeout(timeout=timeout)
+                self._cond.wait(remaining)
+            self._total += 1
+            self._per_host[host] = self._per_host.get(host, 0) + 1
+
+    def release(self, host):
+        """Gives back a slot taken with :meth:`acquire`."""
+        with self._cond:
+            self._total -= 1
+            self._per_host[host] -= 1
+            if not self._per_host[host]:
+                del self._per_host[host]
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, host, timeout=None):
+        """Context manager holding a slot for a host, see :meth:`acquire`."""
+        self.acquire(host, timeout)
+        try:
+            yield
+        finally:
+            self.release(host)
+
+    def in_use(self, host=None):
+        """
+        Returns the number of slots taken.
+
+        :param host: count only the slots of this host, if given.
+        """
+        with self._cond:
+            if host is None:
+                return self._total
+            return self._per_host.get(host, 0)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(host, rate, burst=None):
+    """
+    Returns the process-wide command rate limiter for a host.
+
+    Every CLI and Shell given the limiter of a host shares its budget of
+    commands per second.
+
+    :param host: hostname or address the limiter protects
+    :param rate: commands per second, used if the limiter does not exist
+        yet
+    :param burst: see :class:`TokenBucket`, used if the limiter does not
+        exist yet
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = TokenBucket(rate, burst)
+            _limiters[host] = limiter
+        return limiter
+
+
+def reset_limiters():
+    """Forgets all process-wide rate limiters."""
+    with _limiters_lock:
+        _limiters.clear()
@@ -0,0 +1,332 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Recording of channel sessions, and a channel replaying them.
+
+
+import time
+import struct
+import threading
+
+from steelscript.cmdline import deadline
+from steelscript.cmdline import exceptions
+from steelscript.cmdline import hooks
+from steelscript.cmdline.channel import Channel
+from steelscript.cmdline.footprint import sizeof
+
+# The file format is MAGIC followed by records, each a RECORD header
+# followed by its payload.  The header holds the seconds since recording
+# started, the kind of record and the payload length.
+MAGIC = b'SSCMDREC1\n'
+RECORD = struct.Struct('<dcI')
+
+CONNECT = b'C'
+"""Record of a channel connecting.  No payload."""
+
+SENT = b'>'
+"""Record of text sent, as UTF-8."""
+
+RECEIVED = b'<'
+"""Record of a chunk of output received, as read."""
+
+CLOSED = b'X'
+"""Record of a channel closing.  No payload."""
+
+_KINDS = {
+    hooks.CONNECT: CONNECT,
+    hooks.SEND: SENT,
+    hooks.RECEIVE: RECEIVED,
+    hooks.CLOSE: CLOSED,
+}
+
+
+class Recorder(object):
+    """
+    Records everything sent and received on channels to a file.
+
+    Each record is timestamped, so that :class:`ReplayChannel` can replay
+    the session at its original pace::
+
+        with Recorder('show_version.rec'):
+            with RVBD_CLI(hostname='sh1', password='pw') as cli:
+                cli.exec_command('show version')
+
+    :param path: file to write the recording to.
+    :param channel: the channel to record.  If None, every channel is
+        recorded, which lets the connection of a session be recorded too;
+        record one session at a time then, as the records of sessions
+        running at once would be interleaved.
+    """
+
+    def __init__(self, path, channel=None):
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._channel = channel
+
+        for event in _KINDS:
+            if channel is None:
+                Channel.hooks.add(event, self._record)
+            else:
+                channel.add_hook(event, self._record)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _record(self, channel, event, text=None, data=None, **ignored):
+        payload = text if event == hooks.SEND else data
+        if payload is None:
+            payload = b''
+        elif isinstance(payload, str):
+            payload = payload.encode('utf8')
+        header = RECORD.pack(time.monotonic() - self._started,
+                             _KINDS[event], len(payload))
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(header + payload)
+
+    def close(self):
+        """Stops recording and closes the file."""
+        if self._file.closed:
+            return
+        for event in _KINDS:
+            if self._channel is None:
+                Channel.hooks.remove(event, self._record)
+            else:
+                self._channel.remove_hook(event, self._record)
+        with self._lock:
+            self._file.close()
+
+
+def read_recording(path):
+    """
+    Reads a recording written by :class:`Recorder`.
+
+    :param path: the recording file.
+    :return: a list of ``(seconds, kind, payload)`` tuples, where kind is
+        one of :const:`CONNECT`, :const:`SENT`, :const:`RECEIVED` and
+        :const:`CLOSED`, and payload is bytes.
+    :raises ValueError: if the file is not a recording.
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    if not content.startswith(MAGIC):
+        raise ValueError("%s is not a session recording" % path)
+
+    records = []
+    offset = len(MAGIC)
+    while offset + RECORD.size <= len(content):
+        seconds, kind, length = RECORD.unpack_from(content, offset)
+        offset += RECORD.size
+        records.append((seconds, kind, content[offset:offset + length]))
+        offset += length
+    return records
+
+
+class ReplayChannel(Channel):
+    """
+    Channel playing back a session recorded by :class:`Recorder`.
+
+    Give it to a CLI as its ``channel_class`` to run the CLI against a
+    recording instead of a device, for testing prompt handling and
+    parsing, or measuring the CLI layer alone::
+
+        cli = RVBD_CLI(hostname='sh1', channel_class=ReplayChannel,
+                       recording='show_version.rec')
+
+    Every :meth:`send` moves the replay to the matching send of the
+    recording, after which the output that followed it can be received.
+    Output is matched exactly as :class:`SSHChannel` matches it.
+
+    :param recording: path of the recording, or records as returned by
+        :func:`read_recording`.
+    :param speed: None to replay as fast as possible, or a pace relative to
+        the recording, such as 1 to deliver output with its original
+        timing or 10 to go ten times as fast.
+    :param strict: if True, raise :class:`exceptions.ReplayMismatch` when
+        sending anything other than the recording did.  If False, anything
+        sent stands for the next send of the recording.
+    :param kwargs: other parameters are ignored, for compatibility with
+        other channel construction interfaces.
+    """
+
+    BASH_PROMPT = r'\[\S+ \S+\]#\s*$'
+
+    def __init__(self, recording, speed=None, strict=True, **kwargs):
+        if isinstance(recording, str):
+            recording = read_recording(recording)
+        self._records = recording
+        self._speed = speed
+        self._strict = strict
+
+        # Index of the next record to replay.
+        self._next = 0
+        # Recorded and actual time that pacing is relative to.
+        self._anchor = None
+        self._started = False
+        self._closed = False
+
+    def _pace(self, seconds):
+        # Waits until a record made at the given time is due.
+        if self._speed is None:
+            return
+        recorded, actual = self._anchor
+        delay = actual + (seconds - recorded) / self._speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _set_anchor(self, seconds):
+        self._anchor = (seconds, time.monotonic())
+
+    def start(self, match_res=None, timeout=60):
+        """
+        Starts replaying, from the first connection in the recording.
+
+        :param match_res: Pattern(s) of prompts to look for.
+        :param timeout: passed to :meth:`expect`.
+        :return: Python :class:`re.MatchObject` containing data on what
+            was matched.
+        """
+        if not match_res:
+            match_res = [self.BASH_PROMPT]
+        elif not isinstance(match_res, (list, tuple)):
+            match_res = [match_res, ]
+        else:
+            match_res = list(match_res)
+
+        seconds = self._records[0][0] if self._records else 0
+        for index, (recorded, kind, payload) in enumerate(self._records):
+            if kind == CONNECT:
+                self._next = index + 1
+                seconds = recorded
+                break
+        self._set_anchor(seconds)
+        self._started = True
+        self._closed = False
+        self._fire(hooks.CONNECT)
+        return self.expect(match_res, timeout)[1]
+
+    def close(self):
+        if self._started and not self._closed:
+            self._fire(hooks.CLOSE)
+        self._closed = True
+
+    def footprint(self):
+        """
+        Returns the memory held by the recording being replayed.
+
+        :return: a :class:`steelscript.cmdline.footprint.Footprint`
+        """
+        footprint = super(ReplayChannel, self).footprint()
+        footprint.held['recording'] = sizeof(self._records)
+        return footprint
+
+    def _verify_connected(self):
+        if not self._started or self._closed:
+            raise exceptions.ConnectionError(
+                context='Replay channel is not started')
+
+    def _next_received(self):
+        # Returns the next received chunk before the next send, or None.
+        while self._next < len(self._records):
+            seconds, kind, payload = self._records[self._next]
+            if kind == SENT:
+                return None
+            self._next += 1
+            if kind == RECEIVED:
+                self._pace(seconds)
+                return payload
+        return None
+
+    def receive_all(self):
+        """
+        Returns the recorded output up to the next send.
+
+        :return: the text received.
+        """
+        self._verify_connected()
+        chunks = []
+        while True:
+            chunk = self._next_received()
+            if chunk is None:
+                break
+            self._fire(hooks.RECEIVE, data=chunk)
+            chunks.append(chunk)
+        return b''.join(chunks).decode()
+
+    def send(self, text_to_send):
+        """
+        Moves the replay past the recorded send of this text.
+
+        :param text_to_send: Text to send.
+        :raises ReplayMismatch: if strict and the recording sent something
+            else.
+        """
+        self._verify_connected()
+        self._fire(hooks.SEND, text=text_to_send)
+
+        # Output the session did not wait for is skipped.
+        while (self._next < len(self._records) and
+               self._records[self._next][1] != SENT):
+            self._next += 1
+        if self._next == len(self._records):
+            if self._strict:
+                raise exceptions.ReplayMismatch(text_to_send)
+            return
+
+        seconds, kind, payload = self._records[self._next]
+        expected = payload.decode('utf8')
+        if self._strict and expected != text_to_send:
+            raise exceptions.ReplayMismatch(text_to_send, expected)
+        self._next += 1
+        self._set_anchor(seconds)
+
+    def expect(self, match_res, timeout=60):
+        """
+        Matches the recorded output following the last send.
+
+        :param match_res: Pattern(s) to look for to be considered successful.
+        :param timeout: maximum time, in seconds, to wait for a match, or a
+            :class:`steelscript.cmdline.deadline.Deadline`.  Only matters
+            when replaying with pacing.
+
+        :return: ``(output, match_object)``, as for
+            :meth:`steelscript.cmdline.sshchannel.SSHChannel.expect`.
+
+        :raises CmdlineTimeout: if the recorded output does not match, as
+            the recorded session would then have waited forever, or if it
+            would arrive too late.
+        """
+        match_res, safe_match_text = self._expect_init(match_res)
+        expect_deadline = deadline.Deadline.coerce(timeout)
+        received_data = ''
+        next_line_start = 0
+
+        while True:
+            new_data = self._next_received()
+            if new_data is None or expect_deadline.expired():
+                timeout = expect_deadline.timeout or 0
+                self._fire(hooks.TIMEOUT, timeout=timeout,
+                           failed_match=match_res)
+                raise exceptions.CmdlineTimeout(
+                    command=None,
+                    output=repr(self.safe_line_feeds(received_data)),
+                    timeout=timeout,
+                    failed_match=match_res)
+            self._fire(hooks.RECEIVE, data=new_data)
+
+            received_data, new_lines = self._process_data(
+                new_data, received_data, next_line_start)
+            output, match = self._match_lines(
+                received_data, next_line_start, new_lines, match_res)
+            if (output, match) != (None, None):
+                self._fire(hooks.MATCH, output=output, match=match)
+                return output, match
+            next_line_start = received_data.rfind('\n') + 1
@@ -0,0 +1,244 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Retry policies and circuit breakers for (re)connecting to devices.
+
+
+import copy
+import time
+import random
+import socket
+import logging
+import threading
+import contextlib
+
+from steelscript.cmdline import exceptions
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with jitter, for retrying connection attempts.
+
+    The delay before retry ``n`` (counting from 0) is
+    ``min(max_delay, base_delay * multiplier ** n)``, reduced by a random
+    fraction of up to ``jitter`` so that many clients failing at the same
+    moment do not all retry at the same moment.
+
+    :param max_attempts: total number of attempts, including the first.
+        None to keep trying until ``max_elapsed`` is reached.
+    :param base_delay: seconds to wait before the first retry
+    :param max_delay: upper bound on the wait between attempts
+    :param multiplier: growth factor of the wait between attempts
+    :param jitter: fraction (0 to 1) of each wait that is randomized.
+        0 disables jitter, 1 is "full jitter".
+    :param max_elapsed: give up rather than wait past this many seconds
+        since the first attempt.  None for no limit.
+    :param retry_on: exception types that trigger a retry.  Anything else
+        is raised immediately, as is :class:`CircuitOpen`.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=1, max_delay=30,
+                 multiplier=2, jitter=1.0, max_elapsed=None,
+                 retry_on=(exceptions.ConnectionError, socket.error)):
+        if max_attempts is None and max_elapsed is None:
+            raise TypeError("One of max_attempts or max_elapsed is required")
+        if max_attempts is not None and max_attempts < 1:
+            raise ValueError("max_attempts should be at least 1")
+        if not 0 <= jitter <= 1:
+            raise ValueError("jitter should be between 0 and 1")
+
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.max_elapsed = max_elapsed
+        self.retry_on = retry_on
+
+    def limited_to(self, max_elapsed):
+        """
+        Returns a copy of this policy that gives up after ``max_elapsed``.
+
+        :param max_elapsed: seconds, or None to return this policy as is.
+        """
+        if max_elapsed is None:
+            return self
+        policy = copy.copy(self)
+        if policy.max_elapsed is None or max_elapsed < policy.max_elapsed:
+            policy.max_elapsed = max_elapsed
+        return policy
+
+    def delays(self):
+        """
+        Generates the wait before each retry.
+
+        :return: an iterator yielding one delay, in seconds, per retry.
+        """
+        retry = 0
+        while self.max_attempts is None or retry < self.max_attempts - 1:
+            delay = min(self.max_delay,
+                        self.base_delay * self.multiplier ** retry)
+            yield delay * (1 - self.jitter * random.random())
+            retry += 1
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls ``func(*args, **kwargs)``, retrying as the policy allows.
+
+        :return: the return value of ``func``.
+        :raises: the last exception raised by ``func`` once the policy
+            gives up.
+        """
+        start = time.time()
+        delays = self.delays()
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except exceptions.CircuitOpen:
+                raise
+            except self.retry_on as e:
+                delay = next(delays, None)
+                if delay is None:
+                    raise
+                if (self.max_elapsed is not None and
+                        time.time() - start + delay > self.max_elapsed):
+                    raise
+                logging.info("Attempt failed (%s), retrying in %.1f "
+                             "seconds" % (e, delay))
+                time.sleep(delay)
+
+
+class CircuitBreaker(object):
+    """
+    Fails fast on calls to a host that is known to be down.
+
+    After ``failure_threshold`` consecutive failures the circuit opens
+    and calls are refused with :class:`CircuitOpen` without touching the
+    network.  Once ``reset_timeout`` seconds have passed a single trial
+    call is let through: if it succeeds the circuit closes again,
+    otherwise it stays open for another ``reset_timeout``.
+
+    :param name: name of the protected resource, for messages
+    :param failure_threshold: consecutive failures before opening
+    :param reset_timeout: seconds to stay open before a trial call
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        """The current state: CLOSED, OPEN or HALF_OPEN."""
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.time() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def check(self):
+        """
+        Claims permission to make a call.
+
+        :raises CircuitOpen: if the circuit is open, or half-open with a
+            trial call already in progress.
+        """
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+            retry_in = self._opened_at + self.reset_timeout - time.time()
+        raise exceptions.CircuitOpen(self.name, max(retry_in, 0))
+
+    def record_success(self):
+        """Closes the circuit."""
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        """Counts a failure, opening the circuit if over the threshold."""
+        with self._lock:
+            self._failures += 1
+            if (self._trial_running or
+                    self._failures >= self.failure_threshold):
+                if self._opened_at is None or self._trial_running:
+                    logging.warning("Circuit for %s opened after %d "
+                                    "failures" % (self.name, self._failures))
+                self._opened_at = time.time()
+            self._trial_running = False
+
+    @contextlib.contextmanager
+    def guard(self, failures=(exceptions.ConnectionError, socket.error)):
+        """
+        Context manager wrapping one call through the breaker.
+
+        :param failures: exception types that count as a failure.
+        :raises CircuitOpen: if the call is not allowed.
+        """
+        self.check()
+        try:
+            yield
+        except failures:
+            self.record_failure()
+            raise
+        except BaseException:
+            # Not the host's fault; let another trial through.
+            with self._lock:
+                self._trial_running = False
+            raise
+        self.record_success()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(host, port=None, **kwargs):
+    """
+    Returns the process-wide circuit breaker for a port of a host.
+
+    Each port has its own breaker, since a device may serve SSH while
+    its telnet or console port is down.
+
+    :param host: hostname or address the breaker protects
+    :param port: port the breaker protects, or None for the host as a
+        whole
+    :param kwargs: passed to :class:`CircuitBreaker` if the breaker
+        does not exist yet, and ignored otherwise.
+    """
+    key = (host, port)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            name = host if port is None else '%s:%s' % (host, port)
+            breaker = CircuitBreaker(name, **kwargs)
+            _breakers[key] = breaker
+        return breaker
+
+
+def reset_breakers():
+    """Forgets all process-wide circuit breakers, closing their circuits."""
+    with _breakers_lock:
+        _breakers.clear()
@@ -0,0 +1,242 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Bulk file transfer over an SSHProcess transport using SFTP.
+
+
+import os
+import logging
+import functools
+import contextlib
+from concurrent import futures
+
+import paramiko
+
+from steelscript.cmdline import exceptions
+
+# Size of each read()/write() issued against the remote file.  Paramiko
+# splits requests larger than its MAX_REQUEST_SIZE, so there is no benefit
+# in going bigger.
+DEFAULT_CHUNK_SIZE = 32768
+
+# Maximum number of read requests kept in flight per file while prefetching.
+DEFAULT_MAX_REQUESTS = 64
+
+# Number of files transferred concurrently by get_many().
+DEFAULT_MAX_WORKERS = 4
+
+
+class SFTPTransfer(object):
+    """
+    Pipelined SFTP file transfer on top of an :class:`SSHProcess`.
+
+    Reads are prefetched so that many requests are in flight at once, and
+    writes are pipelined so that the client does not wait for an
+    acknowledgement after every chunk.  This hides the round trip latency
+    that dominates naive transfers over WAN links.
+
+    :param sshprocess: a connected
+        :class:`steelscript.cmdline.sshprocess.SSHProcess`
+    :param chunk_size: bytes per read or write request
+    :param max_requests: maximum read requests in flight per file
+    """
+
+    def __init__(self, sshprocess, chunk_size=DEFAULT_CHUNK_SIZE,
+                 max_requests=DEFAULT_MAX_REQUESTS):
+        self._sshprocess = sshprocess
+        self._chunk_size = chunk_size
+        self._max_requests = max_requests
+        self._log = logging.getLogger(__name__)
+
+    @contextlib.contextmanager
+    def _client(self):
+        try:
+            sftp = self._sshprocess.open_sftp()
+        except paramiko.SSHException as e:
+            raise exceptions.ConnectionError(
+                cause=e, context='Failed to open SFTP session')
+        try:
+            yield sftp
+        except paramiko.SSHException as e:
+            raise exceptions.ConnectionError(
+                cause=e, context='SFTP transfer failed')
+        finally:
+            sftp.close()
+
+    def get(self, remotepath, localpath, callback=None, resume=False):
+        """
+        Copies a remote file to the local host.
+
+        :param remotepath: path of the file on the remote host
+        :param localpath: destination path on the local host
+        :param callback: optional callable invoked as
+            ``callback(bytes_transferred, bytes_total)`` after each chunk
+        :param resume: if True and ``localpath`` already holds a prefix of
+            the remote file, only the remaining bytes are transferred.
+
+        :return: the size of the file in bytes.
+
+        :raises ConnectionError: if the SFTP session fails.
+        :raises IOError: if either file cannot be accessed.
+        """
+        with self._client() as sftp:
+            return self._get(sftp, remotepath, localpath, callback, resume)
+
+    def put(self, localpath, remotepath, callback=None, resume=False):
+        """
+        Copies a local file to the remote host.
+
+        :param localpath: path of the file on the local host
+        :param remotepath: destination path on the remote host
+        :param callback: optional callable invoked as
+            ``callback(bytes_transferred, bytes_total)`` after each chunk
+        :param resume: if True and ``remotepath`` already holds a prefix of
+            the local file, only the remaining bytes are transferred.
+
+        :return: the size of the file in bytes.
+
+        :raises ConnectionError: if the SFTP session fails.
+        :raises IOError: if either file cannot be accessed.
+        """
+        with self._client() as sftp:
+            return self._put(sftp, localpath, remotepath, callback, resume)
+
+    def get_many(self, files, callback=None, resume=False,
+                 max_workers=DEFAULT_MAX_WORKERS):
+        """
+        Copies several remote files to the local host in parallel.
+
+        Each worker uses its own SFTP session multiplexed over the single
+        SSH transport, so no additional logins are made.
+
+        :param files: a dict mapping remote paths to local paths, or an
+            iterable of ``(remotepath, localpath)`` pairs.
+        :param callback: optional callable invoked as
+            ``callback(remotepath, bytes_transferred, bytes_total)``
+        :param resume: as for :meth:`get`
+        :param max_workers: number of files to transfer concurrently
+
+        :return: dict mapping each remote path to its size in bytes.
+
+        :raises ConnectionError: if any SFTP session fails.
+        :raises IOError: if any file cannot be accessed.  The remaining
+            transfers are allowed to finish before the error is raised.
+        """
+        if isinstance(files, dict):
+            files = list(files.items())
+        else:
+            files = list(files)
+
+        def transfer(remotepath, localpath):
+            file_callback = None
+            if callback is not None:
+                file_callback = functools.partial(callback, remotepath)
+            return self.get(remotepath, localpath, callback=file_callback,
+                            resume=resume)
+
+        results = {}
+        error = None
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = dict((pool.submit(transfer, remote, local), remote)
+                           for remote, local in files)
+            for future in futures.as_completed(pending):
+                remotepath = pending[future]
+                try:
+                    results[remotepath] = future.result()
+                except Exception as e:
+                    self._log.error('Failed to transfer "%s": %s',
+                                    remotepath, e)
+                    if error is None:
+                        error = e
+        if error is not None:
+            raise error
+        return results
+
+    def _get(self, sftp, remotepath, localpath, callback, resume):
+        total = sftp.stat(remotepath).st_size
+        offset = self._resume_offset(
+            resume, total, functools.partial(os.path.getsize, localpath),
+            functools.partial(sftp.open, remotepath, 'rb'),
+            functools.partial(open, localpath, 'rb'))
+        self._log.debug('Getting "%s" (%d bytes, starting at %d)',
+                        remotepath, total, offset)
+
+        with sftp.open(remotepath, 'rb') as remote_file, \
+                open(localpath, 'ab' if offset else 'wb') as local_file:
+            remote_file.seek(offset)
+            remote_file.prefetch(total, self._max_requests)
+            transferred = offset
+            while transferred < total:
+                data = remote_file.read(self._chunk_size)
+                if not data:
+                    break
+                local_file.write(data)
+                transferred += len(data)
+                if callback is not None:
+                    callback(transferred, total)
+
+        if transferred != total:
+            raise IOError('Short read from "%s": got %d of %d bytes' %
+                          (remotepath, transferred, total))
+        return total
+
+    def _put(self, sftp, localpath, remotepath, callback, resume):
+        total = os.path.getsize(localpath)
+        offset = self._resume_offset(
+            resume, total, lambda: sftp.stat(remotepath).st_size,
+            functools.partial(open, localpath, 'rb'),
+            functools.partial(sftp.open, remotepath, 'rb'))
+        self._log.debug('Putting "%s" (%d bytes, starting at %d)',
+                        remotepath, total, offset)
+
+        # 'r+' opens without truncating so that we can seek past the part
+        # that was already transferred.
+        with open(localpath, 'rb') as local_file, \
+                sftp.open(remotepath, 'r+b' if offset else 'wb') \
+                as remote_file:
+            remote_file.set_pipelined(True)
+            local_file.seek(offset)
+            remote_file.seek(offset)
+            transferred = offset
+            while True:
+                data = local_file.read(self._chunk_size)
+                if not data:
+                    break
+                remote_file.write(data)
+                transferred += len(data)
+                if callback is not None:
+                    callback(transferred, total)
+
+        return total
+
+    def _resume_offset(self, resume, total, get_size, open_source,
+                       open_partial):
+        """
+        Work out where a resumed transfer should start.
+
+        The partial file is only resumed if it is a prefix of the source.
+        Rather than reading all of it back, its last chunk is compared with
+        the same range of the source, which catches a source that was
+        replaced or rewritten since.  Otherwise, or if the partial file is
+        larger than the source, the transfer starts over.
+        """
+        if not resume:
+            return 0
+        try:
+            size = get_size()
+            if size == 0 or size > total:
+                return 0
+            start = max(0, size - self._chunk_size)
+            with open_source() as source, open_partial() as partial:
+                source.seek(start)
+                partial.seek(start)
+                if source.read(size - start) != partial.read(size - start):
+                    self._log.debug('Partial file does not match the source, '
+                                    'starting over')
+                    return 0
+        except (IOError, OSError):
+            return 0
+        return size
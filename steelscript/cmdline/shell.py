@@ -8,12 +8,96 @@
 import paramiko
 import logging
 import time
-import select
 import socket
 import traceback
+import zlib
+import lzma
+import collections
 
 from steelscript.cmdline import sshprocess
 from steelscript.cmdline import exceptions
+from steelscript.cmdline import retry
+from steelscript.cmdline import sftp
+from steelscript.cmdline import timeouts
+from steelscript.cmdline import instrumentation
+from steelscript.cmdline import netutils
+
+# Remote compressors usable by Shell.exec_command(compress=...), in order of
+# preference when compress=True.  Each command compresses stdin to stdout.
+COMPRESSORS = collections.OrderedDict([
+    ('gzip', 'gzip -c'),
+    ('xz', 'xz -c -1'),
+])
+
+# Leading bytes of the output of each compressor.
+COMPRESSOR_MAGIC = {
+    'gzip': b'\x1f\x8b',
+    'xz': b'\xfd7zXZ\x00',
+}
+
+# Runs a command with its output piped through a compressor, while still
+# exiting with the status of the command rather than of the compressor.
+# This is the portable form of bash's ${PIPESTATUS[0]}: the status is
+# smuggled out on fd 3 to a subshell that exits with it.
+COMPRESS_WRAPPER = ('{ { { ( %s ) 2>&1; echo $? >&3; } | %s >&4; } 3>&1 | '
+                    '(read status; exit $status); } 4>&1')
+
+
+class _Decompressor(object):
+    """
+    Incrementally decompresses the output of a wrapped remote command.
+
+    If the output turns out not to be compressed (for instance because
+    the remote shell mangled the wrapper), it is passed through unchanged.
+
+    :param name: key in :const:`COMPRESSORS`
+    """
+
+    def __init__(self, name):
+        self._magic = COMPRESSOR_MAGIC[name]
+        if name == 'gzip':
+            # 16 + MAX_WBITS selects the gzip container format.
+            self._engine = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._engine = lzma.LZMADecompressor()
+        self._head = b''
+        self._compressed = None
+
+    def feed(self, data):
+        """
+        Decompresses the next chunk of output.
+
+        :return: whatever plain output is available so far, as bytes.
+        """
+        if self._compressed is None:
+            # Hold data back until we can check the magic number.
+            self._head += data
+            if (len(self._head) < len(self._magic) and
+                    self._magic.startswith(self._head)):
+                return b''
+            self._compressed = self._head.startswith(self._magic)
+            if not self._compressed:
+                logging.debug('Remote output is not compressed, '
+                              'passing it through')
+            data, self._head = self._head, b''
+
+        if self._compressed:
+            return self._engine.decompress(data)
+        return data
+
+    def finish(self):
+        """
+        Flushes any output still buffered.
+
+        :return: remaining plain output, as bytes.
+        """
+        if self._compressed is None:
+            # Too short to hold a magic number, so it cannot be compressed.
+            self._compressed = False
+            return self._head
+        if self._compressed and hasattr(self._engine, 'flush'):
+            return self._engine.flush()
+        return b''
 
 
 class Shell(object):
@@ -27,9 +111,34 @@ class Shell(object):
     :param host: host/ip to ssh into
     :param user: username to log in with
     :param password: password to log in with
+    :param private_key_path: path to a private key file to log in with,
+        taking precedence over the password.  Each file is only parsed once
+        per process.
+    :param private_key_passphrase: passphrase of an encrypted key file
+    :param use_agent: if True, log in with the keys of the running SSH
+        agent when no private key is given, before trying the password
+    :param rate_limiter: :class:`steelscript.cmdline.ratelimit.TokenBucket`
+        limiting the commands run per second.  None for no limit.
+    :param governor:
+        :class:`steelscript.cmdline.ratelimit.ConcurrencyGovernor` that
+        must grant a slot for each command while it runs.
+    :param timeout_model: :class:`steelscript.cmdline.timeouts.TimeoutModel`
+        choosing the timeout of commands run without one, and learning
+        from every command run.
+    :param instrumentation:
+        :class:`steelscript.cmdline.instrumentation.Instrumentation`
+        recording where the time of each command goes.
+    :param retry_policy: :class:`steelscript.cmdline.retry.RetryPolicy`
+        used to reconnect when the connection is lost.  If not given, one
+        is built from the ``retry_count`` and ``retry_delay`` arguments of
+        :meth:`exec_command`.
+    :param port: port to connect to.  Default is 22.
     """
 
-    def __init__(self, host, user='root', password=''):
+    def __init__(self, host, user='root', password='', retry_policy=None,
+                 private_key_path=None, private_key_passphrase=None,
+                 use_agent=False, rate_limiter=None, governor=None,
+                 timeout_model=None, instrumentation=None, port=22):
         # Hostname shell connects to
         self._host = host
 
@@ -41,12 +150,29 @@ class Shell(object):
 
         # Initialize underlying sshprocess, but do not connect automatically.
         # http://www.lag.net/paramiko/docs/
-        self.sshprocess = sshprocess.SSHProcess(host=host, user=user,
-                                                password=password)
-
-    def exec_command(self, command, timeout=60, output_expected=None,
-                     error_expected=False, exit_info=None, retry_count=3,
-                     retry_delay=5,
+        self.sshprocess = sshprocess.SSHProcess(
+            host=host, user=user, password=password,
+            private_key_path=private_key_path,
+            private_key_passphrase=private_key_passphrase,
+            use_agent=use_agent, port=port)
+
+        self._retry_policy = retry_policy
+        self._rate_limiter = rate_limiter
+        self._governor = governor
+        self._timeout_model = timeout_model
+        self._instrumentation = instrumentation
+        # When output was last received, for timing its processing.
+        self._received_at = None
+
+        # Compressors found on the remote host, probed on first use.
+        self._compressors = None
+
+    @instrumentation.instrumented
+    @timeouts.learned_timeout
+    def exec_command(self, command, timeout=timeouts.DEFAULT,
+                     output_expected=None, error_expected=False,
+                     exit_info=None, retry_count=3,
+                     retry_delay=5, compress=False,
                      # Deprecated parameters. Remove for SteelScript.
                      expect_output=None, expect_error=None):
         """Executes the given command statelessly.
@@ -58,7 +184,9 @@ class Shell(object):
         the presence of output or errors.
 
         :param command: command to send
-        :param timeout: seconds to wait for command to finish. None to disable
+        :param timeout: seconds to wait for command to finish. None to disable.
+            Defaults to the timeout learned by the shell's ``timeout_model``
+            if it has one, and to 60 otherwise.
         :param output_expected: If not None, indicates whether output is
             expected (True) or no output is expected (False).
             If the opposite occurs, raise UnexpectedOutput. Default is None.
@@ -76,9 +204,16 @@ class Shell(object):
         :param retry_count: the number of tries to reconnect if underlying
             connection is disconnected. Default is 3
         :type retry_count: int
-        :param retry_delay: delay in seconds between each retry to connect.
-            Default is 5
+        :param retry_delay: delay in seconds before the first retry to
+            connect.  Later retries back off exponentially.  Default is 5
         :type retry_delay: int
+        :param compress: If set, the output is compressed on the remote
+            host and decompressed locally as it arrives, which saves
+            bandwidth for large text output on slow links.  Use True to
+            pick the best compressor the host has, or a key of
+            :const:`COMPRESSORS` to choose one.  If no compressor is
+            available the command is run normally.  Default is False.
+        :type compress: bool or string
 
         :return: output from the command
 
@@ -95,11 +230,23 @@ class Shell(object):
         if (not self.sshprocess.is_connected()):
             self.sshprocess.connect()
 
+        remote_command = command
+        decompressor = None
+        if compress:
+            compressor = self._remote_compressor(compress, timeout,
+                                                 retry_count, retry_delay)
+            if compressor is not None:
+                remote_command = COMPRESS_WRAPPER % (command,
+                                                     COMPRESSORS[compressor])
+                decompressor = _Decompressor(compressor)
+
         output, exit_status = self._exec_paramiko_command(
-            command,
+            remote_command,
             timeout=timeout,
             retry_count=retry_count,
-            retry_delay=retry_delay)
+            retry_delay=retry_delay,
+            decompressor=decompressor,
+            recorded_as=command)
 
         if isinstance(exit_info, dict):
             exit_info['status'] = exit_status
@@ -116,8 +263,153 @@ class Shell(object):
                                               expected_output=output_expected)
         return output
 
+    def get(self, remotepath, localpath, callback=None, resume=False):
+        """
+        Copies a remote file to the local host over SFTP.
+
+        :param remotepath: path of the file on the remote host
+        :param localpath: destination path on the local host
+        :param callback: optional callable invoked as
+            ``callback(bytes_transferred, bytes_total)`` as data arrives
+        :param resume: if True, continue a previously interrupted transfer
+            into ``localpath`` instead of starting over.
+
+        :return: the size of the file in bytes.
+
+        :raises ConnectionError: if the connection is lost
+        :raises IOError: if either file cannot be accessed
+        """
+        return self._sftp().get(remotepath, localpath, callback=callback,
+                                resume=resume)
+
+    def put(self, localpath, remotepath, callback=None, resume=False):
+        """
+        Copies a local file to the remote host over SFTP.
+
+        :param localpath: path of the file on the local host
+        :param remotepath: destination path on the remote host
+        :param callback: optional callable invoked as
+            ``callback(bytes_transferred, bytes_total)`` as data is sent
+        :param resume: if True, continue a previously interrupted transfer
+            into ``remotepath`` instead of starting over.
+
+        :return: the size of the file in bytes.
+
+        :raises ConnectionError: if the connection is lost
+        :raises IOError: if either file cannot be accessed
+        """
+        return self._sftp().put(localpath, remotepath, callback=callback,
+                                resume=resume)
+
+    def get_many(self, files, callback=None, resume=False,
+                 max_workers=sftp.DEFAULT_MAX_WORKERS):
+        """
+        Copies several remote files to the local host in parallel.
+
+        All transfers share the existing SSH connection.
+
+        :param files: a dict mapping remote paths to local paths, or an
+            iterable of ``(remotepath, localpath)`` pairs.
+        :param callback: optional callable invoked as
+            ``callback(remotepath, bytes_transferred, bytes_total)``
+        :param resume: if True, continue previously interrupted transfers.
+        :param max_workers: number of files to transfer concurrently
+
+        :return: dict mapping each remote path to its size in bytes.
+
+        :raises ConnectionError: if the connection is lost
+        :raises IOError: if any file cannot be accessed
+        """
+        return self._sftp().get_many(files, callback=callback, resume=resume,
+                                     max_workers=max_workers)
+
+    def _sftp(self):
+        # connect if ssh is not connected
+        if (not self.sshprocess.is_connected()):
+            self.sshprocess.connect()
+        return sftp.SFTPTransfer(self.sshprocess)
+
+    def _remote_compressor(self, compress, timeout, retry_count,
+                           retry_delay):
+        """
+        Picks the remote compressor to use for exec_command.
+
+        The remote host is probed once for the available compressors and
+        the result is remembered for the lifetime of this object.
+
+        :param compress: True for the preferred available compressor,
+            or a key of :const:`COMPRESSORS`.
+
+        :return: a key of :const:`COMPRESSORS`, or None if the requested
+            compressor is not available.
+        :raises ValueError: if compress names an unknown compressor.
+        """
+        if compress is True:
+            wanted = list(COMPRESSORS)
+        elif compress in COMPRESSORS:
+            wanted = [compress]
+        else:
+            raise ValueError("compress should be True or one of %s" %
+                             ', '.join(COMPRESSORS))
+
+        if self._compressors is None:
+            # 'command -v' prints the path of each tool that exists and
+            # nothing for one that is missing.  Its exit status varies
+            # between shells and need not flag a missing tool, so it is
+            # ignored: a compressor is available only if it is printed.
+            output, exit_status = self._exec_paramiko_command(
+                'command -v %s' % ' '.join(COMPRESSORS),
+                timeout=timeout,
+                retry_count=retry_count,
+                retry_delay=retry_delay)
+            found = set(line.strip().rsplit('/', 1)[-1]
+                        for line in output.splitlines())
+            self._compressors = [name for name in COMPRESSORS
+                                 if name in found]
+            logging.debug('Compressors on %s: %s' %
+                          (self._host, self._compressors))
+
+        for name in wanted:
+            if name in self._compressors:
+                return name
+        logging.info('No compressor available on %s, not compressing' %
+                     self._host)
+        return None
+
     def _exec_paramiko_command(self, command, timeout, retry_count,
-                               retry_delay):
+                               retry_delay, decompressor=None,
+                               recorded_as=None):
+        # recorded_as is the command that the timeout model records the
+        # run as, if any; waits for the rate limiter and governor are not
+        # part of it.
+        if self._rate_limiter is not None:
+            self._rate_limiter.acquire(timeout=timeout or None)
+        if self._governor is None:
+            return self._exec_recorded(command, timeout, retry_count,
+                                       retry_delay, decompressor, recorded_as)
+        with self._governor.slot(self._host, timeout=timeout or None):
+            return self._exec_recorded(command, timeout, retry_count,
+                                       retry_delay, decompressor, recorded_as)
+
+    def _exec_recorded(self, command, timeout, retry_count, retry_delay,
+                       decompressor, recorded_as):
+        if recorded_as is None:
+            return self._exec_paramiko_channel(
+                command, timeout, retry_count, retry_delay, decompressor)
+        with timeouts.recording(self, recorded_as, timeout):
+            return self._exec_paramiko_channel(
+                command, timeout, retry_count, retry_delay, decompressor)
+
+    def _observe_phase(self, name, started):
+        # Records the time since started as a phase of the command.
+        if self._instrumentation is not None:
+            self._instrumentation.observe(
+                'cmdline_phase_seconds', time.monotonic() - started,
+                session=type(self).__name__, phase=name)
+
+    def _exec_paramiko_channel(self, command, timeout, retry_count,
+                               retry_delay, decompressor):
+        phase_start = time.monotonic()
         try:
             channel = self.sshprocess.transport.open_session()
         except socket.error:
@@ -152,38 +444,45 @@ class Shell(object):
                 logging.debug(
                     'Ignore Paramiko SSHException due to 1.7.5 bug')
 
+        self._observe_phase('send', phase_start)
+        phase_start = time.monotonic()
+        if self._instrumentation is None:
+            stats = instrumentation.NO_RECEIVE_STATS
+        else:
+            stats = self._instrumentation.receive_stats(
+                channel=type(self).__name__)
+
         chan_closed = False
-        output = ""
+        output = []
 
         # Read until we time out or the channel closes
         while not chan_closed:
 
-            # Use select to check whether channel is ready for read.
-            # Reading on the channel directly would block until data is
-            # ready, where select blocks at most 10 seconds which allows
-            # us to check whether the specified timeout has been reached.
-            # If channel is not ready for reading within 10 seconds,
-            # select returns an empty list to 'readers'.
-            (readers, w, x) = select.select([channel], [], [], 10)
+            # Check whether channel is ready for read.  Reading on the
+            # channel directly would block until data is ready, where this
+            # waits at most 10 seconds which allows us to check whether the
+            # specified timeout has been reached.
+            readable = netutils.wait_readable(channel, 10)
 
             # Timeout if this is taking too long.
             if timeout and ((time.time() - starttime) > timeout):
                 raise exceptions.CmdlineTimeout(command=command,
                                                 timeout=timeout)
 
-            # If the reader-ready list isn't empty, then read.  We know it must
-            # be channel here, since thats all we're waiting on.
-            if len(readers) > 0:
+            if readable:
                 data = channel.recv(4096)
+                stats.received(len(data))
 
                 # If we get no data back, the channel has closed.
                 if len(data) > 0:
-                    output += data
+                    if decompressor is not None:
+                        data = decompressor.feed(data)
+                    output.append(data)
                 else:
                     chan_closed = True
 
             elif channel.exit_status_ready():
-                # If no readers were available, see if the
+                # If the channel was not readable, see if the
                 # exit status is ready - if so, the channel must be closed.
                 # exit_status_ready can return true before we've read all the
                 # data.  Problem is, I know I've seen it return true when there
@@ -204,6 +503,17 @@ class Shell(object):
         exit_status = channel.recv_exit_status()
         channel.close()
 
+        self._observe_phase('wait', phase_start)
+        stats.finished()
+        if self._instrumentation is not None:
+            self._received_at = time.monotonic()
+
+        if decompressor is not None:
+            output.append(decompressor.finish())
+        # Commands such as cat can print bytes that are not UTF-8, which
+        # should not lose the rest of the output.
+        output = b''.join(output).decode('utf8', errors='replace')
+
         return output, exit_status
 
     def _reconnect(self, retry_count, retry_delay):
@@ -212,13 +522,18 @@ class Shell(object):
         if not isinstance(retry_delay, int) or retry_delay < 1:
             raise TypeError("retry_delay should be positive int")
 
-        for count in range(retry_count):
-            try:
-                self.sshprocess.connect()
-                return
-            except exceptions.ConnectionError:
-                logging.info("sleep %d second and retry..." % retry_delay)
-                time.sleep(retry_delay)
-
-        raise exceptions.ConnectionError("Failed to connect after "
-                                         "%d retries" % retry_count)
+        policy = self._retry_policy
+        if policy is None:
+            # Without jitter, so that attempts are never closer together
+            # than retry_delay, which callers use to wait out reboots.
+            policy = retry.RetryPolicy(max_attempts=retry_count,
+                                       base_delay=retry_delay,
+                                       max_delay=retry_delay * 8, jitter=0)
+        try:
+            policy.call(self.sshprocess.connect)
+        except exceptions.CircuitOpen:
+            raise
+        except exceptions.ConnectionError as e:
+            raise exceptions.ConnectionError(
+                cause=e,
+                context="Failed to connect after %d retries" % retry_count)
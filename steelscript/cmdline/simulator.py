@@ -0,0 +1,988 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Local SSH server simulating the command line of Riverbed, IOS and Vyatta
+# devices, for testing and load testing over a real connection.
+
+
+import os
+import abc
+import time
+import socket
+import logging
+import argparse
+import threading
+
+import paramiko
+
+from steelscript.cmdline import netutils
+
+log = logging.getLogger(__name__)
+
+# Keystrokes handled by the simulated line editor.
+DELETE_LINE = '\x15'
+BACKSPACES = '\x08\x7f'
+
+_host_key = None
+_host_key_lock = threading.Lock()
+
+
+def _default_host_key():
+    # Generated once per process; ECDSA keys are quick to generate.
+    global _host_key
+    with _host_key_lock:
+        if _host_key is None:
+            _host_key = paramiko.ECDSAKey.generate()
+        return _host_key
+
+
+class Personality(object, metaclass=abc.ABCMeta):
+    """
+    The command line of a simulated device.
+
+    A personality is a state machine fed one line of input at a time, which
+    answers with the output of the line and tracks the mode, and so the
+    prompt, of the session.  Subclasses implement :meth:`run`.
+
+    Commands starting with ``show`` answer with the text configured for
+    them, if any, and otherwise with ``output_size`` characters of
+    generated lines.
+
+    :param hostname: name shown in prompts.  Defaults to ``HOSTNAME``.
+    :param username: the user logged in.
+    :param output_size: characters of output of ``show`` commands.
+    :param outputs: dict of commands to the output they should give
+        instead, either text or a number of characters to generate.
+    :param enable_password: if not None, the password that entering
+        enable mode asks for.
+    """
+
+    HOSTNAME = 'sim1'
+
+    # Mode that sessions start in, and the prompt of each mode, formatted
+    # with the host and user names.
+    START_MODE = 'normal'
+    PROMPTS = {}
+
+    SHOW = {}
+
+    def __init__(self, hostname=None, username='admin', output_size=1024,
+                 outputs=None, enable_password=None):
+        self.hostname = hostname or self.HOSTNAME
+        self.username = username
+        self.output_size = output_size
+        self.outputs = dict(self.SHOW)
+        self.outputs.update(outputs or {})
+        self.enable_password = enable_password
+
+        self.mode = self.START_MODE
+        self.paging = True
+        self.closed = False
+        # Whether input is echoed, which it is not while asking for a
+        # password.
+        self.echo = True
+
+        # Mode to enter once the password asked for is given.
+        self._password_for = None
+        self._filler = None
+
+    def banner(self):
+        """Returns the text shown on login, before the first prompt."""
+        return ''
+
+    def prompt(self):
+        """Returns the current prompt."""
+        if self._password_for is not None:
+            return 'Password: '
+        return self.PROMPTS[self.mode].format(host=self.hostname,
+                                              user=self.username)
+
+    def more_prompt(self, first, last):
+        """
+        Returns the prompt shown while paging through output.
+
+        :param first: number of the first line shown, from 1.
+        :param last: number of the last line shown.
+        """
+        return '--More--'
+
+    def handle(self, line):
+        """
+        Runs a line of input.
+
+        :param line: the line, without its terminator.
+        :return: the output, with lines separated by ``\\n``.  Empty if
+            there is none.
+        """
+        if self._password_for is not None:
+            return self._check_password(line)
+        command = line.strip()
+        if not command:
+            return ''
+        return self.run(command)
+
+    @abc.abstractmethod
+    def run(self, command):
+        """
+        Runs a command in the current mode.
+
+        :param command: the command, stripped of surrounding whitespace.
+        :return: the output, as for :meth:`handle`.
+        """
+        pass
+
+    def show(self, command):
+        """Returns the output of a ``show`` command."""
+        output = self.outputs.get(command, self.output_size)
+        if isinstance(output, str):
+            return output.format(host=self.hostname, user=self.username)
+        return self.generate(output)
+
+    def generate(self, size):
+        """
+        Returns generated output.
+
+        :param size: length of the output, in characters.
+        :return: numbered lines of text.
+        """
+        if size == self.output_size:
+            if self._filler is None:
+                self._filler = self._generate(size)
+            return self._filler
+        return self._generate(size)
+
+    @staticmethod
+    def _generate(size):
+        lines = []
+        length = 0
+        number = 0
+        while length < size:
+            number += 1
+            line = '%06d %s' % (number, 'x' * 57)
+            lines.append(line)
+            length += len(line) + 1
+        return '\n'.join(lines)[:size].rstrip('\n')
+
+    def _enter_with_password(self, mode):
+        # Enters a mode, first asking for the enable password if there is
+        # one.
+        if self.enable_password is None:
+            self.mode = mode
+        else:
+            self._password_for = mode
+            self.echo = False
+        return ''
+
+    def _check_password(self, password):
+        mode, self._password_for = self._password_for, None
+        self.echo = True
+        if password == self.enable_password:
+            self.mode = mode
+            return ''
+        return '% Access denied'
+
+
+class RVBDPersonality(Personality):
+    """
+    Command line of a Riverbed appliance, as driven by
+    :class:`steelscript.cmdline.cli.rvbd_cli.RVBD_CLI`.
+
+    Sessions start in normal mode, or in a bash shell if ``login_shell`` is
+    True, as logins as root do.  The CLI is started from the shell with
+    ``/opt/tms/bin/cli`` or ``cli``, and ``_shell`` leaves it for a shell
+    from enable or config mode.  Output longer than the terminal is paged
+    until ``no cli session paging enable`` is run.
+
+    :param login_shell: if True, start sessions in a shell.
+    """
+
+    PROMPTS = {
+        'shell': '[{user}@{host} ~]# ',
+        'normal': '{host} > ',
+        'enable': '{host} # ',
+        'config': '{host} (config) # ',
+    }
+
+    SHOW = {
+        'show version': ('Product name:      rbt_sh\n'
+                         'Product release:   9.0.0\n'
+                         'Build ID:          #0\n'
+                         'Build date:        2019-01-01 00:00:00\n'
+                         'Build arch:        x86_64\n'
+                         'Built by:          simulator\n'
+                         '\n'
+                         'Uptime:            0d 0h 1m 0s\n'
+                         '\n'
+                         'Product model:     CX770\n'
+                         'System memory:     2048 MB used / 6000 MB free '
+                         '/ 8048 MB total\n'
+                         'Number of CPUs:    4\n'
+                         'CPU load averages: 0.01 / 0.02 / 0.00'),
+    }
+
+    CLI_COMMANDS = ('/opt/tms/bin/cli', 'cli')
+    CONFIGURE_COMMANDS = ('configure terminal', 'config terminal', 'conf t')
+
+    def __init__(self, login_shell=False, **kwargs):
+        super(RVBDPersonality, self).__init__(**kwargs)
+        if login_shell:
+            self.mode = 'shell'
+        # The CLI mode that a shell started by _shell returns to.
+        self._shell_from = None
+        self._cli_from_shell = login_shell
+
+    def banner(self):
+        if self.mode == 'shell':
+            return ''
+        return 'Riverbed SteelHead\n'
+
+    def more_prompt(self, first, last):
+        return 'lines %d-%d ' % (first, last)
+
+    def run(self, command):
+        mode = self.mode
+        if mode == 'shell':
+            return self._run_shell(command)
+
+        if command == 'no cli session paging enable':
+            self.paging = False
+            return ''
+        if command == 'cli session paging enable':
+            self.paging = True
+            return ''
+        if command.startswith('show '):
+            return self.show(command)
+        if command == 'exit':
+            if mode == 'config':
+                self.mode = 'enable'
+            elif self._cli_from_shell:
+                self.mode = 'shell'
+            else:
+                self.closed = True
+            return ''
+
+        if mode == 'normal':
+            if command == 'enable':
+                return self._enter_with_password('enable')
+        else:
+            if command == 'enable':
+                return ''
+            if command == 'disable':
+                self.mode = 'normal'
+                return ''
+            if command in self.CONFIGURE_COMMANDS:
+                self.mode = 'config'
+                return ''
+            if command == '_shell':
+                self._shell_from = mode
+                self.mode = 'shell'
+                return ''
+            if mode == 'config':
+                # Configuration is accepted without checking it.
+                return ''
+        return '%% Unrecognized command "%s".\nType "?" for help.' % command
+
+    def _run_shell(self, command):
+        if command in self.CLI_COMMANDS:
+            self.mode = 'normal'
+            return ''
+        if command == 'exit':
+            if self._shell_from is not None:
+                self.mode, self._shell_from = self._shell_from, None
+            else:
+                self.closed = True
+            return ''
+        return '-bash: %s: command not found' % command.split()[0]
+
+
+class IOSPersonality(Personality):
+    """
+    Command line of a Cisco IOS router, as driven by
+    :class:`steelscript.cmdline.cli.ios_cli.IOS_CLI`.
+
+    Interfaces are configured in sub-interface mode, entered with
+    ``interface <name>`` from config mode.  Output longer than the
+    terminal is paged until ``terminal length 0`` is run.
+    """
+
+    # IOS_CLI only recognizes host names with a 't' after any dashes.
+    HOSTNAME = 'sim-tr1'
+
+    PROMPTS = {
+        'normal': '{host}>',
+        'enable': '{host}#',
+        'config': '{host}(config)#',
+        'subif': '{host}(config-subif)#',
+    }
+
+    SHOW = {
+        'show version': ('Cisco IOS Software, Simulated Software, '
+                         'Version 15.0(1)\n'
+                         'Technical Support: http://www.cisco.com/techsupport'
+                         '\n\n'
+                         '{host} uptime is 1 minute\n'
+                         'System image file is "flash:sim.bin"\n\n'
+                         'Configuration register is 0x2102'),
+    }
+
+    CONFIGURE_COMMANDS = ('configure terminal', 'config terminal', 'conf t')
+    CONFIGURE_BANNER = ('Enter configuration commands, one per line.  '
+                        'End with CNTL/Z.')
+
+    def more_prompt(self, first, last):
+        return ' --More-- '
+
+    def run(self, command):
+        mode = self.mode
+        if command.startswith('do show '):
+            command = command[len('do '):]
+        if command.startswith('show '):
+            return self.show(command)
+        if command.startswith('terminal length '):
+            self.paging = command.split()[-1] != '0'
+            return ''
+        if command == 'exit':
+            if mode == 'subif':
+                self.mode = 'config'
+            elif mode == 'config':
+                self.mode = 'enable'
+            else:
+                self.closed = True
+            return ''
+
+        if mode == 'normal':
+            if command == 'enable':
+                return self._enter_with_password('enable')
+        elif mode == 'enable':
+            if command == 'disable':
+                self.mode = 'normal'
+                return ''
+            if command in self.CONFIGURE_COMMANDS:
+                self.mode = 'config'
+                return self.CONFIGURE_BANNER
+        else:
+            if command == 'end':
+                self.mode = 'enable'
+                return ''
+            if command.startswith('interface '):
+                self.mode = 'subif'
+                return ''
+            # Configuration is accepted without checking it.
+            return ''
+        return ("%s^\n%% Invalid input detected at '^' marker." %
+                (' ' * len(self.prompt())))
+
+
+class VyattaPersonality(Personality):
+    """
+    Command line of a Vyatta router, as driven by
+    :class:`steelscript.cmdline.cli.vyatta_cli.VyattaCLI`.
+
+    Config mode is entered with ``configure``, and answers every command
+    with ``[edit]``.  Leaving it with ``exit`` fails while there are
+    changes that were not committed, unless ``exit discard`` is used.
+    Output longer than the terminal is paged until ``set terminal length
+    0`` is run.
+    """
+
+    HOSTNAME = 'vyatta-sim'
+
+    PROMPTS = {
+        'normal': '{user}@{host}:~$ ',
+        'config': '{user}@{host}# ',
+    }
+
+    SHOW = {
+        'show version': ('Version:      VSE6.7R1\n'
+                         'Description:  Simulated Vyatta\n'
+                         'Copyright:    2019 Simulator\n'
+                         'Built by:     simulator\n'
+                         'System type:  x86 64-bit'),
+    }
+
+    EDIT = '[edit]'
+
+    def __init__(self, **kwargs):
+        super(VyattaPersonality, self).__init__(**kwargs)
+        # Whether there are changes that were not committed.
+        self.modified = False
+
+    def banner(self):
+        return 'Welcome to Vyatta\n'
+
+    def prompt(self):
+        prompt = super(VyattaPersonality, self).prompt()
+        if self.mode == 'normal' and self.username == 'root':
+            prompt = prompt.replace(':~$', ':~#')
+        return prompt
+
+    def more_prompt(self, first, last):
+        return ':'
+
+    def run(self, command):
+        if self.mode == 'normal':
+            return self._run_normal(command)
+
+        if command == 'exit discard':
+            self.mode = 'normal'
+            self.modified = False
+            return ''
+        if command == 'exit':
+            if self.modified:
+                return ("Cannot exit: configuration modified.\n"
+                        "Use 'exit discard' to discard the changes and exit.\n"
+                        + self.EDIT)
+            self.mode = 'normal'
+            return ''
+        if command == 'commit':
+            self.modified = False
+        elif command.split()[0] in ('set', 'delete'):
+            self.modified = True
+        elif command.startswith('show '):
+            return self.show(command) + '\n' + self.EDIT
+        elif command != 'show':
+            return 'Invalid command: [%s]\n%s' % (command.split()[0],
+                                                  self.EDIT)
+        return self.EDIT
+
+    def _run_normal(self, command):
+        if command == 'configure':
+            self.mode = 'config'
+            return self.EDIT
+        if command.startswith('set terminal length '):
+            self.paging = command.split()[-1] != '0'
+            return ''
+        if command.startswith('show '):
+            return self.show(command)
+        if command == 'exit':
+            self.closed = True
+            return ''
+        return 'Invalid command: [%s]' % command.split()[0]
+
+
+PERSONALITIES = {
+    'rvbd': RVBDPersonality,
+    'ios': IOSPersonality,
+    'vyatta': VyattaPersonality,
+}
+"""Personalities by the names accepted by :class:`DeviceSimulator`."""
+
+
+class _Request(object):
+    # What a client asked of a channel: a shell, or a command to execute.
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.command = None
+        self.subsystem = None
+        self.height = 24
+
+
+class _Server(paramiko.ServerInterface):
+
+    def __init__(self, simulator):
+        self._simulator = simulator
+        self._lock = threading.Lock()
+        self._requests = {}
+
+    def request(self, chanid):
+        with self._lock:
+            return self._requests.setdefault(chanid, _Request())
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if (username == self._simulator.username and
+                password == self._simulator.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_pty_request(self, channel, term, width, height,
+                                  pixelwidth, pixelheight, modes):
+        self.request(channel.get_id()).height = height
+        return True
+
+    def check_channel_window_change_request(self, channel, width, height,
+                                            pixelwidth, pixelheight):
+        self.request(channel.get_id()).height = height
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.request(channel.get_id()).ready.set()
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        request = self.request(channel.get_id())
+        request.command = command.decode('utf8', 'replace')
+        request.ready.set()
+        return True
+
+    def check_channel_subsystem_request(self, channel, name):
+        # The handler registered with the transport serves the channel.
+        if not super(_Server, self).check_channel_subsystem_request(
+                channel, name):
+            return False
+        request = self.request(channel.get_id())
+        request.subsystem = name
+        request.ready.set()
+        return True
+
+
+class _SFTPHandle(paramiko.SFTPHandle):
+
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(
+                os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+
+class _SFTPServer(paramiko.SFTPServerInterface):
+    # Serves the files under a local directory, which paths are relative to.
+
+    def __init__(self, server, root):
+        super(_SFTPServer, self).__init__(server)
+        self._root = root
+
+    def _path(self, path):
+        # Normalizing first keeps '..' from leaving the root.
+        return os.path.join(self._root,
+                            os.path.normpath('/' + path).lstrip('/'))
+
+    def list_folder(self, path):
+        path = self._path(path)
+        try:
+            return [paramiko.SFTPAttributes.from_stat(
+                        os.stat(os.path.join(path, name)), name)
+                    for name in os.listdir(path)]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(
+                os.stat(self._path(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(self._path(path), flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & (os.O_WRONLY | os.O_RDWR):
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+            if flags & os.O_RDWR:
+                mode = mode[0] + '+b'
+        else:
+            mode = 'rb'
+        handle = _SFTPHandle(flags)
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self._path(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.rename(self._path(oldpath), self._path(newpath))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self._path(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self._path(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+
+class _Session(object):
+    # Runs a personality on an SSH channel.
+
+    def __init__(self, simulator, channel, personality, height):
+        self._simulator = simulator
+        self._channel = channel
+        self._personality = personality
+        self._page_size = max(height - 1, 1)
+        # Lines left to page through, and how many were shown.
+        self._pages = None
+        self._shown = 0
+
+    def _write(self, text, newline='\r\n'):
+        # Sends text at the simulated bandwidth.
+        data = text.replace('\n', newline).encode('utf8')
+        bandwidth = self._simulator.bandwidth
+        if not bandwidth:
+            self._channel.sendall(data)
+            return
+        chunk_size = max(int(bandwidth / 50), 1)
+        due = time.monotonic()
+        for offset in range(0, len(data), chunk_size):
+            chunk = data[offset:offset + chunk_size]
+            self._channel.sendall(chunk)
+            due += len(chunk) / bandwidth
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _run(self, line):
+        # Runs a line, taking the simulated latency.
+        started = time.monotonic()
+        output = self._personality.handle(line)
+        self._simulator._count_command()
+        delay = self._simulator.latency - (time.monotonic() - started)
+        if delay > 0:
+            time.sleep(delay)
+        return output
+
+    def run_exec(self, command):
+        output = self._run(command)
+        if output:
+            self._write(output + '\n', newline='\n')
+        self._channel.send_exit_status(0)
+
+    def run_shell(self):
+        personality = self._personality
+        self._write(personality.banner() + personality.prompt())
+        line = ''
+        # Whether the last character ended a line with \r, so that a \n
+        # following it is part of the same line ending.
+        after_cr = False
+
+        while not personality.closed:
+            data = self._channel.recv(4096)
+            if not data:
+                return
+            echo = []
+            for char in data.decode('utf8', 'replace'):
+                if after_cr and char == '\n':
+                    after_cr = False
+                    continue
+                after_cr = char == '\r'
+
+                if self._pages is not None:
+                    self._page_key(char)
+                elif char in '\r\n':
+                    echo.append('\n')
+                    self._write(''.join(echo))
+                    echo = []
+                    self._respond(line)
+                    line = ''
+                    if personality.closed:
+                        return
+                elif char == DELETE_LINE:
+                    line = ''
+                elif char in BACKSPACES:
+                    if line:
+                        line = line[:-1]
+                        echo.append('\b \b')
+                else:
+                    line += char
+                    if personality.echo:
+                        echo.append(char)
+            if echo:
+                self._write(''.join(echo))
+
+    def _respond(self, line):
+        output = self._run(line)
+        lines = output.split('\n') if output else []
+        if self._personality.paging and len(lines) > self._page_size:
+            self._pages = lines
+            self._shown = 0
+            self._next_page()
+            return
+        text = ''.join(output_line + '\n' for output_line in lines)
+        if not self._personality.closed:
+            text += self._personality.prompt()
+        self._write(text)
+
+    def _next_page(self):
+        first = self._shown
+        page = self._pages[first:first + self._page_size]
+        self._shown += len(page)
+        text = ''.join(line + '\n' for line in page)
+        if self._shown >= len(self._pages):
+            self._pages = None
+            text += self._personality.prompt()
+        else:
+            text += self._personality.more_prompt(first + 1, self._shown)
+        self._write(text)
+
+    def _page_key(self, char):
+        # Space and most other keys show the next page, q stops paging.
+        more = self._personality.more_prompt(self._shown, self._shown)
+        erase = '\r' + ' ' * len(more) + '\r'
+        if char in 'qQ':
+            self._pages = None
+            self._write(erase + self._personality.prompt())
+        else:
+            self._write(erase)
+            self._next_page()
+
+
+class DeviceSimulator(object):
+    """
+    SSH server simulating the command line of network devices.
+
+    Each session gets a fresh :class:`Personality`, so the CLI classes of
+    this package can be run against the simulator over a real SSH
+    connection, to test them or to measure their throughput::
+
+        with DeviceSimulator('rvbd', latency=0.01) as simulator:
+            cli = RVBD_CLI(**simulator.connect_args)
+            cli.start()
+            cli.exec_command('show version')
+
+    Interactive sessions need a pty and a shell; commands may also be
+    executed directly, as by :class:`steelscript.cmdline.shell.Shell`.
+    If ``sftp_root`` is given, the files under it are served over SFTP,
+    without the latency and bandwidth limits.
+    The simulator can also be run on its own, as a load target::
+
+        python -m steelscript.cmdline.simulator --personality ios
+
+    :param personality: the :class:`Personality` subclass to simulate, or
+        its name in :const:`PERSONALITIES`.
+    :param host: address to listen on.
+    :param port: port to listen on.  Defaults to a free port, see
+        :attr:`port`.
+    :param username: user name that logins must use.
+    :param password: password that logins must use.
+    :param latency: seconds that every line takes to answer.
+    :param bandwidth: bytes per second that output is sent at, or None for
+        no limit.
+    :param output_size: characters of output of ``show`` commands.
+    :param host_key: ``paramiko.PKey`` of the server.  Defaults to a key
+        generated once per process.
+    :param sftp_root: local directory to serve over SFTP, or None to
+        refuse SFTP sessions.
+    :param personality_args: other arguments, such as ``outputs``,
+        ``enable_password`` or ``hostname``, are passed to the personality.
+    """
+
+    # Seconds that a new connection has to send its banner, and a new
+    # channel to ask for a shell or a command.
+    REQUEST_TIMEOUT = 10
+
+    def __init__(self, personality='rvbd', host='127.0.0.1', port=0,
+                 username='admin', password='password', latency=0,
+                 bandwidth=None, output_size=1024, host_key=None,
+                 sftp_root=None, **personality_args):
+        if isinstance(personality, str):
+            personality = PERSONALITIES[personality]
+        self.personality = personality
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.output_size = output_size
+        self._host_key = host_key or _default_host_key()
+        self.sftp_root = sftp_root
+        self._personality_args = personality_args
+
+        self._listener = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._transports = set()
+
+        self.connections = 0
+        """Number of SSH connections made so far."""
+
+        self.commands = 0
+        """Number of lines run so far."""
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    @property
+    def connect_args(self):
+        """
+        Arguments for a CLI or channel to connect to the simulator, as a
+        dict of ``hostname``, ``port``, ``username`` and ``password``.
+        """
+        return {'hostname': self.host, 'port': self.port,
+                'username': self.username, 'password': self.password}
+
+    def start(self):
+        """
+        Starts listening.  Once this returns, :attr:`port` is the port
+        listened on.
+        """
+        self._stopping.clear()
+        self._listener = socket.create_server((self.host, self.port))
+        self.port = self._listener.getsockname()[1]
+        self._thread = threading.Thread(
+            target=self._serve, name='simulator-%s' % self.port)
+        self._thread.daemon = True
+        self._thread.start()
+        log.info('Simulating %s on %s:%s', self.personality.__name__,
+                 self.host, self.port)
+
+    def stop(self):
+        """Stops listening and closes all connections."""
+        if self._listener is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._listener.close()
+        self._listener = None
+        with self._lock:
+            transports = list(self._transports)
+        for transport in transports:
+            transport.close()
+
+    def _count_command(self):
+        with self._lock:
+            self.commands += 1
+
+    def _spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def _serve(self):
+        while not self._stopping.is_set():
+            if not netutils.wait_readable(self._listener, 0.1):
+                continue
+            try:
+                sock, address = self._listener.accept()
+            except OSError:
+                continue
+            self._spawn(self._connection, sock)
+
+    def _connection(self, sock):
+        # Clients send their banner straight away.  Connections closed
+        # without one only tested that the port is open, and would fail
+        # the SSH negotiation noisily.
+        try:
+            if (not netutils.wait_readable(sock, self.REQUEST_TIMEOUT) or
+                    not sock.recv(1, socket.MSG_PEEK)):
+                sock.close()
+                return
+        except socket.error:
+            sock.close()
+            return
+
+        # Echoes and output are written separately, and would otherwise
+        # wait for delayed acknowledgements.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = paramiko.Transport(sock)
+        transport.add_server_key(self._host_key)
+        if self.sftp_root is not None:
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer,
+                                            _SFTPServer, self.sftp_root)
+        server = _Server(self)
+        try:
+            transport.start_server(server=server)
+        except (paramiko.SSHException, EOFError, socket.error) as e:
+            log.debug('SSH negotiation failed: %s', e)
+            transport.close()
+            return
+
+        with self._lock:
+            self.connections += 1
+            self._transports.add(transport)
+        try:
+            while transport.is_active() and not self._stopping.is_set():
+                channel = transport.accept(0.5)
+                if channel is not None:
+                    self._spawn(self._session, transport, server, channel)
+        finally:
+            with self._lock:
+                self._transports.discard(transport)
+
+    def _session(self, transport, server, channel):
+        request = server.request(channel.get_id())
+        try:
+            if not request.ready.wait(self.REQUEST_TIMEOUT):
+                return
+            if request.subsystem is not None:
+                # Its handler closes the channel when done.
+                channel = None
+                return
+            personality = self.personality(
+                username=transport.get_username(),
+                output_size=self.output_size, **self._personality_args)
+            session = _Session(self, channel, personality, request.height)
+            if request.command is None:
+                session.run_shell()
+            else:
+                session.run_exec(request.command)
+        except (socket.error, EOFError, paramiko.SSHException) as e:
+            log.debug('Simulated session ended: %s', e)
+        finally:
+            if channel is not None:
+                channel.close()
+
+
+def main(argv=None):
+    """Runs a simulator from the command line until interrupted."""
+    parser = argparse.ArgumentParser(
+        description='Simulate the SSH command line of a network device.')
+    parser.add_argument('--personality', choices=sorted(PERSONALITIES),
+                        default='rvbd')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2222)
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds that every line takes to answer')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='bytes per second to send output at')
+    parser.add_argument('--output-size', type=int, default=1024,
+                        help='characters of output of show commands')
+    parser.add_argument('--sftp-root', default=None,
+                        help='directory to serve over SFTP')
+    options = parser.parse_args(argv)
+
+    simulator = DeviceSimulator(
+        options.personality, host=options.host, port=options.port,
+        username=options.username, password=options.password,
+        latency=options.latency, bandwidth=options.bandwidth,
+        output_size=options.output_size, sftp_root=options.sftp_root)
+    simulator.start()
+    print('Simulating %s on %s:%s' % (options.personality, simulator.host,
+                                      simulator.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,14 +5,19 @@
 # as set forth in the License.
 
 
-import time
-import select
 import logging
 import paramiko
 
 from steelscript.cmdline import channel
+from steelscript.cmdline import deadline
 from steelscript.cmdline import exceptions
+from steelscript.cmdline import hooks
+from steelscript.cmdline import netutils
+from steelscript.cmdline import retry
 from steelscript.cmdline import sshprocess
+from steelscript.cmdline.debuglog import Preview
+
+log = logging.getLogger(__name__)
 
 DEFAULT_TERM_WIDTH = 80
 DEFAULT_TERM_HEIGHT = 24
@@ -29,12 +34,19 @@ class SSHChannel(channel.Channel):
     :param port: optional port for the connection.  Default is 22.
     :param username: account to use for authentication
     :param password: password for authentication
-    :param private_key_path: absolute system path to private key file
+    :param private_key_path: absolute system path to private key file.
+        RSA, ECDSA and Ed25519 keys are supported, and each file is only
+        parsed once per process.
+    :param private_key_passphrase: passphrase of an encrypted key file
+    :param use_agent: if True, authenticate with the keys of the running
+        SSH agent when no private key is given, before trying the password
     :param terminal: terminal emulation to use; defaults to 'console'
     :param width: width (in characters) of the terminal screen;
         defaults to 80
     :param height: height (in characters) of the terminal screen;
         defaults to 24
+    :param retry_policy: :class:`steelscript.cmdline.retry.RetryPolicy`
+        for connecting in :meth:`start`.  Defaults to a single attempt.
 
     Both password and private_key_path may be passed, but private keys
     will take precedence for authentication, with no fallback to password
@@ -51,29 +63,30 @@ class SSHChannel(channel.Channel):
                  private_key_path=None, port=DEFAULT_PORT,
                  terminal='console',
                  width=DEFAULT_TERM_WIDTH, height=DEFAULT_TERM_HEIGHT,
-                 **kwargs):
+                 retry_policy=None, private_key_passphrase=None,
+                 use_agent=False, **kwargs):
 
         self.conn_port = port
 
-        if password is None and private_key_path is None:
-            cause = 'Either password or path to private key must be included.'
+        if password is None and private_key_path is None and not use_agent:
+            cause = ('Either password, path to private key or use of the SSH '
+                     'agent must be included.')
             raise exceptions.ConnectionError(cause=cause)
 
-        pkey = None
-        if private_key_path is not None:
-            with open(private_key_path, 'r') as f:
-                pkey = paramiko.rsakey.RSAKey.from_private_key(f)
-
-        self.sshprocess = sshprocess.SSHProcess(host=hostname,
-                                                user=username,
-                                                password=password,
-                                                private_key=pkey,
-                                                port=self.conn_port)
+        self.sshprocess = sshprocess.SSHProcess(
+            host=hostname, user=username, password=password,
+            private_key_path=private_key_path,
+            private_key_passphrase=private_key_passphrase,
+            use_agent=use_agent, port=self.conn_port)
         self._host = hostname
         self._term = terminal
         self._term_width = width
         self._term_height = height
 
+        if retry_policy is None:
+            retry_policy = retry.RetryPolicy(max_attempts=1)
+        self._retry_policy = retry_policy
+
         self.channel = None
 
     def _verify_connected(self):
@@ -99,7 +112,9 @@ class SSHChannel(channel.Channel):
         :param match_res: Pattern(s) of prompts to look for.
             May be a single regex string, or a list of them.
         :param timeout: maximum time, in seconds, to wait for a regular
-            expression match. 0 to wait forever.
+            expression match, or a
+            :class:`steelscript.cmdline.deadline.Deadline`.
+            0 to wait forever.
         :return: Python :class:`re.MatchObject` containing data on
             what was matched.
         """
@@ -109,18 +124,52 @@ class SSHChannel(channel.Channel):
             match_res = [match_res, ]
 
         if not self.sshprocess.is_connected():
-            # sshprocess.connect() handles the authentication / login.
-            self.sshprocess.connect()
+            # sshprocess.connect() handles the authentication / login,
+            # and fails fast if the host's circuit breaker is open.
+            self._retry_policy.call(self.sshprocess.connect)
 
         # Start channel
         self.channel = self.sshprocess.open_interactive_channel(
             self._term, self._term_width, self._term_height)
 
-        logging.info('Interactive channel to "%s" started' % self._host)
+        log.info('Interactive channel to "%s" started' % self._host)
+        self._fire(hooks.CONNECT)
+
+        return self.expect(match_res, timeout)[1]
+
+    def keepalive(self, timeout=10):
+        """
+        Checks that the host still answers, closing the session if not.
+
+        See :meth:`steelscript.cmdline.sshprocess.SSHProcess.keepalive`.
+
+        :param timeout: seconds to wait for the host to answer
+        :return: True if the session is alive, False otherwise.
+        """
+        if self.channel is None or self.channel.closed:
+            return False
+        return self.sshprocess.keepalive(timeout)
+
+    def footprint(self):
+        """
+        Returns the memory held by the session: received data not read yet
+        and, as reserved, what the server may still send before it has to
+        wait for that data to be read.
 
-        return self.expect(match_res)[1]
+        :return: a :class:`steelscript.cmdline.footprint.Footprint`
+        """
+        footprint = super(SSHChannel, self).footprint()
+        if self.channel is not None:
+            buffered = (len(self.channel.in_buffer) +
+                        len(self.channel.in_stderr_buffer))
+            footprint.held['receive_buffer'] = buffered
+            footprint.reserved['receive_window'] = max(
+                0, self.channel.in_window_size - buffered -
+                self.channel.in_window_sofar)
+        return footprint
 
     def close(self):
+        self._fire(hooks.CLOSE)
         if self.sshprocess.is_connected():
             # This closes the paramiko channel's underlying transport,
             # which according to the paramiko documentation closes
@@ -136,7 +185,7 @@ class SSHChannel(channel.Channel):
 
         self._verify_connected()
 
-        logging.debug('Receiving all data')
+        log.debug('Receiving all data')
 
         # Going behind Paramiko's back here; the Channel object does not have a
         # function to do this, but the BufferedPipe object that it uses to
@@ -170,7 +219,8 @@ class SSHChannel(channel.Channel):
         """
         self._verify_connected()
 
-        logging.debug('Sending "%s"' % self.safe_line_feeds(text_to_send))
+        log.debug('Sending "%s"', Preview(text_to_send))
+        self._fire(hooks.SEND, text=text_to_send)
 
         bytes_sent = 0
         bytes_to_send = text_to_send.encode()
@@ -196,7 +246,9 @@ class SSHChannel(channel.Channel):
                           May be a single regex string, or a list of them.
                           Currently cannot match multiple lines.
         :param timeout: maximum time, in seconds, to wait for a regular
-                        expression match. 0 to wait forever.
+                        expression match, or a
+                        :class:`steelscript.cmdline.deadline.Deadline`.
+                        0 to wait forever.
 
         :return: ``(output, match_object)`` where output is the output of
             the command (without the matched text), and match_object is a
@@ -219,24 +271,31 @@ class SSHChannel(channel.Channel):
         # line.
         next_line_start = 0
 
-        starttime = time.time()
+        expect_deadline = deadline.Deadline.coerce(timeout)
+        stats = self._receive_stats()
 
         while True:
-            # Use select to check whether channel is ready for read.
-            # Reading on the channel directly would block until data is
-            # ready, where select blocks at most 10 seconds which allows
-            # us to check whether the specified timeout has been reached.
-            # If channel is not ready for reading within 10 seconds,
-            # select returns an empty list to 'readers'.
-            (readers, w, x) = select.select([self.channel], [], [], 10)
+            # Check whether channel is ready for read.  Reading on the
+            # channel directly would block until data is ready, where this
+            # waits at most 10 seconds (or until the deadline, if sooner)
+            # which allows us to check whether the specified timeout has
+            # been reached.
+            wait = 10
+            remaining = expect_deadline.remaining()
+            if remaining is not None:
+                wait = min(wait, remaining)
+            readable = netutils.wait_readable(self.channel, wait)
 
             # Timeout if this is taking too long.
-            if timeout and ((time.time() - starttime) > timeout):
+            if expect_deadline.expired():
+                self._fire(hooks.TIMEOUT, timeout=expect_deadline.timeout,
+                           failed_match=match_res)
                 partial_output = repr(self.safe_line_feeds(received_data))
-                raise exceptions.CmdlineTimeout(command=None,
-                                                output=partial_output,
-                                                timeout=timeout,
-                                                failed_match=match_res)
+                raise exceptions.CmdlineTimeout(
+                    command=None,
+                    output=partial_output,
+                    timeout=expect_deadline.timeout,
+                    failed_match=match_res)
 
             new_data = None
 
@@ -247,8 +306,9 @@ class SSHChannel(channel.Channel):
             #   (2) channel is not ready for reading but exit_status_ready()
             # Our experiments has shown that this correctly handles detecting
             # if a channel has been unexpected closed.
-            if len(readers) > 0:
+            if readable:
                 new_data = self.channel.recv(4096)
+                stats.received(len(new_data))
 
                 if len(new_data) == 0:
                     # Channel closed
@@ -256,6 +316,8 @@ class SSHChannel(channel.Channel):
                         failed_match=match_res,
                         context='Channel unexpectedly closed')
 
+                self._fire(hooks.RECEIVE, data=new_data)
+
                 # If we're still here, we have new data to process.
                 received_data, new_lines = self._process_data(
                     new_data, received_data, next_line_start)
@@ -264,6 +326,8 @@ class SSHChannel(channel.Channel):
                     received_data, next_line_start, new_lines, match_res)
 
                 if (output, match) != (None, None):
+                    stats.finished()
+                    self._fire(hooks.MATCH, output=output, match=match)
                     return output, match
 
                 # Update next_line_start to be the index of the last \n
@@ -273,61 +337,3 @@ class SSHChannel(channel.Channel):
                 raise exceptions.ConnectionError(
                     failed_match=match_res,
                     context='Channel unexpectedly closed')
-
-    def _process_data(self, new_data, received_data, next_line_start):
-        """
-        Process the new data and return updated received_data and new lines.
-
-        :param bytes new_data: The newly read data in bytes
-        :param str received_data: All data received before new_data, str
-        :param next_line_start: Where to start splitting off the new lines.
-
-        :return: A tuple of the updated received_data followed by the list
-            of new lines.
-        """
-        received_data += new_data.decode()
-
-        # The CLI does some odd things, sending multiple \r's or just a
-        # \r, sometimes \r\r\n. To make this look like typical input, all
-        # the \r characters with \n near them are stripped. To make
-        # prompt matching easier, any \r character that does not have
-        # a \n near is replaced with a \n.
-        received_data = received_data[:next_line_start] + \
-            self.fixup_carriage_returns(received_data[next_line_start:])
-
-        # Take the data from next_line_start to end and split it into
-        # lines so we can look for a match on each one
-        new_lines = received_data[next_line_start:].splitlines()
-        return received_data, new_lines
-
-    def _match_lines(self, received_data, next_line_start,
-                     new_lines, match_res):
-        """
-        Examine new lines for matches against our regular expressions.
-
-        :param received_data: All data received so far, including latest.
-        :param new_lines: Latest data split into individual lines.
-        :param next_line_start: The point in received_data where new lines
-            begin.
-        :param match_res: The regular expressions for matching as documented
-            for `expect()`
-
-        :return: ``(output, match_object)`` as described for `expect() except
-            that ``(None, None)`` is returned to indicate no match.
-        """
-        # Loop through all new lines and check them for matches.
-        for line_num in range(len(new_lines)):
-            match = self._find_match(new_lines[line_num], match_res)
-            if match:
-                logging.debug(
-                    'Matched "%s" in \n%s'
-                    % (self.safe_line_feeds(match.re.pattern),
-                       new_lines[line_num]))
-
-                # Output is all data up to the next_line_start, plus
-                # all lines up to the one we matched.
-                output = received_data[:next_line_start] + \
-                    '\n'.join(new_lines[:line_num]) + \
-                    new_lines[line_num][:match.start()]
-                return output, match
-        return None, None
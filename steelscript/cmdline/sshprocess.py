@@ -10,8 +10,13 @@
 
 import paramiko
 import logging
+import socket
+import threading
 
 from steelscript.cmdline import exceptions
+from steelscript.cmdline import keys
+from steelscript.cmdline import netutils
+from steelscript.cmdline import retry
 from steelscript.cmdline import transport
 
 
@@ -23,17 +28,62 @@ class SSHProcess(transport.Transport):
     :param user: username to log in with
     :param password: password to log in with
     :param private_key: paramiko private key (Pkey) object
+    :param private_key_path: path to a private key file, used if
+        private_key is not given.  Files are parsed once per process, see
+        :func:`steelscript.cmdline.keys.load_private_key`.
+    :param private_key_passphrase: passphrase of an encrypted key file
+    :param use_agent: if True and no private key is given, try the keys
+        of the running SSH agent before falling back to the password.
+    :param circuit_breaker: :class:`steelscript.cmdline.retry.CircuitBreaker`
+        guarding connection attempts.  Defaults to the process-wide breaker
+        for ``host`` and ``port``, so that once a host has failed
+        repeatedly, further attempts fail fast with ``CircuitOpen`` for a
+        while.
+    :param sock: an already connected socket, or socket-like object such as
+        a ``paramiko.ProxyCommand``, to use for the first connection instead
+        of connecting to ``host`` directly.  Later reconnects connect
+        directly.
 
-    If a private_key is passed, it will take precendence over a password,
+    Each phase of connecting is bounded by a timeout: looking up the host
+    (``DNS_TIMEOUT``), opening the TCP connection (``CONNECT_TIMEOUT``),
+    receiving the SSH banner (``BANNER_TIMEOUT``), the key exchange
+    (``HANDSHAKE_TIMEOUT``) and logging in (``AUTH_TIMEOUT``).  These may
+    be overridden per instance.  Hosts with several addresses have them
+    tried in parallel, alternating IPv6 and IPv4, so that one unreachable
+    address does not hold up the others.
+
+    If a private key is passed, it will take precendence over a password,
     no fallback attempt will be made if the private key connection fails,
     however.
     """
 
+    # Seconds to wait for the host name to resolve.
+    DNS_TIMEOUT = 5
+
+    # Seconds to wait for the TCP connection, across all of its addresses.
+    CONNECT_TIMEOUT = 10
+
     # Seconds to wait for banner coming out after starting connection.
     BANNER_TIMEOUT = 5
 
+    # Seconds to wait for the key exchange to complete.
+    HANDSHAKE_TIMEOUT = 15
+
+    # Seconds to wait for the server to accept or reject our credentials.
+    AUTH_TIMEOUT = 30
+
+    # Flow control window for SFTP channels.  The Paramiko default is
+    # sized for interactive use and throttles bulk transfers on links
+    # with any appreciable latency.
+    SFTP_WINDOW_SIZE = 16 * 1024 * 1024
+
+    # Global request used by keepalive(), as sent by OpenSSH clients.
+    KEEPALIVE_REQUEST = 'keepalive@openssh.com'
+
     def __init__(self, host, user='root', password=None, private_key=None,
-                 port=22):
+                 port=22, circuit_breaker=None, sock=None,
+                 private_key_path=None, private_key_passphrase=None,
+                 use_agent=False):
         # Hostname shell connects to
         self._host = host
         self._port = port
@@ -45,8 +95,21 @@ class SSHProcess(transport.Transport):
         self._password = password
 
         # Private key as paramiko.pkey.PKey
+        if private_key is None and private_key_path is not None:
+            private_key = keys.load_private_key(private_key_path,
+                                                private_key_passphrase)
         self._private_key = private_key
 
+        # Whether to try the SSH agent's keys
+        self._use_agent = use_agent
+
+        if circuit_breaker is None:
+            circuit_breaker = retry.get_breaker(host, int(port))
+        self.circuit_breaker = circuit_breaker
+
+        # Pre-established socket for the first connection, if any.
+        self._sock = sock
+
         # paramiko.Transport object, the actual SSH engine.
         # http://www.lag.net/paramiko/docs/
         self.transport = None
@@ -58,24 +121,66 @@ class SSHProcess(transport.Transport):
         """
         Connects to the host and logs in.
 
+        :raises CircuitOpen: if the host has failed too often recently
         :raises ConnectionError: on error
         """
         self._log.info('Connecting to "%s" as "%s"' % (self._host, self._user))
+
+        # Only failures to reach the host count against its breaker; a
+        # rejected login shows that the host itself is up.
+        with self.circuit_breaker.guard():
+            self._start_transport()
+        self._authenticate()
+
+    def _start_transport(self):
         try:
-            self.transport = paramiko.Transport((self._host, self._port))
+            sock, self._sock = self._sock, None
+            if sock is None:
+                sock = netutils.connect(self._host, int(self._port),
+                                        timeout=self.CONNECT_TIMEOUT,
+                                        dns_timeout=self.DNS_TIMEOUT)
+            self.transport = paramiko.Transport(sock)
             self.transport.banner_timeout = self.BANNER_TIMEOUT
-            self.transport.start_client()
+            self.transport.handshake_timeout = self.HANDSHAKE_TIMEOUT
+            self.transport.auth_timeout = self.AUTH_TIMEOUT
+            self.transport.start_client(timeout=self.HANDSHAKE_TIMEOUT)
+        except (paramiko.ssh_exception.SSHException, socket.error) as e:
+            self._connect_failed(e)
 
+    def _authenticate(self):
+        try:
             if self._private_key:
                 self.transport.auth_publickey(self._user, self._private_key)
+            elif self._use_agent and self._authenticate_with_agent():
+                return
+            elif self._use_agent and self._password is None:
+                raise paramiko.ssh_exception.AuthenticationException(
+                    'No SSH agent key was accepted')
             else:
                 self.transport.auth_password(self._user, self._password,
                                              fallback=True)
-        except paramiko.ssh_exception.SSHException:
-            # Close the session, or the child thread apparently hangs
-            self.disconnect()
-            self._log.exception("Could not connect to %s", self._host)
-            raise exceptions.ConnectionError
+        except paramiko.ssh_exception.SSHException as e:
+            self._connect_failed(e)
+
+    def _authenticate_with_agent(self):
+        # Returns True once the server accepts one of the agent's keys.
+        agent = paramiko.Agent()
+        try:
+            for key in agent.get_keys():
+                try:
+                    self.transport.auth_publickey(self._user, key)
+                    return True
+                except paramiko.ssh_exception.AuthenticationException:
+                    continue
+            return False
+        finally:
+            agent.close()
+
+    def _connect_failed(self, cause):
+        # Close the session, or the child thread apparently hangs
+        self.disconnect()
+        self._log.exception("Could not connect to %s", self._host)
+        raise exceptions.ConnectionError(cause=cause)
 
     def disconnect(self):
         """
@@ -95,6 +200,39 @@ class SSHProcess(transport.Transport):
             return True
         return False
 
+    def keepalive(self, timeout=10):
+        """
+        Checks that the host still answers on this connection.
+
+        Sends an SSH keepalive request and waits for the reply, whether the
+        server supports the request or not.  Unlike :meth:`is_connected`,
+        this notices connections silently dropped along the way, for
+        example by a firewall idle timeout.  A connection that does not
+        answer in time is closed.
+
+        :param timeout: seconds to wait for the reply
+        :return: True if the host answered, False otherwise.
+        """
+        if not self.is_connected():
+            return False
+
+        # Paramiko's global_request() has no timeout of its own, and
+        # returns once the transport is closed.
+        transport = self.transport
+        thread = threading.Thread(target=transport.global_request,
+                                  args=(self.KEEPALIVE_REQUEST,),
+                                  name='keepalive-%s' % self._host)
+        thread.daemon = True
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive() or not transport.is_active():
+            self._log.warning('No keepalive reply from "%s" after %s '
+                              'seconds, closing connection' %
+                              (self._host, timeout))
+            self.disconnect()
+            return False
+        return True
+
     def open_interactive_channel(self, term='console', width=80, height=24):
         """
         Creates and starts a stateful interactive channel.
@@ -124,3 +262,22 @@ class SSHProcess(transport.Transport):
         channel.invoke_shell()
         channel.set_combine_stderr(True)
         return channel
+
+    def open_sftp(self):
+        """
+        Opens an SFTP session on the existing SSH connection.
+
+        The session uses its own channel, so several may be open at once
+        on a single connection.  Callers are responsible for closing it.
+
+        :return: A Paramiko SFTPClient.
+
+        :raises ConnectionError: if the SSH connection has not yet been
+            established.
+        """
+
+        if (not self.is_connected()):
+            raise exceptions.ConnectionError(context='Not connected!')
+
+        return paramiko.SFTPClient.from_transport(
+            self.transport, window_size=self.SFTP_WINDOW_SIZE)
@@ -0,0 +1,533 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Telnet client (RFC 854) over a non-blocking socket, in place of the
+# standard library's telnetlib, which was removed in Python 3.13.
+
+
+import re
+import time
+import socket
+import struct
+import logging
+
+from steelscript.cmdline import netutils
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PORT = 23
+
+# Commands.
+IAC = bytes([255])  # Interpret As Command
+DONT = bytes([254])
+DO = bytes([253])
+WONT = bytes([252])
+WILL = bytes([251])
+SB = bytes([250])  # Subnegotiation Begin
+GA = bytes([249])  # Go Ahead
+NOP = bytes([241])
+SE = bytes([240])  # Subnegotiation End
+
+# Options.
+BINARY = bytes([0])  # Binary Transmission, RFC 856
+ECHO = bytes([1])  # Echo, RFC 857
+SGA = bytes([3])  # Suppress Go Ahead, RFC 858
+TTYPE = bytes([24])  # Terminal Type, RFC 1091
+NAWS = bytes([31])  # Negotiate About Window Size, RFC 1073
+
+# Terminal type subnegotiation.
+TTYPE_IS = bytes([0])
+TTYPE_SEND = bytes([1])
+
+_IAC, _DONT, _DO, _WONT, _WILL, _SB, _SE = (
+    IAC[0], DONT[0], DO[0], WONT[0], WILL[0], SB[0], SE[0])
+
+# Parser states.
+_DATA, _COMMAND, _OPTION, _SUBNEGOTIATION, _SUBNEGOTIATION_IAC = range(5)
+
+# Longest subnegotiation kept; the ones handled here are a few bytes.
+_MAX_SUBNEGOTIATION = 1024
+
+_RECV_SIZE = 65536
+
+
+class TelnetProtocol(object):
+    """
+    Telnet protocol state of one connection, without any I/O.
+
+    Received bytes are passed to :meth:`feed`, which returns the data in
+    them with telnet commands removed.  Replies to the server's option
+    negotiation collect in :attr:`output`, for the caller to send along
+    with data encoded by :meth:`encode`.
+
+    Only the options a command line session needs are agreed to: binary
+    transmission, echo and suppress go ahead by the server, and binary
+    transmission, suppress go ahead, terminal type and window size by this
+    side.  Anything else is refused.
+
+    :param terminal: terminal type reported to the server
+    :param width: terminal width, in characters, reported to the server
+    :param height: terminal height, in lines, reported to the server
+    """
+
+    # Options, as ints, that the server may perform (WILL) and that this
+    # side performs if asked to (DO).
+    REMOTE_OPTIONS = frozenset(BINARY + ECHO + SGA)
+    LOCAL_OPTIONS = frozenset(BINARY + SGA + TTYPE + NAWS)
+
+    def __init__(self, terminal='console', width=80, height=24):
+        self.terminal = terminal
+        self.width = width
+        self.height = height
+
+        # Options enabled by this side and by the server, as ints.
+        self.local = set()
+        self.remote = set()
+        # (verb, option) requests sent and not answered yet.
+        self._requested = set()
+
+        self.output = bytearray()
+        self._state = _DATA
+        self._verb = None
+        self._subnegotiation = bytearray()
+
+    @property
+    def binary(self):
+        """Whether the server sends data as is, rather than as NVT text."""
+        return BINARY[0] in self.remote
+
+    def request(self, verb, option):
+        """
+        Asks the server to enable an option, unless it is already enabled.
+
+        :param verb: :data:`DO` for the server to perform the option, or
+            :data:`WILL` to offer to perform it.
+        :param option: the option, such as :data:`BINARY`.
+        """
+        enabled = self.remote if verb == DO else self.local
+        if option[0] in enabled or (verb[0], option[0]) in self._requested:
+            return
+        self._requested.add((verb[0], option[0]))
+        self.output += IAC + verb + option
+
+    def set_window_size(self, width, height):
+        """Reports a new window size, if the server asked for it."""
+        self.width = width
+        self.height = height
+        if NAWS[0] in self.local:
+            self._send_window_size()
+
+    def encode(self, data):
+        """Returns data ready to send, with its IAC bytes escaped."""
+        return data.replace(IAC, IAC + IAC)
+
+    def feed(self, data):
+        """
+        Processes received bytes.
+
+        :param data: bytes as received, which may end part way through a
+            command; the rest of it is expected in the next call.
+        :return: the data in them, as bytes, with telnet commands removed.
+        """
+        if self._state == _DATA and IAC not in data:
+            return self._cook(data)
+
+        cooked = bytearray()
+        i = 0
+        length = len(data)
+        while i < length:
+            state = self._state
+            if state == _DATA:
+                end = data.find(IAC, i)
+                if end < 0:
+                    cooked += data[i:]
+                    break
+                cooked += data[i:end]
+                self._state = _COMMAND
+                i = end + 1
+                continue
+
+            byte = data[i]
+            i += 1
+            if state == _COMMAND:
+                if byte == _IAC:
+                    # An escaped 255 data byte.
+                    cooked.append(byte)
+                    self._state = _DATA
+                elif byte in (_WILL, _WONT, _DO, _DONT):
+                    self._verb = byte
+                    self._state = _OPTION
+                elif byte == _SB:
+                    del self._subnegotiation[:]
+                    self._state = _SUBNEGOTIATION
+                else:
+                    # NOP, GA and the like carry nothing for a client.
+                    self._state = _DATA
+            elif state == _OPTION:
+                self._state = _DATA
+                self._negotiate(self._verb, byte)
+            elif state == _SUBNEGOTIATION:
+                if byte == _IAC:
+                    self._state = _SUBNEGOTIATION_IAC
+                elif len(self._subnegotiation) < _MAX_SUBNEGOTIATION:
+                    self._subnegotiation.append(byte)
+            else:
+                if byte == _SE:
+                    self._state = _DATA
+                    self._subnegotiated(bytes(self._subnegotiation))
+                else:
+                    if len(self._subnegotiation) < _MAX_SUBNEGOTIATION:
+                        self._subnegotiation.append(byte)
+                    self._state = _SUBNEGOTIATION
+        return self._cook(bytes(cooked))
+
+    def _cook(self, data):
+        # NVT text pads a bare carriage return with a NUL, which is not
+        # part of the text.
+        if self.binary or b'\0' not in data:
+            return data
+        return data.replace(b'\0', b'')
+
+    def _negotiate(self, verb, option):
+        if verb in (_WILL, _WONT):
+            enabled, allowed = self.remote, self.REMOTE_OPTIONS
+            agree, refuse, asked = DO, DONT, _DO
+        else:
+            enabled, allowed = self.local, self.LOCAL_OPTIONS
+            agree, refuse, asked = WILL, WONT, _WILL
+        requested = (asked, option) in self._requested
+        self._requested.discard((asked, option))
+
+        # Only changes of state are answered, so that the two sides
+        # cannot loop acknowledging each other.
+        if verb in (_WILL, _DO):
+            if option in enabled:
+                return
+            if option not in allowed:
+                self.output += IAC + refuse + bytes([option])
+                return
+            enabled.add(option)
+            if not requested:
+                self.output += IAC + agree + bytes([option])
+            if verb == _DO and option == NAWS[0]:
+                self._send_window_size()
+        elif option in enabled:
+            enabled.discard(option)
+            self.output += IAC + refuse + bytes([option])
+
+    def _subnegotiated(self, data):
+        if (data[:2] == TTYPE + TTYPE_SEND and TTYPE[0] in self.local):
+            self.output += (IAC + SB + TTYPE + TTYPE_IS +
+                            self.encode(self.terminal.encode('ascii')) +
+                            IAC + SE)
+
+    def _send_window_size(self):
+        size = struct.pack('>HH', min(self.width, 0xffff),
+                           min(self.height, 0xffff))
+        self.output += IAC + SB + NAWS + self.encode(size) + IAC + SE
+
+
+class Telnet(object):
+    """
+    Telnet client connection, over a non-blocking socket.
+
+    Received data is kept in a bytearray until it is read.  :meth:`expect`
+    searches only what arrived since its last search, from the start of
+    the line that data continues, rather than the whole buffer each time
+    data arrives.  As a result a pattern can span at most one line break.
+
+    Used as with telnetlib, :meth:`write`, :meth:`expect` and
+    :meth:`read_very_eager` block as needed.  To drive the connection from
+    a selector or an asyncio loop instead, wait for :meth:`fileno` to be
+    readable, then call :meth:`process_input` and :meth:`match`; call
+    :meth:`write` with ``block=False``, and :meth:`flush` once writable
+    while :attr:`wants_write` is True.  None of these block::
+
+        def on_readable():
+            telnet.process_input()
+            index, match, text = telnet.match(prompts)
+            ...
+
+        loop.add_reader(telnet.fileno(), on_readable)
+
+    :param host: host to connect to, or None to connect later with
+        :meth:`open`
+    :param port: port to connect to
+    :param timeout: seconds allowed for connecting.  None for no limit.
+    :param terminal: terminal type reported to the server
+    :param width: terminal width, in characters, reported to the server
+    :param height: terminal height, in lines, reported to the server
+    :param binary: if True, ask the server for binary transmission both
+        ways, so that data is passed as is rather than as NVT text
+    :param sock: an already connected socket to use instead of connecting
+        to ``host``
+    """
+
+    def __init__(self, host=None, port=DEFAULT_PORT, timeout=None,
+                 terminal='console', width=80, height=24, binary=False,
+                 sock=None):
+        self.host = host
+        self.port = port
+        self.binary = binary
+        self.protocol = TelnetProtocol(terminal, width, height)
+        self.sock = None
+        self.eof = False
+        # time.monotonic() of the last data sent or received.
+        self.last_activity = time.monotonic()
+
+        self._received = bytearray()
+        self._outgoing = bytearray()
+        # Where the next search of _received starts, for the patterns
+        # last searched for.
+        self._search_from = 0
+        self._searched = None
+
+        if sock is not None:
+            self._attach(sock)
+        elif host is not None:
+            self.open(host, port, timeout)
+
+    def open(self, host, port=DEFAULT_PORT, timeout=None):
+        """
+        Connects to a host.
+
+        :param host: host to connect to
+        :param port: port to connect to
+        :param timeout: seconds allowed for connecting.  None for no limit.
+        """
+        self.host = host
+        self.port = port
+        self.msg('connecting')
+        self._attach(netutils.connect(host, port, timeout))
+
+    def _attach(self, sock):
+        sock.setblocking(False)
+        self.sock = sock
+        self.eof = False
+        self.last_activity = time.monotonic()
+        self.protocol.request(WILL, NAWS)
+        if self.binary:
+            self.protocol.request(DO, BINARY)
+            self.protocol.request(WILL, BINARY)
+        self._queue_protocol_output()
+
+    def msg(self, msg, *args):
+        """Logs a debug message about this connection."""
+        log.debug('Telnet(%s,%s): ' + msg, self.host, self.port, *args)
+
+    def fileno(self):
+        """Returns the socket's file descriptor, for selectors."""
+        return self.sock.fileno()
+
+    def get_socket(self):
+        """Returns the socket, or None if not connected."""
+        return self.sock
+
+    @property
+    def buffered(self):
+        """Bytes of data received and not read yet."""
+        return len(self._received)
+
+    @property
+    def idle(self):
+        """Seconds since data was last sent or received."""
+        return time.monotonic() - self.last_activity
+
+    def pending_error(self):
+        """
+        Returns the error the socket has recorded, such as a connection
+        reset seen when sending, without blocking.
+
+        :return: an errno value, or 0 if there is none.
+        """
+        return self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+
+    @property
+    def wants_write(self):
+        """Whether there is output waiting for the socket to be writable."""
+        return bool(self._outgoing)
+
+    def process_input(self):
+        """
+        Reads what the socket has received, without blocking.
+
+        Sets :attr:`eof` if the server closed the connection.
+
+        :return: the number of data bytes received, telnet commands
+            excluded.
+        """
+        received = 0
+        while True:
+            try:
+                data = self.sock.recv(_RECV_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
+            if not data:
+                self.msg('connection closed')
+                self.eof = True
+                break
+            self.last_activity = time.monotonic()
+            cooked = self.protocol.feed(data)
+            self._received += cooked
+            received += len(cooked)
+            if len(data) < _RECV_SIZE:
+                break
+        self._queue_protocol_output()
+        return received
+
+    def _queue_protocol_output(self):
+        if self.protocol.output:
+            self._outgoing += self.protocol.output
+            del self.protocol.output[:]
+            self.flush()
+
+    def flush(self):
+        """
+        Sends as much pending output as the socket takes without blocking.
+
+        :return: True if all pending output was sent.
+        """
+        while self._outgoing:
+            try:
+                sent = self.sock.send(self._outgoing)
+            except (BlockingIOError, InterruptedError):
+                return False
+            del self._outgoing[:sent]
+            self.last_activity = time.monotonic()
+        return True
+
+    def send_command(self, command):
+        """
+        Sends a telnet command, such as :data:`NOP`, without blocking.
+
+        :param command: the command byte, sent after :data:`IAC`.
+        """
+        self._outgoing += IAC + command
+        self.flush()
+
+    def write(self, data, block=True):
+        """
+        Sends data, escaping its IAC bytes.
+
+        :param data: bytes, or str to be sent UTF-8 encoded
+        :param block: if True, wait until all of it is sent.  If False,
+            send what can be sent now and leave the rest to :meth:`flush`.
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.msg('send %r', data)
+        self._outgoing += self.protocol.encode(data)
+        if block:
+            while not self.flush():
+                netutils.wait_writable(self.sock)
+        else:
+            self.flush()
+
+    def set_window_size(self, width, height):
+        """Reports a new terminal size to the server."""
+        self.protocol.set_window_size(width, height)
+        self._queue_protocol_output()
+
+    def match(self, patterns):
+        """
+        Looks for patterns in the data received, without blocking.
+
+        Calls with the same patterns search on from where the last one
+        stopped.  Patterns are tried in order, and the first that matches
+        is used.
+
+        :param patterns: list of regular expressions, as str or compiled
+        :return: ``(index, match, text)``: the index of the pattern that
+            matched, the match object, and the text received up to the end
+            of the match, which is removed from the buffer; or
+            ``(-1, None, '')`` if nothing matched.
+        """
+        patterns = tuple(re.compile(pattern) for pattern in patterns)
+        if patterns != self._searched:
+            self._searched = patterns
+            self._search_from = 0
+
+        # Later searches start at the last line break searched, with the
+        # character before it, so that patterns anchored on a line break or
+        # on the start of the buffer see what they would in the whole
+        # buffer.
+        start = max(self._search_from - 1, 0)
+        window = self._received[start:].decode('utf-8', 'surrogateescape')
+        position = 1 if self._search_from else 0
+        for index, pattern in enumerate(patterns):
+            match = pattern.search(window, position)
+            if match:
+                end = start + len(window[:match.end()].encode(
+                    'utf-8', 'surrogateescape'))
+                text = self._received[:end].decode('utf-8', 'replace')
+                del self._received[:end]
+                self._search_from = 0
+                return index, match, text
+
+        line_break = max(self._received.rfind(b'\n', self._search_from),
+                         self._received.rfind(b'\r', self._search_from))
+        if line_break > 0:
+            self._search_from = line_break
+        return -1, None, ''
+
+    def expect(self, patterns, timeout=None):
+        """
+        Waits for one of several patterns to be received.
+
+        :param patterns: list of regular expressions, as str or compiled
+        :param timeout: maximum seconds to wait.  None to wait forever.
+        :return: ``(index, match, text)`` as returned by :meth:`match`.
+            If nothing matched in time, ``(-1, None, text)`` with all the
+            text received, which is removed from the buffer.
+        :raises EOFError: if the connection was closed, with nothing
+            matched or left to read.
+        """
+        expires = None if timeout is None else time.monotonic() + timeout
+        while True:
+            result = self.match(patterns)
+            if result[0] >= 0 or self.eof:
+                break
+            remaining = None
+            if expires is not None:
+                remaining = expires - time.monotonic()
+                if remaining <= 0:
+                    break
+            if netutils.wait_readable(self.sock, remaining):
+                self.process_input()
+
+        if result[0] >= 0:
+            return result
+        text = self._take_all()
+        if not text and self.eof:
+            raise EOFError('telnet connection closed')
+        return -1, None, text
+
+    def read_very_eager(self):
+        """
+        Returns all text received, without blocking.
+
+        :raises EOFError: if the connection was closed and nothing is left
+            to read.
+        """
+        if not self.eof:
+            self.process_input()
+        text = self._take_all()
+        if not text and self.eof:
+            raise EOFError('telnet connection closed')
+        return text
+
+    def _take_all(self):
+        text = self._received.decode('utf-8', 'replace')
+        del self._received[:]
+        self._search_from = 0
+        return text
+
+    def close(self):
+        """Closes the connection."""
+        sock, self.sock = self.sock, None
+        self.eof = True
+        if sock is not None:
+            sock.close()
@@ -4,18 +4,25 @@
 # accompanying the software ("License").  This software is distributed "AS IS"
 # as set forth in the License.
 
+import os
 import logging
-import telnetlib
 import socket
 
 from steelscript.cmdline import exceptions
 from steelscript.cmdline import channel
+from steelscript.cmdline import telnet
+from steelscript.cmdline import deadline
+from steelscript.cmdline import hooks
+from steelscript.cmdline import netutils
+from steelscript.cmdline.debuglog import Preview
 
+log = logging.getLogger(__name__)
 
-class SteelScriptTelnet(telnetlib.Telnet):
+
+class SteelScriptTelnet(telnet.Telnet):
     """Local subclass to facilitate logging."""
     def msg(self, msg, *args):
-        """ Forward telnetlib's debug messages to log """
+        """ Forward the telnet client's debug messages to log """
         context = 'Telnet(%s,%d):' % (self.host, self.port)
         logging.debug(context + msg, *args)
 
@@ -31,6 +38,14 @@ class TelnetChannel(channel.Channel):
     :param username: username to log in with
     :param password: password to log in with
     :param port: telnet port, defaults to 23
+    :param terminal: terminal type reported to the server
+    :param width: terminal width, in characters, reported to the server
+    :param height: terminal height, in lines, reported to the server
+    :param binary: if True, ask the server for binary transmission, in
+        which data is passed as is rather than as NVT text
+    :param keepalive_interval: seconds a connection may be idle before
+        :meth:`expect` sends a telnet NOP along with its checks.  0 never
+        sends one.  Defaults to ``KEEPALIVE_INTERVAL``.
     """
 
     LOGIN_PROMPT = r'(^|\n|\r)(L|l)ogin: '
@@ -39,8 +54,13 @@ class TelnetChannel(channel.Channel):
 
     BASH_PROMPT = r'\[\S+ \S+\]#\s*$'
 
+    # Seconds without sending or receiving anything after which a NOP is
+    # sent when the connection is checked.
+    KEEPALIVE_INTERVAL = 60
+
     def __init__(self, hostname, username='root', password='', port=23,
-                 **kwargs):
+                 terminal='console', width=80, height=24, binary=False,
+                 keepalive_interval=None, **kwargs):
 
         # Hostname to connects
         self._host = hostname
@@ -48,6 +68,13 @@ class TelnetChannel(channel.Channel):
         self._user = username
         self._password = password
         self._port = port
+        self._terminal = terminal
+        self._width = width
+        self._height = height
+        self._binary = binary
+        if keepalive_interval is None:
+            keepalive_interval = self.KEEPALIVE_INTERVAL
+        self.keepalive_interval = keepalive_interval
 
         # SteelScriptTelnet
         self.channel = None
@@ -58,8 +85,10 @@ class TelnetChannel(channel.Channel):
 
         :param match_res: Pattern(s) of prompts to look for.
                           May be a single regex string, or a list of them.
-        :param timeout: maximum time, in seconds, to wait for a regular
-                        expression match. 0 to wait forever.
+        :param timeout: maximum time, in seconds, to wait for the login to
+                        complete, or a
+                        :class:`steelscript.cmdline.deadline.Deadline`.
+                        0 to wait forever.
         :return: Python re.MatchObject containing data on what was matched.
         """
 
@@ -69,26 +98,79 @@ class TelnetChannel(channel.Channel):
             match_res = [match_res, ]
 
         # Start channel
-        self.channel = SteelScriptTelnet(self._host, self._port)
+        self.channel = SteelScriptTelnet(
+            self._host, self._port, terminal=self._terminal,
+            width=self._width, height=self._height, binary=self._binary)
+        self._fire(hooks.CONNECT)
 
         return self._handle_init_login(match_res, timeout)
 
     def close(self):
         if self.channel is not None:
+            self._fire(hooks.CLOSE)
             self.channel.close()
 
+    def footprint(self):
+        """
+        Returns the memory held by received data not read yet.
+
+        :return: a :class:`steelscript.cmdline.footprint.Footprint`
+        """
+        footprint = super(TelnetChannel, self).footprint()
+        if self.channel is not None:
+            footprint.held['receive_buffer'] = self.channel.buffered
+        return footprint
+
+    def keepalive(self, timeout=10):
+        """
+        Sends a telnet NOP to check that the connection is still up.
+
+        The NOP is invisible to the remote application.  It is queued
+        behind any output still pending, so that it never lands in the
+        middle of it, and the socket is left non-blocking.  Telnet does
+        not acknowledge it, so a dead connection is only found once the
+        network reports the write as failed; the first probe after the
+        connection dropped may still succeed.
+
+        :param timeout: maximum time, in seconds, to wait for the NOP to be
+            sent.
+        :return: True if the NOP was sent, False if the connection is dead,
+            in which case the channel has been closed.
+        """
+        if self.channel is None or self.channel.get_socket() is None:
+            return False
+        keepalive_deadline = deadline.Deadline(timeout)
+        try:
+            self.channel.send_command(telnet.NOP)
+            while not self.channel.flush():
+                if not netutils.wait_writable(self.channel.get_socket(),
+                                              keepalive_deadline.remaining()):
+                    raise socket.timeout('Timed out sending NOP')
+            error = self.channel.pending_error()
+            if error:
+                raise socket.error(error, os.strerror(error))
+        except socket.error as e:
+            log.warning("Telnet connection to %s is dead: %s" %
+                        (self._host, e))
+            self.close()
+            return False
+        return True
+
     def _handle_init_login(self, match_res, timeout):
         """
         Handle initial login.
 
         :param match_res: Pattern(s) of prompts to look for after login.
             May be a single regex string, or a list of them.
-        :param timeout: maximum time, in seconds, to wait for a regular
-            expression match. 0 to wait forever.
+        :param timeout: maximum time, in seconds, for the whole login,
+            or a :class:`steelscript.cmdline.deadline.Deadline`.
+            0 to wait forever.
         :return: Python :class:`re.MatchObject` containing data on what
             was matched after login.
-        :raises CmdlineTimeout: if any step of the login exceeds the timeout.
+        :raises CmdlineTimeout: if the login exceeds the timeout.
         """
+        login_deadline = deadline.Deadline.coerce(timeout)
+        timeout = login_deadline.timeout
 
         # Add login prompt and password prompt so that we can detect
         # what require for login
@@ -96,44 +178,51 @@ class TelnetChannel(channel.Channel):
         reg_with_login_prompts.insert(0, self.PASSWORD_PROMPT)
         reg_with_login_prompts.insert(0, self.LOGIN_PROMPT)
 
-        (index, match, data) = self.channel.expect(reg_with_login_prompts,
-                                                   timeout)
+        (index, match, data) = self.channel.expect(
+            reg_with_login_prompts, login_deadline.remaining())
 
         if index == 0:
             # username is required for login
-            logging.debug("Sending login user ...")
+            log.debug("Sending login user ...")
             # We are Python3 now - everything is unicode, right?
             text_to_send = (self._user + self.ENTER_LINE)
             self.channel.write(text_to_send)
-            (index, match, data) = self.channel.expect(reg_with_login_prompts,
-                                                       timeout)
+            (index, match, data) = self.channel.expect(
+                reg_with_login_prompts, login_deadline.remaining())
         if index == 1:
             # password is required for login
-            logging.debug("Sending password ...")
+            log.debug("Sending password ...")
             # We are Python3 now - everything is unicode, right?
             text_to_send = (self._password + self.ENTER_LINE)
             self.channel.write(text_to_send)
-            (index, match, data) = self.channel.expect(reg_with_login_prompts,
-                                                       timeout)
+            (index, match, data) = self.channel.expect(
+                reg_with_login_prompts, login_deadline.remaining())
         # At this point, we should already logged in; raises exceptions if not
         if index < 0:
             raise exceptions.CmdlineTimeout(timeout=timeout,
                                             failed_match=match_res)
         elif index in (0, 1):
-            logging.info("Login failed, still waiting for %s prompt",
-                         ('username' if index == 0 else 'password'))
+            log.info("Login failed, still waiting for %s prompt",
+                     ('username' if index == 0 else 'password'))
             raise exceptions.CmdlineTimeout(
                 timeout=timeout,
                 failed_match=reg_with_login_prompts[index])
 
         # Login successfully if reach this point
-        logging.info('Telnet channel to "%s" started' % self._host)
+        log.info('Telnet channel to "%s" started' % self._host)
         return match
 
     def _verify_connected(self):
         """
         Verifies an established connection and transport.
 
+        This is called before each expect, so it does not wait or probe
+        the server: the connection counts as alive unless it was closed or
+        the socket recorded an error, such as a reset seen when sending.
+        Telnet does not acknowledge anything, so a connection that was
+        idle for ``keepalive_interval`` is sent a NOP, for a dead one to
+        be found by the next check.
+
         :raises ConnectionError: if we are not connected
         """
 
@@ -141,11 +230,20 @@ class TelnetChannel(channel.Channel):
             raise exceptions.ConnectionError(
                 context='Channel has not been started')
 
-        # Send an NOP to see whether connection is still alive.
+        if self.channel.get_socket() is None or (
+                self.channel.eof and not self.channel.buffered):
+            raise exceptions.ConnectionError(
+                context='Host telnet connection has been closed')
+
         try:
-            self.channel.sock.sendall(telnetlib.IAC + telnetlib.NOP)
+            error = self.channel.pending_error()
+            if error:
+                raise socket.error(error, os.strerror(error))
+            if (self.keepalive_interval and
+                    self.channel.idle >= self.keepalive_interval):
+                self.channel.send_command(telnet.NOP)
         except socket.error:
-            logging.exception('Host SSH shell has been disconnected')
+            log.exception('Host telnet connection has been disconnected')
             raise exceptions.ConnectionError
 
     def receive_all(self):
@@ -155,7 +253,7 @@ class TelnetChannel(channel.Channel):
         :return: the text that was present in the receive queue, if any.
         """
 
-        logging.debug('Receiving all data')
+        log.debug('Receiving all data')
         return self.channel.read_very_eager()
 
     def send(self, text_to_send):
@@ -164,7 +262,8 @@ class TelnetChannel(channel.Channel):
 
         :param text_to_send: Text to send, may be an empty string.
         """
-        logging.debug('Sending "%s"' % self.safe_line_feeds(text_to_send))
+        log.debug('Sending "%s"', Preview(text_to_send))
+        self._fire(hooks.SEND, text=text_to_send)
         self.channel.write(text_to_send)
 
     def expect(self, match_res, timeout=60):
@@ -180,7 +279,9 @@ class TelnetChannel(channel.Channel):
         :param match_res: Pattern(s) to look for to be considered successful.
                           May be a single regex string, or a list of them.
         :param timeout: maximum time, in seconds, to wait for a regular
-                        expression match. 0 to wait forever.
+                        expression match, or a
+                        :class:`steelscript.cmdline.deadline.Deadline`.
+                        0 to wait forever.
 
         :return: ``(output, match_object)`` where output is the output of
             the command (without the matched text), and match_object is a
@@ -193,13 +294,29 @@ class TelnetChannel(channel.Channel):
             which will be one of the elements of match_res passed in.
 
         :raises CmdlineTimeout: if no match found before timeout.
+        :raises ConnectionError: if the channel is closed.
         """
 
         match_res, safe_match_text = self._expect_init(match_res)
-        (index, matched, data) = self.channel.expect(match_res, timeout)
+        expect_deadline = deadline.Deadline.coerce(timeout)
+        stats = self._receive_stats()
+        try:
+            (index, matched, data) = self.channel.expect(
+                match_res, expect_deadline.remaining())
+        except EOFError:
+            raise exceptions.ConnectionError(
+                failed_match=match_res,
+                context='Channel unexpectedly closed')
         if index == -1:
-            raise exceptions.CmdlineTimeout(timeout=timeout,
+            self._fire(hooks.TIMEOUT, timeout=expect_deadline.timeout,
+                       failed_match=match_res)
+            raise exceptions.CmdlineTimeout(timeout=expect_deadline.timeout,
                                             failed_match=match_res)
+        # The telnet client reads internally; count its output as a single
+        # read.
+        stats.received(len(data))
+        stats.finished()
+        self._fire(hooks.RECEIVE, data=data.encode('utf8'))
         # Remove matched string at the end
         length = matched.start() - matched.end()
         if length < 0:
@@ -208,4 +325,5 @@ class TelnetChannel(channel.Channel):
         # Normalize carriage returns
         data = self.fixup_carriage_returns(data)
 
+        self._fire(hooks.MATCH, output=data, match=matched)
         return (data, matched)
@@ -0,0 +1,244 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+#
+# Command timeouts learned from past execution times.
+
+
+import os
+import re
+import json
+import time
+import inspect
+import tempfile
+import functools
+import threading
+import contextlib
+
+from steelscript.cmdline import exceptions
+from steelscript.cmdline.histogram import Histogram
+
+# Timeout used when there is no model, or not enough history.
+DEFAULT_TIMEOUT = 60
+
+
+class _Default(object):
+    # Placeholder for a timeout the caller left to the timeout model.
+
+    def __repr__(self):
+        return 'DEFAULT'
+
+
+DEFAULT = _Default()
+
+# Parts of commands that vary between runs of the "same" command.
+_VARIABLE_PARTS = [
+    (re.compile(r'"[^"]*"|\'[^\']*\''), '"*"'),
+    (re.compile(r'\b[0-9a-fA-F:]*:[0-9a-fA-F:]+\b'), '*'),
+    (re.compile(r'\b\d+(\.\d+)*(/\d+)?\b'), '*'),
+]
+
+
+def command_pattern(command):
+    """
+    Reduces a command to a pattern shared by its variants.
+
+    Quoted strings, numbers, and IP addresses are replaced with ``*``, so
+    that ``ping -c 3 10.0.0.1`` and ``ping -c 5 10.0.0.2`` share their
+    history.
+
+    :param command: the command as sent
+    :return: the pattern, as a string.
+    """
+    pattern = command.strip()
+    for regex, replacement in _VARIABLE_PARTS:
+        pattern = regex.sub(replacement, pattern)
+    return ' '.join(pattern.split())
+
+
+class TimeoutModel(object):
+    """
+    Derives command timeouts from the execution times of past runs.
+
+    A histogram of execution times is kept for each device class and
+    command pattern (see :func:`command_pattern`).  Once a command has
+    ``min_samples`` runs, its timeout is the ``quantile`` of its history
+    times ``factor``, kept between ``floor`` and ``ceiling``.  This detects
+    a hung ``show version`` within seconds while still giving a slow
+    ``show stats`` all the time it usually needs.
+
+    Runs that time out are recorded at the timeout they hit, so a timeout
+    learned too short grows back.
+
+    Pass the model to :class:`steelscript.cmdline.cli.CLI` or
+    :class:`steelscript.cmdline.shell.Shell` as ``timeout_model``; their
+    ``exec_command`` methods then use and feed it whenever no timeout is
+    given.  One model can be shared by any number of sessions and threads.
+
+    :param path: JSON file to load history from, if it exists, and to
+        :meth:`save` it to.
+    :param quantile: fraction of past runs the timeout should cover
+    :param factor: multiplier applied to that quantile
+    :param floor: smallest timeout returned, in seconds
+    :param ceiling: largest timeout returned, in seconds
+    :param min_samples: runs needed before history is used
+    :param default: timeout used until then, in seconds
+    """
+
+    def __init__(self, path=None, quantile=0.99, factor=3, floor=5,
+                 ceiling=600, min_samples=20, default=DEFAULT_TIMEOUT):
+        self.path = path
+        self.quantile = quantile
+        self.factor = factor
+        self.floor = floor
+        self.ceiling = ceiling
+        self.min_samples = min_samples
+        self.default = default
+
+        self._lock = threading.Lock()
+        self._histograms = {}
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def _histogram(self, device_class, command, create=False):
+        key = (device_class, command_pattern(command))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None and create:
+                histogram = self._histograms[key] = Histogram()
+            return histogram
+
+    def record(self, device_class, command, seconds):
+        """
+        Adds one execution time to the history of a command.
+
+        :param device_class: name of the kind of device, such as the CLI
+            class name
+        :param command: the command that ran
+        :param seconds: how long it took
+        """
+        self._histogram(device_class, command, create=True).record(seconds)
+
+    def timeout(self, device_class, command):
+        """
+        Returns the timeout to use for a command.
+
+        :param device_class: as for :meth:`record`
+        :param command: the command about to run
+        :return: seconds.
+        """
+        histogram = self._histogram(device_class, command)
+        if histogram is None or histogram.count < self.min_samples:
+            return self.default
+        learned = histogram.quantile(self.quantile) * self.factor
+        return min(self.ceiling, max(self.floor, learned))
+
+    def save(self, path=None):
+        """
+        Writes the history to a JSON file.
+
+        The file is replaced atomically, so a concurrent reader sees either
+        the old or the new history.
+
+        :param path: file to write.  Defaults to the model's ``path``.
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path to save the timeout model to")
+        with self._lock:
+            data = [{'device_class': device_class, 'pattern': pattern,
+                     'histogram': histogram.to_dict()}
+                    for (device_class, pattern), histogram
+                    in sorted(self._histograms.items())]
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': 1, 'commands': data}, f, indent=1)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def load(self, path):
+        """
+        Adds the history saved in a JSON file to the model.
+
+        :param path: file written by :meth:`save`
+        """
+        with open(path) as f:
+            data = json.load(f)
+        for entry in data['commands']:
+            histogram = Histogram.from_dict(entry['histogram'])
+            key = (entry['device_class'], entry['pattern'])
+            with self._lock:
+                existing = self._histograms.get(key)
+                if existing is None:
+                    self._histograms[key] = histogram
+                    continue
+            existing.merge(histogram)
+
+
+def learned_timeout(method):
+    """
+    Decorator letting an ``exec_command`` method use a timeout model.
+
+    The method's ``timeout`` should default to :data:`DEFAULT`.  When the
+    method is called without a timeout, the timeout is taken from its
+    object's ``_timeout_model`` if it has one, and is
+    :const:`DEFAULT_TIMEOUT` otherwise.  The method feeds the model by
+    running the command itself under :func:`recording`.
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        arguments = signature.bind(self, *args, **kwargs)
+        arguments.apply_defaults()
+        model = getattr(self, '_timeout_model', None)
+        device_class = type(self).__name__
+        command = arguments.arguments['command']
+
+        if arguments.arguments['timeout'] is DEFAULT:
+            if model is None:
+                arguments.arguments['timeout'] = DEFAULT_TIMEOUT
+            else:
+                arguments.arguments['timeout'] = model.timeout(device_class,
+                                                               command)
+        return method(*arguments.args, **arguments.kwargs)
+    return wrapper
+
+
+@contextlib.contextmanager
+def recording(session, command, timeout):
+    """
+    Context manager recording how long a command takes to the
+    ``_timeout_model`` of a session, if it has one.
+
+    It should wrap only the sending of the command and the wait for its
+    output, and not mode changes, reconnects or waits for rate limits and
+    governor slots, so that the model learns how long the command takes
+    on the device rather than how busy the session was.
+
+    :param session: the CLI or Shell running the command
+    :param command: the command run
+    :param timeout: the timeout the command is run with.  A command that
+        times out is recorded as taking that long.
+    """
+    model = getattr(session, '_timeout_model', None)
+    if model is None:
+        yield
+        return
+
+    device_class = type(session).__name__
+    start = time.time()
+    try:
+        yield
+    except exceptions.CmdlineTimeout:
+        if timeout:
+            model.record(device_class, command, timeout)
+        raise
+    model.record(device_class, command, time.time() - start)
@@ -0,0 +1,106 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import pytest
+import threading
+from unittest.mock import Mock
+
+from steelscript.cmdline.cli import actor
+from steelscript.cmdline.cli.actor import CLIActor
+from steelscript.cmdline import exceptions
+
+ANY_COMMAND = 'show version'
+ANY_TIMEOUT = 5
+
+
+@pytest.fixture
+def any_cli():
+    cli = Mock()
+    cli.exec_command.side_effect = lambda command, **kwargs: command.upper()
+    return cli
+
+
+@pytest.fixture
+def blocked_actor(any_cli):
+    # An actor whose thread is busy until the returned event is set.
+    a = CLIActor(any_cli)
+    started, release = threading.Event(), threading.Event()
+    a.call(lambda cli: started.set() or release.wait(ANY_TIMEOUT))
+    started.wait(ANY_TIMEOUT)
+    yield a, release
+    release.set()
+    a.close()
+
+
+def test_submit_returns_output(any_cli):
+    with CLIActor(any_cli) as a:
+        future = a.submit(ANY_COMMAND, timeout=30)
+        assert future.result(ANY_TIMEOUT) == ANY_COMMAND.upper()
+    any_cli.exec_command.assert_called_once_with(ANY_COMMAND, timeout=30)
+    assert any_cli._cleanup_helper.called
+
+
+def test_unstarted_cli_is_started(any_cli):
+    any_cli.channel = None
+    with CLIActor(any_cli) as a:
+        a.submit(ANY_COMMAND).result(ANY_TIMEOUT)
+    assert any_cli.start.called
+
+
+def test_errors_are_set_on_future(any_cli):
+    any_cli.exec_command.side_effect = exceptions.CLIError(ANY_COMMAND,
+                                                           mode='enable')
+    with CLIActor(any_cli) as a:
+        future = a.submit(ANY_COMMAND)
+        with pytest.raises(exceptions.CLIError):
+            future.result(ANY_TIMEOUT)
+        a.close()
+        assert a.stats()['failed'] == 1
+
+
+def test_priority_order(blocked_actor):
+    a, release = blocked_actor
+    order = []
+    for command, priority in [('poll1', actor.PRIORITY_BACKGROUND),
+                              ('user1', actor.PRIORITY_INTERACTIVE),
+                              ('poll2', actor.PRIORITY_BACKGROUND),
+                              ('user2', actor.PRIORITY_INTERACTIVE)]:
+        a.call(lambda cli, c=command: order.append(c), priority=priority)
+    assert a.queue_depth == 4
+    release.set()
+    a.close()
+    assert order == ['user1', 'user2', 'poll1', 'poll2']
+
+
+def test_cancelled_commands_do_not_run(blocked_actor, any_cli):
+    a, release = blocked_actor
+    future = a.submit(ANY_COMMAND)
+    assert future.cancel()
+    release.set()
+    a.close()
+    assert not any_cli.exec_command.called
+    assert a.stats()['cancelled'] == 1
+
+
+def test_stats(blocked_actor):
+    a, release = blocked_actor
+    a.submit(ANY_COMMAND)
+    release.set()
+    a.close()
+    stats = a.stats()
+    assert stats['submitted'] == 2
+    assert stats['completed'] == 2
+    assert stats['queue_depth'] == 0
+    assert stats['max_wait'] >= stats['mean_wait'] > 0
+
+
+def test_submit_after_close(any_cli):
+    a = CLIActor(any_cli)
+    a.close(close_cli=False)
+    assert not any_cli._cleanup_helper.called
+    with pytest.raises(RuntimeError):
+        a.submit(ANY_COMMAND)
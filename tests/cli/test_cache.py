@@ -4,10 +4,14 @@
 # accompanying the software ("License").  This software is distributed "AS IS"
 # as set forth in the License.
 
+import threading
+
 import pytest
 from unittest import mock
 
 from steelscript.cmdline import cli
+from steelscript.cmdline.footprint import Footprint
+from steelscript.cmdline.ratelimit import ConcurrencyGovernor
 
 
 UNIQUE_ID = 1234
@@ -57,8 +61,8 @@ def test_get_cli(resource):
 
     c = cache.get_cli(resource, cli_class=mock_cli_class)
 
-    mock_cli_class.assert_called_once_with(host=resource.admin_ip,
-                                           user=USERNAME,
+    mock_cli_class.assert_called_once_with(hostname=resource.admin_ip,
+                                           username=USERNAME,
                                            password=PASSWORD)
     mock_cli.start.assert_called_once_with()
     assert UNIQUE_ID in cache._cli_cache
@@ -77,3 +81,132 @@ def test_attach_cli():
     target = mock.MagicMock()
     cli.CLICache.attach_cache(target)
     assert isinstance(target.cli_cache, cli.CLICache)
+
+
+def test_get_cli_with_limits(resource):
+    governor = mock.Mock()
+    cache = cli.CLICache(commands_per_second=5, governor=governor)
+    mock_cli_class = mock.MagicMock()
+    with mock.patch('steelscript.cmdline.cli.ratelimit.get_limiter') as get:
+        cache.get_cli(resource, cli_class=mock_cli_class)
+    get.assert_called_once_with(resource.admin_ip, 5, None)
+    mock_cli_class.assert_called_once_with(hostname=resource.admin_ip,
+                                           username=USERNAME,
+                                           password=PASSWORD,
+                                           rate_limiter=get.return_value,
+                                           governor=governor)
+
+
+def footprint_cli_class(sizes):
+    """A CLI class whose CLIs hold the bytes given by host in sizes."""
+    def cli_class(hostname, username, password, **limits):
+        cli = mock.MagicMock()
+        cli.footprint.side_effect = lambda: Footprint(
+            {'receive_buffer': sizes[hostname]})
+        return cli
+    return cli_class
+
+
+def resources(count):
+    return [mock.MagicMock(uniqueid=index, admin_ip=index,
+                           username=USERNAME, password=PASSWORD)
+            for index in range(count)]
+
+
+def test_footprint():
+    sizes = {0: 100, 1: 50}
+    cache = cli.CLICache()
+    for r in resources(2):
+        cache.get_cli(r, cli_class=footprint_cli_class(sizes))
+    assert cache.footprint().total == 150
+    assert dict((k, f.total) for k, f in cache.footprints().items()) == sizes
+
+
+def test_memory_budget_drops_least_recently_used():
+    sizes = {0: 100, 1: 100, 2: 100}
+    cli_class = footprint_cli_class(sizes)
+    cache = cli.CLICache(memory_budget=250)
+    r = resources(3)
+    cache.get_cli(r[0], cli_class)
+    cache.get_cli(r[1], cli_class)
+    # Using the first CLI makes the second the least recently used.
+    cache.get_cli(r[0], cli_class)
+    cache.get_cli(r[2], cli_class)
+    assert list(cache._cli_cache) == [0, 2]
+    assert cache.evictions == 1
+
+
+def test_trim_with_session_budget():
+    sizes = {0: 10, 1: 1000, 2: 10}
+    cache = cli.CLICache(session_budget=500)
+    for r in resources(3):
+        cache.get_cli(r, footprint_cli_class(sizes))
+    # Budgets are only checked as new CLIs are cached if there is a
+    # memory budget.
+    assert len(cache._cli_cache) == 3
+    assert cache.trim() == [1]
+    assert list(cache._cli_cache) == [0, 2]
+    sizes[0] = 1000
+    cache.memory_budget = 5
+    assert cache.trim() == [0, 2]
+    assert cache.evictions == 3
+
+
+def test_trim_without_budget():
+    cache = cli.CLICache()
+    for r in resources(2):
+        cache.get_cli(r, footprint_cli_class({0: 10 ** 9, 1: 10 ** 9}))
+    assert cache.trim() == []
+    assert len(cache._cli_cache) == 2
+
+
+class StubChannel(object):
+    """A channel that connects to nothing."""
+
+    def __init__(self, **kwargs):
+        pass
+
+    def start(self, match_res=None, timeout=None):
+        pass
+
+    def close(self):
+        pass
+
+
+class StubCLI(cli.CLI):
+
+    def __init__(self, **kwargs):
+        super(StubCLI, self).__init__(channel_class=StubChannel, **kwargs)
+
+
+def test_governor_slots_are_per_device():
+    governor = ConcurrencyGovernor(max_per_host=1)
+    cache = cli.CLICache(governor=governor)
+    clis = []
+
+    def get_clis():
+        for r in resources(2):
+            r.admin_ip = '10.0.0.%d' % r.uniqueid
+            clis.append(cache.get_cli(r, StubCLI))
+
+    # A shared slot would block the second device forever.
+    thread = threading.Thread(target=get_clis)
+    thread.daemon = True
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert len(clis) == 2
+    assert governor.in_use('10.0.0.0') == governor.in_use('10.0.0.1') == 1
+    cache.drop_all()
+    for c in clis:
+        c._cleanup_helper()
+    assert governor.in_use() == 0
+
+
+def test_governor_slot_with_deprecated_host():
+    governor = ConcurrencyGovernor(max_per_host=1)
+    c = StubCLI(host=HOSTNAME, governor=governor)
+    c.start()
+    assert governor.in_use(HOSTNAME) == 1
+    c._cleanup_helper()
+    assert governor.in_use(HOSTNAME) == 0
@@ -9,8 +9,11 @@ import pytest
 from unittest.mock import Mock, MagicMock, patch
 
 from steelscript.cmdline.cli import CLI, DEFAULT_MACHINE_MANAGER_URI
-from steelscript.cmdline import exceptions
+from steelscript.cmdline import exceptions, retry
 from steelscript.cmdline.sshchannel import SSHChannel
+from steelscript.cmdline.ratelimit import ConcurrencyGovernor
+from steelscript.cmdline.instrumentation import Instrumentation
+from steelscript.common.exceptions import RvbdConnectException
 
 ANY_HOST = 'sh1'
 ANY_USER = 'user1'
@@ -62,21 +65,25 @@ def test_members_initialize_correctly(any_cli):
 def test_start_initialize_ssh(any_cli, prompt_match):
     cli = CLI(hostname=ANY_HOST, username=ANY_USER, password=ANY_PASSWORD,
               terminal=ANY_TERMINAL, channel_class=SSHChannel)
-    module = 'steelscript.cmdline.sshchannel.SSHChannel.__new__'
-    with patch(module) as channel_new:
+    # Patching __init__ rather than __new__, which cannot be restored and
+    # breaks SSHChannel for the tests that follow.
+    with patch.object(SSHChannel, '__init__', return_value=None) as \
+            channel_init, patch.object(SSHChannel, 'start'), \
+            patch.object(SSHChannel, 'close'):
         module = 'steelscript.cmdline.cli.test_tcp_conn'
         with patch(module) as mock_test:
             mock_test.return_value = True
             cli.start()
-        channel_new.assert_called_with(SSHChannel,
-                                       hostname=ANY_HOST,
-                                       username=ANY_USER,
-                                       password=ANY_PASSWORD,
-                                       private_key_path=None,
-                                       prompt=None,
-                                       machine_name=None,
-                                       machine_manager_uri='qemu:///system',
-                                       terminal=ANY_TERMINAL)
+        assert isinstance(cli.channel, SSHChannel)
+        channel_init.assert_called_with(hostname=ANY_HOST,
+                                        username=ANY_USER,
+                                        password=ANY_PASSWORD,
+                                        private_key_path=None,
+                                        prompt=None,
+                                        machine_name=None,
+                                        machine_manager_uri='qemu:///system',
+                                        terminal=ANY_TERMINAL)
+        cli._cleanup_helper()
 
 
 def test_start_initialize_channel_class():
@@ -153,3 +160,94 @@ def test_exec_command_no_output(cli_mock_output, prompt_match):
     assert cmo.exec_command(ANY_COMMAND, output_expected=False) == ''
     with pytest.raises(exceptions.UnexpectedOutput):
         cmo.exec_command(ANY_COMMAND, output_expected=True)
+
+
+def test_keepalive_delegates_to_channel(any_cli):
+    assert not any_cli.keepalive()
+    any_cli.channel = Mock()
+    assert (any_cli.keepalive(ANY_TIMEOUT) ==
+            any_cli.channel.keepalive.return_value)
+    any_cli.channel.keepalive.assert_called_once_with(ANY_TIMEOUT)
+
+
+def test_start_holds_governor_slot_until_closed():
+    governor = ConcurrencyGovernor(max_per_host=1)
+    rate_limiter = Mock()
+    cli = CLI(hostname=ANY_HOST, username=ANY_USER, password=ANY_PASSWORD,
+              channel_class=MagicMock(), governor=governor,
+              rate_limiter=rate_limiter)
+    with patch('steelscript.cmdline.cli.test_tcp_conn', return_value=True):
+        cli.start()
+        assert governor.in_use(ANY_HOST) == 1
+        assert rate_limiter.acquire.call_count == 1
+        cli._cleanup_helper()
+        assert governor.in_use(ANY_HOST) == 0
+
+
+def test_failed_start_releases_governor_slot():
+    governor = ConcurrencyGovernor(max_per_host=1)
+    cli = CLI(hostname=ANY_HOST, username=ANY_USER, password=ANY_PASSWORD,
+              channel_class=MagicMock(), governor=governor)
+    with patch('steelscript.cmdline.cli.test_tcp_conn',
+               side_effect=exceptions.ConnectionError()):
+        with pytest.raises(exceptions.ConnectionError):
+            cli.start()
+    assert governor.in_use(ANY_HOST) == 0
+
+
+def test_unreachable_host_raises_connection_error():
+    cli = CLI(hostname=ANY_HOST, username=ANY_USER, password=ANY_PASSWORD,
+              port=22, channel_class=MagicMock())
+    with patch('steelscript.cmdline.cli.test_tcp_conn',
+               side_effect=RvbdConnectException('refused')):
+        with pytest.raises(exceptions.ConnectionError) as excinfo:
+            cli.start()
+    assert isinstance(excinfo.value.cause, RvbdConnectException)
+    assert retry.get_breaker(ANY_HOST, 22)._failures == 1
+    assert retry.get_breaker(ANY_HOST, 23)._failures == 0
+
+
+def test_reachable_port_does_not_reset_breaker():
+    breaker = retry.get_breaker(ANY_HOST, 22)
+    breaker.record_failure()
+    breaker.record_failure()
+    cli = CLI(hostname=ANY_HOST, username=ANY_USER, password=ANY_PASSWORD,
+              port=22, channel_class=MagicMock())
+    with patch('steelscript.cmdline.cli.test_tcp_conn', return_value=True):
+        assert cli._test_connection()
+    # Only the channel getting a session up shows that the host is fine.
+    assert breaker._failures == 2
+
+
+def test_restart_retries_unreachable_host():
+    policy = retry.RetryPolicy(max_attempts=3, base_delay=0, jitter=0)
+    cli = CLI(hostname=ANY_HOST, username=ANY_USER, password=ANY_PASSWORD,
+              port=22, channel_class=MagicMock(), retry_policy=policy)
+    with patch('steelscript.cmdline.cli.test_tcp_conn',
+               side_effect=[RvbdConnectException('refused'),
+                            RvbdConnectException('refused'),
+                            True]) as mock_test:
+        cli._restart()
+    assert mock_test.call_count == 3
+    assert retry.get_breaker(ANY_HOST, 22).state == retry.CircuitBreaker.CLOSED
+
+
+def test_commands_take_rate_limit_tokens(any_cli):
+    any_cli._rate_limiter = Mock()
+    any_cli.channel = Mock()
+    any_cli.channel.expect.return_value = (ANY_COMMAND_OUTPUT_DATA, None)
+    with patch('steelscript.cmdline.cli.test_tcp_conn', return_value=True):
+        any_cli._send_and_wait(ANY_COMMAND, [])
+    any_cli._rate_limiter.acquire.assert_called_once_with(timeout=None)
+
+
+def test_instrumented_command_records_phases(any_cli):
+    metrics = Instrumentation()
+    any_cli._instrumentation = metrics
+    any_cli.channel = Mock()
+    any_cli.channel.expect.return_value = (ANY_COMMAND_OUTPUT_DATA, None)
+    with patch('steelscript.cmdline.cli.test_tcp_conn', return_value=True):
+        assert any_cli.exec_command(ANY_COMMAND) == ANY_COMMAND_OUTPUT
+    phases = {s['labels'].get('phase') for s in metrics.snapshot()
+              if s['labels']['session'] == 'CLI'}
+    assert phases == {None, 'send', 'wait', 'parse'}
@@ -0,0 +1,210 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import time
+import pytest
+import threading
+from unittest.mock import Mock
+
+from steelscript.cmdline.cli import CLIMode
+from steelscript.cmdline.cli.pool import CLIPool
+from steelscript.cmdline import exceptions
+
+ANY_MODE = CLIMode.ENABLE
+
+
+class FakeCLI(object):
+    """Records what the pool does with a session."""
+
+    fail_start = False
+
+    def __init__(self):
+        self.started = False
+        self.closed = False
+        self.modes = []
+
+    def start(self):
+        if FakeCLI.fail_start:
+            raise exceptions.ConnectionError()
+        self.started = True
+
+    def enter_mode(self, mode):
+        self.modes.append(mode)
+
+    def reconnect(self):
+        pass
+
+    def _cleanup_helper(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool():
+    FakeCLI.fail_start = False
+    pool = CLIPool(FakeCLI, min_idle=2, max_size=3, mode=ANY_MODE,
+                   retry_delay=0.01)
+    yield pool
+    pool.close()
+
+
+def wait_for(condition, timeout=5):
+    expires = time.time() + timeout
+    while not condition():
+        assert time.time() < expires, 'condition not met in time'
+        time.sleep(0.005)
+
+
+def test_pool_starts_min_idle_sessions(pool):
+    wait_for(lambda: pool.idle == 2)
+    assert pool.size == 2
+
+
+def test_acquire_hands_out_started_session_in_mode(pool):
+    wait_for(lambda: pool.idle == 2)
+    cli = pool.acquire()
+    assert cli.started
+    assert cli.modes == [ANY_MODE]
+    # The pool tops itself back up.
+    wait_for(lambda: pool.idle == 2)
+    assert pool.size == 3
+    pool.release(cli)
+
+
+def test_released_session_is_reset_and_reused(pool):
+    cli = pool.acquire()
+    pool.release(cli)
+    wait_for(lambda: len(cli.modes) == 2)
+    assert cli.modes == [ANY_MODE, ANY_MODE]
+    wait_for(lambda: cli in pool._idle)
+    assert not cli.closed
+
+
+def test_discarded_session_is_closed_and_replaced(pool):
+    wait_for(lambda: pool.idle == 2)
+    with pytest.raises(exceptions.ConnectionError):
+        with pool.session() as cli:
+            raise exceptions.ConnectionError()
+    assert cli.closed
+    wait_for(lambda: pool.idle == 2)
+    assert pool.size == 2
+
+
+def test_acquire_times_out_when_exhausted(pool):
+    sessions = [pool.acquire() for _ in range(3)]
+    with pytest.raises(exceptions.CmdlineTimeout):
+        pool.acquire(timeout=0.05)
+    pool.release(sessions[0])
+    assert pool.acquire(timeout=5) is sessions[0]
+
+
+def test_acquire_waits_for_release(pool):
+    sessions = [pool.acquire() for _ in range(3)]
+    threading.Timer(0.05, pool.release, args=(sessions[1],)).start()
+    assert pool.acquire(timeout=5) is sessions[1]
+
+
+def test_start_failure_is_retried_later(pool):
+    FakeCLI.fail_start = True
+    pool.close()
+    pool = CLIPool(FakeCLI, min_idle=1, retry_delay=0.01)
+    try:
+        with pytest.raises(exceptions.ConnectionError):
+            pool.acquire()
+        FakeCLI.fail_start = False
+        wait_for(lambda: pool.idle == 1)
+    finally:
+        pool.close()
+
+
+def test_close_closes_idle_sessions(pool):
+    wait_for(lambda: pool.idle == 2)
+    cli = pool.acquire()
+    idle = list(pool._idle)
+    pool.close()
+    assert all(session.closed for session in idle)
+    assert not cli.closed
+    pool.release(cli)
+    assert cli.closed
+    with pytest.raises(exceptions.ConnectionError):
+        pool.acquire()
+
+
+def test_idle_sessions_are_watched():
+    monitor = Mock()
+    pool = CLIPool(FakeCLI, min_idle=1, health_monitor=monitor)
+    try:
+        wait_for(lambda: pool.idle == 1)
+        wait_for(lambda: monitor.watch.called)
+        cli = pool.acquire()
+        monitor.unwatch.assert_called_with(cli)
+    finally:
+        pool.close()
+
+
+def test_sessions_are_watched_before_handed_out():
+    created = threading.Event()
+    published = []
+
+    def watch(cli, **kwargs):
+        created.wait(5)
+        published.append(cli in pool._idle)
+    monitor = Mock()
+    monitor.watch.side_effect = watch
+    pool = CLIPool(FakeCLI, min_idle=1, health_monitor=monitor)
+    created.set()
+    try:
+        wait_for(lambda: pool.idle == 1)
+        assert monitor.watch.called
+        assert published == [False]
+    finally:
+        pool.close()
+
+
+def test_close_waits_for_health_check(pool):
+    wait_for(lambda: pool.idle == 2)
+    cli = pool._idle[0]
+    lock = pool._locks[id(cli)]
+    # As the health monitor does while checking a session.
+    lock.acquire()
+    closer = threading.Thread(target=pool.close)
+    closer.start()
+    try:
+        wait_for(lambda: pool.idle == 0)
+        time.sleep(0.05)
+        assert not cli.closed
+    finally:
+        lock.release()
+    closer.join(5)
+    assert cli.closed
+
+
+def test_slow_close_does_not_block_pool(pool):
+    wait_for(lambda: pool.idle == 2)
+    closing = threading.Event()
+    finish = threading.Event()
+    cli = pool.acquire()
+
+    def slow_cleanup():
+        closing.set()
+        finish.wait(5)
+    cli._cleanup_helper = slow_cleanup
+    discarder = threading.Thread(target=pool.release, args=(cli, True))
+    discarder.start()
+    try:
+        assert closing.wait(5)
+        started = time.time()
+        other = pool.acquire(timeout=1)
+        assert time.time() - started < 1
+        pool.release(other)
+    finally:
+        finish.set()
+        discarder.join(5)
+
+
+def test_max_size_below_min_idle():
+    with pytest.raises(ValueError):
+        CLIPool(FakeCLI, min_idle=3, max_size=2)
@@ -11,6 +11,7 @@ from unittest.mock import Mock, MagicMock, patch
 from steelscript.cmdline.cli.rvbd_cli import RVBD_CLI
 from steelscript.cmdline.cli import CLIMode
 from steelscript.cmdline import exceptions
+from steelscript.cmdline.deadline import Deadline
 
 ANY_HOST = 'sh1'
 ANY_USER = 'user1'
@@ -281,3 +282,83 @@ def test_get_sub_command_error(cli_mock_output, config_mode_match):
                                             config_mode_match)
     with pytest.raises(exceptions.CLIError):
         cmo.get_sub_commands(ANY_ROOT_COMMAND)
+
+
+def test_exec_command_restarts_on_connection_error(cli_mock_output,
+                                                   config_mode_match):
+    cmo = cli_mock_output
+    cmo.enter_mode = MagicMock(name='method')
+    cmo.start = MagicMock(name='method')
+    cmo._send_line_and_wait.side_effect = [
+        exceptions.ConnectionError(),
+        (ANY_COMMAND_OUTPUT_DATA, config_mode_match)]
+    assert cmo.exec_command(ANY_COMMAND) == ANY_COMMAND_OUTPUT
+    assert cmo.start.call_count == 1
+
+
+def test_enter_mode_reinit_retries_start(any_cli):
+    any_cli.enter_mode_enable = MagicMock(
+        side_effect=[exceptions.ConnectionError(), None])
+    any_cli.start = MagicMock(side_effect=[exceptions.ConnectionError(),
+                                           None])
+    with patch('steelscript.cmdline.retry.time.sleep') as sleep:
+        any_cli.enter_mode(CLIMode.ENABLE)
+    assert any_cli.start.call_count == 2
+    assert sleep.call_count == 1
+    assert any_cli.enter_mode_enable.call_count == 2
+
+
+def test_enter_mode_reinit_fails_fast_on_open_circuit(any_cli):
+    any_cli.enter_mode_enable = MagicMock(
+        side_effect=exceptions.ConnectionError())
+    any_cli.start = MagicMock(side_effect=exceptions.CircuitOpen(ANY_HOST))
+    with pytest.raises(exceptions.CircuitOpen):
+        any_cli.enter_mode(CLIMode.ENABLE)
+    assert any_cli.start.call_count == 1
+
+
+def test_exec_command_deadline_covers_mode_change(cli_mock_output,
+                                                  config_mode_match):
+    cmo = cli_mock_output
+    now = [1000.0]
+    timeouts = []
+
+    def enter_mode(mode, interface=None):
+        # Changing mode eats most of the time allowed for the command.
+        now[0] += 8
+
+    def send_line_and_wait(command, match_res, timeout):
+        timeouts.append(cmo._deadline.limit(timeout))
+        return ANY_COMMAND_OUTPUT_DATA, config_mode_match
+
+    cmo.enter_mode = enter_mode
+    cmo._send_line_and_wait.side_effect = send_line_and_wait
+    with patch('steelscript.cmdline.deadline.time.time',
+               side_effect=lambda: now[0]):
+        assert cmo.exec_command(ANY_COMMAND, timeout=10,
+                                mode=CLIMode.CONFIG) == ANY_COMMAND_OUTPUT
+    assert timeouts == [2]
+    assert cmo._deadline is None
+
+
+def test_exec_command_shared_deadline(any_cli, config_mode_match):
+    now = [1000.0]
+
+    def enter_mode(mode, interface=None):
+        now[0] += 8
+
+    any_cli.enter_mode = enter_mode
+    any_cli.channel.expect.return_value = (ANY_COMMAND_OUTPUT_DATA,
+                                           config_mode_match)
+    with patch('steelscript.cmdline.deadline.time.time',
+               side_effect=lambda: now[0]), \
+            patch('steelscript.cmdline.cli.test_tcp_conn', return_value=True):
+        deadline = Deadline(10)
+        any_cli.exec_command(ANY_COMMAND, timeout=60,
+                             mode=CLIMode.CONFIG, deadline=deadline)
+        assert any_cli.channel.expect.call_args[0][1] == 2
+        # The first command used up the rest of the shared deadline.
+        with pytest.raises(exceptions.CmdlineTimeout):
+            any_cli.exec_command(ANY_COMMAND, timeout=60,
+                                 mode=CLIMode.CONFIG, deadline=deadline)
+    assert any_cli.channel.expect.call_count == 1
@@ -0,0 +1,41 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import pytest
+
+from steelscript.cmdline import retry
+from steelscript.cmdline.simulator import DeviceSimulator
+
+
+@pytest.fixture(autouse=True)
+def reset_breakers():
+    # Failures recorded by one test must not open circuits for the next.
+    retry.reset_breakers()
+    yield
+    retry.reset_breakers()
+
+
+@pytest.fixture
+def simulator():
+    """
+    Starts device simulators, stopping them after the test::
+
+        def test_show_version(simulator):
+            sim = simulator('ios', latency=0.01)
+            cli = IOS_CLI(**sim.connect_args)
+    """
+    started = []
+
+    def start(personality='rvbd', **kwargs):
+        sim = DeviceSimulator(personality, **kwargs)
+        sim.start()
+        started.append(sim)
+        return sim
+
+    yield start
+    for sim in started:
+        sim.stop()
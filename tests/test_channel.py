@@ -5,6 +5,10 @@
 # as set forth in the License.
 
 
+import pytest
+from unittest.mock import Mock
+
+from steelscript.cmdline import hooks
 from steelscript.cmdline.channel import Channel
 
 
@@ -30,3 +34,42 @@ def test_correct_methods_required():
                 Channel.expect.__isabstractmethod__,
                 Channel.receive_all.__isabstractmethod__,
                 Channel._verify_connected.__isabstractmethod__))
+
+
+class HookedChannel(Channel):
+    def send(self, text):
+        self._fire(hooks.SEND, text=text)
+
+    def expect(self):
+        pass
+
+    def receive_all(self):
+        pass
+
+    def _verify_connected(self):
+        pass
+
+
+def test_channel_hooks():
+    callback = Mock()
+    channel, other = HookedChannel(), HookedChannel()
+    channel.add_hook(hooks.SEND, callback)
+    channel.send('ls')
+    other.send('ls')
+    callback.assert_called_once_with(channel, hooks.SEND, text='ls')
+    channel.remove_hook(hooks.SEND, callback)
+    with pytest.raises(ValueError):
+        other.remove_hook(hooks.SEND, callback)
+
+
+def test_hooks_for_all_channels():
+    callback = Mock()
+    channel = HookedChannel()
+    channel.add_hook(hooks.CLOSE, Mock())
+    Channel.hooks.add(hooks.SEND, callback)
+    try:
+        channel.send('ls')
+        HookedChannel().send('pwd')
+    finally:
+        Channel.hooks.clear()
+    assert callback.call_count == 2
@@ -0,0 +1,76 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import pytest
+from unittest.mock import patch
+
+from steelscript.cmdline import exceptions
+from steelscript.cmdline.deadline import Deadline
+from steelscript.cmdline.retry import RetryPolicy
+
+
+@pytest.fixture
+def clock():
+    now = [1000.0]
+    with patch('steelscript.cmdline.deadline.time.time',
+               side_effect=lambda: now[0]):
+        yield now
+
+
+def test_no_timeout_means_no_deadline(clock):
+    for timeout in (None, 0):
+        deadline = Deadline(timeout)
+        assert deadline.remaining() is None
+        assert not deadline.expired()
+        assert deadline.limit(5) == 5
+        assert deadline.limit() is None
+
+
+def test_remaining_counts_down(clock):
+    deadline = Deadline(10)
+    clock[0] += 4
+    assert deadline.remaining() == 6
+    clock[0] += 7
+    assert deadline.remaining() == 0
+    assert deadline.expired()
+
+
+def test_limit_clamps_to_remaining(clock):
+    deadline = Deadline(10)
+    clock[0] += 4
+    assert deadline.limit(60) == 6
+    assert deadline.limit(2) == 2
+    # A step that would wait forever still ends with the deadline.
+    assert deadline.limit(0) == 6
+
+
+def test_limit_raises_once_expired(clock):
+    deadline = Deadline(10)
+    clock[0] += 10
+    with pytest.raises(exceptions.CmdlineTimeout) as e:
+        deadline.limit(60)
+    assert e.value.timeout == 10
+
+
+def test_coerce_keeps_deadlines(clock):
+    deadline = Deadline(10)
+    assert Deadline.coerce(deadline) is deadline
+    assert Deadline.coerce(5).remaining() == 5
+
+
+def test_earliest(clock):
+    short, long = Deadline(5), Deadline(50)
+    assert Deadline.earliest(long, None, short, Deadline(0)) is short
+    assert Deadline.earliest(None, Deadline(None)).expires is None
+
+
+def test_retry_policy_limited_to():
+    policy = RetryPolicy(max_elapsed=30)
+    assert policy.limited_to(None) is policy
+    assert policy.limited_to(10).max_elapsed == 10
+    assert policy.limited_to(60).max_elapsed == 30
+    assert policy.max_elapsed == 30
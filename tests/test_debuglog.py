@@ -0,0 +1,104 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import logging
+import logging.handlers
+import pytest
+from unittest.mock import patch
+
+from steelscript.cmdline import debuglog, hooks
+from steelscript.cmdline.channel import Channel
+from steelscript.cmdline.debuglog import Preview
+
+ANY_PATTERN = r'\$ $'
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        super(RecordingHandler, self).__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class FakeChannel(Channel):
+    _host = 'sh1'
+
+    def send(self, text):
+        self._fire(hooks.SEND, text=text)
+
+    def expect(self, data):
+        self._fire(hooks.RECEIVE, data=data)
+
+    def receive_all(self):
+        pass
+
+    def _verify_connected(self):
+        pass
+
+
+def test_preview_escapes_and_truncates():
+    assert str(Preview('a\r\nb')) == 'a\\r\\nb'
+    assert str(Preview(b'abc')) == 'abc'
+    with patch.object(debuglog, 'PREVIEW_SIZE', 3):
+        assert str(Preview('abcdef')) == 'abc...(3 more)'
+        assert repr(Preview('abcdef')) == "'abc...(3 more)'"
+    with patch.object(debuglog, 'PREVIEW_SIZE', None):
+        assert str(Preview('x' * 1000)) == 'x' * 1000
+
+
+def test_find_match_does_not_format_unless_debugging(caplog):
+    channel = FakeChannel()
+    with patch.object(Preview, '__str__') as to_str:
+        caplog.set_level(logging.INFO, logger='steelscript.cmdline.channel')
+        assert channel._find_match('prompt $ ', [ANY_PATTERN])
+        assert not to_str.called
+
+    caplog.set_level(logging.DEBUG, logger='steelscript.cmdline.channel')
+    with patch.object(debuglog, 'PREVIEW_SIZE', 10):
+        channel._find_match('line\n' * 100, [ANY_PATTERN])
+        # Formatted when the message is handled.
+        assert caplog.messages == [
+            r'Search "\$ $" in "line\nline\n...(490 more)"']
+
+
+def test_transcript(tmpdir):
+    channel = FakeChannel()
+    handler = debuglog.enable_transcript(RecordingHandler())
+    path = str(tmpdir.join('transcript.log'))
+    file_handler = debuglog.enable_transcript(path)
+    try:
+        channel.send('show version\r')
+        channel.expect(b'x' * 1000)
+    finally:
+        debuglog.disable_transcript(handler)
+    channel.send('not recorded')
+    debuglog.disable_transcript()
+
+    assert handler.messages == ["FakeChannel(sh1) >> 'show version\\r'",
+                                "FakeChannel(sh1) << %r" % (b'x' * 1000)]
+    with open(path) as f:
+        assert f.read().splitlines() == (handler.messages +
+                                         ["FakeChannel(sh1) >> 'not "
+                                          "recorded'"])
+    assert not Channel.hooks
+    with pytest.raises(ValueError):
+        debuglog.disable_transcript(file_handler)
+
+
+def test_transcript_footprint():
+    handler = debuglog.enable_transcript(
+        logging.handlers.MemoryHandler(capacity=1000))
+    try:
+        assert debuglog.transcript_footprint().total == 0
+        FakeChannel().expect(b'x' * 1000)
+        assert debuglog.transcript_footprint().held['transcript'] > 1000
+    finally:
+        debuglog.disable_transcript(handler)
+    assert debuglog.transcript_footprint().total == 0
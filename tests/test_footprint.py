@@ -0,0 +1,39 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import sys
+
+from steelscript.cmdline.footprint import Footprint, sizeof
+
+
+def test_footprint_totals():
+    footprint = Footprint({'receive_buffer': 10, 'recording': 5},
+                          {'receive_window': 100})
+    assert footprint.total == 15
+    assert footprint.reserved_total == 100
+    assert footprint.to_dict() == {
+        'total': 15, 'held': {'receive_buffer': 10, 'recording': 5},
+        'reserved_total': 100, 'reserved': {'receive_window': 100}}
+
+
+def test_footprints_add():
+    first = Footprint({'receive_buffer': 10}, {'receive_window': 100})
+    second = Footprint({'receive_buffer': 1, 'recording': 5})
+    total = first + second
+    assert total.held == {'receive_buffer': 11, 'recording': 5}
+    assert total.reserved == {'receive_window': 100}
+    assert first.held == {'receive_buffer': 10}
+    assert sum([first, second], Footprint()).total == 16
+
+
+def test_sizeof_counts_contents_once():
+    payload = b'x' * 1000
+    records = [(0.0, 'received', payload), (1.0, 'received', payload)]
+    size = sizeof(records)
+    assert size >= 1000 + sys.getsizeof(records)
+    assert size < 2000
+    assert sizeof({'key': payload}) > 1000
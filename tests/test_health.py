@@ -0,0 +1,97 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import threading
+from unittest.mock import Mock
+
+from steelscript.cmdline.health import HealthMonitor
+
+ANY_TIMEOUT = 3
+
+
+def any_session(alive=True):
+    session = Mock(spec=['keepalive'])
+    session.keepalive.return_value = alive
+    return session
+
+
+def test_healthy_session_is_left_alone():
+    monitor = HealthMonitor(timeout=ANY_TIMEOUT)
+    session = any_session()
+    reconnect = Mock()
+    monitor.watch(session, reconnect=reconnect)
+    assert monitor.check() == []
+    session.keepalive.assert_called_once_with(ANY_TIMEOUT)
+    assert monitor.is_healthy(session)
+    assert not reconnect.called
+
+
+def test_dead_session_is_reconnected():
+    monitor = HealthMonitor()
+    session = any_session(alive=False)
+    reconnect = Mock()
+    monitor.watch(session, reconnect=reconnect)
+    assert monitor.check() == []
+    assert reconnect.called
+    assert monitor.is_healthy(session)
+
+
+def test_reconnect_defaults_to_session_method():
+    monitor = HealthMonitor()
+    session = Mock(spec=['keepalive', 'reconnect'])
+    session.keepalive.return_value = False
+    monitor.watch(session)
+    monitor.check()
+    assert session.reconnect.called
+
+
+def test_failed_reconnect_leaves_session_unhealthy():
+    monitor = HealthMonitor()
+    session = any_session(alive=False)
+    monitor.watch(session, reconnect=Mock(side_effect=IOError('down')))
+    assert monitor.check() == [session]
+    assert not monitor.is_healthy(session)
+
+
+def test_keepalive_errors_count_as_dead():
+    monitor = HealthMonitor()
+    session = any_session()
+    session.keepalive.side_effect = IOError('reset')
+    monitor.watch(session)
+    assert monitor.check() == [session]
+
+
+def test_busy_sessions_are_skipped():
+    monitor = HealthMonitor()
+    session = any_session(alive=False)
+    lock = threading.Lock()
+    monitor.watch(session, lock=lock)
+    with lock:
+        monitor.check()
+    assert not session.keepalive.called
+    monitor.check()
+    assert session.keepalive.called
+
+
+def test_unwatch():
+    monitor = HealthMonitor()
+    session = any_session()
+    monitor.watch(session)
+    monitor.unwatch(session)
+    monitor.unwatch(session)
+    monitor.check()
+    assert not session.keepalive.called
+
+
+def test_background_thread_checks_sessions():
+    checked = threading.Event()
+    session = any_session()
+    session.keepalive.side_effect = lambda timeout: checked.set() or True
+    with HealthMonitor(interval=0.01) as monitor:
+        monitor.watch(session)
+        assert checked.wait(5)
+    assert monitor._thread is None
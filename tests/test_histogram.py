@@ -0,0 +1,59 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import json
+import pytest
+
+from steelscript.cmdline.histogram import Histogram
+
+
+def test_empty_histogram():
+    histogram = Histogram()
+    assert histogram.quantile(0.5) is None
+    assert histogram.mean is None
+
+
+def test_quantiles_are_within_one_bucket():
+    histogram = Histogram()
+    for i in range(1, 101):
+        histogram.record(i / 10.0)
+    assert histogram.count == 100
+    assert histogram.mean == pytest.approx(5.05)
+    assert 5.0 <= histogram.quantile(0.5) <= 5.0 * 1.25
+    assert 9.9 <= histogram.quantile(0.99) <= 10.0
+    assert histogram.quantile(1) == 10.0
+
+
+def test_overflow_bucket_reports_max():
+    histogram = Histogram(bounds=[1, 2])
+    histogram.record(0.5)
+    histogram.record(50)
+    assert histogram.quantile(0.5) == 1
+    assert histogram.quantile(0.99) == 50
+
+
+def test_merge():
+    a, b = Histogram(), Histogram()
+    a.record(1)
+    b.record(3)
+    b.record(2)
+    a.merge(b)
+    assert a.count == 3
+    assert a.max == 3
+    with pytest.raises(ValueError):
+        a.merge(Histogram(bounds=[1]))
+
+
+def test_round_trip_through_json():
+    for histogram in (Histogram(), Histogram(bounds=[1, 10, 100])):
+        for value in (0.2, 7, 7, 300):
+            histogram.record(value)
+        data = json.loads(json.dumps(histogram.to_dict()))
+        copy = Histogram.from_dict(data)
+        assert copy.bounds == histogram.bounds
+        assert copy.counts == histogram.counts
+        assert copy.quantile(0.9) == histogram.quantile(0.9)
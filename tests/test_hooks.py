@@ -0,0 +1,72 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import pytest
+from unittest.mock import Mock
+
+from steelscript.cmdline import hooks
+from steelscript.cmdline.hooks import HookRegistry
+
+ANY_CHANNEL = object()
+
+
+def test_empty_registry_is_false():
+    registry = HookRegistry()
+    assert not registry
+    assert not HookRegistry(parent=registry)
+    registry.add(hooks.SEND, Mock())
+    assert registry
+    assert HookRegistry(parent=registry)
+
+
+def test_fire_runs_callbacks_in_order():
+    calls = []
+    registry = HookRegistry()
+    registry.add(hooks.SEND, lambda c, e, **d: calls.append(('first', d)))
+    registry.add(hooks.SEND, lambda c, e, **d: calls.append(('second', d)))
+    registry.add(hooks.CLOSE, lambda c, e, **d: calls.append(('close', d)))
+    registry.fire(hooks.SEND, ANY_CHANNEL, text='ls\r')
+    assert calls == [('first', {'text': 'ls\r'}),
+                     ('second', {'text': 'ls\r'})]
+
+
+def test_parent_callbacks_run_after_own():
+    parent, own = Mock(), Mock()
+    registry = HookRegistry()
+    registry.add(hooks.MATCH, parent)
+    child = HookRegistry(parent=registry)
+    child.add(hooks.MATCH, own)
+    assert child.callbacks(hooks.MATCH) == (own, parent)
+    child.fire(hooks.MATCH, ANY_CHANNEL, output='', match=None)
+    own.assert_called_once_with(ANY_CHANNEL, hooks.MATCH, output='',
+                                match=None)
+    parent.assert_called_once_with(ANY_CHANNEL, hooks.MATCH, output='',
+                                   match=None)
+
+
+def test_failing_callback_does_not_stop_others():
+    callback = Mock()
+    registry = HookRegistry()
+    registry.add(hooks.RECEIVE, Mock(side_effect=RuntimeError))
+    registry.add(hooks.RECEIVE, callback)
+    registry.fire(hooks.RECEIVE, ANY_CHANNEL, data=b'x')
+    callback.assert_called_once_with(ANY_CHANNEL, hooks.RECEIVE, data=b'x')
+
+
+def test_remove_and_clear():
+    callback = Mock()
+    registry = HookRegistry()
+    with pytest.raises(ValueError):
+        registry.add('nonsense', callback)
+    registry.add(hooks.SEND, callback)
+    registry.remove(hooks.SEND, callback)
+    assert not registry
+    with pytest.raises(ValueError):
+        registry.remove(hooks.SEND, callback)
+    registry.add(hooks.SEND, callback)
+    registry.clear()
+    assert not registry
@@ -0,0 +1,120 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import pytest
+from unittest.mock import Mock
+
+from steelscript.cmdline import instrumentation
+from steelscript.cmdline.instrumentation import Instrumentation
+
+ANY_LABELS = {'session': 'RVBD_CLI', 'phase': 'wait'}
+
+
+class FakeSession(object):
+
+    def __init__(self, instrumentation=None):
+        self._instrumentation = instrumentation
+        self._received_at = None
+
+    @instrumentation.instrumented
+    def exec_command(self, command):
+        self._received_at = 0
+        return command.upper()
+
+
+def test_observe_and_snapshot():
+    metrics = Instrumentation()
+    for value in (0.1, 0.2, 0.3):
+        metrics.observe('cmdline_phase_seconds', value, **ANY_LABELS)
+    metrics.observe('cmdline_received_bytes', 5000, channel='SSHChannel')
+
+    snapshot = metrics.snapshot()
+    assert [s['name'] for s in snapshot] == ['cmdline_phase_seconds',
+                                             'cmdline_received_bytes']
+    phase = snapshot[0]
+    assert phase['labels'] == ANY_LABELS
+    assert phase['count'] == 3
+    assert phase['sum'] == pytest.approx(0.6)
+    assert phase['max'] == 0.3
+    assert 0.2 <= phase['quantiles'][0.5] <= 0.25
+    # Sizes are bucketed by powers of two.
+    assert snapshot[1]['quantiles'][0.5] == 5000
+    assert metrics.histogram('cmdline_received_bytes',
+                             channel='SSHChannel').bounds == \
+        instrumentation.SIZE_BOUNDS
+
+    metrics.reset()
+    assert metrics.snapshot() == []
+
+
+def test_timer_records_on_error():
+    metrics = Instrumentation()
+    with pytest.raises(ValueError):
+        with metrics.timer('cmdline_command_seconds', session='Shell'):
+            raise ValueError
+    assert metrics.histogram('cmdline_command_seconds',
+                             session='Shell').count == 1
+
+
+def test_prometheus_text():
+    metrics = Instrumentation()
+    metrics.observe('cmdline_received_chunks', 3, channel='a"b')
+    metrics.observe('cmdline_received_chunks', 300, channel='a"b')
+    lines = metrics.to_prometheus().splitlines()
+    assert lines[0].startswith('# HELP cmdline_received_chunks ')
+    assert lines[1] == '# TYPE cmdline_received_chunks histogram'
+    assert 'cmdline_received_chunks_bucket{channel="a\\"b",le="2"} 0' in lines
+    assert 'cmdline_received_chunks_bucket{channel="a\\"b",le="4"} 1' in lines
+    assert ('cmdline_received_chunks_bucket{channel="a\\"b",le="+Inf"} 2'
+            in lines)
+    assert 'cmdline_received_chunks_sum{channel="a\\"b"} 303.0' in lines
+    assert 'cmdline_received_chunks_count{channel="a\\"b"} 2' in lines
+    assert Instrumentation().to_prometheus() == ''
+
+
+def test_export(tmpdir):
+    metrics = Instrumentation()
+    metrics.observe('cmdline_command_seconds', 1, session='Shell')
+    path = str(tmpdir.join('cmdline.prom'))
+    callback = Mock()
+    metrics.export(path, callback=callback)
+    with open(path) as f:
+        assert f.read() == metrics.to_prometheus()
+    callback.assert_called_once_with(metrics.to_prometheus())
+    assert tmpdir.listdir() == [tmpdir.join('cmdline.prom')]
+    with pytest.raises(ValueError):
+        metrics.export()
+
+
+def test_receive_stats():
+    metrics = Instrumentation()
+    stats = metrics.receive_stats(channel='SSHChannel')
+    stats.received(0)
+    assert stats.first_byte is None
+    stats.received(100)
+    stats.received(50)
+    stats.finished()
+    assert metrics.histogram('cmdline_received_bytes',
+                             channel='SSHChannel').sum == 150
+    assert metrics.histogram('cmdline_received_chunks',
+                             channel='SSHChannel').sum == 3
+    assert metrics.histogram('cmdline_first_byte_seconds',
+                             channel='SSHChannel').count == 1
+    assert metrics.histogram('cmdline_receive_seconds',
+                             channel='SSHChannel').count == 1
+
+
+def test_instrumented_decorator():
+    assert FakeSession().exec_command('pwd') == 'PWD'
+
+    metrics = Instrumentation()
+    session = FakeSession(metrics)
+    assert session.exec_command('pwd') == 'PWD'
+    assert metrics.histogram('cmdline_command_seconds',
+                             session='FakeSession').count == 1
+    assert metrics.histogram('cmdline_phase_seconds', session='FakeSession',
+                             phase='parse').count == 1
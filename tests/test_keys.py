@@ -0,0 +1,103 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import os
+import pytest
+import paramiko
+from unittest.mock import patch
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+from steelscript.cmdline import keys
+
+ANY_PASSPHRASE = 'secret'
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    keys.clear_key_cache()
+    yield
+    keys.clear_key_cache()
+
+
+@pytest.fixture
+def rsa_key_path(tmpdir):
+    path = str(tmpdir.join('id_rsa'))
+    paramiko.RSAKey.generate(1024).write_private_key_file(path)
+    return path
+
+
+@pytest.fixture
+def ed25519_key_path(tmpdir):
+    path = str(tmpdir.join('id_ed25519'))
+    data = ed25519.Ed25519PrivateKey.generate().private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.OpenSSH,
+        serialization.NoEncryption())
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def test_loads_rsa_key(rsa_key_path):
+    assert isinstance(keys.load_private_key(rsa_key_path),
+                      paramiko.RSAKey)
+
+
+def test_loads_ecdsa_key(tmpdir):
+    path = str(tmpdir.join('id_ecdsa'))
+    paramiko.ECDSAKey.generate().write_private_key_file(path)
+    assert isinstance(keys.load_private_key(path), paramiko.ECDSAKey)
+
+
+def test_loads_ed25519_key(ed25519_key_path):
+    assert isinstance(keys.load_private_key(ed25519_key_path),
+                      paramiko.Ed25519Key)
+
+
+def test_key_is_parsed_once(rsa_key_path):
+    key = keys.load_private_key(rsa_key_path)
+    with patch.object(paramiko.RSAKey, 'from_private_key_file') as parse:
+        assert keys.load_private_key(rsa_key_path) is key
+        assert not parse.called
+
+
+def test_modified_key_is_parsed_again(rsa_key_path):
+    key = keys.load_private_key(rsa_key_path)
+    paramiko.RSAKey.generate(1024).write_private_key_file(rsa_key_path)
+    stat = os.stat(rsa_key_path)
+    os.utime(rsa_key_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert keys.load_private_key(rsa_key_path) != key
+
+
+def test_encrypted_key(tmpdir):
+    path = str(tmpdir.join('id_rsa'))
+    paramiko.RSAKey.generate(1024).write_private_key_file(
+        path, password=ANY_PASSPHRASE)
+    with pytest.raises(paramiko.PasswordRequiredException):
+        keys.load_private_key(path)
+    assert isinstance(keys.load_private_key(path, ANY_PASSPHRASE),
+                      paramiko.RSAKey)
+
+
+def test_cached_encrypted_key_checks_passphrase(tmpdir):
+    path = str(tmpdir.join('id_rsa'))
+    paramiko.RSAKey.generate(1024).write_private_key_file(
+        path, password=ANY_PASSPHRASE)
+    key = keys.load_private_key(path, ANY_PASSPHRASE)
+    with pytest.raises(paramiko.SSHException):
+        keys.load_private_key(path, 'wrong')
+    with pytest.raises(paramiko.PasswordRequiredException):
+        keys.load_private_key(path)
+    assert keys.load_private_key(path, ANY_PASSPHRASE) is key
+
+
+def test_unsupported_file_raises(tmpdir):
+    path = str(tmpdir.join('not_a_key'))
+    with open(path, 'w') as f:
+        f.write('hello')
+    with pytest.raises(paramiko.SSHException):
+        keys.load_private_key(path)
@@ -5,6 +5,9 @@
 # as set forth in the License.
 
 import re
+import time
+import threading
+
 import pytest
 from unittest import mock
 
@@ -35,6 +38,7 @@ ANY_DATA_CHAR = b'a'
 ANY_DATA_RECEIVED = 'Optimization Service: Running'
 ANY_DATA_RECEIVED_UTF8 = ANY_DATA_RECEIVED.encode()
 ANY_TIMEOUT = 120
+WOULD_BLOCK = -2
 
 PROMPT_LOGIN = '\nlogin: '
 PROMPT_PASSWORD = '\npassword: '
@@ -48,7 +52,8 @@ MATCH_ROOT = re.search(libvirtchannel.ROOT_PROMPT, PROMPT_ROOT)
 @pytest.fixture
 def any_libvirt_channel():
     return LibVirtChannel(machine_name=ANY_HOST, username=ANY_USERNAME,
-                          password=ANY_PASSWORD)
+                          password=ANY_PASSWORD,
+                          manager=libvirtchannel.ConsoleManager())
 
 
 @pytest.fixture
@@ -59,6 +64,7 @@ def connected_channel(any_libvirt_channel):
     any_libvirt_channel._domain = mock.Mock()
     any_libvirt_channel._conn = mock.Mock()
     any_libvirt_channel._stream = mock.Mock()
+    any_libvirt_channel._stream.recv.return_value = WOULD_BLOCK
     any_libvirt_channel._verify_domain_running = mock.Mock(return_value=None)
     return any_libvirt_channel
 
@@ -220,7 +226,9 @@ def test_check_console_mode_already_logged_in(any_libvirt_channel):
 
 def test_start_calls_appropriate_methods(any_libvirt_channel):
     module = 'steelscript.cmdline.libvirtchannel.libvirt.open'
-    with mock.patch(module) as lvopen:
+    event_loop = 'steelscript.cmdline.libvirtchannel.start_event_loop'
+    with mock.patch(module) as lvopen, \
+            mock.patch(event_loop) as start_event_loop:
         mock_conn = mock.Mock()
         mock_stream = mock.Mock()
         mock_retval = mock.Mock()
@@ -238,9 +246,11 @@ def test_start_calls_appropriate_methods(any_libvirt_channel):
         mock_conn.lookupByName.assert_called_with(
             any_libvirt_channel._machine_name)
         assert any_libvirt_channel._verify_domain_running.called
-        mock_conn.newStream.assert_called_with(0)
+        assert start_event_loop.called
+        mock_conn.newStream.assert_called_with(libvirt.VIR_STREAM_NONBLOCK)
         any_libvirt_channel._domain.openConsole.assert_called_with(
             None, mock_stream, libvirt.VIR_DOMAIN_CONSOLE_FORCE)
+        assert mock_stream.eventAddCallback.called
 
         assert any_libvirt_channel._handle_init_login.called
 
@@ -280,6 +290,25 @@ def test_init_login_raises(login_channel):
                                          libvirtchannel.DEFAULT_EXPECT_TIMEOUT)
 
 
+def test_init_login_is_bounded_by_timeout(connected_channel):
+    started = time.time()
+    with pytest.raises(exceptions.CmdlineTimeout):
+        connected_channel._handle_init_login([libvirtchannel.ROOT_PROMPT],
+                                             0.2)
+    # The retry after the first timeout shares the same deadline.
+    assert time.time() - started < 1
+
+
+def test_init_login_passes_deadline_to_every_expect(login_prompt_channel):
+    login_deadline = libvirtchannel.deadline.Deadline(ANY_TIMEOUT)
+    login_prompt_channel._handle_init_login([libvirtchannel.ROOT_PROMPT],
+                                            login_deadline)
+    login_prompt_channel._check_console_mode.assert_called_once_with(
+        [libvirtchannel.ROOT_PROMPT], timeout=login_deadline)
+    for call in login_prompt_channel.expect.call_args_list:
+        assert call[0][1] is login_deadline
+
+
 def test_send_calls_appropriate_methods(connected_channel):
     connected_channel.send(ANY_TEXT_TO_SEND_UNICODE)
     connected_channel._stream.send.assert_called_with(ANY_TEXT_TO_SEND_UTF8)
@@ -287,16 +316,9 @@ def test_send_calls_appropriate_methods(connected_channel):
 
 def test_receive_all(connected_channel):
     # inject bytes as returned data which get decoded to string as return val
-
-    def side_effect(handler, opaque):
-        # iterating over bytes objects returns ascii integer, so split it up
-        data = ANY_DATA_RECEIVED_UTF8
-        bytes_list = [data[i:i+1]
-                      for i in range(len(data))]
-        for c in bytes_list:
-            handler(None, c, opaque)
-
-    connected_channel._stream.recvAll.side_effect = side_effect
+    data = ANY_DATA_RECEIVED_UTF8
+    connected_channel._stream.recv.side_effect = [
+        data[:5], data[5:], WOULD_BLOCK]
     assert connected_channel.receive_all() == ANY_DATA_RECEIVED
 
 
@@ -339,3 +361,208 @@ def test_expect_returns_on_success(any_libvirt_channel):
     (data, matched) = any_libvirt_channel.expect(ANY_PROMPT_RE)
     assert data == ANY_DATA_RECEIVED
     assert matched.re.pattern == m.re.pattern
+
+
+def test_expect_reads_blocks_and_keeps_the_rest(any_libvirt_channel):
+    any_libvirt_channel._stream = mock.Mock()
+    # A character split between reads, and text after the prompt.
+    data = ('caf\u00e9 %s%s more' % (ANY_DATA_RECEIVED, ANY_PROMPT_MATCHED))
+    data = data.encode('utf8')
+    any_libvirt_channel._stream.recv.side_effect = [
+        data[:4], data[4:20], data[20:], WOULD_BLOCK]
+
+    (output, matched) = any_libvirt_channel.expect(ANY_PROMPT_RE)
+    assert output == 'caf\u00e9 %s' % ANY_DATA_RECEIVED
+    assert matched.group() == ANY_PROMPT_MATCHED
+    assert any_libvirt_channel.receive_all() == ' more'
+
+
+def test_footprint_counts_unread_data(any_libvirt_channel):
+    any_libvirt_channel._stream = mock.Mock()
+    # The prompt, then text and the first byte of a two byte character.
+    data = ('%s more \u00e9' % ANY_PROMPT_MATCHED).encode('utf8')[:-1]
+    any_libvirt_channel._stream.recv.side_effect = [data, WOULD_BLOCK]
+
+    assert any_libvirt_channel.footprint().held == {'receive_buffer': 0}
+    any_libvirt_channel.expect(ANY_PROMPT_RE)
+    assert any_libvirt_channel.footprint().held == {'receive_buffer': 7}
+
+
+def test_expect_matches_text_left_from_before(any_libvirt_channel):
+    any_libvirt_channel._stream = mock.Mock()
+    any_libvirt_channel._unread = ANY_DATA_RECEIVED + ANY_PROMPT_MATCHED
+
+    (output, matched) = any_libvirt_channel.expect(ANY_PROMPT_RE)
+    assert output == ANY_DATA_RECEIVED
+    assert not any_libvirt_channel._stream.recv.called
+
+
+def test_expect_matches_across_lines(any_libvirt_channel):
+    any_libvirt_channel._stream = mock.Mock()
+    lines = ['line %d\r\n' % i for i in range(100)]
+    chunks = [line.encode() for line in lines] + [b'\nlogin: ']
+    any_libvirt_channel._stream.recv.side_effect = chunks
+
+    (output, matched) = any_libvirt_channel.expect(
+        [libvirtchannel.LOGIN_PROMPT])
+    assert output == ''.join(lines)
+
+
+def test_expect_waits_for_stream_events(any_libvirt_channel):
+    any_libvirt_channel._stream = mock.Mock()
+    data = (ANY_DATA_RECEIVED + ANY_PROMPT_MATCHED).encode()
+    reads = [WOULD_BLOCK, data]
+
+    def recv(nbytes):
+        if reads[0] == WOULD_BLOCK:
+            # The event loop thread reports the data as it arrives.
+            threading.Timer(0.05, any_libvirt_channel._on_stream_event,
+                            (None, libvirt.VIR_STREAM_EVENT_READABLE,
+                             None)).start()
+        return reads.pop(0)
+
+    any_libvirt_channel._stream.recv.side_effect = recv
+    (output, matched) = any_libvirt_channel.expect(ANY_PROMPT_RE)
+    assert output == ANY_DATA_RECEIVED
+
+
+def test_expect_raises_if_console_closed(any_libvirt_channel):
+    any_libvirt_channel._stream = mock.Mock()
+    any_libvirt_channel._stream.recv.return_value = b''
+    with pytest.raises(exceptions.ConnectionError):
+        any_libvirt_channel.expect(ANY_PROMPT_RE, timeout=1)
+
+
+def test_expect_raises_connection_error_if_read_fails(any_libvirt_channel):
+    any_libvirt_channel._stream = mock.Mock()
+    error = libvirt.libvirtError('stream aborted')
+    any_libvirt_channel._stream.recv.side_effect = error
+    with pytest.raises(exceptions.ConnectionError) as excinfo:
+        any_libvirt_channel.expect(ANY_PROMPT_RE, timeout=1)
+    assert excinfo.value.cause is error
+
+
+def test_send_raises_connection_error_if_write_fails(connected_channel):
+    connected_channel._stream.send.side_effect = libvirt.libvirtError(
+        'stream aborted')
+    with pytest.raises(exceptions.ConnectionError):
+        connected_channel.send(ANY_TEXT_TO_SEND_UNICODE)
+
+
+def test_expect_times_out_while_waiting(any_libvirt_channel):
+    any_libvirt_channel._stream = mock.Mock()
+    any_libvirt_channel._stream.recv.return_value = WOULD_BLOCK
+    started = time.time()
+    with pytest.raises(exceptions.CmdlineTimeout):
+        any_libvirt_channel.expect(ANY_PROMPT_RE, timeout=0.2)
+    assert 0.2 <= time.time() - started < 1
+
+
+def test_expect_in_parallel_threads():
+    channels = [LibVirtChannel(machine_name='vm%d' % i) for i in range(4)]
+    results = {}
+
+    def run(channel, matching):
+        channel._stream = mock.Mock()
+        if matching:
+            channel._stream.recv.side_effect = [
+                (ANY_DATA_RECEIVED + ANY_PROMPT_MATCHED).encode()]
+        else:
+            channel._stream.recv.return_value = WOULD_BLOCK
+        try:
+            results[channel] = channel.expect(ANY_PROMPT_RE, timeout=0.3)[0]
+        except exceptions.CmdlineTimeout:
+            results[channel] = 'timeout'
+
+    threads = [threading.Thread(target=run, args=(channel, i % 2 == 0))
+               for i, channel in enumerate(channels)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [results[channel] for channel in channels] == [
+        ANY_DATA_RECEIVED, 'timeout', ANY_DATA_RECEIVED, 'timeout']
+
+
+@pytest.fixture
+def manager():
+    module = 'steelscript.cmdline.libvirtchannel'
+    with mock.patch(module + '.libvirt.open') as lvopen, \
+            mock.patch(module + '.start_event_loop'):
+        lvopen.side_effect = lambda uri: mock.Mock(name=uri)
+        yield libvirtchannel.ConsoleManager()
+
+
+def _started(manager, name, uri='qemu:///system'):
+    channel = manager.channel(name, uri, username=ANY_USERNAME,
+                              password=ANY_PASSWORD)
+    channel._verify_domain_running = mock.Mock(return_value=None)
+    channel._handle_init_login = mock.Mock(return_value=MATCH_ROOT)
+    channel.start()
+    return channel
+
+
+def test_manager_shares_connections(manager):
+    first = _started(manager, 'vm1')
+    second = _started(manager, 'vm2')
+    other = _started(manager, 'vm3', uri='qemu+ssh://hv2/system')
+    assert isinstance(first, LibVirtChannel)
+    assert first._conn is second._conn
+    assert other._conn is not first._conn
+    assert libvirtchannel.libvirt.open.call_count == 2
+
+    conn = first._conn
+    first.close()
+    assert not conn.close.called
+    second.close()
+    conn.close.assert_called_once_with()
+    assert conn.unregisterCloseCallback.called
+    assert not other._conn.close.called
+
+
+def test_close_closes_console(manager):
+    channel = _started(manager, 'vm1')
+    stream = channel._stream
+    conn = channel._conn
+    channel.close()
+    stream.eventRemoveCallback.assert_called_once_with()
+    stream.abort.assert_called_once_with()
+    conn.close.assert_called_once_with()
+    assert channel._stream is None
+    assert channel._conn is None
+    assert not channel._verify_connected()
+    channel.close()
+
+
+def test_failed_start_releases_connection(manager):
+    channel = manager.channel('vm1')
+    channel._verify_domain_running = mock.Mock(
+        side_effect=exceptions.ConnectionError)
+    with pytest.raises(exceptions.ConnectionError):
+        channel.start()
+    assert channel._conn is None
+    assert not manager._users
+
+
+def test_manager_reconnects_after_connection_closed(manager):
+    first = _started(manager, 'vm1')
+    manager._on_connection_closed(first._conn, 0, 'qemu:///system')
+    second = _started(manager, 'vm2')
+    assert second._conn is not first._conn
+    conn = first._conn
+    first.close()
+    conn.close.assert_called_once_with()
+
+
+def test_manager_close_closes_channels(manager):
+    channels = [_started(manager, 'vm%d' % i) for i in range(3)]
+    conn = channels[0]._conn
+    manager.close()
+    assert all(channel._stream is None for channel in channels)
+    conn.close.assert_called_once_with()
+
+
+def test_default_console_manager():
+    default = libvirtchannel.default_console_manager()
+    assert isinstance(default, libvirtchannel.ConsoleManager)
+    assert libvirtchannel.default_console_manager() is default
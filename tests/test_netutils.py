@@ -0,0 +1,120 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import os
+import time
+import socket
+import pytest
+from unittest.mock import patch
+
+from steelscript.cmdline import netutils
+
+V4 = socket.AF_INET
+V6 = socket.AF_INET6
+
+
+def addrinfo(family, address, port):
+    return (family, socket.SOCK_STREAM, socket.IPPROTO_TCP, '',
+            (address, port))
+
+
+@pytest.fixture
+def listener():
+    server = socket.socket(V4, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(8)
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def closed_port():
+    # A port nothing is listening on, so connections are refused.
+    sock = socket.socket(V4, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_interleave_alternates_families():
+    addrs = [addrinfo(V6, '::1', 22), addrinfo(V6, '::2', 22),
+             addrinfo(V6, '::3', 22), addrinfo(V4, '10.0.0.1', 22),
+             addrinfo(V4, '10.0.0.2', 22)]
+    ordered = [a[4][0] for a in netutils.interleave(addrs)]
+    assert ordered == ['::1', '10.0.0.1', '::2', '10.0.0.2', '::3']
+
+
+def test_resolve_times_out():
+    def slow_lookup(*args):
+        time.sleep(1)
+    with patch('steelscript.cmdline.netutils.socket.getaddrinfo',
+               side_effect=slow_lookup):
+        with pytest.raises(socket.timeout):
+            netutils.resolve('slow.example.com', 22, timeout=0.05)
+
+
+def test_resolve_raises_lookup_errors():
+    with patch('steelscript.cmdline.netutils.socket.getaddrinfo',
+               side_effect=socket.gaierror('no such host')):
+        with pytest.raises(socket.gaierror):
+            netutils.resolve('nowhere.example.com', 22, timeout=1)
+
+
+def test_connect(listener):
+    port = listener.getsockname()[1]
+    sock = netutils.connect('127.0.0.1', port, timeout=5)
+    try:
+        assert sock.getpeername() == ('127.0.0.1', port)
+        assert sock.gettimeout() is None
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+    finally:
+        sock.close()
+
+
+def test_connect_falls_back_to_next_address(listener, closed_port):
+    port = listener.getsockname()[1]
+    addrs = [addrinfo(V4, '127.0.0.1', closed_port),
+             addrinfo(V4, '127.0.0.1', port)]
+    with patch('steelscript.cmdline.netutils.resolve', return_value=addrs):
+        sock = netutils.connect('anyhost', port, timeout=5)
+    try:
+        assert sock.getpeername()[1] == port
+    finally:
+        sock.close()
+
+
+def test_connect_raises_last_error(closed_port):
+    with pytest.raises(ConnectionRefusedError):
+        netutils.connect('127.0.0.1', closed_port, timeout=5)
+
+
+def test_wait_readable():
+    left, right = socket.socketpair()
+    try:
+        assert not netutils.wait_readable(left, 0)
+        right.sendall(b'x')
+        assert netutils.wait_readable(left, 5)
+    finally:
+        left.close()
+        right.close()
+
+
+def test_wait_readable_high_descriptor():
+    # select() cannot wait on descriptors from FD_SETSIZE (1024) up.
+    resource = pytest.importorskip('resource')
+    if resource.getrlimit(resource.RLIMIT_NOFILE)[0] <= 2000:
+        pytest.skip('too few descriptors allowed')
+    left, right = socket.socketpair()
+    high = socket.socket(fileno=os.dup2(left.fileno(), 2000))
+    try:
+        right.sendall(b'x')
+        assert netutils.wait_readable(high, 5)
+    finally:
+        high.close()
+        left.close()
+        right.close()
@@ -0,0 +1,95 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import pytest
+import threading
+from unittest.mock import patch
+
+from steelscript.cmdline import ratelimit
+from steelscript.cmdline import exceptions
+from steelscript.cmdline.ratelimit import TokenBucket, ConcurrencyGovernor
+
+ANY_HOST = 'host1'
+OTHER_HOST = 'host2'
+
+
+@pytest.fixture
+def clock():
+    # A fake clock that sleeping advances.
+    now = [1000.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+    with patch('steelscript.cmdline.ratelimit.time.monotonic',
+               side_effect=lambda: now[0]), \
+            patch('steelscript.cmdline.ratelimit.time.sleep',
+                  side_effect=sleep) as mock_sleep:
+        yield mock_sleep
+
+
+def test_bucket_allows_burst_then_limits_rate(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    for i in range(3):
+        assert bucket.acquire() == 0
+    assert not bucket.try_acquire()
+    assert bucket.acquire() == 0.5
+    assert bucket.acquire() == 0.5
+
+
+def test_bucket_refills_up_to_burst(clock):
+    bucket = TokenBucket(rate=10)
+    for i in range(10):
+        bucket.acquire()
+    clock(60)
+    for i in range(10):
+        assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+
+def test_bucket_timeout_takes_nothing(clock):
+    bucket = TokenBucket(rate=1, burst=1)
+    bucket.acquire()
+    with pytest.raises(exceptions.CmdlineTimeout):
+        bucket.acquire(timeout=0.5)
+    assert bucket.acquire(timeout=1) == 1
+
+
+def test_bucket_rejects_bad_arguments():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+    with pytest.raises(ValueError):
+        TokenBucket(rate=1, burst=2).acquire(3)
+
+
+def test_governor_per_host_limit():
+    governor = ConcurrencyGovernor(max_per_host=1)
+    governor.acquire(ANY_HOST)
+    governor.acquire(OTHER_HOST)
+    with pytest.raises(exceptions.CmdlineTimeout):
+        governor.acquire(ANY_HOST, timeout=0.01)
+    governor.release(ANY_HOST)
+    with governor.slot(ANY_HOST, timeout=0.01):
+        assert governor.in_use(ANY_HOST) == 1
+        assert governor.in_use() == 2
+    assert governor.in_use(ANY_HOST) == 0
+
+
+def test_governor_total_limit_waits_for_release():
+    governor = ConcurrencyGovernor(max_total=1)
+    governor.acquire(ANY_HOST)
+    threading.Timer(0.05, governor.release, args=(ANY_HOST,)).start()
+    governor.acquire(OTHER_HOST, timeout=5)
+    assert governor.in_use(OTHER_HOST) == 1
+
+
+def test_get_limiter_is_shared_per_host():
+    ratelimit.reset_limiters()
+    limiter = ratelimit.get_limiter(ANY_HOST, rate=5)
+    assert ratelimit.get_limiter(ANY_HOST, rate=50) is limiter
+    assert limiter.rate == 5
+    assert ratelimit.get_limiter(OTHER_HOST, rate=5) is not limiter
+    ratelimit.reset_limiters()
@@ -0,0 +1,158 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import pytest
+from unittest.mock import patch
+
+from steelscript.cmdline import exceptions, hooks
+from steelscript.cmdline.channel import Channel
+from steelscript.cmdline.cli import CLI
+from steelscript.cmdline.cli.rvbd_cli import RVBD_CLI
+from steelscript.cmdline.replay import (Recorder, ReplayChannel,
+                                        read_recording, CONNECT, SENT,
+                                        RECEIVED, CLOSED)
+
+ANY_HOST = 'sh1'
+ANY_PROMPT = r'sh1 >\s*$'
+ANY_COMMAND = 'show version'
+ANY_OUTPUT = 'Product name:      rbt_sh'
+RECORDS = [
+    (0.0, CONNECT, b''),
+    (0.1, RECEIVED, b'Last login: today\r\nsh1 > '),
+    (1.0, SENT, b'show version\r'),
+    (1.5, RECEIVED, b'show version\r\n' + ANY_OUTPUT.encode() + b'\r\n'),
+    (1.6, RECEIVED, b'sh1 > '),
+    (2.0, SENT, b'exit\r'),
+    (2.1, CLOSED, b''),
+]
+
+
+class FakeChannel(Channel):
+
+    def send(self, text):
+        self._fire(hooks.SEND, text=text)
+
+    def expect(self, data):
+        self._fire(hooks.RECEIVE, data=data)
+
+    def receive_all(self):
+        pass
+
+    def _verify_connected(self):
+        pass
+
+
+@pytest.fixture
+def replay():
+    channel = ReplayChannel(RECORDS)
+    channel.start(ANY_PROMPT)
+    return channel
+
+
+def test_recorder_round_trip(tmpdir):
+    path = str(tmpdir.join('session.rec'))
+    channel, other = FakeChannel(), FakeChannel()
+    with Recorder(path, channel=channel):
+        channel._fire(hooks.CONNECT)
+        channel.send('show version\r')
+        other.send('not recorded')
+        channel.expect(b'output')
+        channel.expect('text')
+        channel._fire(hooks.CLOSE)
+    channel.send('not recorded either')
+
+    records = read_recording(path)
+    assert [(kind, payload) for seconds, kind, payload in records] == [
+        (CONNECT, b''), (SENT, b'show version\r'), (RECEIVED, b'output'),
+        (RECEIVED, b'text'), (CLOSED, b'')]
+    times = [seconds for seconds, kind, payload in records]
+    assert times == sorted(times)
+
+
+def test_recorder_records_all_channels(tmpdir):
+    path = str(tmpdir.join('session.rec'))
+    with Recorder(path):
+        FakeChannel().send('ls\r')
+    assert not Channel.hooks
+    assert read_recording(path)[0][1:] == (SENT, b'ls\r')
+
+
+def test_read_recording_rejects_other_files(tmpdir):
+    path = tmpdir.join('session.rec')
+    path.write('hello')
+    with pytest.raises(ValueError):
+        read_recording(str(path))
+
+
+def test_replay_matches_like_ssh(replay):
+    replay.send('show version\r')
+    output, match = replay.expect(ANY_PROMPT)
+    assert output == 'show version\n%s\n' % ANY_OUTPUT
+    assert match.group(0) == 'sh1 > '
+
+
+def test_replay_start_with_tuple_of_prompts():
+    replay = ReplayChannel(RECORDS)
+    match = replay.start((r'never#', ANY_PROMPT))
+    assert match.group(0) == 'sh1 > '
+
+
+def test_replay_strict_mismatch(replay):
+    with pytest.raises(exceptions.ReplayMismatch):
+        replay.send('show stats\r')
+
+
+def test_replay_not_strict():
+    replay = ReplayChannel(RECORDS, strict=False)
+    replay.start(ANY_PROMPT)
+    replay.send('show stats\r')
+    assert replay.expect(ANY_PROMPT)[0].endswith(ANY_OUTPUT + '\n')
+
+
+def test_replay_times_out_without_matching_output(replay):
+    replay.send('show version\r')
+    with pytest.raises(exceptions.CmdlineTimeout):
+        replay.expect(r'never#')
+    with pytest.raises(exceptions.CmdlineTimeout):
+        replay.expect(ANY_PROMPT)
+
+
+def test_replay_paces_output():
+    replay = ReplayChannel(RECORDS, speed=2)
+    with patch('steelscript.cmdline.replay.time.sleep') as sleep:
+        replay.start(ANY_PROMPT)
+        assert sleep.call_args[0][0] == pytest.approx(0.05, abs=0.01)
+        replay.send('show version\r')
+        replay.expect(ANY_PROMPT)
+        delays = [c[0][0] for c in sleep.call_args_list[1:]]
+    assert delays == [pytest.approx(0.25, abs=0.01),
+                      pytest.approx(0.3, abs=0.01)]
+
+
+def test_replay_requires_start():
+    with pytest.raises(exceptions.ConnectionError):
+        ReplayChannel(RECORDS).send('show version\r')
+
+
+def test_cli_runs_against_replay():
+    cli = CLI(hostname=ANY_HOST, channel_class=ReplayChannel,
+              recording=RECORDS, prompt=ANY_PROMPT)
+    cli.start(ANY_PROMPT)
+    assert cli.exec_command(ANY_COMMAND) == ANY_OUTPUT
+
+
+def test_rvbd_cli_runs_against_replay():
+    cli = RVBD_CLI(hostname=ANY_HOST, channel_class=ReplayChannel,
+                   recording=RECORDS)
+    cli.start(run_cli=False)
+    assert cli.exec_command(ANY_COMMAND, mode=None) == ANY_OUTPUT
+
+
+def test_replay_footprint_counts_recording(replay):
+    footprint = replay.footprint()
+    assert footprint.held['recording'] > sum(len(payload) for _, _, payload
+                                             in RECORDS)
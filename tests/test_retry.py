@@ -0,0 +1,156 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import pytest
+from unittest.mock import Mock, patch
+
+from steelscript.cmdline import retry
+from steelscript.cmdline import exceptions
+from steelscript.cmdline.retry import RetryPolicy, CircuitBreaker
+
+ANY_HOST = 'host1'
+
+
+@pytest.fixture
+def no_sleep():
+    with patch('steelscript.cmdline.retry.time.sleep') as mock:
+        yield mock
+
+
+@pytest.fixture
+def clock():
+    now = [1000.0]
+    with patch('steelscript.cmdline.retry.time.time',
+               side_effect=lambda: now[0]):
+        yield now
+
+
+def test_delays_grow_exponentially_without_jitter():
+    policy = RetryPolicy(max_attempts=6, base_delay=1, max_delay=10,
+                         jitter=0)
+    assert list(policy.delays()) == [1, 2, 4, 8, 10]
+
+
+def test_delays_are_jittered_below_the_backoff():
+    policy = RetryPolicy(max_attempts=4, base_delay=4, jitter=0.5)
+    with patch('steelscript.cmdline.retry.random.random', return_value=1.0):
+        assert list(policy.delays()) == [2, 4, 8]
+
+
+def test_policy_requires_a_limit():
+    with pytest.raises(TypeError):
+        RetryPolicy(max_attempts=None, max_elapsed=None)
+    with pytest.raises(ValueError):
+        RetryPolicy(max_attempts=0)
+
+
+def test_call_retries_until_success(no_sleep):
+    func = Mock(side_effect=[exceptions.ConnectionError(),
+                             exceptions.ConnectionError(), 'ok'])
+    policy = RetryPolicy(max_attempts=3, jitter=0)
+    assert policy.call(func, 1, a=2) == 'ok'
+    assert func.call_count == 3
+    func.assert_called_with(1, a=2)
+    assert [c[0][0] for c in no_sleep.call_args_list] == [1, 2]
+
+
+def test_call_raises_last_error_after_max_attempts(no_sleep):
+    func = Mock(side_effect=exceptions.ConnectionError())
+    with pytest.raises(exceptions.ConnectionError):
+        RetryPolicy(max_attempts=2).call(func)
+    assert func.call_count == 2
+
+
+def test_call_does_not_retry_other_errors(no_sleep):
+    func = Mock(side_effect=ValueError())
+    with pytest.raises(ValueError):
+        RetryPolicy().call(func)
+    assert func.call_count == 1
+
+
+def test_call_does_not_retry_open_circuits(no_sleep):
+    func = Mock(side_effect=exceptions.CircuitOpen(ANY_HOST))
+    with pytest.raises(exceptions.CircuitOpen):
+        RetryPolicy().call(func)
+    assert func.call_count == 1
+
+
+def test_call_stops_at_max_elapsed(no_sleep, clock):
+    def fail():
+        clock[0] += 5
+        raise exceptions.ConnectionError()
+    policy = RetryPolicy(max_attempts=None, base_delay=1, jitter=0,
+                         max_elapsed=10)
+    with pytest.raises(exceptions.ConnectionError):
+        policy.call(fail)
+    # 5 + 1 <= 10 allows one retry; 10 + 2 > 10 does not.
+    assert no_sleep.call_count == 1
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker(ANY_HOST, failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.check()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(exceptions.CircuitOpen) as e:
+        breaker.check()
+    assert e.value.host == ANY_HOST
+    assert e.value.retry_in == 30
+
+
+def test_breaker_allows_one_trial_when_half_open(clock):
+    breaker = CircuitBreaker(ANY_HOST, failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock[0] += 30
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.check()
+    with pytest.raises(exceptions.CircuitOpen):
+        breaker.check()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_reopens_on_failed_trial(clock):
+    breaker = CircuitBreaker(ANY_HOST, failure_threshold=3, reset_timeout=30)
+    for i in range(3):
+        breaker.record_failure()
+    clock[0] += 30
+    breaker.check()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_guard_records_outcome(clock):
+    breaker = CircuitBreaker(ANY_HOST, failure_threshold=1)
+    with pytest.raises(ValueError):
+        with breaker.guard():
+            raise ValueError()
+    assert breaker.state == CircuitBreaker.CLOSED
+    with pytest.raises(exceptions.ConnectionError):
+        with breaker.guard():
+            raise exceptions.ConnectionError()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_get_breaker_is_shared_per_host():
+    retry.reset_breakers()
+    breaker = retry.get_breaker(ANY_HOST, failure_threshold=7)
+    assert retry.get_breaker(ANY_HOST) is breaker
+    assert breaker.failure_threshold == 7
+    assert retry.get_breaker('other') is not breaker
+    retry.reset_breakers()
+    assert retry.get_breaker(ANY_HOST) is not breaker
+
+
+def test_get_breaker_is_per_port():
+    breaker = retry.get_breaker(ANY_HOST, 22)
+    assert retry.get_breaker(ANY_HOST, 22) is breaker
+    assert retry.get_breaker(ANY_HOST, 23) is not breaker
+    assert retry.get_breaker(ANY_HOST) is not breaker
+    assert breaker.name == '%s:22' % ANY_HOST
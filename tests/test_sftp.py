@@ -0,0 +1,208 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import os
+import pytest
+from unittest.mock import Mock
+from paramiko import SSHException
+
+from steelscript.cmdline.sftp import SFTPTransfer
+from steelscript.cmdline import exceptions
+
+ANY_DATA = b'0123456789' * 10000
+ANY_CHUNK_SIZE = 4096
+
+
+class FakeRemoteFile(object):
+    """Wraps a local file to look like a paramiko SFTPFile."""
+
+    def __init__(self, path, mode):
+        self._file = open(path, mode)
+        self.prefetched = None
+        self.pipelined = False
+        self.start = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._file.close()
+
+    def prefetch(self, file_size, max_requests):
+        self.prefetched = file_size
+        self.start = self._file.tell()
+
+    def set_pipelined(self, pipelined):
+        self.pipelined = pipelined
+
+    def seek(self, offset):
+        self._file.seek(offset)
+
+    def read(self, size):
+        return self._file.read(size)
+
+    def write(self, data):
+        self._file.write(data)
+
+
+class FakeSFTP(object):
+    """Serves the local filesystem the way a paramiko SFTPClient would."""
+
+    def __init__(self):
+        self.files = []
+        self.closed = False
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def open(self, path, mode):
+        remote_file = FakeRemoteFile(path, mode)
+        self.files.append(remote_file)
+        return remote_file
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_sftp():
+    return FakeSFTP()
+
+
+@pytest.fixture
+def transfer(fake_sftp):
+    sshprocess = Mock()
+    sshprocess.open_sftp.return_value = fake_sftp
+    return SFTPTransfer(sshprocess, chunk_size=ANY_CHUNK_SIZE)
+
+
+@pytest.fixture
+def remote_file(tmpdir):
+    path = str(tmpdir.join('remote'))
+    with open(path, 'wb') as f:
+        f.write(ANY_DATA)
+    return path
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_get(transfer, fake_sftp, remote_file, tmpdir):
+    local = str(tmpdir.join('local'))
+    progress = []
+    size = transfer.get(remote_file, local,
+                        callback=lambda n, total: progress.append((n, total)))
+    assert size == len(ANY_DATA)
+    assert read(local) == ANY_DATA
+    assert fake_sftp.files[0].prefetched == len(ANY_DATA)
+    assert progress[-1] == (len(ANY_DATA), len(ANY_DATA))
+    assert len(progress) == -(-len(ANY_DATA) // ANY_CHUNK_SIZE)
+    assert fake_sftp.closed
+
+
+def test_get_resume(transfer, fake_sftp, remote_file, tmpdir):
+    local = str(tmpdir.join('local'))
+    with open(local, 'wb') as f:
+        f.write(ANY_DATA[:5000])
+    transfer.get(remote_file, local, resume=True)
+    assert read(local) == ANY_DATA
+    assert fake_sftp.files[-1].start == 5000
+
+
+def test_get_resume_restarts_if_local_is_larger(transfer, fake_sftp,
+                                                remote_file, tmpdir):
+    local = str(tmpdir.join('local'))
+    with open(local, 'wb') as f:
+        f.write(ANY_DATA + b'extra')
+    transfer.get(remote_file, local, resume=True)
+    assert read(local) == ANY_DATA
+    assert fake_sftp.files[-1].start == 0
+
+
+def test_get_resume_restarts_if_source_changed(transfer, fake_sftp,
+                                               remote_file, tmpdir):
+    local = str(tmpdir.join('local'))
+    with open(local, 'wb') as f:
+        f.write(ANY_DATA[:4000] + b'x' * 1000)
+    transfer.get(remote_file, local, resume=True)
+    assert read(local) == ANY_DATA
+    assert fake_sftp.files[-1].start == 0
+
+
+def test_get_without_resume_overwrites(transfer, remote_file, tmpdir):
+    local = str(tmpdir.join('local'))
+    with open(local, 'wb') as f:
+        f.write(ANY_DATA[:5000])
+    transfer.get(remote_file, local)
+    assert read(local) == ANY_DATA
+
+
+def test_put(transfer, fake_sftp, remote_file, tmpdir):
+    dest = str(tmpdir.join('dest'))
+    assert transfer.put(remote_file, dest) == len(ANY_DATA)
+    assert read(dest) == ANY_DATA
+    assert fake_sftp.files[0].pipelined
+
+
+def test_put_resume(transfer, remote_file, tmpdir):
+    dest = str(tmpdir.join('dest'))
+    with open(dest, 'wb') as f:
+        f.write(ANY_DATA[:7000])
+    progress = []
+    transfer.put(remote_file, dest, resume=True,
+                 callback=lambda n, total: progress.append(n))
+    assert read(dest) == ANY_DATA
+    assert progress[0] == 7000 + ANY_CHUNK_SIZE
+
+
+def test_put_resume_restarts_if_source_changed(transfer, remote_file, tmpdir):
+    dest = str(tmpdir.join('dest'))
+    with open(dest, 'wb') as f:
+        f.write(b'x' * 7000)
+    progress = []
+    transfer.put(remote_file, dest, resume=True,
+                 callback=lambda n, total: progress.append(n))
+    assert read(dest) == ANY_DATA
+    assert progress[0] == ANY_CHUNK_SIZE
+
+
+def test_get_many(transfer, remote_file, tmpdir):
+    files = {remote_file: str(tmpdir.join('local1'))}
+    other = str(tmpdir.join('remote2'))
+    with open(other, 'wb') as f:
+        f.write(b'abc')
+    files[other] = str(tmpdir.join('local2'))
+
+    progress = {}
+
+    def callback(path, n, total):
+        progress[path] = (n, total)
+
+    results = transfer.get_many(files, callback=callback, max_workers=2)
+    assert results == {remote_file: len(ANY_DATA), other: 3}
+    assert progress[other] == (3, 3)
+    for remote, local in files.items():
+        assert read(local) == read(remote)
+
+
+def test_get_many_raises_after_finishing_others(transfer, remote_file,
+                                                tmpdir):
+    local = str(tmpdir.join('local'))
+    files = [(str(tmpdir.join('missing')), str(tmpdir.join('nope'))),
+             (remote_file, local)]
+    with pytest.raises(OSError):
+        transfer.get_many(files)
+    assert read(local) == ANY_DATA
+
+
+def test_ssh_errors_become_connection_errors(remote_file, tmpdir):
+    sshprocess = Mock()
+    sshprocess.open_sftp.side_effect = SSHException('no sftp')
+    with pytest.raises(exceptions.ConnectionError):
+        SFTPTransfer(sshprocess).get(remote_file, str(tmpdir.join('x')))
@@ -5,11 +5,16 @@
 # as set forth in the License.
 
 
+import gzip
 import pytest
 from unittest.mock import patch, Mock, MagicMock
 from paramiko import SSHException
 
+from steelscript.cmdline import shell
 from steelscript.cmdline.shell import Shell
+from steelscript.cmdline.ratelimit import ConcurrencyGovernor
+from steelscript.cmdline.instrumentation import Instrumentation
+from steelscript.cmdline.timeouts import TimeoutModel
 from steelscript.cmdline import exceptions
 
 ANY_HOST = 'host1'
@@ -88,3 +93,156 @@ def test_exec_command_unexpected_non_output(shell_mock_output):
     shell_mock_output._exec_paramiko_command.return_value = NO_OUTPUT
     with pytest.raises(exceptions.UnexpectedOutput):
         shell_mock_output.exec_command(ANY_COMMAND, output_expected=True)
+
+
+def test_get_connects_and_transfers(any_shell):
+    with patch('steelscript.cmdline.shell.sftp.SFTPTransfer') as transfer:
+        transfer.return_value.get.return_value = 42
+        assert any_shell.get('/remote', '/local') == 42
+        assert any_shell.sshprocess.connect.called
+        transfer.assert_called_once_with(any_shell.sshprocess)
+        transfer.return_value.get.assert_called_once_with(
+            '/remote', '/local', callback=None, resume=False)
+
+
+def test_get_many_passes_options(any_shell):
+    files = {'/remote': '/local'}
+    with patch('steelscript.cmdline.shell.sftp.SFTPTransfer') as transfer:
+        any_shell.get_many(files, resume=True, max_workers=8)
+        transfer.return_value.get_many.assert_called_once_with(
+            files, callback=None, resume=True, max_workers=8)
+
+
+def mock_channel_output(any_shell, *outputs):
+    """Make each new session return the next output, in chunks."""
+    channels = []
+    for output in outputs:
+        channel = Mock()
+        chunks = [output[i:i + 10] for i in range(0, len(output), 10)]
+        channel.recv.side_effect = chunks + [b'']
+        channel.exit_status_ready.return_value = True
+        channel.recv_exit_status.return_value = 0
+        channels.append(channel)
+    any_shell.sshprocess.transport.open_session.side_effect = channels
+    return channels
+
+
+@pytest.fixture
+def select_ready():
+    with patch('steelscript.cmdline.shell.netutils.wait_readable',
+               return_value=True) as mock:
+        yield mock
+
+
+def test_exec_command_decodes_output(any_shell, select_ready):
+    mock_channel_output(any_shell, b'some output\nmore output')
+    assert any_shell.exec_command(ANY_COMMAND) == 'some output\nmore output'
+
+
+def test_exec_command_replaces_invalid_utf8(any_shell, select_ready):
+    mock_channel_output(any_shell, b'binary \xff\xfe output')
+    assert (any_shell.exec_command(ANY_COMMAND) ==
+            'binary \ufffd\ufffd output')
+
+
+def test_exec_command_compressed(any_shell, select_ready):
+    text = 'line of log output\n' * 1000
+    channels = mock_channel_output(any_shell, b'/usr/bin/gzip\n',
+                                   gzip.compress(text.encode()))
+    assert any_shell.exec_command(ANY_COMMAND, compress=True) == text
+    wrapped = channels[1].exec_command.call_args[0][0]
+    assert wrapped == shell.COMPRESS_WRAPPER % (ANY_COMMAND, 'gzip -c')
+
+
+def test_exec_command_compressed_probes_once(any_shell, select_ready):
+    channels = mock_channel_output(any_shell, b'/usr/bin/gzip\n',
+                                   gzip.compress(b'a'), gzip.compress(b'b'))
+    assert any_shell.exec_command(ANY_COMMAND, compress=True) == 'a'
+    assert any_shell.exec_command(ANY_COMMAND, compress='gzip') == 'b'
+    assert channels[0].exec_command.call_args[0][0].startswith('command -v')
+
+
+def test_exec_command_records_command_only(any_shell, select_ready):
+    any_shell._timeout_model = TimeoutModel()
+    mock_channel_output(any_shell, b'/usr/bin/gzip\n', gzip.compress(b'a'))
+    any_shell.exec_command(ANY_COMMAND, compress=True)
+    # Recorded as the command run, and not the compressor probe.
+    assert list(any_shell._timeout_model._histograms) == [
+        ('Shell', ANY_COMMAND)]
+
+
+def test_exec_command_compress_falls_back(any_shell, select_ready):
+    channels = mock_channel_output(any_shell, b'', b'plain output')
+    assert any_shell.exec_command(ANY_COMMAND,
+                                  compress=True) == 'plain output'
+    channels[1].exec_command.assert_called_once_with(ANY_COMMAND)
+
+
+def test_exec_command_compress_unknown(any_shell):
+    with pytest.raises(ValueError):
+        any_shell.exec_command(ANY_COMMAND, compress='zip')
+
+
+def test_decompressor_passes_through_plain_output():
+    decompressor = shell._Decompressor('xz')
+    data = decompressor.feed(b'not') + decompressor.feed(b' compressed')
+    assert data + decompressor.finish() == b'not compressed'
+
+
+def test_reconnect_backs_off_between_attempts(any_shell):
+    any_shell.sshprocess.connect.side_effect = [
+        exceptions.ConnectionError(), exceptions.ConnectionError(), None]
+    with patch('steelscript.cmdline.retry.time.sleep') as sleep, \
+            patch('steelscript.cmdline.retry.random.random',
+                  return_value=0.99):
+        any_shell._reconnect(retry_count=3, retry_delay=5)
+    # Never sooner than retry_delay, whatever the random numbers.
+    assert [c[0][0] for c in sleep.call_args_list] == [5, 10]
+
+
+def test_reconnect_raises_after_retries(any_shell):
+    any_shell.sshprocess.connect.side_effect = exceptions.ConnectionError()
+    with patch('steelscript.cmdline.retry.time.sleep'):
+        with pytest.raises(exceptions.ConnectionError):
+            any_shell._reconnect(retry_count=2, retry_delay=1)
+    assert any_shell.sshprocess.connect.call_count == 2
+
+
+def test_reconnect_fails_fast_on_open_circuit(any_shell):
+    any_shell.sshprocess.connect.side_effect = exceptions.CircuitOpen(
+        ANY_HOST)
+    with pytest.raises(exceptions.CircuitOpen):
+        any_shell._reconnect(retry_count=3, retry_delay=1)
+    assert any_shell.sshprocess.connect.call_count == 1
+
+
+def test_exec_takes_token_and_governor_slot(any_shell):
+    governor = ConcurrencyGovernor(max_per_host=1)
+    any_shell._rate_limiter = Mock()
+    any_shell._governor = governor
+    seen = []
+
+    def run(*args):
+        seen.append(governor.in_use(ANY_HOST))
+        return ANY_OUTPUT
+
+    any_shell._exec_paramiko_channel = Mock(side_effect=run)
+    assert any_shell._exec_paramiko_command(ANY_COMMAND, 30, 0, 0) == \
+        ANY_OUTPUT
+    any_shell._rate_limiter.acquire.assert_called_once_with(timeout=30)
+    assert seen == [1]
+    assert governor.in_use(ANY_HOST) == 0
+
+
+def test_exec_command_instrumented(any_shell, select_ready):
+    metrics = Instrumentation()
+    any_shell._instrumentation = metrics
+    mock_channel_output(any_shell, b'some output\nmore output')
+    any_shell.exec_command(ANY_COMMAND)
+    received = metrics.histogram('cmdline_received_bytes', channel='Shell')
+    assert received.sum == 23
+    assert metrics.histogram('cmdline_received_chunks',
+                             channel='Shell').sum == 4
+    for phase in ('send', 'wait', 'parse'):
+        assert metrics.histogram('cmdline_phase_seconds', session='Shell',
+                                 phase=phase).count == 1
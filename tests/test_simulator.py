@@ -0,0 +1,217 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import re
+import time
+
+import pytest
+
+from steelscript.cmdline import cli, exceptions
+from steelscript.cmdline.cli.ios_cli import IOS_CLI
+from steelscript.cmdline.cli.rvbd_cli import RVBD_CLI
+from steelscript.cmdline.cli.vyatta_cli import VyattaCLI
+from steelscript.cmdline.shell import Shell
+from steelscript.cmdline.simulator import (Personality, RVBDPersonality,
+                                           IOSPersonality, VyattaPersonality)
+from steelscript.cmdline.sshchannel import SSHChannel
+from steelscript.cmdline.sshprocess import SSHProcess
+
+ANY_COMMAND = 'show running-config'
+ANY_OUTPUT_SIZE = 3000
+
+
+def test_personality_generates_output_size():
+    personality = RVBDPersonality(output_size=ANY_OUTPUT_SIZE)
+    output = personality.handle(ANY_COMMAND)
+    assert len(output) == ANY_OUTPUT_SIZE
+    assert output.startswith('000001 ')
+
+
+def test_personality_requires_run():
+    with pytest.raises(TypeError):
+        Personality()
+
+
+def test_personality_configured_outputs():
+    personality = IOSPersonality(outputs={ANY_COMMAND: 'text of {host}',
+                                          'show log': 10})
+    assert personality.handle(ANY_COMMAND) == 'text of sim-tr1'
+    assert len(personality.handle('show log')) == 10
+
+
+def test_rvbd_personality_modes():
+    personality = RVBDPersonality(hostname='sh1', login_shell=True)
+    assert personality.prompt() == '[admin@sh1 ~]# '
+    personality.handle('/opt/tms/bin/cli')
+    assert personality.prompt() == 'sh1 > '
+    personality.handle('enable')
+    personality.handle('configure terminal')
+    assert personality.prompt() == 'sh1 (config) # '
+    personality.handle('_shell')
+    assert personality.mode == 'shell'
+    personality.handle('exit')
+    assert personality.mode == 'config'
+    personality.handle('exit')
+    assert personality.prompt() == 'sh1 # '
+    assert personality.handle('bogus').startswith('%')
+
+
+def test_enable_password():
+    personality = IOSPersonality(enable_password='secret')
+    personality.handle('enable')
+    assert personality.prompt() == 'Password: '
+    assert not personality.echo
+    assert personality.handle('wrong').startswith('%')
+    assert personality.mode == 'normal'
+    personality.handle('enable')
+    personality.handle('secret')
+    assert personality.prompt() == 'sim-tr1#'
+
+
+def test_vyatta_exit_with_changes():
+    personality = VyattaPersonality(username='vyatta')
+    assert personality.handle('configure') == '[edit]'
+    assert personality.handle('set system host-name r1') == '[edit]'
+    assert personality.handle('exit').startswith('Cannot exit')
+    assert personality.mode == 'config'
+    personality.handle('exit discard')
+    assert personality.prompt() == 'vyatta@vyatta-sim:~$ '
+
+
+@pytest.mark.parametrize('personality, cli_class', [
+    ('rvbd', RVBD_CLI),
+    ('ios', IOS_CLI),
+    ('vyatta', VyattaCLI),
+])
+def test_cli_modes(simulator, personality, cli_class):
+    sim = simulator(personality, output_size=ANY_OUTPUT_SIZE)
+    with cli_class(**sim.connect_args) as device:
+        assert len(device.exec_command(ANY_COMMAND, mode=None)) == \
+            ANY_OUTPUT_SIZE
+        device.enter_mode(cli.CLIMode.CONFIG)
+        assert device.current_cli_mode() == cli.CLIMode.CONFIG
+        device.exec_command('set system host-name r1',
+                            mode=cli.CLIMode.CONFIG, output_expected=False)
+        if personality == 'vyatta':
+            # The change was not committed.
+            device.enter_mode(cli.CLIMode.NORMAL, force=True)
+        else:
+            device.enter_mode(cli.CLIMode.NORMAL)
+        assert device.current_cli_mode() == cli.CLIMode.NORMAL
+    assert sim.connections == 1
+
+
+def test_rvbd_cli_from_login_shell(simulator):
+    sim = simulator('rvbd', login_shell=True)
+    with RVBD_CLI(**sim.connect_args) as device:
+        assert device.current_cli_mode() == cli.CLIMode.NORMAL
+        device.enter_mode(cli.CLIMode.SHELL)
+        assert device.current_cli_mode() == cli.CLIMode.SHELL
+
+
+def test_ios_subif(simulator):
+    sim = simulator('ios')
+    with IOS_CLI(**sim.connect_args) as device:
+        device.exec_command('description uplink', mode=cli.CLIMode.SUBIF,
+                            interface='gi0/1.666', output_expected=False)
+        assert device.current_cli_mode() == cli.CLIMode.SUBIF
+        with pytest.raises(exceptions.CLIError):
+            device.exec_command('bogus', mode=cli.CLIMode.ENABLE)
+
+
+def test_paging(simulator):
+    sim = simulator('rvbd', output_size=ANY_OUTPUT_SIZE)
+    channel = SSHChannel(**sim.connect_args)
+    channel.start(RVBD_CLI.CLI_NORMAL_PROMPT)
+    try:
+        channel.send(ANY_COMMAND + '\r')
+        output, match = channel.expect(RVBD_CLI.CLI_LESS_PROMPT)
+        assert match.group().strip() == 'lines 1-23'
+        channel.send('q')
+        channel.expect(RVBD_CLI.CLI_NORMAL_PROMPT)
+    finally:
+        channel.close()
+
+
+def test_exec_request(simulator):
+    sim = simulator('vyatta')
+    process = SSHProcess(host=sim.host, user=sim.username,
+                         password=sim.password, port=sim.port)
+    process.connect()
+    try:
+        session = process.transport.open_session()
+        session.exec_command('show version')
+        output = session.makefile().read().decode()
+        assert session.recv_exit_status() == 0
+        assert output.startswith('Version:')
+    finally:
+        process.disconnect()
+
+
+def test_sftp(simulator, tmp_path):
+    root = tmp_path / 'root'
+    root.mkdir()
+    (root / 'remote.txt').write_bytes(b'x' * 100000)
+    (tmp_path / 'local.txt').write_bytes(b'y' * 1000)
+    sim = simulator('rvbd', sftp_root=str(root))
+    shell = Shell(sim.host, user=sim.username, password=sim.password,
+                  port=sim.port)
+    try:
+        assert shell.get('remote.txt', str(tmp_path / 'copy.txt')) == 100000
+        assert shell.put(str(tmp_path / 'local.txt'), 'put.txt') == 1000
+        # Paths cannot leave the root.
+        with pytest.raises(IOError):
+            shell.get('../local.txt', str(tmp_path / 'escaped.txt'))
+        # Sessions still work alongside SFTP.
+        assert shell.exec_command('show version').startswith('Product')
+    finally:
+        shell.sshprocess.disconnect()
+    assert (tmp_path / 'copy.txt').read_bytes() == b'x' * 100000
+    assert (root / 'put.txt').read_bytes() == b'y' * 1000
+
+
+def test_sftp_refused_without_root(simulator, tmp_path):
+    sim = simulator('rvbd')
+    shell = Shell(sim.host, user=sim.username, password=sim.password,
+                  port=sim.port)
+    try:
+        with pytest.raises(exceptions.ConnectionError):
+            shell.get('remote.txt', str(tmp_path / 'copy.txt'))
+    finally:
+        shell.sshprocess.disconnect()
+
+
+def test_bad_password(simulator):
+    sim = simulator('rvbd')
+    args = dict(sim.connect_args, password='wrong')
+    channel = SSHChannel(**args)
+    with pytest.raises(exceptions.ConnectionError):
+        channel.start()
+
+
+def test_latency_and_bandwidth(simulator):
+    sim = simulator('ios', latency=0.05, bandwidth=20000, output_size=2000)
+    with IOS_CLI(**sim.connect_args) as device:
+        started = time.monotonic()
+        output = device.exec_command(ANY_COMMAND, mode=None)
+        elapsed = time.monotonic() - started
+    assert re.match(r'000001 x+$', output.splitlines()[0])
+    # Latency, plus the output sent at 20 kB/s.
+    assert elapsed >= 0.05 + 0.1
+
+
+def test_footprint_counts_unread_output(simulator):
+    sim = simulator('rvbd', output_size=5000)
+    with RVBD_CLI(**sim.connect_args) as device:
+        assert device.footprint().held == {'receive_buffer': 0}
+        assert device.footprint().reserved['receive_window'] > 0
+        device.channel.send('show logging\r')
+        expires = time.time() + 5
+        while (device.footprint().total < 5000 and
+               time.time() < expires):
+            time.sleep(0.01)
+        assert device.footprint().total > 5000
@@ -6,12 +6,11 @@
 
 
 import pytest
-import select
 from unittest.mock import MagicMock, patch
 from testfixtures import Replacer, test_time
 
 from steelscript.cmdline.sshchannel import SSHChannel
-from steelscript.cmdline import exceptions
+from steelscript.cmdline import exceptions, hooks
 
 ANY_HOSTNAME = 'hostname'
 ANY_USERNAME = 'you'
@@ -44,6 +43,20 @@ def any_ssh_channel():
     return channel
 
 
+@pytest.fixture
+def readable():
+    with patch('steelscript.cmdline.sshchannel.netutils.wait_readable',
+               return_value=True) as mock:
+        yield mock
+
+
+@pytest.fixture
+def not_readable():
+    with patch('steelscript.cmdline.sshchannel.netutils.wait_readable',
+               return_value=False) as mock:
+        yield mock
+
+
 def test_members_initialized_correctly():
     with patch('steelscript.cmdline.sshchannel.sshprocess') as sshp_module:
         sshp = MagicMock()
@@ -134,42 +147,48 @@ def test_expect_raises_if_match_regex_is_empty_string(any_ssh_channel):
         any_ssh_channel.expect('')
 
 
-def test_expect_if_channel_returns_nothing(any_ssh_channel):
-    select.select = MagicMock(name='method', return_value=([1], [], []))
+def test_expect_if_channel_returns_nothing(any_ssh_channel, readable):
     any_ssh_channel.channel.recv.return_value = ''
     with pytest.raises(exceptions.ConnectionError):
         any_ssh_channel.expect(ANY_PROMPT_RE)
 
 
-def test_expect_raises_if_channel_exits_early(any_ssh_channel):
-    select.select = MagicMock(name='method', return_value=([], [], []))
+def test_expect_does_not_fire_receive_on_close(any_ssh_channel, readable):
+    received = []
+    any_ssh_channel.add_hook(
+        hooks.RECEIVE, lambda channel, event, data: received.append(data))
+    any_ssh_channel.channel.recv.side_effect = [
+        ANY_DATA_RECEIVED.encode(), b'']
+    with pytest.raises(exceptions.ConnectionError):
+        any_ssh_channel.expect(ANY_PROMPT_RE)
+    assert received == [ANY_DATA_RECEIVED.encode()]
+
+
+def test_expect_raises_if_channel_exits_early(any_ssh_channel, not_readable):
     any_ssh_channel.channel.exit_status_ready.return_value = True
     with pytest.raises(exceptions.ConnectionError):
         any_ssh_channel.expect(ANY_PROMPT_RE)
 
 
-def test_expect_if_not_ready_before_timeout(any_ssh_channel):
-    select.select = MagicMock(name='method', return_value=([], [], []))
+def test_expect_if_not_ready_before_timeout(any_ssh_channel, not_readable):
     any_ssh_channel.channel.exit_status_ready.return_value = False
     with Replacer() as r:
         mock_time = test_time(delta=(ANY_TIMEOUT+1), delta_type='seconds')
-        r.replace('steelscript.cmdline.sshchannel.time.time', mock_time)
+        r.replace('steelscript.cmdline.deadline.time.time', mock_time)
         with pytest.raises(exceptions.CmdlineTimeout):
             any_ssh_channel.expect(ANY_PROMPT_RE, ANY_TIMEOUT)
 
 
-def test_expect_timeout_if_no_matched_prompt(any_ssh_channel):
-    select.select = MagicMock(name='method', return_value=([1], [], []))
+def test_expect_timeout_if_no_matched_prompt(any_ssh_channel, readable):
     any_ssh_channel.channel.recv.return_value = ANY_DATA_RECEIVED
     with Replacer() as r:
         mock_time = test_time(delta=(ANY_TIMEOUT+1), delta_type='seconds')
-        r.replace('steelscript.cmdline.sshchannel.time.time', mock_time)
+        r.replace('steelscript.cmdline.deadline.time.time', mock_time)
         with pytest.raises(exceptions.CmdlineTimeout):
             any_ssh_channel.expect(ANY_PROMPT_RE, ANY_TIMEOUT)
 
 
-def test_expect_return_if_prompt_matched(any_ssh_channel):
-    select.select = MagicMock(name='method', return_value=([1], [], []))
+def test_expect_return_if_prompt_matched(any_ssh_channel, readable):
     mock_return = ANY_DATA_RECEIVED + '\r\n' + ANY_MATCHED_PROMPT
 
     # channel results are in bytes
@@ -180,8 +199,7 @@ def test_expect_return_if_prompt_matched(any_ssh_channel):
     assert matched.re.pattern == ANY_PROMPT_RE
 
 
-def test_expect_with_two_prompt_re(any_ssh_channel):
-    select.select = MagicMock(name='method', return_value=([1], [], []))
+def test_expect_with_two_prompt_re(any_ssh_channel, readable):
     mock_return = ANY_DATA_RECEIVED + '\n' + ANY_MATCHED_PROMPT
     any_ssh_channel.channel.recv.return_value = mock_return
 
@@ -194,8 +212,7 @@ def test_expect_with_two_prompt_re(any_ssh_channel):
     assert matched.re.pattern == ANY_PROMPT_RE
 
 
-def test_expect_returns_data_in_two_lines(any_ssh_channel):
-    select.select = MagicMock(name='method', return_value=([1], [], []))
+def test_expect_returns_data_in_two_lines(any_ssh_channel, readable):
     data = ANY_DATA_RECEIVED + '\n' + ANY_DATA_RECEIVED
     mock_return = data + '\n' + ANY_MATCHED_PROMPT
 
@@ -205,3 +222,28 @@ def test_expect_returns_data_in_two_lines(any_ssh_channel):
     (output, matched) = any_ssh_channel.expect(ANY_PROMPT_RE)
     assert output == data
     assert matched.re.pattern == ANY_PROMPT_RE
+
+
+def test_keepalive_delegates_to_sshprocess(any_ssh_channel):
+    any_ssh_channel.channel.closed = False
+    assert (any_ssh_channel.keepalive(5) ==
+            any_ssh_channel.sshprocess.keepalive.return_value)
+    any_ssh_channel.sshprocess.keepalive.assert_called_once_with(5)
+    any_ssh_channel.channel.closed = True
+    assert not any_ssh_channel.keepalive(5)
+
+
+def test_footprint(any_ssh_channel):
+    any_ssh_channel.channel.in_buffer = b'x' * 300
+    any_ssh_channel.channel.in_stderr_buffer = b'y' * 20
+    any_ssh_channel.channel.in_window_size = 1000
+    any_ssh_channel.channel.in_window_sofar = 100
+    footprint = any_ssh_channel.footprint()
+    assert footprint.held == {'receive_buffer': 320}
+    assert footprint.reserved == {'receive_window': 580}
+
+
+def test_footprint_without_channel():
+    channel = SSHChannel(hostname=ANY_HOSTNAME, username=ANY_USERNAME,
+                         password=ANY_PASSWORD)
+    assert channel.footprint().total == 0
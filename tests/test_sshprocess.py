@@ -5,10 +5,14 @@
 # as set forth in the License.
 
 
+import socket
+import threading
 import pytest
 from unittest.mock import Mock, patch
+from paramiko import AuthenticationException
 
 from steelscript.cmdline.sshprocess import SSHProcess
+from steelscript.cmdline.retry import CircuitBreaker
 from steelscript.cmdline import exceptions
 
 ANY_HOST = 'host1'
@@ -22,6 +26,12 @@ def any_sshprocess():
     return SSHProcess(ANY_HOST, ANY_USER, ANY_PASSWORD, port=ANY_PORT)
 
 
+@pytest.fixture
+def mock_connect():
+    with patch('steelscript.cmdline.sshprocess.netutils.connect') as mock:
+        yield mock
+
+
 def test_members_initialized_correctly(any_sshprocess):
     assert any_sshprocess._host == ANY_HOST
     assert any_sshprocess._user == ANY_USER
@@ -30,13 +40,37 @@ def test_members_initialized_correctly(any_sshprocess):
     assert any_sshprocess.transport is None
 
 
-def test_connect(any_sshprocess):
+def test_connect(any_sshprocess, mock_connect):
     with patch('steelscript.cmdline.sshprocess.paramiko.Transport') as mock:
         mock_transport = mock.return_value
         any_sshprocess.connect()
+        mock_connect.assert_called_once_with(
+            ANY_HOST, int(ANY_PORT), timeout=SSHProcess.CONNECT_TIMEOUT,
+            dns_timeout=SSHProcess.DNS_TIMEOUT)
+        mock.assert_called_once_with(mock_connect.return_value)
         assert any_sshprocess.transport == mock_transport
         assert any_sshprocess.transport.start_client.called
         assert any_sshprocess.transport.auth_password.called
+        assert mock_transport.auth_timeout == SSHProcess.AUTH_TIMEOUT
+
+
+def test_connect_uses_given_socket_once(mock_connect):
+    sock = Mock()
+    sshprocess = SSHProcess(ANY_HOST, ANY_USER, ANY_PASSWORD, sock=sock)
+    with patch('steelscript.cmdline.sshprocess.paramiko.Transport') as mock:
+        sshprocess.connect()
+        mock.assert_called_once_with(sock)
+        assert not mock_connect.called
+        sshprocess.connect()
+        mock.assert_called_with(mock_connect.return_value)
+
+
+def test_connect_timeout_raises_connection_error(any_sshprocess,
+                                                 mock_connect):
+    mock_connect.side_effect = socket.timeout('timed out')
+    with pytest.raises(exceptions.ConnectionError) as e:
+        any_sshprocess.connect()
+    assert isinstance(e.value.cause, socket.timeout)
 
 
 def test_disconnect_closes_transport(any_sshprocess):
@@ -66,3 +100,111 @@ def test_open_interactive_channel_if_connected(any_sshprocess):
     assert any_sshprocess.transport.open_session.called
     assert mock_channel.get_pty.called
     assert mock_channel.invoke_shell.called
+
+
+def test_open_sftp_raise_if_not_connected(any_sshprocess):
+    with pytest.raises(exceptions.ConnectionError):
+        any_sshprocess.open_sftp()
+
+
+def test_open_sftp_if_connected(any_sshprocess):
+    any_sshprocess.is_connected = Mock(return_value=True)
+    any_sshprocess.transport = Mock()
+    with patch('steelscript.cmdline.sshprocess.paramiko.SFTPClient') as mock:
+        client = any_sshprocess.open_sftp()
+        assert client == mock.from_transport.return_value
+        mock.from_transport.assert_called_once_with(
+            any_sshprocess.transport,
+            window_size=SSHProcess.SFTP_WINDOW_SIZE)
+
+
+def test_connect_fails_fast_when_circuit_open(mock_connect):
+    breaker = CircuitBreaker(ANY_HOST, failure_threshold=1)
+    sshprocess = SSHProcess(ANY_HOST, ANY_USER, ANY_PASSWORD,
+                            circuit_breaker=breaker)
+    mock_connect.side_effect = socket.error('unreachable')
+    with pytest.raises(exceptions.ConnectionError):
+        sshprocess.connect()
+    with pytest.raises(exceptions.CircuitOpen):
+        sshprocess.connect()
+    assert mock_connect.call_count == 1
+
+
+def test_auth_failure_does_not_open_circuit(mock_connect):
+    breaker = CircuitBreaker(ANY_HOST, failure_threshold=1)
+    sshprocess = SSHProcess(ANY_HOST, ANY_USER, ANY_PASSWORD,
+                            circuit_breaker=breaker)
+    with patch('steelscript.cmdline.sshprocess.paramiko.Transport') as mock:
+        mock.return_value.auth_password.side_effect = (
+            AuthenticationException('bad password'))
+        with pytest.raises(exceptions.ConnectionError):
+            sshprocess.connect()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_private_key_path_is_loaded_through_cache():
+    with patch('steelscript.cmdline.sshprocess.keys.load_private_key') as load:
+        sshprocess = SSHProcess(ANY_HOST, ANY_USER,
+                                private_key_path='/any/key',
+                                private_key_passphrase='secret')
+    load.assert_called_once_with('/any/key', 'secret')
+    assert sshprocess._private_key == load.return_value
+
+
+def test_agent_keys_tried_in_turn(mock_connect):
+    sshprocess = SSHProcess(ANY_HOST, ANY_USER, use_agent=True)
+    agent_keys = [Mock(), Mock()]
+    with patch('steelscript.cmdline.sshprocess.paramiko.Transport') as mock, \
+            patch('steelscript.cmdline.sshprocess.paramiko.Agent') as agent:
+        agent.return_value.get_keys.return_value = agent_keys
+        transport = mock.return_value
+        transport.auth_publickey.side_effect = [
+            AuthenticationException('rejected'), None]
+        sshprocess.connect()
+    assert transport.auth_publickey.call_args[0] == (ANY_USER, agent_keys[1])
+    assert not transport.auth_password.called
+    assert agent.return_value.close.called
+
+
+def test_agent_falls_back_to_password(mock_connect):
+    sshprocess = SSHProcess(ANY_HOST, ANY_USER, ANY_PASSWORD, use_agent=True)
+    with patch('steelscript.cmdline.sshprocess.paramiko.Transport') as mock, \
+            patch('steelscript.cmdline.sshprocess.paramiko.Agent') as agent:
+        agent.return_value.get_keys.return_value = ()
+        sshprocess.connect()
+    assert mock.return_value.auth_password.called
+
+
+def test_agent_without_password_fails_if_no_key_accepted(mock_connect):
+    sshprocess = SSHProcess(ANY_HOST, ANY_USER, use_agent=True)
+    with patch('steelscript.cmdline.sshprocess.paramiko.Transport'), \
+            patch('steelscript.cmdline.sshprocess.paramiko.Agent') as agent:
+        agent.return_value.get_keys.return_value = ()
+        with pytest.raises(exceptions.ConnectionError):
+            sshprocess.connect()
+
+
+def test_keepalive_when_host_answers(any_sshprocess):
+    any_sshprocess.transport = Mock()
+    any_sshprocess.transport.is_active.return_value = True
+    assert any_sshprocess.keepalive(timeout=1)
+    any_sshprocess.transport.global_request.assert_called_once_with(
+        SSHProcess.KEEPALIVE_REQUEST)
+    assert not any_sshprocess.transport.close.called
+
+
+def test_keepalive_closes_unresponsive_connection(any_sshprocess):
+    release = threading.Event()
+    any_sshprocess.transport = Mock()
+    any_sshprocess.transport.is_active.return_value = True
+    any_sshprocess.transport.global_request.side_effect = (
+        lambda kind: release.wait(5))
+    try:
+        assert not any_sshprocess.keepalive(timeout=0.05)
+        assert any_sshprocess.transport.close.called
+    finally:
+        release.set()
+
+
+def test_keepalive_when_not_connected(any_sshprocess):
+    assert not any_sshprocess.keepalive()
@@ -5,10 +5,14 @@
 # as set forth in the License.
 
 
+import socket
+
 import pytest
 from unittest.mock import patch
 
+from steelscript.cmdline import telnet
 from steelscript.cmdline.telnetchannel import SteelScriptTelnet
+from steelscript.cmdline.telnetchannel import TelnetChannel as telnet_channel
 
 ANY_MSG_WITH_ARGS = 'send %s'
 ANY_STR_SENT = 'any command'
@@ -39,3 +43,226 @@ def test_msg_without_args(any_telnet):
         any_telnet.msg(ANY_STR_SENT)
         msg = PREFIX + ANY_STR_SENT
         assert mock.debug.called_with(msg)
+
+
+def test_telnet_does_not_connect_without_host(any_telnet):
+    assert any_telnet.get_socket() is None
+    assert any_telnet.buffered == 0
+
+
+@pytest.fixture
+def protocol():
+    return telnet.TelnetProtocol(terminal='vt100', width=132, height=50)
+
+
+def test_feed_passes_data_through(protocol):
+    assert protocol.feed(b'login: ') == b'login: '
+    assert protocol.output == b''
+
+
+def test_feed_removes_commands(protocol):
+    data = b'a' + telnet.IAC + telnet.NOP + b'b' + telnet.IAC + telnet.IAC
+    assert protocol.feed(data) == b'ab\xff'
+
+
+def test_feed_removes_nvt_padding(protocol):
+    assert protocol.feed(b'a\r\0b\r\n') == b'a\rb\r\n'
+
+
+def test_feed_keeps_nuls_in_binary_mode(protocol):
+    protocol.feed(telnet.IAC + telnet.WILL + telnet.BINARY)
+    assert protocol.binary
+    assert protocol.feed(b'a\r\0b') == b'a\r\0b'
+
+
+def test_feed_handles_commands_split_across_reads(protocol):
+    data = (b'one' + telnet.IAC + telnet.DO + telnet.TTYPE +
+            telnet.IAC + telnet.SB + telnet.TTYPE + telnet.TTYPE_SEND +
+            telnet.IAC + telnet.SE + b'two')
+    cooked = b''.join(protocol.feed(data[i:i + 1])
+                      for i in range(len(data)))
+    assert cooked == b'onetwo'
+    assert protocol.output == (
+        telnet.IAC + telnet.WILL + telnet.TTYPE +
+        telnet.IAC + telnet.SB + telnet.TTYPE + telnet.TTYPE_IS + b'vt100' +
+        telnet.IAC + telnet.SE)
+
+
+def test_negotiation_agrees_to_supported_options(protocol):
+    protocol.feed(telnet.IAC + telnet.WILL + telnet.ECHO +
+                  telnet.IAC + telnet.WILL + telnet.SGA)
+    assert protocol.output == (telnet.IAC + telnet.DO + telnet.ECHO +
+                               telnet.IAC + telnet.DO + telnet.SGA)
+    assert protocol.remote == set(telnet.ECHO + telnet.SGA)
+
+
+def test_negotiation_refuses_other_options(protocol):
+    linemode = bytes([34])
+    protocol.feed(telnet.IAC + telnet.DO + linemode +
+                  telnet.IAC + telnet.WILL + linemode)
+    assert protocol.output == (telnet.IAC + telnet.WONT + linemode +
+                               telnet.IAC + telnet.DONT + linemode)
+    assert not protocol.local and not protocol.remote
+
+
+def test_negotiation_does_not_answer_repeats(protocol):
+    protocol.feed(telnet.IAC + telnet.WILL + telnet.ECHO)
+    del protocol.output[:]
+    protocol.feed(telnet.IAC + telnet.WILL + telnet.ECHO)
+    assert protocol.output == b''
+    protocol.feed(telnet.IAC + telnet.WONT + telnet.ECHO)
+    assert protocol.output == telnet.IAC + telnet.DONT + telnet.ECHO
+    assert not protocol.remote
+
+
+def test_negotiation_does_not_answer_replies_to_requests(protocol):
+    protocol.request(telnet.DO, telnet.BINARY)
+    protocol.request(telnet.DO, telnet.BINARY)
+    assert protocol.output == telnet.IAC + telnet.DO + telnet.BINARY
+    del protocol.output[:]
+    protocol.feed(telnet.IAC + telnet.WILL + telnet.BINARY)
+    assert protocol.output == b''
+    assert protocol.binary
+
+
+def test_naws_reports_window_size(protocol):
+    protocol.feed(telnet.IAC + telnet.DO + telnet.NAWS)
+    assert protocol.output == (
+        telnet.IAC + telnet.WILL + telnet.NAWS +
+        telnet.IAC + telnet.SB + telnet.NAWS + b'\x00\x84\x00\x32' +
+        telnet.IAC + telnet.SE)
+    del protocol.output[:]
+    protocol.set_window_size(255, 24)
+    assert protocol.output == (
+        telnet.IAC + telnet.SB + telnet.NAWS + b'\x00\xff\xff\x00\x18' +
+        telnet.IAC + telnet.SE)
+
+
+def test_encode_escapes_iac(protocol):
+    assert protocol.encode(b'a\xffb') == b'a\xff\xffb'
+
+
+@pytest.fixture
+def connection():
+    client, server = socket.socketpair()
+    server.settimeout(5)
+    connection = telnet.Telnet(sock=client)
+    yield connection, server
+    connection.close()
+    server.close()
+
+
+def _recv_all(server):
+    server.settimeout(0.1)
+    data = b''
+    try:
+        while True:
+            chunk = server.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+    except socket.timeout:
+        pass
+    server.settimeout(5)
+    return data
+
+
+def test_connection_offers_window_size(connection):
+    connection, server = connection
+    assert _recv_all(server) == telnet.IAC + telnet.WILL + telnet.NAWS
+
+
+def test_connection_socket_is_non_blocking(connection):
+    connection, server = connection
+    assert connection.get_socket().gettimeout() == 0.0
+    assert connection.process_input() == 0
+    assert connection.match(['prompt']) == (-1, None, '')
+
+
+def test_write_escapes_and_encodes(connection):
+    connection, server = connection
+    _recv_all(server)
+    connection.write('café\r')
+    connection.write(b'\xff')
+    assert _recv_all(server) == b'caf\xc3\xa9\r\xff\xff'
+
+
+def test_expect_matches_and_keeps_the_rest(connection):
+    connection, server = connection
+    server.sendall(b'Last login\r\n' + telnet.IAC + telnet.WILL +
+                   telnet.ECHO + b'host > more')
+    index, match, text = connection.expect(['nomatch', r'(\S+) >'], 5)
+    assert index == 1
+    assert match.group(1) == 'host'
+    assert text == 'Last login\r\nhost >'
+    assert text[match.start() - match.end():] == 'host >'
+    assert connection.read_very_eager() == ' more'
+    assert _recv_all(server).endswith(telnet.IAC + telnet.DO + telnet.ECHO)
+
+
+def test_expect_matches_across_reads(connection):
+    connection, server = connection
+    patterns = [telnet_channel.LOGIN_PROMPT]
+    server.sendall(b'banner line\r\nlog')
+    assert connection.expect(patterns, 0.1) == (
+        -1, None, 'banner line\r\nlog')
+    server.sendall(b'one\r\ntwo\r')
+    assert connection.expect(patterns, 0.1)[0] == -1
+    server.sendall(b'\nLogin: ')
+    index, match, text = connection.expect(patterns, 5)
+    assert index == 0
+    assert text == '\nLogin: '
+
+
+def test_match_searches_incrementally(connection):
+    connection, server = connection
+    patterns = [r'(^|\n)prompt> $']
+    server.sendall(b'x' * 100 + b'\nprompt')
+    while connection.buffered < 107:
+        connection.process_input()
+    assert connection.match(patterns)[0] == -1
+    assert connection._search_from == 100
+    server.sendall(b'> ')
+    while connection.buffered < 109:
+        connection.process_input()
+    index, match, text = connection.match(patterns)
+    assert index == 0
+    assert text == 'x' * 100 + '\nprompt> '
+    assert connection.buffered == 0
+
+
+def test_match_restarts_for_other_patterns(connection):
+    connection, server = connection
+    server.sendall(b'first\nsecond\nthird')
+    while connection.buffered < 18:
+        connection.process_input()
+    assert connection.match(['nomatch'])[0] == -1
+    assert connection.match(['first'])[2] == 'first'
+
+
+def test_expect_raises_on_close(connection):
+    connection, server = connection
+    _recv_all(server)
+    server.sendall(b'bye')
+    server.close()
+    assert connection.expect(['prompt'], 5) == (-1, None, 'bye')
+    with pytest.raises(EOFError):
+        connection.expect(['prompt'], 5)
+    with pytest.raises(EOFError):
+        connection.read_very_eager()
+
+
+def test_activity_is_tracked(connection):
+    connection, server = connection
+    connection.last_activity -= 100
+    assert connection.idle >= 100
+    server.sendall(b'data')
+    server.recv(64)
+    while not connection.buffered:
+        connection.process_input()
+    assert connection.idle < 100
+    connection.last_activity -= 100
+    connection.send_command(telnet.NOP)
+    assert connection.idle < 100
+    assert server.recv(64) == telnet.IAC + telnet.NOP
+    assert connection.pending_error() == 0
@@ -5,11 +5,16 @@
 # as set forth in the License.
 
 
+import socket
+import threading
+
 import pytest
 from unittest.mock import Mock, MagicMock, patch
 
 from steelscript.cmdline.telnetchannel import TelnetChannel
 from steelscript.cmdline import exceptions
+from steelscript.cmdline import hooks
+from steelscript.cmdline import telnet
 
 ANY_HOST = 'my-sh1'
 ANY_USERNAME = 'user1'
@@ -175,3 +180,168 @@ def test_expect_returns_on_success(any_telnet_channel):
     (data, matched) = any_telnet_channel.expect(ANY_PROMPT_RE)
     assert data == ANY_DATA_RECEIVED
     assert matched == mock_match
+
+
+def test_keepalive_sends_nop(any_telnet_channel):
+    any_telnet_channel.channel = _connected_channel()
+    assert any_telnet_channel.keepalive()
+    any_telnet_channel.channel.send_command.assert_called_once_with(b'\xf1')
+    assert not any_telnet_channel.channel.sock.sendall.called
+
+
+def test_keepalive_closes_dead_connection(any_telnet_channel):
+    any_telnet_channel.channel = _connected_channel()
+    any_telnet_channel.channel.send_command.side_effect = OSError(
+        'broken pipe')
+    assert not any_telnet_channel.keepalive()
+    assert any_telnet_channel.channel.close.called
+
+
+def test_keepalive_closes_connection_with_socket_error(any_telnet_channel):
+    any_telnet_channel.channel = _connected_channel(error=104)
+    assert not any_telnet_channel.keepalive()
+    assert any_telnet_channel.channel.close.called
+
+
+def test_keepalive_queues_nop_after_pending_output(any_telnet_channel):
+    local, remote = socket.socketpair()
+    local.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    any_telnet_channel.channel = telnet.Telnet(sock=local)
+    data = b'x' * 1000000
+    any_telnet_channel.channel.write(data, block=False)
+    assert any_telnet_channel.channel.wants_write
+
+    received = bytearray()
+
+    def read():
+        while not received.endswith(telnet.IAC + telnet.NOP):
+            chunk = remote.recv(65536)
+            if not chunk:
+                break
+            received.extend(chunk)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        assert any_telnet_channel.keepalive(timeout=5)
+        reader.join(5)
+        assert received.endswith(data + telnet.IAC + telnet.NOP)
+        assert not local.getblocking()
+    finally:
+        local.close()
+        remote.close()
+
+
+def test_keepalive_without_connection(any_telnet_channel):
+    assert not any_telnet_channel.keepalive()
+
+
+def test_expect_fires_hooks(any_telnet_channel):
+    any_telnet_channel._verify_connected = MagicMock(name='method')
+    any_telnet_channel.channel = Mock()
+    events = []
+    for event in hooks.EVENTS:
+        any_telnet_channel.add_hook(
+            event, lambda channel, event, **data: events.append(event))
+    mock_match = Mock()
+    mock_match.start.return_value = len(ANY_DATA_RECEIVED)
+    mock_match.end.return_value =\
+        len(ANY_DATA_RECEIVED) + len(ANY_PROMPT_MATCHED)
+    raw_data = ANY_DATA_RECEIVED + ANY_PROMPT_MATCHED
+    any_telnet_channel.channel.expect.return_value = (0, mock_match, raw_data)
+    any_telnet_channel.send(ANY_TEXT_TO_SEND)
+    any_telnet_channel.expect(ANY_PROMPT_RE)
+    any_telnet_channel.channel.expect.return_value = (-1, '', '')
+    with pytest.raises(exceptions.CmdlineTimeout):
+        any_telnet_channel.expect(ANY_PROMPT_RE)
+    any_telnet_channel.close()
+    assert events == [hooks.SEND, hooks.RECEIVE, hooks.MATCH, hooks.TIMEOUT,
+                      hooks.CLOSE]
+
+
+def test_expect_fires_receive_with_bytes(any_telnet_channel):
+    any_telnet_channel._verify_connected = MagicMock(name='method')
+    any_telnet_channel.channel = Mock()
+    received = []
+    any_telnet_channel.add_hook(
+        hooks.RECEIVE, lambda channel, event, data: received.append(data))
+    mock_match = Mock()
+    mock_match.start.return_value = len(ANY_DATA_RECEIVED)
+    mock_match.end.return_value =\
+        len(ANY_DATA_RECEIVED) + len(ANY_PROMPT_MATCHED)
+    raw_data = ANY_DATA_RECEIVED + ANY_PROMPT_MATCHED
+    any_telnet_channel.channel.expect.return_value = (0, mock_match, raw_data)
+    any_telnet_channel.expect(ANY_PROMPT_RE)
+    assert received == [raw_data.encode('utf8')]
+
+
+def test_expect_raises_if_connection_closed(any_telnet_channel):
+    any_telnet_channel._verify_connected = MagicMock(name='method')
+    any_telnet_channel.channel = Mock()
+    any_telnet_channel.channel.expect.side_effect = EOFError
+    with pytest.raises(exceptions.ConnectionError):
+        any_telnet_channel.expect(ANY_PROMPT_RE)
+
+
+def test_start_passes_terminal_settings():
+    channel = TelnetChannel(ANY_HOST, ANY_USERNAME, ANY_PASSWORD,
+                            terminal='vt100', width=132, binary=True)
+    channel._handle_init_login = MagicMock(name='method')
+    with patch('steelscript.cmdline.telnetchannel.SteelScriptTelnet') as mock:
+        channel.start()
+    mock.assert_called_once_with(ANY_HOST, 23, terminal='vt100', width=132,
+                                 height=24, binary=True)
+
+
+def test_footprint_counts_unread_data(any_telnet_channel):
+    any_telnet_channel.channel = Mock(buffered=100)
+    assert any_telnet_channel.footprint().held == {'receive_buffer': 100}
+
+
+def _connected_channel(idle=0, error=0, eof=False, buffered=0):
+    channel = Mock(idle=idle, eof=eof, buffered=buffered)
+    channel.pending_error.return_value = error
+    return channel
+
+
+def test_verify_connected_does_not_send_when_active(any_telnet_channel):
+    any_telnet_channel.channel = _connected_channel(idle=1)
+    any_telnet_channel._verify_connected()
+    assert not any_telnet_channel.channel.send_command.called
+    assert not any_telnet_channel.channel.sock.sendall.called
+
+
+def test_verify_connected_sends_nop_when_idle(any_telnet_channel):
+    any_telnet_channel.channel = _connected_channel(
+        idle=any_telnet_channel.KEEPALIVE_INTERVAL)
+    any_telnet_channel._verify_connected()
+    any_telnet_channel.channel.send_command.assert_called_once_with(b'\xf1')
+
+
+def test_verify_connected_keepalive_interval_zero_never_sends():
+    channel = TelnetChannel(ANY_HOST, ANY_USERNAME, ANY_PASSWORD,
+                            keepalive_interval=0)
+    channel.channel = _connected_channel(idle=3600)
+    channel._verify_connected()
+    assert not channel.channel.send_command.called
+
+
+def test_verify_connected_raises_on_socket_error(any_telnet_channel):
+    any_telnet_channel.channel = _connected_channel(error=104)
+    with pytest.raises(exceptions.ConnectionError):
+        any_telnet_channel._verify_connected()
+
+
+def test_verify_connected_raises_if_send_fails(any_telnet_channel):
+    any_telnet_channel.channel = _connected_channel(idle=3600)
+    any_telnet_channel.channel.send_command.side_effect = OSError('reset')
+    with pytest.raises(exceptions.ConnectionError):
+        any_telnet_channel._verify_connected()
+
+
+def test_verify_connected_after_close(any_telnet_channel):
+    any_telnet_channel.channel = _connected_channel(eof=True, buffered=10)
+    any_telnet_channel._verify_connected()
+    any_telnet_channel.channel = _connected_channel(eof=True)
+    with pytest.raises(exceptions.ConnectionError):
+        any_telnet_channel._verify_connected()
@@ -0,0 +1,141 @@
+# Copyright (c) 2019 Riverbed Technology, Inc.
+#
+# This software is licensed under the terms and conditions of the MIT License
+# accompanying the software ("License").  This software is distributed "AS IS"
+# as set forth in the License.
+
+
+import pytest
+from unittest.mock import Mock, patch
+
+from steelscript.cmdline import timeouts
+from steelscript.cmdline import exceptions
+from steelscript.cmdline.timeouts import TimeoutModel, command_pattern
+
+ANY_CLASS = 'RVBD_CLI'
+FAST_COMMAND = 'show version'
+SLOW_COMMAND = 'show stats'
+
+
+class FakeCLI(object):
+
+    def __init__(self, model=None):
+        self._timeout_model = model
+        self.enter_mode = Mock()
+        self.run = Mock(return_value='output')
+
+    @timeouts.learned_timeout
+    def exec_command(self, command, timeout=timeouts.DEFAULT, mode=None):
+        if mode is not None:
+            self.enter_mode(mode)
+        with timeouts.recording(self, command, timeout):
+            return self.run(command, timeout)
+
+
+@pytest.fixture
+def model():
+    return TimeoutModel(min_samples=5, factor=2, floor=1, ceiling=100)
+
+
+def train(model, command, seconds, times=10):
+    for i in range(times):
+        model.record(ANY_CLASS, command, seconds)
+
+
+def test_command_pattern():
+    assert (command_pattern('ping -c 3  10.0.0.1') ==
+            command_pattern('ping -c 5 192.168.1.20'))
+    assert command_pattern('show interfaces "inpath0_0"') == \
+        'show interfaces "*"'
+    assert command_pattern('show ip fe80::1') == 'show ip *'
+    assert command_pattern(FAST_COMMAND) != command_pattern(SLOW_COMMAND)
+
+
+def test_default_until_enough_samples(model):
+    train(model, FAST_COMMAND, 0.5, times=4)
+    assert model.timeout(ANY_CLASS, FAST_COMMAND) == timeouts.DEFAULT_TIMEOUT
+    train(model, FAST_COMMAND, 0.5, times=1)
+    assert model.timeout(ANY_CLASS, FAST_COMMAND) < 2
+
+
+def test_timeouts_follow_history(model):
+    train(model, FAST_COMMAND, 0.5)
+    train(model, SLOW_COMMAND, 20)
+    fast = model.timeout(ANY_CLASS, FAST_COMMAND)
+    slow = model.timeout(ANY_CLASS, SLOW_COMMAND)
+    assert 1 <= fast < 2
+    assert 40 <= slow <= 50
+    assert model.timeout('IOS_CLI', SLOW_COMMAND) == \
+        timeouts.DEFAULT_TIMEOUT
+
+
+def test_floor_and_ceiling(model):
+    train(model, FAST_COMMAND, 0.01)
+    train(model, SLOW_COMMAND, 500)
+    assert model.timeout(ANY_CLASS, FAST_COMMAND) == 1
+    assert model.timeout(ANY_CLASS, SLOW_COMMAND) == 100
+
+
+def test_save_and_load(model, tmpdir):
+    path = str(tmpdir.join('timeouts.json'))
+    train(model, SLOW_COMMAND, 20)
+    model.save(path)
+    loaded = TimeoutModel(path=path, min_samples=5, factor=2)
+    assert (loaded.timeout(ANY_CLASS, SLOW_COMMAND) ==
+            model.timeout(ANY_CLASS, SLOW_COMMAND))
+    # Loading again adds to the history.
+    loaded.load(path)
+    assert loaded._histogram(ANY_CLASS, SLOW_COMMAND).count == 20
+    with pytest.raises(ValueError):
+        TimeoutModel().save()
+
+
+def test_decorator_without_model():
+    cli = FakeCLI()
+    cli.exec_command(FAST_COMMAND)
+    cli.run.assert_called_once_with(FAST_COMMAND, timeouts.DEFAULT_TIMEOUT)
+    cli.exec_command(FAST_COMMAND, None)
+    cli.run.assert_called_with(FAST_COMMAND, None)
+
+
+def test_decorator_uses_and_feeds_model(model):
+    cli = FakeCLI(model)
+    train(model, 'FakeCLI', 0)
+    model.record('FakeCLI', FAST_COMMAND, 0.5)
+    for i in range(5):
+        cli.exec_command(FAST_COMMAND, mode='enable')
+    assert cli.run.call_args[0][1] < timeouts.DEFAULT_TIMEOUT
+    assert model._histogram('FakeCLI', FAST_COMMAND).count == 6
+    cli.exec_command(FAST_COMMAND, timeout=7)
+    cli.run.assert_called_with(FAST_COMMAND, 7)
+    assert model._histogram('FakeCLI', FAST_COMMAND).count == 7
+
+
+def test_decorator_records_timeouts_at_the_limit(model):
+    cli = FakeCLI(model)
+    cli.run.side_effect = exceptions.CmdlineTimeout(timeout=30)
+    with pytest.raises(exceptions.CmdlineTimeout):
+        cli.exec_command(SLOW_COMMAND, timeout=30)
+    assert model._histogram('FakeCLI', SLOW_COMMAND).max == 30
+
+
+def test_recording_leaves_out_mode_changes(model):
+    cli = FakeCLI(model)
+    clock = [1000.0]
+
+    def advance(seconds):
+        def side_effect(*args):
+            clock[0] += seconds
+            return 'output'
+        return side_effect
+    cli.enter_mode.side_effect = advance(20)
+    cli.run.side_effect = advance(0.5)
+    with patch('steelscript.cmdline.timeouts.time.time',
+               side_effect=lambda: clock[0]):
+        cli.exec_command(FAST_COMMAND, timeout=10, mode='enable')
+    assert model._histogram('FakeCLI', FAST_COMMAND).max == 0.5
+
+
+def test_recording_without_model():
+    with timeouts.recording(object(), FAST_COMMAND, 10):
+        pass